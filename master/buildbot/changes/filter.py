@@ -73,6 +73,26 @@ class ChangeFilter(ComparableMixin):
                 return False
         return True
 
+    def getIndexKey(self):
+        """
+        Return C{(attribute, values)} for an attribute which a change must
+        have one of C{values} for to pass this filter, so that filters can be
+        indexed by value; or None if there is no such attribute.  Where
+        several attributes are limited to lists of values, the shortest list
+        is used.
+        """
+        # a subclass may filter changes differently
+        if self.__class__.filter_change.im_func \
+                is not ChangeFilter.filter_change.im_func:
+            return None
+        key = None
+        for (filt_list, filt_re, filt_fn, chg_attr) in self.checks:
+            if filt_list is None:
+                continue
+            if key is None or len(filt_list) < len(key[1]):
+                key = (chg_attr, filt_list)
+        return key
+
     def __repr__(self):
         checks = []
         for (filt_list, filt_re, filt_fn, chg_attr) in self.checks:
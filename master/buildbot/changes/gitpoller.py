@@ -16,18 +16,138 @@
 import time
 import tempfile
 import os
-from twisted.python import log
-from twisted.internet import defer, utils
+from twisted.python import log, failure
+from twisted.internet import defer, utils, reactor, protocol, error
 
 from buildbot.util import deferredLocked
 from buildbot.changes import base
 from buildbot.util import epoch2datetime
 
+class GitLogParser(object):
+    """
+    Incrementally parse the output of C{git log} with the arguments in
+    L{args}, which describes each commit as NUL-separated fields followed by
+    the list of files it changed.
+    """
+
+    args = [ r'--format=%x00%H%x00%ct%x00%aN <%aE>%x00%s%n%b%x00',
+             '--name-only' ]
+
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self.started = False
+        self.fields = []
+        self.partial = ''
+
+    def feed(self, data):
+        """
+        Parse some more output.
+
+        @returns: list of the commits completed by this data
+        """
+        fields = (self.partial + data).split('\0')
+        self.partial = fields.pop()
+        if not self.started and fields:
+            # text before the first NUL is not part of any commit
+            self.started = True
+            fields.pop(0)
+        # the last field of a commit (its files) is terminated by the NUL
+        # which begins the next commit
+        self.fields.extend(fields)
+        return self._parseCommits()
+
+    def finish(self):
+        """
+        Parse the remaining output, at the end of the log.
+
+        @returns: list of the remaining commits
+        """
+        if self.started:
+            self.fields.append(self.partial)
+        self.partial = ''
+        commits = self._parseCommits()
+        if self.fields:
+            raise EnvironmentError('incomplete output from git log')
+        return commits
+
+    def _parseCommits(self):
+        commits = []
+        fields = self.fields
+        while len(fields) >= 5:
+            rev, timestamp, author, comments, files = fields[:5]
+            del fields[:5]
+            commits.append(self._parseCommit(rev, timestamp, author,
+                                             comments, files))
+        return commits
+
+    def _parseCommit(self, rev, timestamp, author, comments, files):
+        author = author.strip().decode(self.encoding)
+        if not author:
+            raise EnvironmentError('could not get commit author for rev')
+        comments = comments.strip().decode(self.encoding)
+        if not comments:
+            raise EnvironmentError('could not get commit comment for rev')
+        try:
+            timestamp = float(timestamp)
+        except ValueError:
+            log.msg('gitpoller: caught exception converting output \'%s\' '
+                    'to timestamp' % timestamp)
+            raise
+        files = [ f.decode(self.encoding) for f in files.splitlines() if f ]
+        return dict(revision=rev, timestamp=timestamp, author=author,
+                    comments=comments, files=files)
+
+class GitLogProtocol(protocol.ProcessProtocol):
+    """
+    Run C{git log}, parsing its output with a L{GitLogParser} as it arrives,
+    and passing each list of new commits to C{commitsReceived}.
+    C{self.deferred} fires when the process is complete.
+    """
+
+    def __init__(self, parser, commitsReceived):
+        self.parser = parser
+        self.commitsReceived = commitsReceived
+        self.deferred = defer.Deferred()
+        self.stderr = []
+        self.failure = None
+
+    def outReceived(self, data):
+        if self.failure:
+            return
+        try:
+            commits = self.parser.feed(data)
+            if commits:
+                self.commitsReceived(commits)
+        except:
+            # ignore the rest of the output
+            self.failure = failure.Failure()
+
+    def errReceived(self, data):
+        self.stderr.append(data)
+
+    def processEnded(self, reason):
+        if not self.failure:
+            if reason.check(error.ProcessDone):
+                try:
+                    commits = self.parser.finish()
+                    if commits:
+                        self.commitsReceived(commits)
+                except:
+                    self.failure = failure.Failure()
+            else:
+                self.failure = failure.Failure(EnvironmentError(
+                    'git log failed with exit code %s: %s' %
+                    (reason.value.exitCode, ''.join(self.stderr))))
+        if self.failure:
+            self.deferred.errback(self.failure)
+        else:
+            self.deferred.callback(None)
+
 class GitPoller(base.PollingChangeSource):
     """This source will poll a remote git repo for changes and submit
     them to the change master."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branch", "branches", "workdir",
                      "pollInterval", "gitbin", "usetimestamps",
                      "category", "project"]
                      
@@ -36,7 +156,7 @@ class GitPoller(base.PollingChangeSource):
                  gitbin='git', usetimestamps=True,
                  category=None, project=None,
                  pollinterval=-2, fetch_refspec=None,
-                 encoding='utf-8'):
+                 encoding='utf-8', branches=None):
         # for backward compatibility; the parameter used to be spelled with 'i'
         if pollinterval != -2:
             pollInterval = pollinterval
@@ -44,6 +164,12 @@ class GitPoller(base.PollingChangeSource):
 
         self.repourl = repourl
         self.branch = branch
+        # all of the branches to poll, beginning with the one checked out
+        if branches is None:
+            branches = [ branch ]
+        elif branch not in branches:
+            self.branch = branches[0]
+        self.branches = branches
         self.pollInterval = pollInterval
         self.fetch_refspec = fetch_refspec
         self.encoding = encoding
@@ -133,6 +259,21 @@ class GitPoller(base.PollingChangeSource):
             d.addErrback(self._stop_on_failure)
             return d
         d.addCallback(set_master)
+        def set_other_branches(_):
+            # the other branches are never checked out
+            d = defer.succeed(None)
+            for branch in self.branches:
+                if branch == self.branch:
+                    continue
+                args = ['update-ref', 'refs/heads/%s' % branch,
+                        'refs/remotes/origin/%s' % branch]
+                d.addCallback(lambda _, args=args :
+                        utils.getProcessOutputAndValue(self.gitbin, args,
+                            path=self.workdir, env=os.environ))
+                d.addCallback(self._convert_nonzero_to_failure)
+            d.addErrback(self._stop_on_failure)
+            return d
+        d.addCallback(set_other_branches)
         def get_rev(_):
             d = utils.getProcessOutputAndValue(self.gitbin,
                     ['rev-parse', self.branch],
@@ -153,66 +294,28 @@ class GitPoller(base.PollingChangeSource):
         if not self.master:
             status = "[STOPPED - check log]"
         str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+                % (self.repourl, ', '.join(self.branches), status)
         return str
 
     @deferredLocked('initLock')
     def poll(self):
         d = self._get_changes()
-        d.addCallback(self._process_changes)
-        d.addErrback(self._process_changes_failure)
-        d.addCallback(self._catch_up)
-        d.addErrback(self._catch_up_failure)
-        return d
-
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit comment for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
-
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip()
-            if self.usetimestamps:
-                try:
-                    stamp = float(stripped_output)
-                except Exception, e:
-                        log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % stripped_output)
-                        raise e
-                return stamp
-            else:
-                return None
-        d.addCallback(process)
+        d.addCallback(lambda _ : self._process_branches())
         return d
 
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            fileList = git_output.split()
-            return fileList
-        d.addCallback(process)
-        return d
-            
-    def _get_commit_author(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%aN <%aE>']
-        d = utils.getProcessOutput(self.gitbin, args, path=self.workdir, env=os.environ, errortoo=False )
-        def process(git_output):
-            stripped_output = git_output.strip().decode(self.encoding)
-            if len(stripped_output) == 0:
-                raise EnvironmentError('could not get commit author for rev')
-            return stripped_output
-        d.addCallback(process)
-        return d
+    @defer.inlineCallbacks
+    def _process_branches(self):
+        # all branches share the fetch; a failure on one branch does not
+        # prevent the others from being processed
+        for branch in self.branches:
+            try:
+                yield self._process_changes(branch)
+            except:
+                self._process_changes_failure(failure.Failure())
+            try:
+                yield self._catch_up(branch)
+            except:
+                self._catch_up_failure(failure.Failure())
 
     def _get_changes(self):
         log.msg('gitpoller: polling git repo at %s' % self.repourl)
@@ -233,53 +336,47 @@ class GitPoller(base.PollingChangeSource):
 
         return d
 
-    @defer.inlineCallbacks
-    def _process_changes(self, unused_output):
-        # get the change list
-        revListArgs = ['log', '%s..origin/%s' % (self.branch, self.branch), r'--format=%H']
+    def _spawnProcess(self, proto, args):
+        return reactor.spawnProcess(proto, self.gitbin,
+                [ self.gitbin ] + args, env=os.environ, path=self.workdir)
+
+    def _process_changes(self, branch):
+        # a single git log describes every new commit, oldest first; changes
+        # are added in batches as the output is parsed, in order
         self.changeCount = 0
-        results = yield utils.getProcessOutput(self.gitbin, revListArgs,
-                    path=self.workdir, env=os.environ, errortoo=False )
+        added = defer.succeed(None)
+        def commitsReceived(commits):
+            self.changeCount += len(commits)
+            log.msg('gitpoller: processing %d changes: %s in "%s"'
+                    % (len(commits), [ c['revision'] for c in commits ],
+                       self.workdir))
+            changes = []
+            for c in commits:
+                timestamp = None
+                if self.usetimestamps:
+                    timestamp = c['timestamp']
+                changes.append(dict(
+                       author=c['author'],
+                       revision=c['revision'],
+                       files=c['files'],
+                       comments=c['comments'],
+                       when_timestamp=epoch2datetime(timestamp),
+                       branch=branch,
+                       category=self.category,
+                       project=self.project,
+                       repository=self.repourl,
+                       src='git'))
+            added.addCallback(lambda _ : self.master.addChanges(changes))
 
-        # process oldest change first
-        revList = results.split()
-        if not revList:
-            return
+        args = [ 'log', '%s..origin/%s' % (branch, branch), '--reverse' ]
+        args.extend(GitLogParser.args)
+        proto = GitLogProtocol(GitLogParser(self.encoding), commitsReceived)
+        self._spawnProcess(proto, args)
 
-        revList.reverse()
-        self.changeCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes: %s in "%s"'
-                % (self.changeCount, revList, self.workdir) )
-
-        for rev in revList:
-            dl = defer.DeferredList([
-                self._get_commit_timestamp(rev),
-                self._get_commit_author(rev),
-                self._get_commit_files(rev),
-                self._get_commit_comments(rev),
-            ], consumeErrors=True)
-
-            results = yield dl
-
-            # check for failures
-            failures = [ r[1] for r in results if not r[0] ]
-            if failures:
-                # just fail on the first error; they're probably all related!
-                raise failures[0]
-
-            timestamp, author, files, comments = [ r[1] for r in results ]
-            yield self.master.addChange(
-                   author=author,
-                   revision=rev,
-                   files=files,
-                   comments=comments,
-                   when_timestamp=epoch2datetime(timestamp),
-                   branch=self.branch,
-                   category=self.category,
-                   project=self.project,
-                   repository=self.repourl,
-                   src='git')
+        # wait for the changes parsed before any failure, too
+        d = proto.deferred
+        d.addBoth(lambda res : added.addCallback(lambda _ : res))
+        return d
 
     def _process_changes_failure(self, f):
         log.msg('gitpoller: repo poll failed')
@@ -287,12 +384,17 @@ class GitPoller(base.PollingChangeSource):
         # eat the failure to continue along the defered chain - we still want to catch up
         return None
         
-    def _catch_up(self, res):
+    def _catch_up(self, branch):
         if self.changeCount == 0:
             log.msg('gitpoller: no changes, no catch_up')
             return
-        log.msg('gitpoller: catching up tracking branch')
-        args = ['reset', '--hard', 'origin/%s' % (self.branch,)]
+        log.msg('gitpoller: catching up tracking branch %s' % branch)
+        if branch == self.branch:
+            # this branch is checked out
+            args = ['reset', '--hard', 'origin/%s' % (branch,)]
+        else:
+            args = ['update-ref', 'refs/heads/%s' % (branch,),
+                    'refs/remotes/origin/%s' % (branch,)]
         d = utils.getProcessOutputAndValue(self.gitbin, args, path=self.workdir, env=os.environ)
         d.addCallback(self._convert_nonzero_to_failure)
         return d
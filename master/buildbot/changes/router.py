@@ -0,0 +1,109 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.python import failure, log
+from buildbot.util import subscription
+
+class ChangeRouter(subscription.SubscriptionPoint):
+    """
+    The subscription point for new changes, at which each subscriber may
+    give a L{buildbot.changes.filter.ChangeFilter} to receive only the
+    changes it passes.
+
+    Filters which limit an attribute (project, repository, branch or
+    category) to a list of values are indexed by those values, so that a
+    change is only tested against the filters that it might pass.  Filters
+    which use only regular expressions or functions are tested against every
+    change.
+    """
+
+    def __init__(self):
+        subscription.SubscriptionPoint.__init__(self, "changes")
+        # attribute -> value -> subscriptions whose filters need that value
+        self.index = {}
+        # subscriptions without a filter
+        self.unfiltered = set()
+        # subscriptions whose filters cannot be indexed
+        self.unindexed = set()
+
+    def subscribe(self, callback, change_filter=None):
+        """Add C{callback} to the subscriptions, to be called with each
+        change that passes C{change_filter}; returns a
+        L{buildbot.util.subscription.Subscription} instance."""
+        sub = subscription.SubscriptionPoint.subscribe(self, callback)
+        sub.change_filter = change_filter
+        sub.index_key = None
+        if change_filter is None:
+            self.unfiltered.add(sub)
+            return sub
+
+        getIndexKey = getattr(change_filter, 'getIndexKey', None)
+        if getIndexKey:
+            sub.index_key = getIndexKey()
+        if sub.index_key is None:
+            self.unindexed.add(sub)
+        else:
+            attr, values = sub.index_key
+            by_value = self.index.setdefault(attr, {})
+            for value in values:
+                by_value.setdefault(value, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        subscription.SubscriptionPoint._unsubscribe(self, sub)
+        self.unfiltered.discard(sub)
+        self.unindexed.discard(sub)
+        if sub.index_key is not None:
+            attr, values = sub.index_key
+            by_value = self.index[attr]
+            for value in values:
+                subs = by_value.get(value)
+                if subs is None:
+                    continue
+                subs.discard(sub)
+                if not subs:
+                    del by_value[value]
+            if not by_value:
+                del self.index[attr]
+
+    def match(self, change):
+        """Return the subscriptions which should receive C{change}."""
+        candidates = set(self.unindexed)
+        for attr, by_value in self.index.iteritems():
+            try:
+                subs = by_value.get(getattr(change, attr, ''))
+            except TypeError: # unhashable
+                continue
+            if subs:
+                candidates.update(subs)
+
+        matches = set(self.unfiltered)
+        for sub in candidates:
+            try:
+                if sub.change_filter.filter_change(change):
+                    matches.add(sub)
+            except:
+                log.err(failure.Failure(),
+                        'while filtering %s for %s' % (change, sub.callback))
+        return matches
+
+    def deliver(self, change):
+        """Deliver C{change} to the subscribers whose filters it passes."""
+        for sub in self.match(change):
+            try:
+                sub.callback(change)
+            except:
+                log.err(failure.Failure(),
+                        'while invoking callback %s to %s' % (sub.callback, self))
@@ -61,14 +61,17 @@ class MasterConfig(object):
         self.eventHorizon = 50
         self.logHorizon = None
         self.buildHorizon = None
+        self.buildIndex = 'file'
         self.logCompressionLimit = 4*1024
         self.logCompressionMethod = 'bz2'
         self.logMaxTailSize = None
         self.logMaxSize = None
+        self.logWriteBehindSize = None
         self.properties = properties.Properties()
         self.mergeRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.distributorParallelism = 1
         self.slavePortnum = None
         self.multiMaster = False
         self.debugPassword = None
@@ -84,6 +87,11 @@ class MasterConfig(object):
             db_url='sqlite:///state.sqlite',
             db_poll_interval=None,
         )
+        self.notifications = dict(
+            transport=None,
+            listen=None,
+            peers=[],
+        )
         self.metrics = None
         self.caches = dict(
             Builds=15,
@@ -98,12 +106,15 @@ class MasterConfig(object):
         self.revlink = default_revlink_matcher
 
     _known_config_keys = set([
-        "buildbotURL", "buildCacheSize", "builders", "buildHorizon", "caches",
+        "buildbotURL", "buildCacheSize", "builders", "buildHorizon",
+        "buildIndex", "caches",
         "change_source", "codebaseGenerator", "changeCacheSize", "changeHorizon",
-        'db', "db_poll_interval", "db_url", "debugPassword", "eventHorizon",
+        'db', "db_poll_interval", "db_url", "debugPassword",
+        "distributorParallelism", "eventHorizon",
         "logCompressionLimit", "logCompressionMethod", "logHorizon",
-        "logMaxSize", "logMaxTailSize", "manhole", "mergeRequests", "metrics",
-        "multiMaster", "prioritizeBuilders", "projectName", "projectURL",
+        "logMaxSize", "logMaxTailSize", "logWriteBehindSize", "manhole",
+        "mergeRequests", "metrics", "multiMaster", "notifications",
+        "prioritizeBuilders", "projectName", "projectURL",
         "properties", "revlink", "schedulers", "slavePortnum", "slaves",
         "status", "title", "titleURL", "user_managers", "validation"
     ])
@@ -188,6 +199,7 @@ class MasterConfig(object):
         config.load_global(filename, config_dict, errors)
         config.load_validation(filename, config_dict, errors)
         config.load_db(filename, config_dict, errors)
+        config.load_notifications(filename, config_dict, errors)
         config.load_metrics(filename, config_dict, errors)
         config.load_caches(filename, config_dict, errors)
         config.load_schedulers(filename, config_dict, errors)
@@ -245,16 +257,32 @@ class MasterConfig(object):
 
         copy_int_param('logCompressionLimit')
 
+        if 'buildIndex' in config_dict:
+            buildIndex = config_dict.get('buildIndex')
+            if buildIndex not in ('file', None):
+                errors.addError("c['buildIndex'] must be 'file' or None")
+            self.buildIndex = buildIndex
+
         if 'logCompressionMethod' in config_dict:
             logCompressionMethod = config_dict.get('logCompressionMethod')
-            if logCompressionMethod not in ('bz2', 'gz'):
-                errors.addError(
-                        "c['logCompressionMethod'] must be 'bz2' or 'gz'")
+            if logCompressionMethod not in ('bz2', 'gz', 'indexed'):
+                errors.addError("c['logCompressionMethod'] must be 'bz2', "
+                                "'gz' or 'indexed'")
             self.logCompressionMethod = logCompressionMethod
 
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
 
+        if 'logWriteBehindSize' in config_dict:
+            logWriteBehindSize = config_dict['logWriteBehindSize']
+            if logWriteBehindSize is not None and \
+                    (not isinstance(logWriteBehindSize, int)
+                     or logWriteBehindSize < 1):
+                errors.addError("c['logWriteBehindSize'] must be a "
+                                "positive integer or None")
+            else:
+                self.logWriteBehindSize = logWriteBehindSize
+
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
             errors.addError("c['properties'] must be a dictionary")
@@ -281,6 +309,15 @@ class MasterConfig(object):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        if 'distributorParallelism' in config_dict:
+            distributorParallelism = config_dict['distributorParallelism']
+            if (not isinstance(distributorParallelism, int)
+                or distributorParallelism < 1):
+                errors.addError("c['distributorParallelism'] must be a "
+                                "positive integer")
+            else:
+                self.distributorParallelism = distributorParallelism
+
         if 'slavePortnum' in config_dict:
             slavePortnum = config_dict.get('slavePortnum')
             if isinstance(slavePortnum, int):
@@ -341,6 +378,44 @@ class MasterConfig(object):
             self.db['db_poll_interval'] = db_poll_interval
 
 
+    def load_notifications(self, filename, config_dict, errors):
+        if 'notifications' not in config_dict:
+            return
+        notifications = config_dict['notifications']
+
+        if not isinstance(notifications, dict):
+            errors.addError("c['notifications'] must be a dictionary")
+            return
+        if set(notifications.keys()) - set(self.notifications.keys()):
+            errors.addError("unrecognized keys in c['notifications']")
+            return
+
+        transport = notifications.get('transport')
+        if transport not in (None, 'socket'):
+            errors.addError("c['notifications']['transport'] must be "
+                            "'socket' or None")
+
+        listen = notifications.get('listen')
+        if listen is not None and not isinstance(listen, basestring):
+            errors.addError("c['notifications']['listen'] must be a string")
+
+        peers = notifications.get('peers', [])
+        peer_re = re.compile(r'^(tcp:[^:]+:\d+|unix:.+)$')
+        if (not isinstance(peers, (list, tuple))
+            or [ p for p in peers
+                 if not isinstance(p, basestring) or not peer_re.match(p) ]):
+            errors.addError("c['notifications']['peers'] must be a list of "
+                            "'tcp:host:port' or 'unix:path' strings")
+            return
+
+        if transport and not self.db['db_poll_interval']:
+            errors.addError("c['notifications'] requires db_poll_interval, "
+                            "for the consistency sweep")
+
+        self.notifications.update(notifications)
+        self.notifications['peers'] = list(peers)
+
+
     def load_metrics(self, filename, config_dict, errors):
         # we don't try to validate metrics keys
         if 'metrics' in config_dict:
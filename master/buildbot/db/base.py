@@ -63,12 +63,13 @@ class CachedMethod(object):
         meth = self.method
 
         meth_name = meth.__name__
+        # any keyword arguments are passed through the cache to the method
         cache = component.db.master.caches.get_cache(self.cache_name,
-                lambda key : meth(component, key))
-        def wrap(key, no_cache=0):
+                lambda key, **kwargs : meth(component, key, **kwargs))
+        def wrap(key, no_cache=0, **kwargs):
             if no_cache:
-                return meth(component, key)
-            return cache.get(key)
+                return meth(component, key, **kwargs)
+            return cache.get(key, **kwargs)
         wrap.__name__ = meth_name + " (wrapped)"
         wrap.__module__ = meth.__module__
         wrap.__doc__ = meth.__doc__
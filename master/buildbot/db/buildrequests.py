@@ -64,7 +64,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
     @with_master_objectid
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-            bsid=None, _master_objectid=None):
+            bsid=None, brids=None, _master_objectid=None):
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -90,10 +90,22 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     q = q.where(reqs_tbl.c.complete == 0)
             if bsid is not None:
                 q = q.where(reqs_tbl.c.buildsetid == bsid)
-            res = conn.execute(q)
 
-            return [ self._brdictFromRow(row, _master_objectid)
-                     for row in res.fetchall() ]
+            if brids is None:
+                queries = [ q ]
+            else:
+                # batch the brids into groups of 100, so that the parameter
+                # lists supported by the DBAPI aren't exhausted
+                brids_list = list(brids)
+                queries = [ q.where(reqs_tbl.c.id.in_(brids_list[i:i+100]))
+                            for i in xrange(0, len(brids_list), 100) ]
+
+            rv = []
+            for q in queries:
+                res = conn.execute(q)
+                rv.extend([ self._brdictFromRow(row, _master_objectid)
+                            for row in res.fetchall() ])
+            return rv
         return self.db.pool.do(thd)
 
     @with_master_objectid
@@ -119,7 +119,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return self._row2dict(row)
         return self.db.pool.do(thd)
 
-    def getBuildsets(self, complete=None):
+    def getBuildsets(self, complete=None, bsids=None):
         def thd(conn):
             bs_tbl = self.db.model.buildsets
             q = bs_tbl.select()
@@ -129,8 +129,19 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                 else:
                     q = q.where((bs_tbl.c.complete == 0) |
                                 (bs_tbl.c.complete == None))
-            res = conn.execute(q)
-            return [ self._row2dict(row) for row in res.fetchall() ]
+            if bsids is None:
+                queries = [ q ]
+            else:
+                # batch the bsids into groups of 100, so that the parameter
+                # lists supported by the DBAPI aren't exhausted
+                bsids_list = list(bsids)
+                queries = [ q.where(bs_tbl.c.id.in_(bsids_list[i:i+100]))
+                            for i in xrange(0, len(bsids_list), 100) ]
+            rv = []
+            for q in queries:
+                res = conn.execute(q)
+                rv.extend([ self._row2dict(row) for row in res.fetchall() ])
+            return rv
         return self.db.pool.do(thd)
 
     def getBuildsetProperties(self, buildsetid):
@@ -162,6 +173,37 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return dict(l)
         return self.db.pool.do(thd)
 
+    def getBuildsetsProperties(self, buildsetids):
+        """
+        Return the properties for several buildsets at once.  This is
+        equivalent to calling L{getBuildsetProperties} for each buildset, but
+        uses far fewer queries.
+
+        @param buildsetids: buildset IDs
+
+        @returns: dictionary mapping each buildset ID to a dictionary mapping
+        property name to (value, source), via Deferred
+        """
+        def thd(conn):
+            bsp_tbl = self.db.model.buildset_properties
+            rv = dict([ (bsid, {}) for bsid in buildsetids ])
+            bsids_list = list(rv)
+            for i in xrange(0, len(bsids_list), 100):
+                q = sa.select(
+                    [ bsp_tbl.c.buildsetid, bsp_tbl.c.property_name,
+                      bsp_tbl.c.property_value ],
+                    whereclause=(
+                        bsp_tbl.c.buildsetid.in_(bsids_list[i:i+100])))
+                for row in conn.execute(q):
+                    try:
+                        properties = json.loads(row.property_value)
+                        rv[row.buildsetid][row.property_name] = \
+                                tuple(properties)
+                    except ValueError:
+                        pass
+            return rv
+        return self.db.pool.do(thd)
+
     def _row2dict(self, row):
         def mkdt(epoch):
             if epoch:
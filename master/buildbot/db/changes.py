@@ -33,6 +33,41 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             revision=None, when_timestamp=None, branch=None,
             category=None, revlink='', properties={}, repository='', codebase='',
             project='', uid=None, _reactor=reactor):
+        d = self.addChanges([ dict(author=author, files=files,
+                    comments=comments, is_dir=is_dir, revision=revision,
+                    when_timestamp=when_timestamp, branch=branch,
+                    category=category, revlink=revlink, properties=properties,
+                    repository=repository, codebase=codebase,
+                    project=project, uid=uid) ], _reactor=_reactor)
+        d.addCallback(lambda changeids : changeids[0])
+        return d
+
+    def addChanges(self, changes, _reactor=reactor):
+        changes = [ self._checkChangeArgs(_reactor=_reactor, **kwargs)
+                    for kwargs in changes ]
+
+        def thd(conn):
+            # note that in a read-uncommitted database like SQLite this
+            # transaction does not buy atomicitiy - other database users may
+            # still come across a change without its files, properties,
+            # etc.  That's OK, since we don't announce the change until it's
+            # all in the database, but beware.
+
+            transaction = conn.begin()
+            changeids = [ self._addChangeThd(conn, **kwargs)
+                          for kwargs in changes ]
+            transaction.commit()
+
+            return changeids
+        d = self.db.pool.do(thd)
+        return d
+
+    def _checkChangeArgs(self, author=None, files=None, comments=None,
+            is_dir=0, revision=None, when_timestamp=None, branch=None,
+            category=None, revlink='', properties={}, repository='',
+            codebase='', project='', uid=None, _reactor=reactor):
+        # check the arguments for addChanges, returning them as a dictionary
+        # with defaults filled in
         assert project is not None, "project must be a string, not None"
         assert repository is not None, "repository must be a string, not None"
 
@@ -44,88 +79,102 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             assert pv[1] == 'Change', ("properties must be qualified with"
                                        "source 'Change'")
 
-        def thd(conn):
-            # note that in a read-uncommitted database like SQLite this
-            # transaction does not buy atomicitiy - other database users may
-            # still come across a change without its files, properties,
-            # etc.  That's OK, since we don't announce the change until it's
-            # all in the database, but beware.
+        return dict(author=author, files=files, comments=comments,
+                is_dir=is_dir, revision=revision,
+                when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, codebase=codebase, project=project,
+                uid=uid)
 
-            transaction = conn.begin()
+    def _addChangeThd(self, conn, author, files, comments, is_dir, revision,
+            when_timestamp, branch, category, revlink, properties,
+            repository, codebase, project, uid):
+        # This method must be run in a db.pool thread, within a transaction,
+        # and returns the new changeid
+        ch_tbl = self.db.model.changes
 
-            ch_tbl = self.db.model.changes
-
-            self.check_length(ch_tbl.c.author, author)
-            self.check_length(ch_tbl.c.comments, comments)
-            self.check_length(ch_tbl.c.branch, branch)
-            self.check_length(ch_tbl.c.revision, revision)
-            self.check_length(ch_tbl.c.revlink, revlink)
-            self.check_length(ch_tbl.c.category, category)
-            self.check_length(ch_tbl.c.repository, repository)
-            self.check_length(ch_tbl.c.project, project)
-
-            r = conn.execute(ch_tbl.insert(), dict(
-                author=author,
-                comments=comments,
-                is_dir=is_dir,
-                branch=branch,
-                revision=revision,
-                revlink=revlink,
-                when_timestamp=datetime2epoch(when_timestamp),
-                category=category,
-                repository=repository,
-                codebase=codebase,
-                project=project))
-            changeid = r.inserted_primary_key[0]
-            if files:
-                tbl = self.db.model.change_files
-                for f in files:
-                    self.check_length(tbl.c.filename, f)
-                conn.execute(tbl.insert(), [
-                    dict(changeid=changeid, filename=f)
-                        for f in files
-                    ])
-            if properties:
-                tbl = self.db.model.change_properties
-                inserts = [
-                    dict(changeid=changeid,
-                        property_name=k,
-                        property_value=json.dumps(v))
-                    for k,v in properties.iteritems()
-                ]
-                for i in inserts:
-                    self.check_length(tbl.c.property_name,
-                            i['property_name'])
-                    self.check_length(tbl.c.property_value,
-                            i['property_value'])
-
-                conn.execute(tbl.insert(), inserts)
-            if uid:
-                ins = self.db.model.change_users.insert()
-                conn.execute(ins, dict(changeid=changeid, uid=uid))
+        self.check_length(ch_tbl.c.author, author)
+        self.check_length(ch_tbl.c.comments, comments)
+        self.check_length(ch_tbl.c.branch, branch)
+        self.check_length(ch_tbl.c.revision, revision)
+        self.check_length(ch_tbl.c.revlink, revlink)
+        self.check_length(ch_tbl.c.category, category)
+        self.check_length(ch_tbl.c.repository, repository)
+        self.check_length(ch_tbl.c.project, project)
 
-            transaction.commit()
+        r = conn.execute(ch_tbl.insert(), dict(
+            author=author,
+            comments=comments,
+            is_dir=is_dir,
+            branch=branch,
+            revision=revision,
+            revlink=revlink,
+            when_timestamp=datetime2epoch(when_timestamp),
+            category=category,
+            repository=repository,
+            codebase=codebase,
+            project=project))
+        changeid = r.inserted_primary_key[0]
+        if files:
+            tbl = self.db.model.change_files
+            for f in files:
+                self.check_length(tbl.c.filename, f)
+            conn.execute(tbl.insert(), [
+                dict(changeid=changeid, filename=f)
+                    for f in files
+                ])
+        if properties:
+            tbl = self.db.model.change_properties
+            inserts = [
+                dict(changeid=changeid,
+                    property_name=k,
+                    property_value=json.dumps(v))
+                for k,v in properties.iteritems()
+            ]
+            for i in inserts:
+                self.check_length(tbl.c.property_name,
+                        i['property_name'])
+                self.check_length(tbl.c.property_value,
+                        i['property_value'])
 
-            return changeid
-        d = self.db.pool.do(thd)
-        return d
+            conn.execute(tbl.insert(), inserts)
+        if uid:
+            ins = self.db.model.change_users.insert()
+            conn.execute(ins, dict(changeid=changeid, uid=uid))
+
+        return changeid
 
     @base.cached("chdicts")
-    def getChange(self, changeid):
+    def getChange(self, changeid, _prefetched=None):
         assert changeid >= 0
+        # getChanges fills the cache by passing the chdicts it fetched in
+        # bulk as _prefetched, a dictionary keyed by changeid
+        if _prefetched is not None:
+            return defer.succeed(_prefetched.get(changeid))
         def thd(conn):
-            # get the row from the 'changes' table
-            changes_tbl = self.db.model.changes
-            q = changes_tbl.select(whereclause=(changes_tbl.c.changeid == changeid))
-            rp = conn.execute(q)
-            row = rp.fetchone()
-            if not row:
-                return None
-            # and fetch the ancillary data (files, properties)
-            return self._chdict_from_change_row_thd(conn, row)
+            return self._getChangesThd(conn, [ changeid ]).get(changeid)
         d = self.db.pool.do(thd)
         return d
 
+    @defer.inlineCallbacks
+    def getChanges(self, changeids):
+        changeids = list(changeids)
+
+        # fetch everything that is not already cached in a single pass, and
+        # then get each change through the cache, so that it is filled
+        cache = self.getChange.cache
+        missing = [ changeid for changeid in changeids
+                    if changeid not in cache ]
+        prefetched = {}
+        if missing:
+            prefetched = yield self.db.pool.do(lambda conn :
+                    self._getChangesThd(conn, missing))
+
+        chdicts = yield defer.gatherResults([
+            self.getChange(changeid, _prefetched=prefetched)
+            for changeid in changeids ])
+        defer.returnValue(chdicts)
+
     def getChangeUids(self, changeid):
         assert changeid >= 0
         def thd(conn):
@@ -151,11 +200,8 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             return list(reversed(changeids))
         d = self.db.pool.do(thd)
 
-        # then turn those into changes, using the cache
-        def get_changes(changeids):
-            return defer.gatherResults([ self.getChange(changeid)
-                                         for changeid in changeids ])
-        d.addCallback(get_changes)
+        # then turn those into changes, in bulk and using the cache
+        d.addCallback(self.getChanges)
         return d
 
     def getLatestChangeid(self):
@@ -201,16 +247,51 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                     table.delete(table.c.changeid.in_(ids_to_delete)))
         return self.db.pool.do(thd)
 
-    def _chdict_from_change_row_thd(self, conn, ch_row):
-        # This method must be run in a db.pool thread, and returns a chdict
-        # given a row from the 'changes' table
+    def _getChangesThd(self, conn, changeids):
+        # This method must be run in a db.pool thread, and returns a
+        # dictionary mapping changeid to chdict for each of the given changes
+        # that exists.  It makes three queries for each batch of 100 changes,
+        # so that the parameter lists do not get too long.
+        changes_tbl = self.db.model.changes
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
-        chdict = ChDict(
+        chdicts = {}
+        changeids = sorted(set(changeids))
+        for i in xrange(0, len(changeids), 100):
+            batch = changeids[i:i+100]
+
+            q = changes_tbl.select(
+                    whereclause=changes_tbl.c.changeid.in_(batch))
+            for row in conn.execute(q):
+                chdicts[row.changeid] = self._chdict_from_change_row(row)
+
+            q = change_files_tbl.select(
+                    whereclause=change_files_tbl.c.changeid.in_(batch))
+            for r in conn.execute(q):
+                if r.changeid in chdicts:
+                    chdicts[r.changeid]['files'].append(r.filename)
+
+            q = change_properties_tbl.select(
+                    whereclause=change_properties_tbl.c.changeid.in_(batch))
+            for r in conn.execute(q):
+                if r.changeid not in chdicts:
+                    continue
+                try:
+                    v, s = _split_vs(json.loads(r.property_value))
+                    chdicts[r.changeid]['properties'][r.property_name] = (v,s)
+                except ValueError:
+                    pass
+
+        return chdicts
+
+    def _chdict_from_change_row(self, ch_row):
+        # returns a chdict given a row from the 'changes' table, without its
+        # files and properties, which come from other tables
+        return ChDict(
                 changeid=ch_row.changeid,
                 author=ch_row.author,
-                files=[], # see below
+                files=[], # filled in by the caller
                 comments=ch_row.comments,
                 is_dir=ch_row.is_dir,
                 revision=ch_row.revision,
@@ -218,37 +299,19 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 branch=ch_row.branch,
                 category=ch_row.category,
                 revlink=ch_row.revlink,
-                properties={}, # see below
+                properties={}, # filled in by the caller
                 repository=ch_row.repository,
                 codebase=ch_row.codebase,
                 project=ch_row.project)
 
-        query = change_files_tbl.select(
-                whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
-
-        # and properties must be given without a source, so strip that, but
-        # be flexible in case users have used a development version where the
-        # change properties were recorded incorrectly
-        def split_vs(vs):
-            try:
-                v,s = vs
-                if s != "Change":
-                    v,s = vs, "Change"
-            except:
-                v,s = vs, "Change"
-            return v, s
-
-        query = change_properties_tbl.select(
-                whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            try:
-                v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v,s)
-            except ValueError:
-                pass
-
-        return chdict
+def _split_vs(vs):
+    # change properties must be given without a source, so strip that, but be
+    # flexible in case users have used a development version where the change
+    # properties were recorded incorrectly
+    try:
+        v,s = vs
+        if s != "Change":
+            v,s = vs, "Change"
+    except:
+        v,s = vs, "Change"
+    return v, s
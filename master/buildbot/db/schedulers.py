@@ -15,37 +15,99 @@
 
 import sqlalchemy as sa
 import sqlalchemy.exc
+from twisted.internet import defer
+from twisted.python import failure
 from buildbot.db import base
+from buildbot.util import eventual
 
 class SchedulersConnectorComponent(base.DBConnectorComponent):
     # Documentation is in developer/database.rst
 
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # (objectid, classifications, Deferred) waiting to be written
+        self._pending_classifications = []
+
     def classifyChanges(self, objectid, classifications):
+        # the classifications made in the same reactor turn - typically by
+        # each of the schedulers interested in a new change - are written in
+        # a single transaction
+        d = defer.Deferred()
+        if not self._pending_classifications:
+            eventual.eventually(self._writeClassifications)
+        self._pending_classifications.append((objectid, classifications, d))
+        return d
+
+    def _writeClassifications(self):
+        pending = self._pending_classifications
+        self._pending_classifications = []
+
+        # (objectid, changeid) -> important; later classifications win
+        rows = {}
+        for objectid, classifications, _ in pending:
+            for changeid, important in classifications.iteritems():
+                # convert the 'important' value into an integer, since that
+                # is the column type
+                rows[(objectid, changeid)] = important and 1 or 0
+
         def thd(conn):
             transaction = conn.begin()
             tbl = self.db.model.scheduler_changes
+
+            # find the rows that already exist, in batches of 100 changeids
+            # so as not to overflow the parameter limits
+            existing = set()
+            changeids = sorted(set([ changeid for _, changeid in rows ]))
+            while changeids:
+                batch, changeids = changeids[:100], changeids[100:]
+                q = sa.select([ tbl.c.objectid, tbl.c.changeid ],
+                              whereclause=tbl.c.changeid.in_(batch))
+                for row in conn.execute(q).fetchall():
+                    existing.add((row.objectid, row.changeid))
+
             ins_q = tbl.insert()
             upd_q = tbl.update(
-                    ((tbl.c.objectid == objectid)
+                    ((tbl.c.objectid == sa.bindparam('wc_objectid'))
                     & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
-            for changeid, important in classifications.items():
-                # convert the 'important' value into an integer, since that
-                # is the column type
-                imp_int = important and 1 or 0
+
+            inserts = [ dict(objectid=objectid, changeid=changeid,
+                             important=important)
+                        for (objectid, changeid), important in rows.items()
+                        if (objectid, changeid) not in existing ]
+            if inserts:
                 try:
-                    conn.execute(ins_q,
-                            objectid=objectid,
-                            changeid=changeid,
-                            important=imp_int)
+                    conn.execute(ins_q, inserts)
                 except (sqlalchemy.exc.ProgrammingError,
                         sqlalchemy.exc.IntegrityError):
-                    # insert failed, so try an update
+                    # some of the rows were inserted since they were looked
+                    # up, so insert them one at a time, updating any that
+                    # exist
+                    for row in inserts:
+                        try:
+                            conn.execute(ins_q, row)
+                        except (sqlalchemy.exc.ProgrammingError,
+                                sqlalchemy.exc.IntegrityError):
+                            conn.execute(upd_q,
+                                    wc_objectid=row['objectid'],
+                                    wc_changeid=row['changeid'],
+                                    important=row['important'])
+
+            for (objectid, changeid), important in rows.items():
+                if (objectid, changeid) in existing:
                     conn.execute(upd_q,
+                            wc_objectid=objectid,
                             wc_changeid=changeid,
-                            important=imp_int)
+                            important=important)
 
             transaction.commit()
-        return self.db.pool.do(thd)
+        d = self.db.pool.do(thd)
+        def notify(res):
+            for _, _, waiter in pending:
+                if isinstance(res, failure.Failure):
+                    waiter.errback(res)
+                else:
+                    waiter.callback(None)
+        d.addBoth(notify)
 
     def flushChangeClassifications(self, objectid, less_than=None):
         def thd(conn):
@@ -105,12 +105,7 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
             row = res.fetchone()
             if not row:
                 return None
-            ssdict = SsDict(ssid=ssid, branch=row.branch, sourcestampsetid=row.sourcestampsetid,
-                    revision=row.revision, patch_body=None, patch_level=None,
-                    patch_author=None, patch_comment=None, patch_subdir=None,
-                    repository=row.repository, codebase=row.codebase,
-                    project=row.project,
-                    changeids=set([]))
+            ssdict = self._rowToSsdict(row)
             patchid = row.patchid
             res.close()
 
@@ -121,13 +116,7 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
                 res = conn.execute(q)
                 row = res.fetchone()
                 if row:
-                    # note the subtle renaming here
-                    ssdict['patch_level'] = row.patchlevel
-                    ssdict['patch_subdir'] = row.subdir
-                    ssdict['patch_author'] = row.patch_author
-                    ssdict['patch_comment'] = row.patch_comment
-                    body = base64.b64decode(row.patch_base64)
-                    ssdict['patch_body'] = body
+                    self._addPatchToSsdict(ssdict, row)
                 else:
                     log.msg('patchid %d, referenced from ssid %d, not found'
                             % (patchid, ssid))
@@ -143,3 +132,74 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
 
             return ssdict
         return self.db.pool.do(thd)
+
+    def getSourceStampsForSets(self, sourcestampsetids):
+        """
+        Get the sourcestamps in several sets at once.  This is equivalent to
+        calling L{getSourceStamps} for each set, but uses only a few queries
+        for each 100 sets, regardless of the number of sourcestamps.
+
+        @param sourcestampsetids: sourcestamp set IDs
+
+        @returns: dictionary mapping each sourcestamp set ID to an sslist, via
+        Deferred
+        """
+        def thd(conn):
+            rv = dict([ (setid, SsList()) for setid in sourcestampsetids ])
+            setids_list = list(rv)
+            for i in xrange(0, len(setids_list), 100):
+                batch = setids_list[i:i+100]
+
+                tbl = self.db.model.sourcestamps
+                q = tbl.select(whereclause=(
+                            tbl.c.sourcestampsetid.in_(batch)),
+                        order_by=[tbl.c.id])
+                ssdicts = {}
+                patchids = {}
+                for row in conn.execute(q):
+                    ssdict = ssdicts[row.id] = self._rowToSsdict(row)
+                    rv[row.sourcestampsetid].append(ssdict)
+                    if row.patchid is not None:
+                        patchids.setdefault(row.patchid, []).append(ssdict)
+                if not ssdicts:
+                    continue
+
+                # fetch the patches, if necessary
+                if patchids:
+                    tbl = self.db.model.patches
+                    q = tbl.select(whereclause=(
+                                tbl.c.id.in_(patchids.keys())))
+                    for row in conn.execute(q):
+                        for ssdict in patchids.pop(row.id):
+                            self._addPatchToSsdict(ssdict, row)
+                    for patchid, missing in patchids.iteritems():
+                        for ssdict in missing:
+                            log.msg('patchid %d, referenced from ssid %d, '
+                                    'not found' % (patchid, ssdict['ssid']))
+
+                # fetch change ids
+                tbl = self.db.model.sourcestamp_changes
+                q = tbl.select(whereclause=(
+                            tbl.c.sourcestampid.in_(ssdicts.keys())))
+                for row in conn.execute(q):
+                    ssdicts[row.sourcestampid]['changeids'].add(row.changeid)
+            return rv
+        return self.db.pool.do(thd)
+
+    def _rowToSsdict(self, row):
+        return SsDict(ssid=row.id, branch=row.branch,
+                sourcestampsetid=row.sourcestampsetid,
+                revision=row.revision, patch_body=None, patch_level=None,
+                patch_author=None, patch_comment=None, patch_subdir=None,
+                repository=row.repository, codebase=row.codebase,
+                project=row.project,
+                changeids=set([]))
+
+    def _addPatchToSsdict(self, ssdict, row):
+        # note the subtle renaming here
+        ssdict['patch_level'] = row.patchlevel
+        ssdict['patch_subdir'] = row.subdir
+        ssdict['patch_author'] = row.patch_author
+        ssdict['patch_comment'] = row.patch_comment
+        body = base64.b64decode(row.patch_base64)
+        ssdict['patch_body'] = body
@@ -772,7 +772,7 @@ class IStatusLog(Interface):
         to remove a receiver which was not previously registered is a no-op.
         """
 
-    def subscribeConsumer(consumer):
+    def subscribeConsumer(consumer, channels=[], offset=0):
         """Register an L{IStatusLogConsumer} to receive all chunks of the
         logfile, including all the old entries and any that will arrive in
         the future. The consumer will first have their C{registerProducer}
@@ -785,6 +785,10 @@ class IStatusLog(Interface):
         a small amount of data could be written via C{writeChunk} even after
         C{pauseProducing} has been called.
 
+        If C{channels} is given, only chunks from those channels are written.
+        If C{offset} is given, delivery starts at that byte offset within the
+        text of those channels, rather than with the very first chunk.
+
         To unsubscribe the consumer, use C{producer.stopProducing}."""
 
     # once the log has finished, the following methods make sense. They can
@@ -27,13 +27,15 @@ import buildbot
 import buildbot.pbmanager
 from buildbot.util import subscription, epoch2datetime
 from buildbot.status.master import Status
-from buildbot.changes import changes
+from buildbot.status import logfile, saver
+from buildbot.changes import changes, router
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces
 from buildbot.process.builder import BuilderControl
 from buildbot.db import connector
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.process.botmaster import BotMaster
+from buildbot.process.masternotifier import MasterNotifier
 from buildbot.process import debug
 from buildbot.process import metrics
 from buildbot.process import cache
@@ -65,6 +67,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # maximum number of changes to fetch at once when polling the database
+    CHANGE_POLL_BATCH = 100
+
     def __init__(self, basedir, configFileName="master.cfg", umask=None):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -92,8 +97,7 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.log_rotation = LogRotation()
 
         # subscription points
-        self._change_subs = \
-                subscription.SubscriptionPoint("changes")
+        self._change_subs = router.ChangeRouter()
         self._new_buildrequest_subs = \
                 subscription.SubscriptionPoint("buildrequest_additions")
         self._new_buildset_subs = \
@@ -101,6 +105,10 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self._complete_buildset_subs = \
                 subscription.SubscriptionPoint("buildset_completion")
 
+        # serializes pollDatabaseChanges
+        self._poll_changes_lock = defer.DeferredLock()
+        self._poll_changes_queued = False
+
         # local cache for this master's object ID
         self._object_id = None
 
@@ -124,6 +132,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.botmaster = BotMaster(self)
         self.botmaster.setServiceParent(self)
 
+        self.notifier = MasterNotifier(self)
+        self.notifier.setServiceParent(self)
+
         self.scheduler_manager = SchedulerManager(self)
         self.scheduler_manager.setServiceParent(self)
 
@@ -139,6 +150,12 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         self.status = Status(self)
         self.status.setServiceParent(self)
 
+        self.logwriter = logfile.LogWriter()
+        self.logwriter.setServiceParent(self)
+
+        self.statussaver = saver.StatusSaver()
+        self.statussaver.setServiceParent(self)
+
     # setup and reconfig handling
 
     _already_started = False
@@ -414,6 +431,80 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         """
         metrics.MetricCountEvent.log("added_changes", 1)
 
+        db_kwargs = self._changeArgs(who=who, files=files, comments=comments,
+                author=author, isdir=isdir, is_dir=is_dir, revision=revision,
+                when=when, when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, codebase=codebase, project=project)
+
+        d = defer.succeed(None)
+        if src:
+            # create user object, returning a corresponding uid
+            d.addCallback(lambda _ :
+                users.createUserObject(self, db_kwargs['author'], src))
+         
+        # add the Change to the database
+        d.addCallback(lambda uid :
+                          self.db.changes.addChange(uid=uid, **db_kwargs))
+
+        # convert the changeid to a Change instance
+        d.addCallback(lambda changeid :
+            self.db.changes.getChange(changeid))
+        d.addCallback(lambda chdict :
+            changes.Change.fromChdict(self, chdict))
+
+        def notify(change):
+            self._changeAdded(change)
+            return change
+        d.addCallback(notify)
+        return d
+
+    @defer.inlineCallbacks
+    def addChanges(self, change_kwargs):
+        """
+        Add several changes to the buildmaster at once, and act on them.  The
+        changes are added to the database in a single operation, and are
+        otherwise handled exactly as if they were given to L{addChange} one
+        by one, in order.
+
+        @param change_kwargs: list of dictionaries of keyword arguments for
+        L{addChange}
+
+        @returns: list of L{Change} instances via Deferred
+        """
+        if not change_kwargs:
+            defer.returnValue([])
+
+        metrics.MetricCountEvent.log("added_changes", len(change_kwargs))
+
+        all_db_kwargs = []
+        for kwargs in change_kwargs:
+            kwargs = kwargs.copy()
+            src = kwargs.pop('src', None)
+            db_kwargs = self._changeArgs(**kwargs)
+            db_kwargs['uid'] = None
+            if src:
+                db_kwargs['uid'] = yield users.createUserObject(self,
+                                                db_kwargs['author'], src)
+            all_db_kwargs.append(db_kwargs)
+
+        changeids = yield self.db.changes.addChanges(all_db_kwargs)
+        chdicts = yield self.db.changes.getChanges(changeids)
+        new_changes = yield defer.gatherResults([
+                changes.Change.fromChdict(self, chdict)
+                for chdict in chdicts ])
+
+        for change in new_changes:
+            self._changeAdded(change)
+        defer.returnValue(new_changes)
+
+    def _changeArgs(self, who=None, files=None, comments=None, author=None,
+            isdir=None, is_dir=None, revision=None, when=None,
+            when_timestamp=None, branch=None, category=None, revlink='',
+            properties={}, repository='', codebase=None, project=''):
+        # translate the arguments to addChange into those for
+        # db.changes.addChange, except for the uid
+
         # handle translating deprecated names into new names for db.changes
         def handle_deprec(oldname, old, newname, new, default=None,
                           converter = lambda x:x):
@@ -459,47 +550,35 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 codebase = self.config.codebaseGenerator(chdict)
             else:
                 codebase = ''
-            
-        d = defer.succeed(None)
-        if src:
-            # create user object, returning a corresponding uid
-            d.addCallback(lambda _ : users.createUserObject(self, author, src))
-         
-        # add the Change to the database
-        d.addCallback(lambda uid :
-                          self.db.changes.addChange(author=author, files=files,
-                                          comments=comments, is_dir=is_dir,
-                                          revision=revision,
-                                          when_timestamp=when_timestamp,
-                                          branch=branch, category=category,
-                                          revlink=revlink, properties=properties,
-                                          repository=repository, codebase=codebase,
-                                          project=project, uid=uid))
-
-        # convert the changeid to a Change instance
-        d.addCallback(lambda changeid :
-            self.db.changes.getChange(changeid))
-        d.addCallback(lambda chdict :
-            changes.Change.fromChdict(self, chdict))
 
-        def notify(change):
-            msg = u"added change %s to database" % change
-            log.msg(msg.encode('utf-8', 'replace'))
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
-                self._change_subs.deliver(change)
-            return change
-        d.addCallback(notify)
-        return d
-
-    def subscribeToChanges(self, callback):
+        return dict(author=author, files=files, comments=comments,
+                is_dir=is_dir, revision=revision,
+                when_timestamp=when_timestamp, branch=branch,
+                category=category, revlink=revlink, properties=properties,
+                repository=repository, codebase=codebase, project=project)
+
+    def _changeAdded(self, change):
+        msg = u"added change %s to database" % change
+        log.msg(msg.encode('utf-8', 'replace'))
+        # only deliver messages immediately if we're not polling
+        if not self.config.db['db_poll_interval']:
+            self._change_subs.deliver(change)
+        else:
+            # tell the other masters, and pick it up here without
+            # waiting for the next poll
+            self.notifier.changeAdded(change.number)
+            if self.notifier.active:
+                d = self.pollDatabaseChanges()
+                d.addErrback(log.err, 'while polling for a new change')
+
+    def subscribeToChanges(self, callback, change_filter=None):
         """
         Request that C{callback} be called with each Change object added to the
-        cluster.
+        cluster, or only with those that pass C{change_filter}.
 
         Note: this method will go away in 0.9.x
         """
-        return self._change_subs.subscribe(callback)
+        return self._change_subs.subscribe(callback, change_filter)
 
     def addBuildset(self, **kwargs):
         """
@@ -514,8 +593,11 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             log.msg("added buildset %d to database" % bsid)
             # note that buildset additions are only reported on this master
             self._new_buildset_subs.deliver(bsid=bsid, **kwargs)
-            # only deliver messages immediately if we're not polling
-            if not self.config.db['db_poll_interval']:
+            # only deliver messages immediately if we're not polling, or if
+            # other masters will be told about the new requests, too
+            self.notifier.buildsetAdded(bsid, brids)
+            if (not self.config.db['db_poll_interval']
+                    or self.notifier.active):
                 for bn, brid in brids.iteritems():
                     self.buildRequestAdded(bsid=bsid, brid=brid,
                                            buildername=bn)
@@ -589,6 +671,9 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         @param brid: buildrequest ID
         @param buildername: builder named by the build request
         """
+        # the next database poll need not report this request again
+        if self._last_unclaimed_brids_set is not None:
+            self._last_unclaimed_brids_set.add(brid)
         self._new_buildrequest_subs.deliver(
                 dict(bsid=bsid, brid=brid, buildername=buildername))
 
@@ -621,9 +706,22 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
         d.addErrback(log.err, 'while polling database')
         return d
 
+    def pollDatabaseChanges(self):
+        # polls may be requested by notifications from other masters as well
+        # as by the timer; run them one at a time, so that no change is
+        # delivered twice, and skip any request that arrives while a poll is
+        # already waiting to run, since that poll will cover it
+        if self._poll_changes_queued:
+            return defer.succeed(None)
+        self._poll_changes_queued = True
+        def poll():
+            self._poll_changes_queued = False
+            return self._pollDatabaseChanges()
+        return self._poll_changes_lock.run(poll)
+
     _last_processed_change = None
     @defer.inlineCallbacks
-    def pollDatabaseChanges(self):
+    def _pollDatabaseChanges(self):
         # Older versions of Buildbot had each scheduler polling the database
         # independently, and storing a "last_processed" state indicating the
         # last change it had processed.  This had the advantage of allowing
@@ -658,21 +756,27 @@ class BuildMaster(config.ReconfigurableServiceMixin, service.MultiService):
             timer.stop()
             return
 
-        while True:
-            changeid = self._last_processed_change + 1
-            chdict = yield self.db.changes.getChange(changeid)
+        # fetch the new changes in batches
+        latest = yield self.db.changes.getLatestChangeid()
+        reached_end = latest is None
+        while not reached_end and self._last_processed_change < latest:
+            first = self._last_processed_change + 1
+            last = min(latest, first + self.CHANGE_POLL_BATCH - 1)
+            chdicts = yield self.db.changes.getChanges(range(first, last + 1))
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
-                break
+            for chdict in chdicts:
+                # if there's no such change, we've reached the end and can
+                # stop polling; a change with this id may yet be committed
+                if not chdict:
+                    reached_end = True
+                    break
 
-            change = yield changes.Change.fromChdict(self, chdict)
+                change = yield changes.Change.fromChdict(self, chdict)
 
-            self._change_subs.deliver(change)
+                self._change_subs.deliver(change)
 
-            self._last_processed_change = changeid
-            need_setState = True
+                self._last_processed_change = chdict['changeid']
+                need_setState = True
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -141,6 +141,9 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
 
     def startService(self):
         def buildRequestAdded(notif):
+            builder = self.builders.get(notif['buildername'])
+            if builder:
+                builder.buildRequestAdded(notif)
             self.maybeStartBuildsForBuilder(notif['buildername'])
         self.buildrequest_sub = \
             self.master.subscribeToBuildRequests(buildRequestAdded)
@@ -256,6 +259,12 @@ class BotMaster(config.ReconfigurableServiceMixin, service.MultiService):
                 yield defer.maybeDeferred(lambda :
                         builder.disownServiceParent())
 
+            # load the status of the new builders in parallel, before each
+            # is configured
+            yield self.master.status.loadBuilders([
+                    (new_by_name[n].name, new_by_name[n].builddir)
+                    for n in added_names ])
+
             for n in added_names:
                 builder = Builder(n)
                 self.builders[n] = builder
@@ -331,6 +340,11 @@ class BuildRequestDistributor(service.Service):
     are still working on the previous build request, then this class will
     correctly re-prioritize invocations of builders' C{maybeStartBuild}
     methods.
+
+    Up to C{distributorParallelism} builders are called at once, taking them
+    in priority order but skipping any builder which shares a slave with a
+    builder that is already being called, so that builders never contend for
+    the same slave.
     """
 
     def __init__(self, botmaster):
@@ -346,13 +360,25 @@ class BuildRequestDistributor(service.Service):
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
+        # names of builders whose maybeStartBuild method is running, mapped
+        # to the set of slaves each may use
+        self._active_builders = {}
+
+        # Deferreds waiting for a call to finish or for new pending builders
+        self._activity_waiters = []
+
+    @defer.inlineCallbacks
     def stopService(self):
-        # let the parent stopService succeed between activity; then the loop
-        # will stop calling itself, since self.running is false
-        d = self.activity_lock.acquire()
-        d.addCallback(lambda _ : service.Service.stopService(self))
-        d.addBoth(lambda _ : self.activity_lock.release())
-        return d
+        # let the parent stopService succeed between activity, once any
+        # running calls are complete; then the loop will stop calling
+        # itself, since self.running is false
+        yield self.activity_lock.acquire()
+        try:
+            while self._active_builders:
+                yield self._waitForActivity()
+            yield service.Service.stopService(self)
+        finally:
+            self.activity_lock.release()
 
     @defer.inlineCallbacks
     def maybeStartBuildsOn(self, new_builders):
@@ -384,9 +410,12 @@ class BuildRequestDistributor(service.Service):
             self._pending_builders = \
                 yield self._sortBuilders(list(existing_pending | new_builders))
 
-            # start the activity loop, if we aren't already working on that.
+            # start the activity loop, if we aren't already working on that,
+            # or let it know there is more to do
             if not self.active:
                 self._activityLoop()
+            else:
+                self._notifyActivity()
         except:
             log.err(Failure(),
                     "while attempting to start builds on %s" % self.name)
@@ -462,31 +491,88 @@ class BuildRequestDistributor(service.Service):
         while 1:
             yield self.activity_lock.acquire()
 
-            # lock pending_builders, pop an element from it, and release
+            # lock pending_builders, pick elements from it, and release
             yield self.pending_builders_lock.acquire()
 
             # bail out if we shouldn't keep looping
-            if not self.running or not self._pending_builders:
+            if not self.running:
                 self.pending_builders_lock.release()
                 self.activity_lock.release()
                 break
 
-            bldr_name = self._pending_builders.pop(0)
+            to_start = self._pickBuilders()
             self.pending_builders_lock.release()
 
-            try:
-                yield self._callABuilder(bldr_name)
-            except:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            for bldr_name in to_start:
+                self._startBuilder(bldr_name)
 
             self.activity_lock.release()
 
+            # stop if nothing is running, or else wait for something to change
+            if not self._active_builders:
+                break
+            yield self._waitForActivity()
+
         timer.stop()
 
         self.active = False
         self._quiet()
 
+    def _pickBuilders(self):
+        """
+        Remove from the pending builders, and mark active, as many builders
+        as may be called now, in priority order: each is not already being
+        called, and shares no slaves with any builder that is.  Call this
+        with pending_builders_lock held.
+
+        @returns: list of builder names
+        """
+        parallelism = self.master.config.distributorParallelism
+        builders_dict = self.botmaster.builders
+
+        busy_slaves = set()
+        for slavenames in self._active_builders.itervalues():
+            busy_slaves.update(slavenames)
+
+        picked = []
+        for bldr_name in self._pending_builders[:]:
+            if len(self._active_builders) >= parallelism:
+                break
+            if bldr_name in self._active_builders:
+                continue
+            bldr = builders_dict.get(bldr_name)
+            if bldr and bldr.config:
+                slavenames = set(bldr.config.slavenames)
+            else:
+                # _callABuilder will do nothing with this one
+                slavenames = set()
+            if slavenames & busy_slaves:
+                continue
+            self._pending_builders.remove(bldr_name)
+            self._active_builders[bldr_name] = slavenames
+            busy_slaves.update(slavenames)
+            picked.append(bldr_name)
+        return picked
+
+    def _startBuilder(self, bldr_name):
+        d = defer.maybeDeferred(self._callABuilder, bldr_name)
+        d.addErrback(log.err,
+                "from maybeStartBuild for builder '%s'" % (bldr_name,))
+        def done(_):
+            del self._active_builders[bldr_name]
+            self._notifyActivity()
+        d.addCallback(done)
+
+    def _waitForActivity(self):
+        d = defer.Deferred()
+        self._activity_waiters.append(d)
+        return d
+
+    def _notifyActivity(self):
+        waiters, self._activity_waiters = self._activity_waiters, []
+        for d in waiters:
+            d.callback(None)
+
     def _callABuilder(self, bldr_name):
         # get the actual builder object
         bldr = self.botmaster.builders.get(bldr_name)
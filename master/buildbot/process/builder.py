@@ -61,6 +61,19 @@ class Builder(config.ReconfigurableServiceMixin,
         self.config = None
         self.builder_status = None
 
+        # unclaimed build requests for this builder, as a dictionary mapping
+        # brid to brdict, or None if they must be fetched from the database.
+        # This is kept current by buildRequestAdded: new requests are noted
+        # in _newRequestIds and fetched in bulk by _getUnclaimedRequests.
+        self._pendingRequests = None
+        self._newRequestIds = set()
+        # while a fetch is in progress, a list of the Deferreds waiting for
+        # it to finish; otherwise None
+        self._fetchWaiters = None
+        # incremented when the index is discarded, so that a fetch begun
+        # before then is not used
+        self._pendingGeneration = 0
+
         self.reclaim_svc = internet.TimerService(10*60, self.reclaimAllBuilds)
         self.reclaim_svc.setServiceParent(self)
 
@@ -100,21 +113,35 @@ class Builder(config.ReconfigurableServiceMixin,
     def __repr__(self):
         return "<Builder '%r' at %d>" % (self.name, id(self))
 
+    def buildRequestAdded(self, notif):
+        """
+        Note that a build request for this builder has been added (or has
+        become unclaimed).  This is called by the botmaster, with the same
+        notification dictionary given to subscribers of
+        L{BuildMaster.subscribeToBuildRequests}.
+        """
+        if self._pendingRequests is not None \
+                or self._fetchWaiters is not None:
+            self._newRequestIds.add(notif['brid'])
+
     @defer.inlineCallbacks
     def getOldestRequestTime(self):
 
         """Returns the submitted_at of the oldest unclaimed build request for
         this builder, or None if there are no build requests.
 
+        This is answered from the pending request index, so it only consults
+        the database for requests added since the last call.  Requests
+        claimed by other masters remain in the index until this builder
+        fails to claim them, so the result may be slightly too old; it is
+        only used to prioritize builders.
+
         @returns: datetime instance or None, via Deferred
         """
-        unclaimed = yield self.master.db.buildrequests.getBuildRequests(
-                        buildername=self.name, claimed=False)
+        unclaimed = yield self._getUnclaimedRequests()
 
         if unclaimed:
-            unclaimed = [ brd['submitted_at'] for brd in unclaimed ]
-            unclaimed.sort()
-            defer.returnValue(unclaimed[0])
+            defer.returnValue(unclaimed[0]['submitted_at'])
         else:
             defer.returnValue(None)
 
@@ -420,7 +447,15 @@ class Builder(config.ReconfigurableServiceMixin,
 
     def _resubmit_buildreqs(self, build):
         brids = [br.id for br in build.requests]
-        return self.master.db.buildrequests.unclaimBuildRequests(brids)
+        self._invalidatePendingRequests()
+        d = self.master.db.buildrequests.unclaimBuildRequests(brids)
+        @d.addCallback
+        def notify(_):
+            # let other masters try these requests, too
+            for br in build.requests:
+                self.master.notifier.buildRequestUnclaimed(br.bsid, br.id,
+                                                           self.name)
+        return d
 
     def setExpectations(self, progress):
         """Mark the build as successful and update expectations for the next
@@ -461,18 +496,14 @@ class Builder(config.ReconfigurableServiceMixin,
             self.updateBigStatus()
             return
 
-        # now, get the available build requests
-        unclaimed_requests = \
-            yield self.master.db.buildrequests.getBuildRequests(
-                    buildername=self.name, claimed=False)
+        # now, get the available build requests, sorted so the first is the
+        # oldest
+        unclaimed_requests = yield self._getUnclaimedRequests()
 
         if not unclaimed_requests:
             self.updateBigStatus()
             return
 
-        # sort by submitted_at, so the first is the oldest
-        unclaimed_requests.sort(key=lambda brd : brd['submitted_at'])
-
         # get the mergeRequests function for later
         mergeRequests_fn = self._getMergeRequestsFn()
 
@@ -513,10 +544,8 @@ class Builder(config.ReconfigurableServiceMixin,
                 # one or more of the build requests was already claimed;
                 # re-fetch the now-partially-claimed build requests and keep
                 # trying to match them
-                self._breakBrdictRefloops(unclaimed_requests)
-                unclaimed_requests = \
-                    yield self.master.db.buildrequests.getBuildRequests(
-                            buildername=self.name, claimed=False)
+                self._invalidatePendingRequests()
+                unclaimed_requests = yield self._getUnclaimedRequests()
 
                 # go around the loop again
                 continue
@@ -527,14 +556,16 @@ class Builder(config.ReconfigurableServiceMixin,
             # loop. TODO: test that!
 
             # _startBuildFor expects BuildRequest objects, so cook some up
-            breqs = yield defer.gatherResults(
-                    [ self._brdictToBuildRequest(brdict)
-                      for brdict in brdicts ])
+            breqs = yield self._brdictsToBuildRequests(brdicts)
+
+            # these requests are no longer pending
+            self._removePendingRequests(brids)
 
             build_started = yield self._startBuildFor(slavebuilder, breqs)
 
             if not build_started:
                 # build was not started, so unclaim the build requests
+                self._invalidatePendingRequests()
                 yield self.master.db.buildrequests.unclaimBuildRequests(brids)
 
                 # and try starting builds again.  If we still have a working slave,
@@ -548,13 +579,90 @@ class Builder(config.ReconfigurableServiceMixin,
                 unclaimed_requests.remove(brdict)
             available_slavebuilders.remove(slavebuilder)
 
-        self._breakBrdictRefloops(unclaimed_requests)
         self.updateBigStatus()
         return
 
     # a few utility functions to make the maybeStartBuild a bit shorter and
     # easier to read
 
+    @defer.inlineCallbacks
+    def _getUnclaimedRequests(self):
+        """
+        Get the unclaimed build requests for this builder, oldest first.  The
+        requests are fetched from the database only when the pending request
+        index is invalid; otherwise only newly-added requests are fetched.
+
+        Note that the brdicts are shared between calls, along with any
+        L{buildrequest.BuildRequest} objects cached in them.
+
+        @returns: list of build request dictionaries, via Deferred
+        """
+        while (self._pendingRequests is None or self._newRequestIds
+               or self._fetchWaiters is not None):
+            if self._fetchWaiters is not None:
+                # another call is fetching; wait for it, then look again
+                d = defer.Deferred()
+                self._fetchWaiters.append(d)
+                yield d
+            else:
+                yield self._fetchRequests()
+
+        unclaimed_requests = self._pendingRequests.values()
+        unclaimed_requests.sort(key=lambda brd :
+                                    (brd['submitted_at'], brd['brid']))
+        defer.returnValue(unclaimed_requests)
+
+    @defer.inlineCallbacks
+    def _fetchRequests(self):
+        # fetch all unclaimed requests, or only those added since the last
+        # fetch, into the pending request index.  Only one fetch is made at a
+        # time; requests added meanwhile are noted for the next.
+        db = self.master.db
+        generation = self._pendingGeneration
+        self._fetchWaiters = []
+        try:
+            if self._pendingRequests is None:
+                self._newRequestIds = set()
+                pending = {}
+                brdicts = yield db.buildrequests.getBuildRequests(
+                        buildername=self.name, claimed=False)
+            else:
+                pending = self._pendingRequests
+                brids = self._newRequestIds - set(pending)
+                self._newRequestIds = set()
+                brdicts = []
+                if brids:
+                    brdicts = yield db.buildrequests.getBuildRequests(
+                            buildername=self.name, claimed=False,
+                            brids=brids)
+
+            # the index may have been discarded meanwhile, in which case
+            # these results are already out of date
+            if generation == self._pendingGeneration:
+                for brdict in brdicts:
+                    if brdict['brid'] not in pending:
+                        pending[brdict['brid']] = brdict
+                self._pendingRequests = pending
+        finally:
+            waiters = self._fetchWaiters
+            self._fetchWaiters = None
+            for d in waiters:
+                d.callback(None)
+
+    def _removePendingRequests(self, brids):
+        """Remove the given requests from the pending request index"""
+        if self._pendingRequests is None:
+            return
+        for brid in brids:
+            self._pendingRequests.pop(brid, None)
+
+    def _invalidatePendingRequests(self):
+        """Discard the pending request index, so that the next call to
+        L{_getUnclaimedRequests} re-fetches all unclaimed requests"""
+        self._pendingRequests = None
+        self._newRequestIds = set()
+        self._pendingGeneration += 1
+
     def _chooseSlave(self, available_slavebuilders):
         """
         Choose the next slave, using the C{nextSlave} configuration if
@@ -581,8 +689,7 @@ class Builder(config.ReconfigurableServiceMixin,
         if self.config.nextBuild:
             # nextBuild expects BuildRequest objects, so instantiate them here
             # and cache them in the dictionaries
-            d = defer.gatherResults([ self._brdictToBuildRequest(brdict)
-                                      for brdict in buildrequests ])
+            d = self._brdictsToBuildRequests(buildrequests)
             d.addCallback(lambda requestobjects :
                     self.config.nextBuild(self, requestobjects))
             def to_brdict(brobj):
@@ -624,9 +731,8 @@ class Builder(config.ReconfigurableServiceMixin,
             return
 
         # we'll need BuildRequest objects, so get those first
-        unclaimed_request_objects = yield defer.gatherResults(
-                [ self._brdictToBuildRequest(brdict)
-                  for brdict in unclaimed_requests ])
+        unclaimed_request_objects = \
+                yield self._brdictsToBuildRequests(unclaimed_requests)
 
         breq_object = unclaimed_request_objects.pop(
                 unclaimed_requests.index(breq))
@@ -667,6 +773,30 @@ class Builder(config.ReconfigurableServiceMixin,
         d.addCallback(keep)
         return d
 
+    def _brdictsToBuildRequests(self, brdicts):
+        """
+        Convert a list of build request dictionaries to
+        L{buildrequest.BuildRequest} objects, as for L{_brdictToBuildRequest},
+        but fetching the data for all of the requests which are not yet
+        converted in a few bulk queries.
+
+        @param brdicts: list of dictionaries to convert
+
+        @returns: list of L{buildrequest.BuildRequest}, via Deferred
+        """
+        to_convert = [ brdict for brdict in brdicts if 'brobj' not in brdict ]
+        if to_convert:
+            d = buildrequest.BuildRequest.fromBrdicts(self.master, to_convert)
+        else:
+            d = defer.succeed([])
+        def keep(buildrequests):
+            for brdict, br in zip(to_convert, buildrequests):
+                brdict['brobj'] = br
+                br.brdict = brdict
+            return [ brdict['brobj'] for brdict in brdicts ]
+        d.addCallback(keep)
+        return d
+
     def _breakBrdictRefloops(self, requests):
         """Break the reference loops created by L{_brdictToBuildRequest}"""
         for brdict in requests:
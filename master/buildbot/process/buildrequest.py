@@ -90,9 +90,48 @@ class BuildRequest(object):
         cache = master.caches.get_cache("BuildRequests", cls._make_br)
         return cache.get(brdict['brid'], brdict=brdict, master=master)
 
+    @classmethod
+    @defer.inlineCallbacks
+    def fromBrdicts(cls, master, brdicts):
+        """
+        Construct new L{BuildRequest}s from a list of dictionaries, as for
+        L{fromBrdict}.  The buildsets, properties, and sourcestamps of any
+        requests which are not already cached are fetched in bulk, using a
+        few queries rather than several queries per request.
+
+        @param master: current build master
+        @param brdicts: list of build request dictionaries
+
+        @returns: list of L{BuildRequest}, in the same order, via Deferred
+        """
+        cache = master.caches.get_cache("BuildRequests", cls._make_br)
+
+        prefetched = {}
+        bsids = set([ brdict['buildsetid'] for brdict in brdicts
+                      if brdict['brid'] not in cache ])
+        if bsids:
+            buildsets = yield master.db.buildsets.getBuildsets(bsids=bsids)
+            all_properties = \
+                yield master.db.buildsets.getBuildsetsProperties(bsids)
+            sslists = yield master.db.sourcestamps.getSourceStampsForSets(
+                    set([ bs['sourcestampsetid'] for bs in buildsets ]))
+            for buildset in buildsets:
+                prefetched[buildset['bsid']] = dict(buildset=buildset,
+                    buildset_properties=all_properties[buildset['bsid']],
+                    sslist=sslists[buildset['sourcestampsetid']])
+
+        buildrequests = yield defer.gatherResults([
+            cache.get(brdict['brid'], brdict=brdict, master=master,
+                      **prefetched.get(brdict['buildsetid'], {}))
+            for brdict in brdicts ])
+        defer.returnValue(buildrequests)
+
     @classmethod
     @defer.deferredGenerator
-    def _make_br(cls, brid, brdict, master):
+    def _make_br(cls, brid, brdict, master, buildset=None,
+                 buildset_properties=None, sslist=None):
+        # buildset, buildset_properties, and sslist may be given if they
+        # have already been fetched (see fromBrdicts)
         buildrequest = cls()
         buildrequest.id = brid
         buildrequest.bsid = brdict['buildsetid']
@@ -103,18 +142,21 @@ class BuildRequest(object):
         buildrequest.master = master
 
         # fetch the buildset to get the reason
-        wfd = defer.waitForDeferred(
-            master.db.buildsets.getBuildset(brdict['buildsetid']))
-        yield wfd
-        buildset = wfd.getResult()
+        if buildset is None:
+            wfd = defer.waitForDeferred(
+                master.db.buildsets.getBuildset(brdict['buildsetid']))
+            yield wfd
+            buildset = wfd.getResult()
         assert buildset # schema should guarantee this
         buildrequest.reason = buildset['reason']
 
         # fetch the buildset properties, and convert to Properties
-        wfd = defer.waitForDeferred(
-            master.db.buildsets.getBuildsetProperties(brdict['buildsetid']))
-        yield wfd
-        buildset_properties = wfd.getResult()
+        if buildset_properties is None:
+            wfd = defer.waitForDeferred(
+                master.db.buildsets.getBuildsetProperties(
+                    brdict['buildsetid']))
+            yield wfd
+            buildset_properties = wfd.getResult()
 
         pr = properties.Properties()
         for name, (value, source) in buildset_properties.iteritems():
@@ -122,10 +164,12 @@ class BuildRequest(object):
         buildrequest.properties = pr
 
         # fetch the sourcestamp dictionary
-        wfd = defer.waitForDeferred(
-            master.db.sourcestamps.getSourceStamps(buildset['sourcestampsetid']))
-        yield wfd
-        sslist = wfd.getResult()
+        if sslist is None:
+            wfd = defer.waitForDeferred(
+                master.db.sourcestamps.getSourceStamps(
+                    buildset['sourcestampsetid']))
+            yield wfd
+            sslist = wfd.getResult()
         assert len(sslist) > 0, "Empty sourcestampset: db schema enforces set to exist but cannot enforce a non empty set"
 
         # and turn it into a SourceStamps
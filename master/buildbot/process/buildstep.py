@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 
 from zope.interface import implements
 from twisted.internet import reactor, defer, error
@@ -29,6 +30,7 @@ from buildbot.status import progress
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
      EXCEPTION, RETRY, worst_status
 from buildbot.process import metrics, properties
+from buildbot.util import outputbuffer
 
 class BuildStepFailed(Exception):
     pass
@@ -42,12 +44,17 @@ class RemoteCommand(pb.Referenceable):
     rc = None
     debug = False
 
+    # stdout collected for collectStdout is spilled to a temporary file once
+    # it exceeds this many bytes, until the command finishes
+    collectStdoutMemoryLimit = 1024*1024
+
     def __init__(self, remote_command, args, ignore_updates=False, collectStdout=False):
         self.logs = {}
         self.delayedLogs = {}
         self._closeWhenFinished = {}
         self.collectStdout = collectStdout
-        self.stdout = ''
+        self._collectedStdout = outputbuffer.OutputBuffer(
+                self.collectStdoutMemoryLimit)
 
         self._startTime = None
         self._remoteElapsed = None
@@ -58,6 +65,10 @@ class RemoteCommand(pb.Referenceable):
     def __repr__(self):
         return "<RemoteCommand '%s' at %d>" % (self.remote_command, id(self))
 
+    @property
+    def stdout(self):
+        return self._collectedStdout.getvalue()
+
     def run(self, step, remote):
         self.active = True
         self.step = step
@@ -117,6 +128,8 @@ class RemoteCommand(pb.Referenceable):
 
     def _finished(self, failure=None):
         self.active = False
+        # no more output will arrive
+        self._collectedStdout.close()
         # call .remoteComplete. If it raises an exception, or returns the
         # Failure that we gave it, our self.deferred will be errbacked. If
         # it does not (either it ate the Failure or there the step finished
@@ -159,13 +172,16 @@ class RemoteCommand(pb.Referenceable):
         # cleanly
         return None
 
-    def remote_update(self, updates):
+    def remote_update(self, updates, compression=None):
         """
         I am called by the slave's L{buildbot.slave.bot.SlaveBuilder} so
         I can receive updates from the running remote command.
 
         @type  updates: list of [object, int]
         @param updates: list of updates from the remote command
+        @type  compression: string or None
+        @param compression: if given, the method used to compress the text
+        of the updates (only 'zlib' is supported)
         """
         self.buildslave.messageReceivedFromSlave()
         max_updatenum = 0
@@ -173,6 +189,8 @@ class RemoteCommand(pb.Referenceable):
             #log.msg("update[%d]:" % num)
             try:
                 if self.active and not self.ignore_updates:
+                    if compression:
+                        update = self._decompressUpdate(update, compression)
                     self.remoteUpdate(update)
             except:
                 # log failure, terminate build, let slave retire the update
@@ -181,8 +199,25 @@ class RemoteCommand(pb.Referenceable):
                 # skip the rest but ack them all
             if num > max_updatenum:
                 max_updatenum = num
+        # if output arrives faster than the logs can be written, stop reading
+        # from this slave for a while
+        if self.remote is not None:
+            self.buildslave.master.logwriter.throttle(
+                    self.remote.broker.transport)
         return max_updatenum
 
+    def _decompressUpdate(self, update, compression):
+        if compression != 'zlib':
+            raise ValueError("unknown update compression %r" % (compression,))
+        update = update.copy()
+        for k in ('stdout', 'stderr', 'header'):
+            if k in update:
+                update[k] = zlib.decompress(update[k])
+        if 'log' in update:
+            logname, data = update['log']
+            update['log'] = (logname, zlib.decompress(data))
+        return update
+
     def remote_complete(self, failure=None):
         """
         Called by the slave's L{buildbot.slave.bot.SlaveBuilder} to
@@ -203,7 +238,7 @@ class RemoteCommand(pb.Referenceable):
         if 'stdio' in self.logs:
             self.logs['stdio'].addStdout(data)
         if self.collectStdout:
-            self.stdout += data
+            self._collectedStdout.append(data)
 
     def addStderr(self, data):
         if 'stdio' in self.logs:
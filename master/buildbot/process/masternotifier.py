@@ -0,0 +1,214 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.python import log, failure
+from twisted.internet import defer, reactor, protocol
+from twisted.protocols import basic
+from twisted.application import service, strports
+from buildbot import config
+from buildbot.process import metrics
+from buildbot.util import json
+
+class NotificationProtocol(basic.LineReceiver):
+    """
+    Carries notifications, one JSON object per line.  Each side of a
+    connection may both send and receive.
+    """
+
+    delimiter = '\n'
+
+    def connectionMade(self):
+        self.factory.connections.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.connections.discard(self)
+
+    def lineReceived(self, line):
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            log.msg("ignoring invalid notification %r" % (line,))
+            return
+        self.factory.messageReceived(msg)
+
+class _ListenFactory(protocol.ServerFactory):
+
+    protocol = NotificationProtocol
+
+    def __init__(self, messageReceived):
+        self.messageReceived = messageReceived
+        self.connections = set()
+
+class _PeerFactory(protocol.ReconnectingClientFactory):
+
+    protocol = NotificationProtocol
+    maxDelay = 60
+
+    def __init__(self, messageReceived):
+        self.messageReceived = messageReceived
+        self.connections = set()
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return protocol.ReconnectingClientFactory.buildProtocol(self, addr)
+
+class SocketTransport(service.MultiService):
+    """
+    A notification transport which connects to each of the other masters
+    directly, over TCP or UNIX sockets, and listens for their connections.
+    Notifications are sent over the outgoing connections, and received over
+    the incoming connections; notifications sent while a peer is unreachable
+    are simply dropped, and left for the peer's database poll to discover.
+
+    This is suitable for a small number of masters, and serves as an example
+    for transports based on a real message broker.
+    """
+
+    def __init__(self, listen, peers, messageReceived):
+        """
+        @param listen: strports description on which to listen for peers,
+        or None
+        @param peers: list of peers to send to, as C{tcp:host:port} or
+        C{unix:path}
+        @param messageReceived: callable to invoke with each notification
+        received
+        """
+        service.MultiService.__init__(self)
+        self.messageReceived = messageReceived
+        if listen:
+            s = strports.service(listen, _ListenFactory(messageReceived))
+            s.setServiceParent(self)
+        self.peers = peers
+        self.connectors = []
+        self.factories = []
+
+    def startService(self):
+        service.MultiService.startService(self)
+        for peer in self.peers:
+            factory = _PeerFactory(self.messageReceived)
+            kind, address = peer.split(':', 1)
+            if kind == 'tcp':
+                host, port = address.rsplit(':', 1)
+                connector = reactor.connectTCP(host, int(port), factory)
+            else:
+                connector = reactor.connectUNIX(address, factory)
+            self.factories.append(factory)
+            self.connectors.append(connector)
+
+    def stopService(self):
+        for factory, connector in zip(self.factories, self.connectors):
+            factory.stopTrying()
+            connector.disconnect()
+        self.factories = []
+        self.connectors = []
+        return service.MultiService.stopService(self)
+
+    def send(self, msg):
+        """Send C{msg}, a JSON-able dictionary, to all connected peers"""
+        line = json.dumps(msg)
+        for factory in self.factories:
+            for proto in factory.connections:
+                proto.sendLine(line)
+
+class MasterNotifier(config.ReconfigurableServiceMixin, service.MultiService):
+    """
+    Tells other masters about changes, buildsets and build requests added by
+    this master, and acts on such notifications from other masters, so that
+    masters sharing a database need not wait for their next database poll to
+    react.  Polling is still required as a consistency sweep, to catch
+    anything lost in transit.
+
+    The transport is selected by C{c['notifications']['transport']}; see
+    L{transports}.
+    """
+
+    # map from c['notifications']['transport'] to the transport class
+    transports = {
+        'socket' : SocketTransport,
+    }
+
+    def __init__(self, master):
+        service.MultiService.__init__(self)
+        self.setName('notifier')
+        self.master = master
+        self.transport = None
+        self.notifications = None
+
+    @property
+    def active(self):
+        return self.transport is not None
+
+    @defer.inlineCallbacks
+    def reconfigService(self, new_config):
+        if new_config.notifications != self.notifications:
+            if self.transport:
+                yield defer.maybeDeferred(self.transport.disownServiceParent)
+                self.transport = None
+
+            cls = self.transports.get(new_config.notifications['transport'])
+            if cls:
+                self.transport = cls(new_config.notifications['listen'],
+                                     new_config.notifications['peers'],
+                                     self.messageReceived)
+                self.transport.setServiceParent(self)
+            self.notifications = new_config.notifications.copy()
+
+        yield config.ReconfigurableServiceMixin.reconfigService(self,
+                                                            new_config)
+
+    # sending
+
+    def changeAdded(self, changeid):
+        """Tell other masters that a change has been added"""
+        self._send(dict(type='change', changeid=changeid))
+
+    def buildsetAdded(self, bsid, brids):
+        """Tell other masters that a buildset and its build requests (a
+        dictionary mapping builder name to brid) have been added"""
+        self._send(dict(type='buildset', bsid=bsid, brids=brids))
+
+    def buildRequestUnclaimed(self, bsid, brid, buildername):
+        """Tell other masters that a build request is available to be
+        claimed again"""
+        self._send(dict(type='buildrequest', bsid=bsid, brid=brid,
+                        buildername=buildername))
+
+    def _send(self, msg):
+        if self.transport:
+            metrics.MetricCountEvent.log('MasterNotifier.sent', 1)
+            self.transport.send(msg)
+
+    # receiving
+
+    def messageReceived(self, msg):
+        metrics.MetricCountEvent.log('MasterNotifier.received', 1)
+        try:
+            typ = msg['type']
+            if typ == 'change':
+                # the poll delivers changes in order, exactly once
+                d = self.master.pollDatabaseChanges()
+                d.addErrback(log.err, 'while polling for a notified change')
+            elif typ == 'buildset':
+                for buildername, brid in msg['brids'].iteritems():
+                    self.master.buildRequestAdded(bsid=msg['bsid'],
+                            brid=brid, buildername=buildername)
+            elif typ == 'buildrequest':
+                self.master.buildRequestAdded(bsid=msg['bsid'],
+                        brid=msg['brid'], buildername=msg['buildername'])
+            else:
+                log.msg("ignoring notification of unknown type %r" % (typ,))
+        except:
+            log.err(failure.Failure(), "while handling notification %r"
+                                       % (msg,))
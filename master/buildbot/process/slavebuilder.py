@@ -31,6 +31,12 @@ class AbstractSlaveBuilder(pb.Referenceable):
     buildbot. When a remote builder connects, I query it for command versions
     and then make it available to any Builds that are ready to run. """
 
+    # options offered to slaves which support flow control and compression
+    # of command updates: the number of updates a slave may send before they
+    # are acknowledged, and the compression methods that can be decoded
+    updateWindow = 16
+    updateCompression = [ 'zlib' ]
+
     def __init__(self):
         self.ping_watchers = []
         self.state = None # set in subclass
@@ -106,6 +112,17 @@ class AbstractSlaveBuilder(pb.Referenceable):
         d.addCallback(lambda _:
             self.remote.callRemote("setMaster", self))
 
+        def setUpdateOptions(_):
+            d = self.remote.callRemote("setUpdateOptions",
+                    dict(window=self.updateWindow,
+                         compression=self.updateCompression))
+            def unsupported(why):
+                why.trap(pb.NoSuchMethod)
+                # an older slave, which just sends its updates
+            d.addErrback(unsupported)
+            return d
+        d.addCallback(setUpdateOptions)
+
         d.addCallback(lambda _:
             self.remote.callRemote("print", "attached"))
 
@@ -115,13 +115,10 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
         if ssdict['changeids']:
             # sort the changeids in order, oldest to newest
             sorted_changeids = sorted(ssdict['changeids'])
-            def gci(id):
-                d = master.db.changes.getChange(id)
-                d.addCallback(lambda chdict :
-                    Change.fromChdict(master, chdict))
-                return d
-            d = defer.gatherResults([ gci(id)
-                                for id in sorted_changeids ])
+            d = master.db.changes.getChanges(sorted_changeids)
+            d.addCallback(lambda chdicts :
+                defer.gatherResults([ Change.fromChdict(master, chdict)
+                                      for chdict in chdicts ]))
         else:
             d = defer.succeed([])
         def got_changes(changes):
@@ -16,9 +16,8 @@
 from __future__ import with_statement
 
 import os, shutil, re
-from cPickle import dump
 from zope.interface import implements
-from twisted.python import log, runtime, components
+from twisted.python import components
 from twisted.persisted import styles
 from twisted.internet import reactor, defer
 from buildbot import interfaces, util, sourcestamp
@@ -405,22 +404,9 @@ class BuildStatus(styles.Versioned, properties.PropertiesMixin):
         if os.path.isdir(filename):
             # leftover from 0.5.0, which stored builds in directories
             shutil.rmtree(filename, ignore_errors=True)
-        tmpfilename = filename + ".tmp"
-        try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
-        except:
-            log.msg("unable to save build %s-#%d" % (self.builder.name,
-                                                     self.number))
-            log.err()
+        # the pickle is written from a thread, once the master is running
+        self.master.statussaver.save(self, filename,
+                "build %s-#%d" % (self.builder.name, self.number))
 
     def asDict(self):
         result = {}
@@ -16,18 +16,20 @@
 from __future__ import with_statement
 
 
-import weakref
-import os, re, itertools
-from cPickle import load, dump
+import os
+import threading
+from cPickle import load
 
 from zope.interface import implements
-from twisted.python import log, runtime
+from twisted.python import log
 from twisted.persisted import styles
 from buildbot.process import metrics
 from buildbot import interfaces, util
+from buildbot.util import lru
 from buildbot.status.event import Event
 from buildbot.status.build import BuildStatus
 from buildbot.status.buildrequest import BuildRequestStatus
+from buildbot.status import buildindex, buildmanifest
 
 # user modules expect these symbols to be present here
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE, SKIPPED
@@ -35,6 +37,10 @@ from buildbot.status.results import EXCEPTION, RETRY, Results, worst_status
 _hush_pyflakes = [ SUCCESS, WARNINGS, FAILURE, SKIPPED,
                    EXCEPTION, RETRY, Results, worst_status ]
 
+# held while unpickling and upgrading status pickles, which share the global
+# list of Versioned objects to upgrade; builder pickles are loaded in threads
+upgradeLock = threading.Lock()
+
 class BuilderStatus(styles.Versioned):
     """I handle status information for a single process.build.Builder object.
     That object sends status changes to me (frequently as Events), and I
@@ -62,6 +68,8 @@ class BuilderStatus(styles.Versioned):
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
+    buildIndex = None
+    buildManifest = None
 
     def __init__(self, buildername, category, master):
         self.name = buildername
@@ -78,8 +86,7 @@ class BuilderStatus(styles.Versioned):
         self.currentBuilds = []
         self.nextBuild = None
         self.watchers = []
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCache = lru.LRUCache(self.cacheMiss)
 
     # persistence
 
@@ -91,9 +98,11 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
-        del d['buildCache_LRU']
+        d.pop('buildIndex', None)
+        d.pop('buildManifest', None)
         for b in self.currentBuilds:
             b.saveYourself()
+            self._recordLogs(b)
             # TODO: push a 'hey, build was interrupted' event
         del d['currentBuilds']
         d.pop('pendingBuilds', None)
@@ -108,8 +117,7 @@ class BuilderStatus(styles.Versioned):
         # when loading, re-initialize the transient stuff. Remember that
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCache = lru.LRUCache(self.cacheMiss)
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -126,18 +134,13 @@ class BuilderStatus(styles.Versioned):
         self.wasUpgraded = True
 
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
-        what our self.nextBuildNumber should be. Set it one larger than the
-        highest-numbered build we discover. This is called by the top-level
-        Status object shortly after we are created or loaded from disk.
+        """Consult our build manifest to determine what our
+        self.nextBuildNumber should be. Set it one larger than the
+        highest-numbered build we have allocated. This is called by the
+        top-level Status object shortly after we are created or loaded from
+        disk.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match("^\d+$", f)]
-        if existing_builds:
-            self.nextBuildNumber = max(existing_builds) + 1
-        else:
-            self.nextBuildNumber = 0
+        self.nextBuildNumber = self.getBuildManifest().getNextBuildNumber()
 
     def saveYourself(self):
         for b in self.currentBuilds:
@@ -146,71 +149,117 @@ class BuilderStatus(styles.Versioned):
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
         filename = os.path.join(self.basedir, "builder")
-        tmpfilename = filename + ".tmp"
-        try:
-            with open(tmpfilename, "wb") as f:
-                dump(self, f, -1)
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(tmpfilename, filename)
-        except:
-            log.msg("unable to save builder %s" % self.name)
-            log.err()
+        self.master.statussaver.save(self, filename,
+                                     "builder %s" % self.name)
         
 
+    # build manifest management
+
+    def getBuildManifest(self):
+        """
+        Get the manifest of this builder's builds and their log files.
+
+        @returns: L{buildmanifest.BuildManifest} instance
+        """
+        if (self.buildManifest is None
+                or self.buildManifest.basedir != self.basedir):
+            self.buildManifest = buildmanifest.BuildManifest(self.basedir)
+        return self.buildManifest
+
+    def _recordLogs(self, build):
+        filenames = [ l.filename
+                      for step in build.getSteps()
+                      for l in step.getLogs()
+                      if l.filename ]
+        self.getBuildManifest().addLogs(build.number, filenames)
+
+    # build index management
+
+    def getBuildIndex(self):
+        """
+        Get the build index for this builder, as selected by
+        C{c['buildIndex']}.
+
+        @returns: L{buildindex.PickleBuildIndex} instance
+        """
+        cls = buildindex.buildIndexClasses.get(self.master.config.buildIndex,
+                                               buildindex.PickleBuildIndex)
+        if self.buildIndex.__class__ is not cls:
+            self.buildIndex = cls(self)
+        return self.buildIndex
+
+    def getBuildSummary(self, number):
+        """
+        Get the summary of a finished build, or None if there is no such
+        build or it is not finished yet.
+
+        @returns: L{buildindex.BuildSummary} instance or None
+        """
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+        return self.getBuildIndex().getSummary(number)
+
     # build cache management
 
     def makeBuildFilename(self, number):
         return os.path.join(self.basedir, "%d" % number)
 
-    def touchBuildCache(self, build):
-        self.buildCache[build.number] = build
-        if build in self.buildCache_LRU:
-            self.buildCache_LRU.remove(build)
-        cache_size = self.master.config.caches['Builds']
-        self.buildCache_LRU = self.buildCache_LRU[-(cache_size-1):] + [ build ]
-        return build
-
     def getBuildByNumber(self, number):
-        # first look in currentBuilds
-        for b in self.currentBuilds:
-            if b.number == number:
-                return self.touchBuildCache(b)
+        cache = self.buildCache
+        misses, evictions = cache.misses, cache.evictions
+        cache.set_max_size(self.master.config.caches['Builds'])
 
-        # then in the buildCache
-        try:
-            b = self.buildCache[number]
-        except KeyError:
+        build = cache.get(number)
+
+        if cache.misses > misses:
             metrics.MetricCountEvent.log("buildCache.misses", 1)
         else:
             metrics.MetricCountEvent.log("buildCache.hits", 1)
-            return self.touchBuildCache(b)
+        if cache.evictions > evictions:
+            metrics.MetricCountEvent.log("buildCache.evictions",
+                                         cache.evictions - evictions)
+        return build
 
-        # then fall back to loading it from disk
+    def cacheMiss(self, number):
+        # miss function for self.buildCache; first look in currentBuilds
+        for b in self.currentBuilds:
+            if b.number == number:
+                return b
+
+        # then to a build whose pickle is still waiting to be written
         filename = self.makeBuildFilename(number)
+        build = self.master.statussaver.getPending(filename)
+        if build is not None:
+            return build
+
+        # then fall back to loading it from disk
         try:
             log.msg("Loading builder %s's build %d from on-disk pickle"
                 % (self.name, number))
-            with open(filename, "rb") as f:
-                build = load(f)
-            build.setProcessObjects(self, self.master)
-
-            # (bug #1068) if we need to upgrade, we probably need to rewrite
-            # this pickle, too.  We determine this by looking at the list of
-            # Versioned objects that have been unpickled, and (after doUpgrade)
-            # checking to see if any of them set wasUpgraded.  The Versioneds'
-            # upgradeToVersionNN methods all set this.
-            versioneds = styles.versionedsToUpgrade
-            styles.doUpgrade()
-            if True in [ hasattr(o, 'wasUpgraded') for o in versioneds.values() ]:
+            with upgradeLock:
+                with open(filename, "rb") as f:
+                    build = load(f)
+                build.setProcessObjects(self, self.master)
+
+                # (bug #1068) if we need to upgrade, we probably need to
+                # rewrite this pickle, too.  We determine this by looking at
+                # the list of Versioned objects that have been unpickled, and
+                # (after doUpgrade) checking to see if any of them set
+                # wasUpgraded.  The Versioneds' upgradeToVersionNN methods all
+                # set this.
+                versioneds = styles.versionedsToUpgrade
+                styles.doUpgrade()
+                upgraded = True in [ hasattr(o, 'wasUpgraded')
+                                     for o in versioneds.values() ]
+            if upgraded:
                 log.msg("re-writing upgraded build pickle")
                 build.saveYourself()
 
             # check that logfiles exist
             build.checkLogfiles()
-            return self.touchBuildCache(build)
+            return build
         except IOError:
             raise IndexError("no such build %d" % number)
         except EOFError:
@@ -227,7 +276,7 @@ class BuilderStatus(styles.Versioned):
         # get the horizons straight
         buildHorizon = self.master.config.buildHorizon
         if buildHorizon is not None:
-            earliest_build = self.nextBuildNumber - self.buildHorizon
+            earliest_build = self.nextBuildNumber - buildHorizon
         else:
             earliest_build = 0
 
@@ -243,33 +292,12 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
-        # if the directory doesn't exist, bail out here
-        if not os.path.exists(self.basedir):
-            return
+        self.getBuildIndex().pruneBuilds(earliest_build)
 
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
-
-            if num is None: continue
-            if num in self.buildCache: continue
-
-            if (is_logfile and num < earliest_log) or num < earliest_build:
-                pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try: os.unlink(pathname)
-                except OSError: pass
+        # the manifest knows which builds and logs are left to prune, and
+        # deletes their files in a thread
+        return self.getBuildManifest().prune(earliest_build, earliest_log,
+                keep=self.buildCache.keys())
 
     # IBuilderStatus methods
     def getName(self):
@@ -321,32 +349,40 @@ class BuilderStatus(styles.Versioned):
         except IndexError:
             return None
 
+    def generateFinishedSummaries(self, branches=[],
+                                  max_buildnum=None,
+                                  finished_before=None,
+                                  max_search=200):
+        """
+        Generate the summaries of the builds that L{generateFinishedBuilds}
+        would return, from the build index, most recent first.
+
+        @returns: generator of L{buildindex.BuildSummary} instances
+        """
+        if max_buildnum is None or max_buildnum >= self.nextBuildNumber:
+            max_buildnum = self.nextBuildNumber - 1
+        return self.getBuildIndex().findBuilds(branches=branches,
+                min_buildnum=max(0, self.nextBuildNumber - max_search),
+                max_buildnum=max_buildnum,
+                finished_before=finished_before)
+
     def generateFinishedBuilds(self, branches=[],
                                num_builds=None,
                                max_buildnum=None,
                                finished_before=None,
                                max_search=200):
+        # the filtering is done by the build index, so depending on the index
+        # this may not need to load any builds at all
+        index = self.getBuildIndex()
+        summaries = self.generateFinishedSummaries(branches=branches,
+                max_buildnum=max_buildnum,
+                finished_before=finished_before,
+                max_search=max_search)
         got = 0
-        for Nb in itertools.count(1):
-            if Nb > self.nextBuildNumber:
-                break
-            if Nb > max_search:
-                break
-            build = self.getBuild(-Nb)
+        for summary in summaries:
+            build = index.getBuildStatus(summary)
             if build is None:
                 continue
-            if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
-                    continue
-            if not build.isFinished():
-                continue
-            if finished_before is not None:
-                start, end = build.getTimes()
-                if end >= finished_before:
-                    continue
-            if branches:
-                if build.getSourceStamp().branch not in branches:
-                    continue
             got += 1
             yield build
             if num_builds is not None:
@@ -370,6 +406,14 @@ class BuilderStatus(styles.Versioned):
         eventIndex = -1
         e = self.getEvent(eventIndex)
         for Nb in range(1, self.nextBuildNumber+1):
+            # check what we can against the build's summary, which may avoid
+            # loading the build itself
+            summary = self.getBuildSummary(-Nb)
+            if summary:
+                if summary.started < minTime:
+                    break
+                if branches and not summary.branch in branches:
+                    continue
             b = self.getBuild(-Nb)
             if not b:
                 # HACK: If this is the first build we are looking at, it is
@@ -473,6 +517,7 @@ class BuilderStatus(styles.Versioned):
         # build number we've just allocated. This is not quite as important
         # as it was before we switch to determineNextBuildNumber, but I think
         # it may still be useful to have the new build save itself.
+        self.getBuildManifest().addBuild(number)
         s = BuildStatus(self, self.master, number)
         s.waitUntilFinished().addCallback(self._buildFinished)
         return s
@@ -485,7 +530,7 @@ class BuilderStatus(styles.Versioned):
         assert s.builder is self # paranoia
         assert s not in self.currentBuilds
         self.currentBuilds.append(s)
-        self.touchBuildCache(s)
+        self.buildCache.get(s.number)
 
         # now that the BuildStatus is prepared to answer queries, we can
         # announce the new build to all our watchers
@@ -507,6 +552,8 @@ class BuilderStatus(styles.Versioned):
     def _buildFinished(self, s):
         assert s in self.currentBuilds
         s.saveYourself()
+        self._recordLogs(s)
+        self.getBuildIndex().addBuild(s)
         self.currentBuilds.remove(s)
 
         name = self.getName()
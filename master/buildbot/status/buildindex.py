@@ -0,0 +1,421 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import bisect
+from cPickle import dump, load, UnpicklingError
+
+from zope.interface import implements
+from twisted.python import log, runtime, components
+from buildbot import interfaces
+
+class BuildSummary:
+    """
+    A compact summary of a finished build, holding just enough information to
+    list and filter builds without loading the build's pickle.
+
+    @ivar steps: list of (name, results, text, started, finished) tuples, one
+    for each step of the build
+    """
+
+    fields = ('number', 'started', 'finished', 'results', 'branch',
+              'revision', 'slavename', 'text', 'steps')
+
+    def __init__(self, number, started, finished, results, branch,
+                 revision, slavename, text, steps):
+        self.number = number
+        self.started = started
+        self.finished = finished
+        self.results = results
+        self.branch = branch
+        self.revision = revision
+        self.slavename = slavename
+        self.text = text
+        self.steps = steps
+
+    @classmethod
+    def fromBuild(cls, build):
+        ss = build.getSourceStamp()
+        branch = revision = None
+        if ss:
+            branch, revision = ss.branch, ss.revision
+        started, finished = build.getTimes()
+        steps = [ (step.getName(), step.getResults()[0], step.getText())
+                  + tuple(step.getTimes())
+                  for step in build.getSteps() ]
+        return cls(build.getNumber(), started, finished, build.getResults(),
+                   branch, revision, build.getSlavename(), build.getText(),
+                   steps)
+
+    def asTuple(self):
+        return tuple([ getattr(self, f) for f in self.fields ])
+
+    @classmethod
+    def fromTuple(cls, t):
+        return cls(*t)
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def __eq__(self, other):
+        return isinstance(other, BuildSummary) and \
+                self.asTuple() == other.asTuple()
+
+    def __ne__(self, other):
+        return not (self == other)
+
+class PickleBuildIndex:
+    """
+    A build index which keeps no state of its own: summaries are made by
+    loading each build's pickle, and searches visit every build in turn.
+    This is the behavior of Buildbot without a build index.
+    """
+
+    def __init__(self, builder):
+        """
+        @param builder: the L{BuilderStatus} whose builds are indexed
+        """
+        self.builder = builder
+
+    def addBuild(self, build):
+        """Record the summary of a finished build."""
+
+    def pruneBuilds(self, earliest):
+        """Forget all builds numbered below C{earliest}."""
+
+    def getSummary(self, number):
+        """
+        Get the summary of a finished build, or None if there is no such
+        build or it has not finished.
+
+        @returns: L{BuildSummary} or None
+        """
+        build = self.builder.getBuild(number)
+        if build is None or not build.isFinished():
+            return None
+        return BuildSummary.fromBuild(build)
+
+    def getBuildStatus(self, summary):
+        """
+        Get an L{IBuildStatus} provider for the build with the given summary.
+        """
+        return self.builder.getBuild(summary.number)
+
+    def findBuilds(self, branches=[], results=[], min_buildnum=0,
+                   max_buildnum=None, finished_before=None,
+                   finished_after=None):
+        """
+        Generate the summaries of finished builds numbered C{min_buildnum}
+        through C{max_buildnum} (by default, the most recent build) which
+        match all of the given criteria, most recent first.
+
+        @param branches: if not empty, only builds on these branches
+        @param results: if not empty, only builds with these results
+        @param finished_before: only builds finished before this time
+        @param finished_after: only builds finished at or after this time
+        @returns: generator of L{BuildSummary} instances
+        """
+        if max_buildnum is None:
+            max_buildnum = self.builder.nextBuildNumber - 1
+        for number in xrange(max_buildnum, min_buildnum - 1, -1):
+            summary = self.getSummary(number)
+            if summary and _matches(summary, branches, results,
+                                    finished_before, finished_after):
+                yield summary
+
+def _matches(summary, branches, results, finished_before, finished_after):
+    if branches and summary.branch not in branches:
+        return False
+    if results and summary.results not in results:
+        return False
+    if finished_before is not None and summary.finished >= finished_before:
+        return False
+    if finished_after is not None and summary.finished < finished_after:
+        return False
+    return True
+
+class FileBuildIndex(PickleBuildIndex):
+    """
+    A build index which keeps the summaries of a builder's finished builds in
+    a single file in the builder's directory, and in memory indexes them by
+    number, branch and results, so that searches need not load any build
+    pickles.
+
+    The file is a sequence of pickled records, appended as builds finish:
+    either C{('add', summary-tuple)} or C{('prune', earliest)}.  It is
+    rewritten without superseded records when they make up most of it.
+    Builds that finished before the index existed are summarized from their
+    pickles as they are encountered.
+    """
+
+    filename = "build-index"
+
+    def __init__(self, builder):
+        PickleBuildIndex.__init__(self, builder)
+        self.summaries = None
+
+    def _getPath(self):
+        return os.path.join(self.builder.basedir, self.filename)
+
+    def _load(self):
+        if self.summaries is not None:
+            return
+        self.summaries = {}
+        self.numbers = []
+        self.byBranch = {}
+        self.byResults = {}
+        # numbers of builds which are known not to exist on disk
+        self.missing = []
+        self.records = 0
+        path = self._getPath()
+        if not os.path.exists(path):
+            return
+        clean = True
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    op, arg = load(f)
+                except EOFError:
+                    break
+                except (UnpicklingError, ValueError, TypeError,
+                        AttributeError, IndexError):
+                    # probably a partially-written record at the end
+                    log.msg("ignoring corrupt records in %s" % path)
+                    clean = False
+                    break
+                self.records += 1
+                if op == 'add':
+                    self._add(BuildSummary.fromTuple(arg))
+                elif op == 'prune':
+                    self._prune(arg)
+        if not clean:
+            self._rewrite()
+
+    def _add(self, summary):
+        number = summary.number
+        if number in self.summaries:
+            self._remove(number)
+        elif self._isMissing(number):
+            self.missing.remove(number)
+        self.summaries[number] = summary
+        bisect.insort(self.numbers, number)
+        bisect.insort(self.byBranch.setdefault(summary.branch, []), number)
+        bisect.insort(self.byResults.setdefault(summary.results, []), number)
+
+    def _remove(self, number):
+        summary = self.summaries.pop(number)
+        for numbers in (self.numbers, self.byBranch[summary.branch],
+                        self.byResults[summary.results]):
+            del numbers[bisect.bisect_left(numbers, number)]
+
+    def _prune(self, earliest):
+        for number in self.numbers[:bisect.bisect_left(self.numbers,
+                                                       earliest)]:
+            self._remove(number)
+        del self.missing[:bisect.bisect_left(self.missing, earliest)]
+
+    def _append(self, record):
+        path = self._getPath()
+        try:
+            with open(path, "ab") as f:
+                dump(record, f, -1)
+        except IOError:
+            log.msg("unable to update build index %s" % path)
+            log.err()
+        self.records += 1
+        if self.records > 2 * len(self.summaries) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        path = self._getPath()
+        tmppath = path + ".tmp"
+        try:
+            with open(tmppath, "wb") as f:
+                for number in self.numbers:
+                    dump(('add', self.summaries[number].asTuple()), f, -1)
+            if runtime.platformType  == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(path):
+                    os.unlink(path)
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            log.msg("unable to rewrite build index %s" % path)
+            log.err()
+            return
+        self.records = len(self.numbers)
+
+    def addBuild(self, build):
+        self._load()
+        summary = BuildSummary.fromBuild(build)
+        if self.summaries.get(summary.number) == summary:
+            return
+        self._add(summary)
+        self._append(('add', summary.asTuple()))
+
+    def pruneBuilds(self, earliest):
+        self._load()
+        if self.numbers and self.numbers[0] < earliest:
+            self._prune(earliest)
+            self._append(('prune', earliest))
+
+    def getSummary(self, number):
+        self._load()
+        try:
+            return self.summaries[number]
+        except KeyError:
+            pass
+        # not indexed yet; maybe it finished before the index existed
+        if self._isMissing(number):
+            return None
+        build = self.builder.getBuild(number)
+        if build is None:
+            bisect.insort(self.missing, number)
+            return None
+        if not build.isFinished():
+            return None
+        self.addBuild(build)
+        return self.summaries[number]
+
+    def _isMissing(self, number):
+        i = bisect.bisect_left(self.missing, number)
+        return i < len(self.missing) and self.missing[i] == number
+
+    def getBuildStatus(self, summary):
+        return LazyBuildStatus(self.builder, summary)
+
+    def findBuilds(self, branches=[], results=[], min_buildnum=0,
+                   max_buildnum=None, finished_before=None,
+                   finished_after=None):
+        self._load()
+        if max_buildnum is None:
+            max_buildnum = self.builder.nextBuildNumber - 1
+
+        # builds in the range that are not yet indexed must be summarized
+        # from their pickles, and then everything comes from the index
+        self._fillRange(min_buildnum, max_buildnum)
+
+        # pick the most selective index available
+        if branches:
+            candidates = [ self.byBranch.get(b, []) for b in branches ]
+        elif results:
+            candidates = [ self.byResults.get(r, []) for r in results ]
+        else:
+            candidates = [ self.numbers ]
+        if len(candidates) == 1:
+            numbers = candidates[0]
+            lo = bisect.bisect_left(numbers, min_buildnum)
+            hi = bisect.bisect_right(numbers, max_buildnum)
+            numbers = numbers[lo:hi]
+        else:
+            numbers = []
+            for c in candidates:
+                lo = bisect.bisect_left(c, min_buildnum)
+                hi = bisect.bisect_right(c, max_buildnum)
+                numbers.extend(c[lo:hi])
+            numbers.sort()
+
+        for number in reversed(numbers):
+            summary = self.summaries.get(number)
+            if summary and _matches(summary, branches, results,
+                                    finished_before, finished_after):
+                yield summary
+
+    def _fillRange(self, min_buildnum, max_buildnum):
+        def inRange(numbers):
+            lo = bisect.bisect_left(numbers, min_buildnum)
+            hi = bisect.bisect_right(numbers, max_buildnum)
+            return numbers[lo:hi]
+        indexed = inRange(self.numbers)
+        missing = inRange(self.missing)
+        if len(indexed) + len(missing) > max_buildnum - min_buildnum:
+            return # the usual case: everything is accounted for
+        known = set(indexed + missing)
+        for number in xrange(max_buildnum, min_buildnum - 1, -1):
+            if number not in known:
+                self.getSummary(number)
+
+class LazyBuildStatus:
+    """
+    An L{IBuildStatus} for a finished build which answers what it can from
+    the build's L{BuildSummary}, and loads the full L{BuildStatus} from its
+    pickle only when other information (steps, logs, source stamps,
+    properties, and so on) is requested.
+    """
+
+    implements(interfaces.IBuildStatus, interfaces.IStatusEvent)
+
+    def __init__(self, builder, summary):
+        self.builder = builder
+        self.summary = summary
+        self.number = summary.number
+        self._build = None
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def _getBuild(self):
+        if self._build is None:
+            self._build = self.builder.getBuildByNumber(self.number)
+        return self._build
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._getBuild(), name)
+
+    def getSummary(self):
+        return self.summary
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getPreviousBuild(self):
+        if self.number == 0:
+            return None
+        return self.builder.getBuild(self.number - 1)
+
+    def isFinished(self):
+        return True
+
+    def getTimes(self):
+        return (self.summary.started, self.summary.finished)
+
+    def getResults(self):
+        return self.summary.results
+
+    def getText(self):
+        return self.summary.text
+
+    def getSlavename(self):
+        return self.summary.slavename
+
+    def getETA(self):
+        return None
+
+    def getCurrentStep(self):
+        return None
+
+components.registerAdapter(lambda lazy : lazy._getBuild().properties,
+        LazyBuildStatus, interfaces.IProperties)
+
+buildIndexClasses = {
+    None : PickleBuildIndex,
+    'file' : FileBuildIndex,
+}
@@ -0,0 +1,245 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import re
+import bisect
+from cPickle import dump, load, UnpicklingError
+
+from twisted.internet import defer, threads
+from twisted.python import log, runtime
+
+# suffixes a log file may have been given by compression (see
+# LogFile.compressLog)
+LOG_SUFFIXES = ('', '.bz2', '.gz', '.blk', '.blk.idx')
+
+build_re = re.compile(r"^([0-9]+)$")
+build_log_re = re.compile(r"^([0-9]+)-.*$")
+
+class BuildManifest:
+    """
+    A record of the build numbers a builder has allocated and the log files
+    of each build, kept in a file in the builder's directory so that the
+    directory, which may hold a great many files, need not be listed to find
+    the next build number or the files to prune.
+
+    The file is a sequence of pickled records, appended as builds start and
+    finish: C{('build', number)}, C{('logs', number, filenames)}, or
+    C{('forget', build-numbers, log-numbers)}.  It is rewritten without
+    superseded records when they make up most of it.  If it does not exist,
+    it is made from a listing of the builder's directory.
+    """
+
+    filename = "build-manifest"
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.numbers = None
+
+    def _getPath(self):
+        return os.path.join(self.basedir, self.filename)
+
+    def _load(self):
+        if self.numbers is not None:
+            return
+        # sorted numbers of the builds on disk
+        self.numbers = []
+        # sorted numbers of the builds with log files on disk, and the log
+        # filenames of each
+        self.logNumbers = []
+        self.logs = {}
+        # the highest build number ever allocated
+        self.lastNumber = -1
+        self.records = 0
+        path = self._getPath()
+        if not os.path.exists(path):
+            self._scan()
+            return
+        clean = True
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    record = load(f)
+                except EOFError:
+                    break
+                except (UnpicklingError, ValueError, TypeError,
+                        AttributeError, IndexError):
+                    # probably a partially-written record at the end
+                    log.msg("ignoring corrupt records in %s" % path)
+                    clean = False
+                    break
+                self.records += 1
+                op, args = record[0], record[1:]
+                if op == 'build':
+                    self._addBuild(*args)
+                elif op == 'logs':
+                    self._addLogs(*args)
+                elif op == 'forget':
+                    self._forget(*args)
+        if not clean:
+            self._rewrite()
+
+    def _scan(self):
+        # build the manifest from the directory, once
+        try:
+            filenames = os.listdir(self.basedir)
+        except OSError:
+            return
+        logs = {}
+        for filename in filenames:
+            mo = build_re.match(filename)
+            if mo:
+                self._addBuild(int(mo.group(1)))
+                continue
+            mo = build_log_re.match(filename)
+            if mo:
+                logs.setdefault(int(mo.group(1)), []).append(filename)
+        for number, filenames in logs.iteritems():
+            self._addLogs(number, sorted(filenames))
+        self._rewrite()
+
+    def _addBuild(self, number):
+        i = bisect.bisect_left(self.numbers, number)
+        if i == len(self.numbers) or self.numbers[i] != number:
+            self.numbers.insert(i, number)
+        if number > self.lastNumber:
+            self.lastNumber = number
+
+    def _addLogs(self, number, filenames):
+        if number not in self.logs:
+            bisect.insort(self.logNumbers, number)
+            self.logs[number] = []
+        self.logs[number].extend(filenames)
+        if number > self.lastNumber:
+            self.lastNumber = number
+
+    def _forget(self, numbers, logNumbers):
+        for number in numbers:
+            i = bisect.bisect_left(self.numbers, number)
+            if i < len(self.numbers) and self.numbers[i] == number:
+                del self.numbers[i]
+        for number in logNumbers:
+            if self.logs.pop(number, None) is not None:
+                del self.logNumbers[bisect.bisect_left(self.logNumbers,
+                                                       number)]
+
+    def _append(self, record):
+        path = self._getPath()
+        try:
+            with open(path, "ab") as f:
+                dump(record, f, -1)
+        except IOError:
+            log.msg("unable to update build manifest %s" % path)
+            log.err()
+        self.records += 1
+        if self.records > 2 * (len(self.numbers) + len(self.logNumbers)) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        path = self._getPath()
+        tmppath = path + ".tmp"
+        try:
+            with open(tmppath, "wb") as f:
+                if self.lastNumber >= 0 and (not self.numbers or
+                                    self.numbers[-1] != self.lastNumber):
+                    # remember the last number, even though it has been
+                    # forgotten
+                    dump(('build', self.lastNumber), f, -1)
+                    dump(('forget', [ self.lastNumber ], []), f, -1)
+                for number in self.numbers:
+                    dump(('build', number), f, -1)
+                for number in self.logNumbers:
+                    dump(('logs', number, self.logs[number]), f, -1)
+            if runtime.platformType  == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(path):
+                    os.unlink(path)
+            os.rename(tmppath, path)
+        except (IOError, OSError):
+            log.msg("unable to rewrite build manifest %s" % path)
+            log.err()
+            return
+        self.records = len(self.numbers) + len(self.logNumbers)
+
+    def getNextBuildNumber(self):
+        """Return the number following the highest build number recorded."""
+        self._load()
+        return self.lastNumber + 1
+
+    def getBuildNumbers(self):
+        """Return a sorted list of the numbers of the builds on disk."""
+        self._load()
+        return self.numbers[:]
+
+    def addBuild(self, number):
+        """Record that build C{number} has been allocated."""
+        self._load()
+        self._addBuild(number)
+        self._append(('build', number))
+
+    def addLogs(self, number, filenames):
+        """Record the (uncompressed) filenames of build C{number}'s logs."""
+        self._load()
+        filenames = [ fn for fn in filenames
+                      if fn not in self.logs.get(number, []) ]
+        if not filenames:
+            return
+        self._addLogs(number, filenames)
+        self._append(('logs', number, filenames))
+
+    def prune(self, earliest_build, earliest_log, keep=()):
+        """
+        Forget the builds numbered below C{earliest_build} and the logs of
+        those numbered below C{earliest_log}, except for the builds in
+        C{keep}, and delete their files in a thread.  Only the builds and
+        logs which have not already been pruned are visited.
+
+        @returns: Deferred which fires when the files are deleted
+        """
+        self._load()
+        keep = set(keep)
+        numbers = [ n for n in
+                    self.numbers[:bisect.bisect_left(self.numbers,
+                                                     earliest_build)]
+                    if n not in keep ]
+        earliest_log = max(earliest_log, earliest_build)
+        logNumbers = [ n for n in
+                       self.logNumbers[:bisect.bisect_left(self.logNumbers,
+                                                           earliest_log)]
+                       if n not in keep ]
+        if not numbers and not logNumbers:
+            return defer.succeed(None)
+
+        filenames = [ "%d" % n for n in numbers ]
+        for n in logNumbers:
+            filenames.extend(self.logs[n])
+        self._forget(numbers, logNumbers)
+        self._append(('forget', numbers, logNumbers))
+
+        return threads.deferToThread(self._removeFiles, filenames)
+
+    def _removeFiles(self, filenames):
+        # this runs in a thread
+        for filename in filenames:
+            for suffix in LOG_SUFFIXES:
+                pathname = os.path.join(self.basedir, filename + suffix)
+                try:
+                    os.unlink(pathname)
+                except OSError:
+                    pass
+                else:
+                    log.msg("pruned '%s'" % pathname)
@@ -13,7 +13,6 @@
 #
 # Copyright Buildbot Team Members
 
-import os
 from zope.interface import implements
 from twisted.persisted import styles
 from twisted.python import log
@@ -225,6 +224,7 @@ class BuildStepStatus(styles.Versioned):
     def addLog(self, name):
         assert self.started # addLog before stepStarted won't notify watchers
         logfilename = self.build.generateLogfileName(self.name, name)
+        self._recordLog(logfilename)
         log = LogFile(self, name, logfilename)
         self.logs.append(log)
         for w in self.watchers:
@@ -240,12 +240,19 @@ class BuildStepStatus(styles.Versioned):
     def addHTMLLog(self, name, html):
         assert self.started # addLog before stepStarted won't notify watchers
         logfilename = self.build.generateLogfileName(self.name, name)
+        self._recordLog(logfilename)
         log = HTMLLogFile(self, name, logfilename, html)
         self.logs.append(log)
         for w in self.watchers:
             w.logStarted(self.build, self, log)
             w.logFinished(self.build, self, log)
 
+    def _recordLog(self, logfilename):
+        # add the log to the builder's manifest before it is written, so that
+        # it is pruned even if the master stops before the build finishes
+        builder = self.build.builder
+        builder.getBuildManifest().addLogs(self.build.number, [logfilename])
+
     def logFinished(self, log):
         for w in self.watchers:
             w.logFinished(self.build, self, log)
@@ -282,7 +289,7 @@ class BuildStepStatus(styles.Versioned):
             # HTMLLogFiles aren't files
             if logCompressionLimit is not False and \
                     isinstance(loog, LogFile):
-                if os.path.getsize(loog.getFilename()) > logCompressionLimit:
+                if loog.getEncodedLength() > logCompressionLimit:
                     loog_deferred = loog.compressLog()
                     if loog_deferred:
                         cld.append(loog_deferred)
@@ -14,16 +14,18 @@
 # Copyright Buildbot Team Members
 
 import os
-from cStringIO import StringIO
+import bisect
+import struct
+import zlib
 from bz2 import BZ2File
 from gzip import GzipFile
 
 from zope.interface import implements
 from twisted.python import log, runtime
 from twisted.internet import defer, threads, reactor
-from buildbot.util import netstrings
+from buildbot.util import netstrings, writebehind
 from buildbot.util.eventual import eventually
-from buildbot import interfaces
+from buildbot import interfaces, config
 
 STDOUT = interfaces.LOG_CHANNEL_STDOUT
 STDERR = interfaces.LOG_CHANNEL_STDERR
@@ -41,6 +43,346 @@ class LogFileScanner(netstrings.NetstringParser):
         if not self.channels or (channel in self.channels):
             self.chunk_cb((channel, line[1:]))
 
+def _encodedLength(text):
+    # the length of the netstring holding this chunk of text
+    return len(str(1 + len(text))) + len(text) + 3
+
+class LogIndex:
+    """
+    An in-memory index of entry points into the netstring stream of a log.
+
+    Each record is a tuple (offset, stdout bytes, stdout lines, stderr bytes,
+    stderr lines, header bytes, header lines), where C{offset} is the stream
+    offset of a chunk boundary and the remaining fields count the text (and
+    newlines) on each channel preceding that offset.  A record is kept only
+    every C{interval} bytes, so the index stays small even for huge logs.
+    Channels other than those in L{ChunkTypes} are not counted.
+    """
+
+    interval = 64*1024
+
+    def __init__(self):
+        self.records = []
+        self.counts = [0] * (2 * len(ChunkTypes))
+        self.lastOffset = None
+
+    def addChunk(self, offset, channel, text):
+        if self.lastOffset is None or \
+                offset - self.lastOffset >= self.interval:
+            self.records.append((offset,) + tuple(self.counts))
+            self.lastOffset = offset
+        if channel < len(ChunkTypes):
+            self.counts[2*channel] += len(text)
+            self.counts[2*channel+1] += text.count("\n")
+
+    def totals(self):
+        return tuple(self.counts)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+class _IndexKeys:
+    # a sorted, sequence-like view of the sum of some fields of the records
+    # in an index, suitable for use with bisect
+    def __init__(self, index, fields):
+        self.index = index
+        self.fields = fields
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        return sum([ record[f] for f in self.fields ])
+
+BLOCK_MAGIC = "BBLOGBK1"
+INDEX_MAGIC = "BBLOGIX1"
+
+class BlockLogIndex:
+    """
+    The on-disk index of a block-compressed log (the C{.blk.idx} sidecar).
+
+    The file starts with L{INDEX_MAGIC} and contains one fixed-size record per
+    block, followed by a sentinel record describing the end of the stream.
+    Each record holds the uncompressed stream offset at which the block
+    starts, the position of the block in the C{.blk} file, and the per-channel
+    byte and line counts preceding the block.  Records are read on demand, so
+    a bisection over the index costs O(log n) reads.  Items have the same
+    layout as L{LogIndex} records.
+    """
+
+    record = struct.Struct(">QQ" + "QQ" * len(ChunkTypes))
+
+    def __init__(self, f):
+        self.f = f
+        f.seek(0, 2)
+        size = f.tell() - len(INDEX_MAGIC)
+        f.seek(0)
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise IOError("%r is not a log index" % (f.name,))
+        self.nrecords = size // self.record.size
+
+    def _read(self, i):
+        if i < 0:
+            i += self.nrecords
+        if not 0 <= i < self.nrecords:
+            raise IndexError(i)
+        self.f.seek(len(INDEX_MAGIC) + i * self.record.size)
+        return self.record.unpack(self.f.read(self.record.size))
+
+    def blockPosition(self, i):
+        return self._read(i)[1]
+
+    def totals(self):
+        return self._read(-1)[2:]
+
+    def __len__(self):
+        # the sentinel is not an entry point
+        return self.nrecords - 1
+
+    def __getitem__(self, i):
+        record = self._read(i)
+        return record[:1] + record[2:]
+
+    def close(self):
+        self.f.close()
+
+class BlockLogWriter:
+    """
+    Write a log in the block-compressed format: chunks are netstring-encoded
+    exactly as in an uncompressed log, grouped into blocks of about
+    C{blocksize} bytes that always begin on a chunk boundary, and each block
+    is compressed independently with zlib.  An index record is written to
+    the sidecar file for each block.
+    """
+
+    blocksize = 64*1024
+
+    def __init__(self, datafilename, indexfilename):
+        self.datafile = open(datafilename, "wb")
+        self.datafile.write(BLOCK_MAGIC)
+        self.indexfile = open(indexfilename, "wb")
+        self.indexfile.write(INDEX_MAGIC)
+        self.offset = 0
+        self.counts = [0] * (2 * len(ChunkTypes))
+        self.pending = []
+        self.pendingLength = 0
+        self._writeRecord()
+
+    def _writeRecord(self):
+        # remember the state at the start of the block that is accumulating
+        self.blockRecord = BlockLogIndex.record.pack(self.offset,
+                self.datafile.tell(), *self.counts)
+
+    def addChunk(self, channel, text):
+        data = "%d:%d%s," % (1 + len(text), channel, text)
+        self.pending.append(data)
+        self.pendingLength += len(data)
+        self.offset += len(data)
+        if channel < len(ChunkTypes):
+            self.counts[2*channel] += len(text)
+            self.counts[2*channel+1] += text.count("\n")
+        if self.pendingLength >= self.blocksize:
+            self._flushBlock()
+
+    def _flushBlock(self):
+        if not self.pending:
+            return
+        self.indexfile.write(self.blockRecord)
+        self.datafile.write(zlib.compress("".join(self.pending)))
+        self.pending = []
+        self.pendingLength = 0
+        self._writeRecord()
+
+    def close(self):
+        self._flushBlock()
+        # the sentinel
+        self.indexfile.write(self.blockRecord)
+        self.indexfile.close()
+        self.datafile.close()
+
+class BlockLogFile:
+    """
+    A read-only, seekable file-like object presenting the uncompressed
+    netstring stream of a block-compressed log.  Seeking uses the sidecar
+    index, so only the blocks that are actually read get decompressed.
+
+    @ivar index: the L{BlockLogIndex} for this log
+    """
+
+    def __init__(self, filename):
+        """
+        @param filename: base (uncompressed) filename of the log
+        """
+        self.name = filename + ".blk"
+        self.datafile = open(self.name, "rb")
+        if self.datafile.read(len(BLOCK_MAGIC)) != BLOCK_MAGIC:
+            raise IOError("%r is not a block-compressed log" % (self.name,))
+        self.index = BlockLogIndex(open(filename + ".blk.idx", "rb"))
+        self.length = self.index[len(self.index)][0]
+        self.pos = 0
+        self.blockStart = self.blockData = None
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.length
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def _loadBlock(self):
+        offsets = _IndexKeys(self.index, [ 0 ])
+        i = bisect.bisect_right(offsets, self.pos) - 1
+        start = self.index.blockPosition(i)
+        end = self.index.blockPosition(i + 1)
+        self.datafile.seek(start)
+        self.blockData = zlib.decompress(self.datafile.read(end - start))
+        self.blockStart = self.index[i][0]
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.length
+        size = min(size, self.length - self.pos)
+        data = []
+        while size > 0:
+            if self.blockData is None or not \
+                    (self.blockStart <= self.pos <
+                     self.blockStart + len(self.blockData)):
+                self._loadBlock()
+            start = self.pos - self.blockStart
+            piece = self.blockData[start:start+size]
+            data.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        return "".join(data)
+
+    def close(self):
+        self.datafile.close()
+        self.index.close()
+
+class BufferedLogFile:
+    """
+    A read-only, seekable file-like object presenting the netstring stream
+    of a log that is being written behind by a L{LogWriter}.  The part of
+    the stream that has already been written is read from disk, and the
+    rest from the log's buffer, so readers see everything that has been
+    added to the log.
+    """
+
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.name = logfile.getFilename()
+        self.diskfile = open(self.name, "rb")
+        self.pos = 0
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.logfile.getEncodedLength()
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        lf = self.logfile
+        end = lf.getEncodedLength()
+        if size < 0:
+            size = end
+        size = min(size, end - self.pos)
+        data = []
+        if size > 0 and self.pos < lf._bufferedStart:
+            # this part has been written and flushed by the writer thread
+            self.diskfile.seek(self.pos)
+            piece = self.diskfile.read(min(size, lf._bufferedStart - self.pos))
+            data.append(piece)
+            self.pos += len(piece)
+            size -= len(piece)
+        start = lf._bufferedStart
+        for text in lf._buffered:
+            if size <= 0:
+                break
+            if start + len(text) > self.pos >= start:
+                piece = text[self.pos-start:self.pos-start+size]
+                data.append(piece)
+                self.pos += len(piece)
+                size -= len(piece)
+            start += len(text)
+        return "".join(data)
+
+    def close(self):
+        self.diskfile.close()
+
+def _skipText(chunks, field, skip):
+    # drop the first C{skip} bytes (field 0) or lines (field 1) of text from
+    # a sequence of (channel, text) chunks
+    for channel, text in chunks:
+        if skip:
+            if field:
+                pos = -1
+                while skip:
+                    pos = text.find("\n", pos + 1)
+                    if pos == -1:
+                        break
+                    skip -= 1
+                if skip:
+                    continue
+                text = text[pos+1:]
+            else:
+                if len(text) <= skip:
+                    skip -= len(text)
+                    continue
+                text = text[skip:]
+                skip = 0
+            if not text:
+                continue
+        yield (channel, text)
+
+def _limitText(chunks, field, limit):
+    # stop a sequence of (channel, text) chunks after C{limit} bytes (field
+    # 0) or lines (field 1) of text
+    for channel, text in chunks:
+        if limit <= 0:
+            return
+        if field:
+            pos = -1
+            while limit:
+                pos = text.find("\n", pos + 1)
+                if pos == -1:
+                    break
+                limit -= 1
+            if not limit:
+                text = text[:pos+1]
+        else:
+            text = text[:limit]
+            limit -= len(text)
+        yield (channel, text)
+
+def _splitLines(texts):
+    # turn an iterable of text fragments into newline-terminated lines
+    partial = []
+    for text in texts:
+        start = 0
+        while True:
+            end = text.find("\n", start)
+            if end == -1:
+                break
+            partial.append(text[start:end+1])
+            yield "".join(partial)
+            partial = []
+            start = end + 1
+        if start < len(text):
+            partial.append(text[start:])
+    if partial:
+        yield "".join(partial)
+
 class LogFileProducer:
     """What's the plan?
 
@@ -73,31 +415,55 @@ class LogFileProducer:
     except that writeChunk() takes chunks (tuples of (channel,text)) instead
     of the normal write() which takes just text. The LogFileConsumer is
     allowed to call stopProducing, pauseProducing, and resumeProducing on the
-    producer instance it is given. """
+    producer instance it is given.
+
+    If C{channels} is given, only chunks from those channels are produced.
+    If C{offset} is given, the first C{offset} bytes of the text in those
+    channels are skipped, using the logfile's index to avoid reading them
+    from disk. """
 
     paused = False
     subscribed = False
     BUFFERSIZE = 2048
 
-    def __init__(self, logfile, consumer):
+    def __init__(self, logfile, consumer, channels=[], offset=0):
         self.logfile = logfile
         self.consumer = consumer
+        self.channels = channels
+        self.offset = offset
+        self.skip = 0
         self.chunkGenerator = self.getChunks()
         consumer.registerProducer(self, True)
 
+    def _trim(self, channel, text):
+        # filter the chunk by channel and drop any text before self.offset
+        if self.channels and channel not in self.channels:
+            return None
+        if self.skip:
+            if len(text) <= self.skip:
+                self.skip -= len(text)
+                return None
+            text = text[self.skip:]
+            self.skip = 0
+        return (channel, text)
+
     def getChunks(self):
         f = self.logfile.getFile()
         offset = 0
+        if self.offset:
+            offset, self.skip = self.logfile._locate(f, self.channels, 0,
+                                                     self.offset)
         chunks = []
-        p = LogFileScanner(chunks.append)
+        p = LogFileScanner(chunks.append, self.channels)
         f.seek(offset)
         data = f.read(self.BUFFERSIZE)
         offset = f.tell()
         while data:
             p.dataReceived(data)
             while chunks:
-                c = chunks.pop(0)
-                yield c
+                c = self._trim(*chunks.pop(0))
+                if c:
+                    yield c
             f.seek(offset)
             data = f.read(self.BUFFERSIZE)
             offset = f.tell()
@@ -112,7 +478,9 @@ class LogFileProducer:
         if self.logfile.runEntries:
             channel = self.logfile.runEntries[0][0]
             text = "".join([c[1] for c in self.logfile.runEntries])
-            yield (channel, text)
+            c = self._trim(channel, text)
+            if c:
+                yield c
 
         # now we've caught up to the present. Anything further will come from
         # the logfile subscription. We add the callback *after* yielding the
@@ -165,7 +533,9 @@ class LogFileProducer:
 
     def logChunk(self, build, step, logfile, channel, chunk):
         if self.consumer:
-            self.consumer.writeChunk((channel, chunk))
+            c = self._trim(channel, chunk)
+            if c:
+                self.consumer.writeChunk(c)
 
     def logfileFinished(self, logfile):
         self.done()
@@ -203,6 +573,18 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    _index = None
+    # state used when the log is written behind by the master's LogWriter;
+    # _buffered holds encoded chunks, the first _submitted of which have
+    # been handed to the writer thread, starting at stream offset
+    # _bufferedStart
+    _writerChecked = False
+    _writer = None
+    _writefile = None
+    _buffered = []
+    _bufferedStart = 0
+    _bufferedLength = 0
+    _submitted = 0
 
     def __init__(self, parent, name, logfilename):
         """
@@ -228,6 +610,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self._index = LogIndex()
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -252,6 +635,7 @@ class LogFile:
         """
         return os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
+            os.path.exists(self.getFilename() + '.blk') or \
             os.path.exists(self.getFilename())
 
     def getName(self):
@@ -301,12 +685,18 @@ class LogFile:
 
         @returns: file object
         """
+        if self._writefile:
+            # the log is being written behind, so some of it may only be in
+            # memory
+            return BufferedLogFile(self)
         if self.openfile:
             # this is the filehandle we're using to write to the log, so
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
         # try a compressed log first
+        if os.path.exists(self.getFilename() + ".blk"):
+            return BlockLogFile(self.getFilename())
         try:
             return BZ2File(self.getFilename() + ".bz2", "r")
         except IOError:
@@ -395,12 +785,178 @@ class LogFile:
     def readlines(self, channel=STDOUT):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
-        # TODO: make this memory-efficient, by turning it into a generator
-        # that retrieves chunks as necessary, like a pull-driven version of
-        # twisted.protocols.basic.LineReceiver
-        alltext = "".join(self.getChunks([channel], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        return _splitLines(self.getChunks([channel], onlyText=True))
+
+    # random access to the log contents.  Lines and byte offsets are counted
+    # within the text of the selected channels (all channels by default),
+    # and are located using the log's index, so that only the part of the
+    # log following the requested position is read.  Only the channels in
+    # ChunkTypes are indexed.
+
+    def _getIndex(self, f):
+        # block-compressed logs carry their own index; live logs build one
+        # as they are written, and anything else is scanned once
+        if isinstance(f, BlockLogFile):
+            return f.index
+        if self._index is None:
+            self._index = self._scanIndex(f)
+        return self._index
+
+    def _scanIndex(self, f):
+        index = LogIndex()
+        chunks = []
+        p = LogFileScanner(chunks.append)
+        offset = 0
+        f.seek(0)
+        data = f.read(index.interval)
+        while data:
+            p.dataReceived(data)
+            for channel, text in chunks:
+                index.addChunk(offset, channel, text)
+                offset += _encodedLength(text)
+            del chunks[:]
+            data = f.read(index.interval)
+        return index
+
+    def _count(self, channels, field):
+        channels = channels or range(len(ChunkTypes))
+        f = self.getFile()
+        try:
+            totals = self._getIndex(f).totals()
+        finally:
+            if f is not self.openfile:
+                f.close()
+        count = sum([ totals[2*c + field] for c in channels ])
+        for c, text in self.runEntries:
+            if c in channels:
+                count += text.count("\n") if field else len(text)
+        return count
+
+    def getByteCount(self, channels=[]):
+        """
+        Get the length of the text in the given channels.
+
+        @returns: integer
+        """
+        return self._count(channels, 0)
+
+    def getLineCount(self, channels=[]):
+        """
+        Get the number of newline-terminated lines in the given channels.  A
+        trailing partial line is not counted.
+
+        @returns: integer
+        """
+        return self._count(channels, 1)
+
+    def _locate(self, f, channels, field, target):
+        # find the stream offset of the last entry point at or before the
+        # given byte offset (field 0) or line number (field 1), and the
+        # number of bytes or lines between there and the target
+        index = self._getIndex(f)
+        channels = channels or range(len(ChunkTypes))
+        keys = _IndexKeys(index, [ 1 + 2*c + field for c in channels ])
+        if field:
+            # the last entry point before the target line's leading newline
+            i = bisect.bisect_left(keys, target) - 1
+        else:
+            i = bisect.bisect_right(keys, target) - 1
+        if i < 0:
+            return 0, target
+        return index[i][0], target - keys[i]
+
+    def getChunksFrom(self, channels=[], line=None, offset=None,
+                      onlyText=False, limit=None):
+        """
+        Like L{getChunks}, but start at the beginning of line number C{line}
+        (counting from zero) or at byte C{offset} of the text in the given
+        channels.  The first chunk is trimmed accordingly.  If C{limit} is
+        given, stop after that many lines or bytes.
+
+        @returns: iterator
+        """
+        channels = channels or range(len(ChunkTypes))
+        f = self.getFile()
+        if line is not None:
+            field, target = 1, line
+        else:
+            field, target = 0, offset or 0
+        start, skip = self._locate(f, channels, field, target)
+
+        if not self.finished:
+            f.seek(0, 2)
+            remaining = f.tell() - start
+        else:
+            remaining = None
+
+        leftover = None
+        if self.runEntries and self.runEntries[0][0] in channels:
+            leftover = (self.runEntries[0][0],
+                        "".join([c[1] for c in self.runEntries]))
+
+        chunks = self._generateChunks(f, start, remaining, leftover,
+                                      channels, False)
+        chunks = _skipText(chunks, field, skip)
+        if limit is not None:
+            chunks = _limitText(chunks, field, limit)
+        if onlyText:
+            return (text for channel, text in chunks)
+        return chunks
+
+    def getTailChunks(self, count, channels=[], onlyText=False):
+        """
+        Like L{getChunks}, but only generate the last C{count} lines of the
+        text in the given channels, including any trailing partial line.
+
+        @returns: iterator
+        """
+        if count <= 0:
+            return iter([])
+        first = max(0, self.getLineCount(channels) - count)
+        chunks = list(self.getChunksFrom(channels, line=first))
+        if chunks and not chunks[-1][1].endswith("\n") and \
+                sum([ t.count("\n") for c, t in chunks ]) == count:
+            # the trailing partial line is one too many
+            chunks = list(_skipText(chunks, 1, 1))
+        if onlyText:
+            return (text for channel, text in chunks)
+        return iter(chunks)
+
+    def getLines(self, first, last=None, channels=[]):
+        """
+        Get lines C{first} through C{last - 1} (all remaining lines if
+        C{last} is None) of the text in the given channels.
+
+        @returns: list of strings
+        """
+        limit = None
+        if last is not None:
+            limit = max(0, last - first)
+        return list(_splitLines(self.getChunksFrom(channels, line=first,
+                                            onlyText=True, limit=limit)))
+
+    def getTailLines(self, count, channels=[]):
+        """
+        Get the last C{count} lines of the text in the given channels,
+        including any trailing partial line.
+
+        @returns: list of strings
+        """
+        return list(_splitLines(self.getTailChunks(count, channels,
+                                                   onlyText=True)))
+
+    def getBytes(self, start, end=None, channels=[]):
+        """
+        Get bytes C{start} through C{end - 1} (through the end of the log if
+        C{end} is None) of the text in the given channels.
+
+        @returns: string
+        """
+        limit = None
+        if end is not None:
+            limit = max(0, end - start)
+        return "".join(self.getChunksFrom(channels, offset=start,
+                                          onlyText=True, limit=limit))
 
     def subscribe(self, receiver, catchup):
         if self.finished:
@@ -416,10 +972,75 @@ class LogFile:
         if receiver in self.watchers:
             self.watchers.remove(receiver)
 
-    def subscribeConsumer(self, consumer):
-        p = LogFileProducer(self, consumer)
+    def subscribeConsumer(self, consumer, channels=[], offset=0):
+        p = LogFileProducer(self, consumer, channels, offset)
         p.resumeProducing()
 
+    def getEncodedLength(self):
+        """
+        Get the length of the uncompressed on-disk encoding of this log,
+        including any data that has not been written to disk yet.
+
+        @returns: integer
+        """
+        if self._writefile:
+            return self._bufferedStart + self._bufferedLength
+        return os.path.getsize(self.getFilename())
+
+    def waitForWrites(self):
+        """
+        Return a Deferred that will fire when this logfile is finished and
+        completely written to disk.  Unless the log is written behind by a
+        L{LogWriter}, that is as soon as it is finished.
+        """
+        def wait(_):
+            if not self._writefile:
+                return
+            d = defer.Deferred()
+            self._writeWaiters.append(d)
+            return d
+        d = self.waitUntilFinished()
+        d.addCallback(wait)
+        return d
+
+    # interface used by the LogWriter
+
+    def _getWriter(self):
+        # decide, before anything has been written, whether this log is
+        # written behind by the master's LogWriter.  If so, the writer
+        # thread takes over the open file.
+        if not self._writerChecked:
+            self._writerChecked = True
+            if self.master.config.logWriteBehindSize is not None:
+                self._writer = self.master.logwriter
+                self._writefile, self.openfile = self.openfile, None
+                self._buffered = []
+                self._writeWaiters = []
+        return self._writer
+
+    def _takeWrites(self):
+        # hand the chunks merged since the last call to the writer, which
+        # may close the file after writing them once the log is finished
+        pieces = self._buffered[self._submitted:]
+        self._submitted = len(self._buffered)
+        return self._writefile, pieces, self.finished
+
+    def _writesDone(self, count, closed):
+        # the first count buffered chunks are on disk; drop them, and free
+        # their bytes in the writer before anyone waiting is told
+        written = sum([ len(p) for p in self._buffered[:count] ])
+        del self._buffered[:count]
+        self._submitted -= count
+        self._bufferedStart += written
+        self._bufferedLength -= written
+        self._writer.buffered -= written
+        if closed:
+            self._writefile = None
+            waiters = self._writeWaiters
+            self._writeWaiters = []
+            for d in waiters:
+                d.callback(None)
+
     # interface used by the build steps to add things to the log
 
     def _merge(self):
@@ -430,15 +1051,31 @@ class LogFile:
         channel = self.runEntries[0][0]
         text = "".join([c[1] for c in self.runEntries])
         assert channel < 10, "channel number must be a single decimal digit"
-        f = self.openfile
-        f.seek(0, 2)
+        writer = self._getWriter()
+        if writer:
+            f = None
+            pos = self._bufferedStart + self._bufferedLength
+        else:
+            f = self.openfile
+            f.seek(0, 2)
+            pos = f.tell()
+        start = pos
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
-            f.write("%d:%d" % (1 + size, channel))
-            f.write(text[offset:offset+size])
-            f.write(",")
+            chunk = text[offset:offset+size]
+            self._index.addChunk(pos, channel, chunk)
+            if f:
+                f.write("%d:%d" % (1 + size, channel))
+                f.write(chunk)
+                f.write(",")
+            else:
+                self._buffered.append("%d:%d%s," % (1 + size, channel, chunk))
+            pos += _encodedLength(chunk)
             offset += size
+        if writer:
+            self._bufferedLength += pos - start
+            writer.addWrites(self, pos - start)
         self.runEntries = []
         self.runLength = 0
 
@@ -561,6 +1198,9 @@ class LogFile:
             self.openfile.flush()
             self.openfile = None
         self.finished = True
+        if self._writefile:
+            # let the writer close the file once everything is written
+            self._writer.addWrites(self, 0)
         watchers = self.finishedWatchers
         self.finishedWatchers = []
         for w in watchers:
@@ -572,18 +1212,34 @@ class LogFile:
         logCompressionMethod = self.master.config.logCompressionMethod
         # bail out if there's no compression support
         if logCompressionMethod == "bz2":
-            compressed = self.getFilename() + ".bz2.tmp"
+            extensions = [ ".bz2" ]
         elif logCompressionMethod == "gz":
-            compressed = self.getFilename() + ".gz.tmp"
+            extensions = [ ".gz" ]
+        elif logCompressionMethod == "indexed":
+            # the index is renamed into place first, since the presence of
+            # the data file is what marks the log as block-compressed
+            extensions = [ ".blk.idx", ".blk" ]
         else:
             return defer.succeed(None)
+        compressed = [ self.getFilename() + ext + ".tmp"
+                       for ext in extensions ]
 
         def _compressLog():
             infile = self.getFile()
+            if logCompressionMethod == "indexed":
+                writer = BlockLogWriter(compressed[1], compressed[0])
+                p = LogFileScanner(lambda chunk : writer.addChunk(*chunk))
+                while True:
+                    buf = infile.read(writer.blocksize)
+                    if not buf:
+                        break
+                    p.dataReceived(buf)
+                writer.close()
+                return
             if logCompressionMethod == "bz2":
-                cf = BZ2File(compressed, 'w')
+                cf = BZ2File(compressed[0], 'w')
             elif logCompressionMethod == "gz":
-                cf = GzipFile(compressed, 'w')
+                cf = GzipFile(compressed[0], 'w')
             bufsize = 1024*1024
             while True:
                 buf = infile.read(bufsize)
@@ -591,28 +1247,28 @@ class LogFile:
                 if len(buf) < bufsize:
                     break
             cf.close()
-        d = threads.deferToThread(_compressLog)
+        d = self.waitForWrites()
+        d.addCallback(lambda _ : threads.deferToThread(_compressLog))
 
         def _renameCompressedLog(rv):
-            if logCompressionMethod == "bz2":
-                filename = self.getFilename() + '.bz2'
-            else:
-                filename = self.getFilename() + '.gz'
-            if runtime.platformType  == 'win32':
-                # windows cannot rename a file on top of an existing one, so
-                # fall back to delete-first. There are ways this can fail and
-                # lose the builder's history, so we avoid using it in the
-                # general (non-windows) case
-                if os.path.exists(filename):
-                    os.unlink(filename)
-            os.rename(compressed, filename)
+            for ext, tmpname in zip(extensions, compressed):
+                filename = self.getFilename() + ext
+                if runtime.platformType  == 'win32':
+                    # windows cannot rename a file on top of an existing one,
+                    # so fall back to delete-first. There are ways this can
+                    # fail and lose the builder's history, so we avoid using
+                    # it in the general (non-windows) case
+                    if os.path.exists(filename):
+                        os.unlink(filename)
+                os.rename(tmpname, filename)
             _tryremove(self.getFilename(), 1, 5)
         d.addCallback(_renameCompressedLog)
 
         def _cleanupFailedCompress(failure):
             log.msg("failed to compress %s" % self.getFilename())
-            if os.path.exists(compressed):
-                _tryremove(compressed, 1, 5)
+            for tmpname in compressed:
+                if os.path.exists(tmpname):
+                    _tryremove(tmpname, 1, 5)
             failure.trap() # reraise the failure
         d.addErrback(_cleanupFailedCompress)
         return d
@@ -625,6 +1281,11 @@ class LogFile:
         del d['watchers']
         del d['finishedWatchers']
         del d['master']
+        for k in ('_index', '_writerChecked', '_writer', '_writefile',
+                  '_buffered', '_bufferedStart', '_bufferedLength',
+                  '_submitted', '_writeWaiters'):
+            if d.has_key(k):
+                del d[k]
         d['entries'] = [] # let 0.6.4 tolerate the saved log. TODO: really?
         if d.has_key('finished'):
             del d['finished']
@@ -639,6 +1300,95 @@ class LogFile:
         # self.step must be filled in by our parent
         self.finished = True
 
+class LogWriter(config.ReconfigurableServiceMixin,
+                writebehind.WriteBehindService):
+    """
+    A write-behind writer for live logs, used when C{logWriteBehindSize} is
+    configured.  Chunks merged by each L{LogFile} are buffered in memory and
+    written to disk in batches by a dedicated thread.  Until they are
+    written, readers get the buffered chunks from L{LogFile.getFile}.
+
+    At most C{maxBuffered} bytes should be buffered; beyond that, producers
+    passed to L{throttle} (the slaves' connections) are paused until half of
+    the backlog has been written.
+
+    There is only one instance of this class, available at
+    C{master.logwriter}.
+    """
+
+    maxBuffered = None
+
+    def __init__(self):
+        writebehind.WriteBehindService.__init__(self, 'logwriter')
+        self.buffered = 0
+        self.dirty = set()
+        self.paused = []
+
+    def reconfigService(self, new_config):
+        self.maxBuffered = new_config.logWriteBehindSize
+        self._maybeResume()
+        return config.ReconfigurableServiceMixin.reconfigService(self,
+                                                            new_config)
+
+    def addWrites(self, logfile, length):
+        """
+        Note that C{length} more bytes have been buffered by C{logfile}, and
+        arrange for them to be written.  Writes that arrive in the same
+        reactor turn, or while a batch is being written, are batched
+        together.
+        """
+        self.buffered += length
+        self.dirty.add(logfile)
+        self._scheduleFlush()
+
+    def throttle(self, producer):
+        """
+        Pause C{producer} if more than C{maxBuffered} bytes are waiting to be
+        written.  It will be resumed once the backlog has been halved.
+        """
+        if self.maxBuffered is None or self.buffered <= self.maxBuffered:
+            return
+        if producer not in self.paused:
+            self.paused.append(producer)
+            producer.pauseProducing()
+
+    def _maybeResume(self):
+        if not self.paused:
+            return
+        if self.maxBuffered is not None and \
+                self.buffered > self.maxBuffered // 2:
+            return
+        paused = self.paused
+        self.paused = []
+        for producer in paused:
+            producer.resumeProducing()
+
+    # WriteBehindService methods
+
+    def _hasPending(self):
+        return bool(self.dirty)
+
+    def _takeBatch(self):
+        logfiles = list(self.dirty)
+        self.dirty.clear()
+        return [ (lf, lf._takeWrites()) for lf in logfiles ]
+
+    def _writeItem(self, item):
+        # this touches nothing but the file
+        lf, (f, pieces, close) = item
+        if pieces:
+            f.write("".join(pieces))
+            f.flush()
+        if close:
+            f.close()
+
+    def _batchDone(self, batch, results):
+        for (lf, (f, pieces, close)), why in zip(batch, results):
+            if why:
+                log.err(why, "while writing log %s" % lf.getFilename())
+            lf._writesDone(len(pieces), close)
+        self._maybeResume()
+
 class HTMLLogFile:
     implements(interfaces.IStatusLog)
 
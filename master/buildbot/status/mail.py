@@ -16,6 +16,9 @@
 
 import re
 import types
+import itertools
+import base64
+import codecs
 from email.Message import Message
 from email.Utils import formatdate
 from email.MIMEText import MIMEText
@@ -43,7 +46,7 @@ except ImportError:
 
 from buildbot import interfaces, util, config
 from buildbot.process.users import users
-from buildbot.status import base
+from buildbot.status import base, logfile
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, Results
 
 VALID_EMAIL = re.compile("[a-zA-Z0-9\.\_\%\-\+]+@[a-zA-Z0-9\.\_\%\-]+.[a-zA-Z]{2,6}")
@@ -51,6 +54,177 @@ VALID_EMAIL = re.compile("[a-zA-Z0-9\.\_\%\-\+]+@[a-zA-Z0-9\.\_\%\-]+.[a-zA-Z]{2
 ENCODING = 'utf8'
 LOG_ENCODING = 'utf-8'
 
+def _getLogChunks(logf):
+    # logs on disk are read a chunk at a time; other logs (such as
+    # HTMLLogFile) only have their whole text
+    if isinstance(logf, logfile.LogFile):
+        return logf.getChunks([logfile.STDOUT, logfile.STDERR], onlyText=True)
+    return [ logf.getText() ]
+
+class LogLines(object):
+    """
+    The lines of text (without line endings) of a build log, as would be
+    given by C{logf.getText().splitlines()}, but read from the log only as
+    they are used.  Iterating over this object streams the log; L{tail} and
+    L{grep} give the last lines and the lines matching a regular expression.
+
+    It can otherwise be used as the list of lines.  Slices which end at the
+    end of the log, such as C{lines[-n:]} or C{lines[len(lines)-n:]}, use
+    L{tail}; the length is counted once, and searches and other indexing
+    stream the log.  Operations which modify the list, or which need all of
+    it (such as C{+} or C{reverse}), read the whole log once and keep it.
+    """
+
+    def __init__(self, logf):
+        self.logf = logf
+        self._count = None
+        # all of the lines, once something has needed them
+        self._lines = None
+
+    def __iter__(self):
+        if self._lines is not None:
+            return iter(self._lines)
+        return self._readLines()
+
+    def _readLines(self):
+        partial = ''
+        for text in _getLogChunks(self.logf):
+            lines = (partial + text).splitlines(True)
+            partial = ''
+            # the last line may continue in the next chunk (even if it ends
+            # with '\r', which may be followed by '\n')
+            if lines and not lines[-1].endswith('\n'):
+                partial = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r\n')
+        if partial:
+            yield partial.rstrip('\r\n')
+
+    def _list(self):
+        if self._lines is None:
+            self._lines = list(self._readLines())
+        return self._lines
+
+    def tail(self, count):
+        """Return a list of the last C{count} lines of the log."""
+        if count <= 0:
+            return []
+        if self._lines is not None or \
+                not isinstance(self.logf, logfile.LogFile):
+            return list(self)[-count:]
+        lines = []
+        for line in self.logf.getTailLines(count,
+                                [logfile.STDOUT, logfile.STDERR]):
+            lines.extend(line.splitlines())
+        return lines[-count:]
+
+    def grep(self, pattern):
+        """Return a list of the lines which match C{pattern}, a regular
+        expression (as a string or compiled)."""
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern)
+        return [ line for line in self if pattern.search(line) ]
+
+    # sequence methods
+
+    def __len__(self):
+        if self._lines is not None:
+            return len(self._lines)
+        if self._count is None:
+            count = 0
+            for line in self:
+                count += 1
+            self._count = count
+        return self._count
+
+    def __nonzero__(self):
+        if self._lines is not None or self._count is not None:
+            return len(self) > 0
+        for line in self:
+            return True
+        return False
+
+    def __getitem__(self, i):
+        if self._lines is not None:
+            return self._lines[i]
+        if isinstance(i, slice):
+            return self._slice(i.start, i.stop, i.step)
+        if i < 0:
+            lines = self.tail(-i)
+            if len(lines) == -i:
+                return lines[0]
+        else:
+            for line in itertools.islice(self, i, None):
+                return line
+        raise IndexError("log line index out of range")
+
+    def _slice(self, start, stop, step):
+        if stop is None and step in (None, 1) and start:
+            if start > 0:
+                start -= len(self)
+            return self.tail(-start)
+        if (start or 0) >= 0 and (stop or 0) >= 0 and (step or 1) > 0:
+            return list(itertools.islice(self, start, stop, step))
+        return list(self)[start:stop:step]
+
+    def __contains__(self, item):
+        for line in self:
+            if line == item:
+                return True
+        return False
+
+    def index(self, item, start=0, stop=None):
+        if self._lines is not None or start < 0 or (stop or 0) < 0:
+            lines = self._list()
+            if stop is None:
+                stop = len(lines)
+            return lines.index(item, start, stop)
+        for i, line in enumerate(itertools.islice(self, start, stop)):
+            if line == item:
+                return start + i
+        raise ValueError("%r is not in the log" % (item,))
+
+    def count(self, item):
+        return len([ line for line in self if line == item ])
+
+    def __reversed__(self):
+        return reversed(self._list())
+
+    def __add__(self, other):
+        return self._list() + other
+
+    def __radd__(self, other):
+        return other + self._list()
+
+    def __iadd__(self, other):
+        self._list().extend(other)
+        return self
+
+    def __mul__(self, n):
+        return self._list() * n
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if isinstance(other, LogLines):
+            other = list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __setitem__(self, i, value):
+        self._list()[i] = value
+
+    def __delitem__(self, i):
+        del self._list()[i]
+
+    def __getattr__(self, name):
+        # the remaining list methods (append, sort, reverse and so on)
+        if name in ('append', 'extend', 'insert', 'pop', 'remove',
+                    'reverse', 'sort'):
+            return getattr(self._list(), name)
+        raise AttributeError(name)
+
 class Domain(util.ComparableMixin):
     implements(interfaces.IEmailLookup)
     compare_attrs = ["domain"]
@@ -472,7 +646,8 @@ class MailNotifier(base.StatusReceiverMultiService):
     def getCustomMesgData(self, mode, name, build, results, master_status):
         #
         # logs is a list of tuples that contain the log
-        # name, log url, and the log contents as a list of strings.
+        # name, log url, the log contents as a LogLines instance, and the
+        # status of the log's step.
         #
         logs = list()
         for logf in build.getLogs():
@@ -484,7 +659,7 @@ class MailNotifier(base.StatusReceiverMultiService):
                          '%s/steps/%s/logs/%s' % (
                              master_status.getURLForThing(build),
                              stepName, logName),
-                         logf.getText().splitlines(),
+                         LogLines(logf),
                          logStatus))
 
         attrs = {'builderName': name,
@@ -538,6 +713,29 @@ class MailNotifier(base.StatusReceiverMultiService):
                     filename="source patch " + str(index) )
         return a
 
+    def log_to_attachment(self, log, name):
+        # the log is read and encoded a chunk at a time, so that only the
+        # encoded attachment is held in memory
+        decoder = codecs.getincrementaldecoder(LOG_ENCODING)()
+        encoded = []
+        pending = ''
+        for text in _getLogChunks(log):
+            if not isinstance(text, unicode):
+                text = decoder.decode(text)
+            pending += text.encode(ENCODING)
+            # base64 encodes 57 bytes to each line
+            split = len(pending) - len(pending) % 57
+            encoded.append(base64.encodestring(pending[:split]))
+            pending = pending[split:]
+        pending += decoder.decode('', True).encode(ENCODING)
+        encoded.append(base64.encodestring(pending))
+
+        # MIMEText sets the headers for a base64-encoded payload
+        a = MIMEText('', _charset=ENCODING)
+        a.set_payload(''.join(encoded))
+        a.add_header('Content-Disposition', "attachment", filename=name)
+        return a
+
     def createEmail(self, msgdict, builderName, title, results, builds=None,
                     patches=None, logs=None):
         text = msgdict['body'].encode(ENCODING)
@@ -580,14 +778,7 @@ class MailNotifier(base.StatusReceiverMultiService):
                                   log.getName())
                 if ( self._shouldAttachLog(log.getName()) or
                      self._shouldAttachLog(name) ):
-                    text = log.getText()
-                    if not isinstance(text, unicode):
-                        text = text.decode(LOG_ENCODING)
-                    a = MIMEText(text.encode(ENCODING),
-                                 _charset=ENCODING)
-                    a.add_header('Content-Disposition', "attachment",
-                                 filename=name)
-                    m.attach(a)
+                    m.attach(self.log_to_attachment(log, name))
 
         #@todo: is there a better way to do this?
         # Add any extra headers that were requested, doing WithProperties
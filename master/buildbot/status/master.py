@@ -16,21 +16,26 @@
 from __future__ import with_statement
 
 import os, urllib
-from cPickle import load
-from twisted.python import log
+import heapq
+from cPickle import loads
+from twisted.python import log, threadpool
 from twisted.persisted import styles
-from twisted.internet import defer
+from twisted.internet import defer, threads, reactor
 from twisted.application import service
 from zope.interface import implements
 from buildbot import interfaces, config
 from buildbot.util import bbcollections
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
-from buildbot.status import buildset, builder, buildrequest
+from buildbot.status import buildset, builder, buildrequest, buildmanifest
+from buildbot.process import metrics
 
 class Status(config.ReconfigurableServiceMixin, service.MultiService):
     implements(interfaces.IStatus)
 
+    # the number of threads used to load builder status at startup
+    loadThreads = 8
+
     def __init__(self, master):
         service.MultiService.__init__(self)
         self.master = master
@@ -40,6 +45,8 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         self.watchers = []
         # No default limit to the log size
         self.logMaxSize = None
+        # builder status loaded by loadBuilders, keyed by (name, basedir)
+        self._preloaded = {}
 
         self._builder_observers = bbcollections.KeyedSets()
         self._buildreq_observers = bbcollections.KeyedSets()
@@ -239,48 +246,38 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
                          for bn in self.getBuilderNames()
                          if want_builder(bn)]
 
-        # 'sources' is a list of generators, one for each Builder we're
-        # using. When the generator is exhausted, it is replaced in this list
-        # with None.
-        sources = []
-        for bn in builder_names:
-            b = self.getBuilder(bn)
-            g = b.generateFinishedBuilds(branches,
-                                         finished_before=finished_before,
-                                         max_search=max_search)
-            sources.append(g)
-
-        # next_build the next build from each source
-        next_build = [None] * len(sources)
-
-        def refill():
-            for i,g in enumerate(sources):
-                if next_build[i]:
-                    # already filled
-                    continue
-                if not g:
-                    # already exhausted
-                    continue
-                try:
-                    next_build[i] = g.next()
-                except StopIteration:
-                    next_build[i] = None
-                    sources[i] = None
+        # merge the builders' finished builds, most recently finished first,
+        # using their build indexes; only the builds actually yielded are
+        # fetched from the index, which may load their pickles
+        def entry(i, bs, summaries):
+            for summary in summaries:
+                # ties go to the later builder, as they always have
+                return (-summary.finished, -i, summary, bs, summaries)
+            return None
+
+        heap = []
+        for i, bn in enumerate(builder_names):
+            bs = self.getBuilder(bn)
+            summaries = bs.generateFinishedSummaries(branches,
+                                           finished_before=finished_before,
+                                           max_search=max_search)
+            e = entry(i, bs, summaries)
+            if e:
+                heap.append(e)
+        heapq.heapify(heap)
 
         got = 0
-        while True:
-            refill()
-            # find the latest build among all the candidates
-            candidates = [(i, b, b.getTimes()[1])
-                          for i,b in enumerate(next_build)
-                          if b is not None]
-            candidates.sort(lambda x,y: cmp(x[2], y[2]))
-            if not candidates:
-                return
-
-            # and remove it from the list
-            i, build, finshed_time = candidates[-1]
-            next_build[i] = None
+        while heap:
+            negfinished, negi, summary, bs, summaries = heap[0]
+            e = entry(-negi, bs, summaries)
+            if e:
+                heapq.heapreplace(heap, e)
+            else:
+                heapq.heappop(heap)
+
+            build = bs.getBuildIndex().getBuildStatus(summary)
+            if build is None:
+                continue
             got += 1
             yield build
             if num_builds is not None:
@@ -302,28 +299,69 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         if t:
             builder_status.subscribe(t)
 
-    def builderAdded(self, name, basedir, category=None):
+    def loadBuilders(self, builders):
         """
-        @rtype: L{BuilderStatus}
+        Load the status of the given builders in parallel, in a thread pool,
+        so that a subsequent L{builderAdded} for each need not touch the disk.
+
+        @param builders: list of (name, basedir) tuples
+        @returns: Deferred
         """
-        filename = os.path.join(self.basedir, basedir, "builder")
+        if not builders:
+            return defer.succeed(None)
+        timer = metrics.Timer("Status.loadBuilders")
+        timer.start()
+        pool = threadpool.ThreadPool(minthreads=1,
+                maxthreads=min(self.loadThreads, len(builders)),
+                name='BuilderStatusLoader')
+        pool.start()
+
+        def loaded(result, name, basedir):
+            self._preloaded[(name, basedir)] = result
+        dl = []
+        for name, basedir in builders:
+            d = threads.deferToThreadPool(reactor, pool,
+                    self._loadBuilderStatus, name, basedir)
+            d.addCallback(loaded, name, basedir)
+            dl.append(d)
+        d = defer.gatherResults(dl)
+        def done(x):
+            pool.stop()
+            timer.stop()
+            metrics.MetricCountEvent.log("Status.buildersLoaded",
+                    len(builders))
+            return x
+        d.addBoth(done)
+        return d
+
+    def _loadBuilderStatus(self, name, basedir):
+        # load the builder's pickle, upgrading it if necessary, and its build
+        # manifest.  This runs in a thread when called from loadBuilders, so
+        # an upgraded pickle is re-written later, by builderAdded.
+        fullbasedir = os.path.join(self.basedir, basedir)
+        filename = os.path.join(fullbasedir, "builder")
         log.msg("trying to load status pickle from %s" % filename)
         builder_status = None
+        upgraded = False
         try:
             with open(filename, "rb") as f:
-                builder_status = load(f)
-            builder_status.master = self.master
-
-            # (bug #1068) if we need to upgrade, we probably need to rewrite
-            # this pickle, too.  We determine this by looking at the list of
-            # Versioned objects that have been unpickled, and (after doUpgrade)
-            # checking to see if any of them set wasUpgraded.  The Versioneds'
-            # upgradeToVersionNN methods all set this.
-            versioneds = styles.versionedsToUpgrade
-            styles.doUpgrade()
-            if True in [ hasattr(o, 'wasUpgraded') for o in versioneds.values() ]:
-                log.msg("re-writing upgraded builder pickle")
-                builder_status.saveYourself()
+                data = f.read()
+            # unpickling and upgrading use the global list of Versioned
+            # objects to upgrade, so only one builder can do so at a time
+            with builder.upgradeLock:
+                builder_status = loads(data)
+                builder_status.master = self.master
+
+                # (bug #1068) if we need to upgrade, we probably need to
+                # rewrite this pickle, too.  We determine this by looking at
+                # the list of Versioned objects that have been unpickled, and
+                # (after doUpgrade) checking to see if any of them set
+                # wasUpgraded.  The Versioneds' upgradeToVersionNN methods all
+                # set this.
+                versioneds = styles.versionedsToUpgrade
+                styles.doUpgrade()
+                upgraded = True in [ hasattr(o, 'wasUpgraded')
+                                     for o in versioneds.values() ]
 
         except IOError:
             log.msg("no saved status pickle, creating a new one")
@@ -331,6 +369,21 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
             log.msg("error while loading status pickle, creating a new one")
             log.msg("error follows:")
             log.err()
+
+        if not os.path.isdir(fullbasedir):
+            os.makedirs(fullbasedir)
+        manifest = buildmanifest.BuildManifest(fullbasedir)
+        manifest.getNextBuildNumber() # read (or make) the manifest now
+        return builder_status, manifest, upgraded
+
+    def builderAdded(self, name, basedir, category=None):
+        """
+        @rtype: L{BuilderStatus}
+        """
+        loaded = self._preloaded.pop((name, basedir), None)
+        if loaded is None:
+            loaded = self._loadBuilderStatus(name, basedir)
+        builder_status, manifest, upgraded = loaded
         if not builder_status:
             builder_status = builder.BuilderStatus(name, category, self.master)
             builder_status.addPointEvent(["builder", "created"])
@@ -342,10 +395,13 @@ class Status(config.ReconfigurableServiceMixin, service.MultiService):
         builder_status.name = name # it might have been updated
         builder_status.status = self
 
-        if not os.path.isdir(builder_status.basedir):
-            os.makedirs(builder_status.basedir)
+        builder_status.buildManifest = manifest
         builder_status.determineNextBuildNumber()
 
+        if upgraded:
+            log.msg("re-writing upgraded builder pickle")
+            builder_status.saveYourself()
+
         builder_status.setBigState("offline")
 
         for t in self.watchers:
@@ -18,9 +18,12 @@ from __future__ import with_statement
 
 from collections import deque
 import os
+import struct
+import itertools
 import cPickle as pickle
 
 from zope.interface import implements, Interface
+from twisted.python import log, runtime
 
 
 def ReadFile(path):
@@ -55,9 +58,11 @@ class IQueue(Interface):
         """Save the queue to storage if implemented."""
 
     def items():
-        """Returns items in the queue.
+        """Returns items in the queue."""
 
-        Warning: Can be extremely slow for queue on disk."""
+    def iterItems():
+        """Generates the items in the queue, without loading them all at
+        once.  The queue must not be modified while iterating."""
 
     def nbItems():
         """Returns the number of items in the queue."""
@@ -116,6 +121,9 @@ class MemoryQueue(object):
     def items(self):
         return list(self._items)
 
+    def iterItems(self):
+        return iter(list(self._items))
+
     def nbItems(self):
         return len(self._items)
 
@@ -123,20 +131,51 @@ class MemoryQueue(object):
         return self._maxItems
 
 
+class _Segment(object):
+    """Bookkeeping for one segment file of a L{DiskQueue}."""
+
+    def __init__(self, id, nbItems=0, size=0):
+        self.id = id
+        # Number of records in the file, and its size in bytes.
+        self.nbItems = nbItems
+        self.size = size
+        # Number of records already popped, and the offset of the next one.
+        self.consumed = 0
+        self.offset = 0
+
+
 class DiskQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
+    Items are appended to segment files, each holding up to segmentItems
+    length-prefixed records, so pushing and popping an item costs a single
+    sequential write or read.  Segments are deleted once all of their items
+    are popped, and chunks inserted back get a segment of their own in front
+    of the others.  A small index file records the size of each segment and
+    the position of the next item to pop; it is written, and the segments
+    fsync'ed, every syncItems operations, when a segment is deleted and when
+    the queue is saved.  After
+    a crash, segments which do not match the index are scanned again, so
+    items may be popped twice but are never lost once synced.
+
+    Queues written by older versions, with one file per item, are migrated
+    when loaded.
+
     Use pickle for serialization."""
     implements(IQueue)
 
+    _header = struct.Struct('>I')
+
     def __init__(self, path, maxItems=None, pickleFn=pickle.dumps,
-                 unpickleFn=pickle.loads):
+                 unpickleFn=pickle.loads, segmentItems=1000, syncItems=100):
         """
         @path: directory to save the items.
         @maxItems: maximum number of items to keep on disk, flush the
         older ones.
         @pickleFn: function used to pack the items to disk.
         @unpickleFn: function used to unpack items from disk.
+        @segmentItems: maximum number of items in each segment file.
+        @syncItems: number of operations between syncs to the disk.
         """
         self.path = path
         self._maxItems = maxItems
@@ -146,29 +185,25 @@ class DiskQueue(object):
             os.mkdir(self.path)
         self.pickleFn = pickleFn
         self.unpickleFn = unpickleFn
+        self.segmentItems = segmentItems
+        self.syncItems = syncItems
 
         # Total number of items.
         self._nbItems = 0
-        # The actual items id start at one.
-        self.firstItemId = 0
-        self.lastItemId = 0
+        # The segments, oldest first.
+        self._segments = deque()
+        # Files open for appending to the last segment and reading from the
+        # first one.
+        self._tail = None
+        self._head = None
+        self._unsynced = 0
         self._loadFromDisk()
 
     def pushItem(self, item):
         ret = None
         if self._nbItems == self._maxItems:
-            id = self._findNext(self.firstItemId)
-            path = os.path.join(self.path, str(id))
-            ret = self.unpickleFn(ReadFile(path))
-            os.remove(path)
-            self.firstItemId = id + 1
-        else:
-            self._nbItems += 1
-        self.lastItemId += 1
-        path = os.path.join(self.path, str(self.lastItemId))
-        if os.path.exists(path):
-            raise IOError('%s already exists.' % path)
-        WriteFile(path, self.pickleFn(item))
+            ret = self._popItem()
+        self._appendItem(self.pickleFn(item))
         return ret
 
     def insertBackChunk(self, chunk):
@@ -177,41 +212,36 @@ class DiskQueue(object):
         if excess > 0:
             ret = chunk[0:excess]
             chunk = chunk[excess:]
-        for i in reversed(chunk):
-            self.firstItemId -= 1
-            path = os.path.join(self.path, str(self.firstItemId))
-            if os.path.exists(path):
-                raise IOError('%s already exists.' % path)
-            WriteFile(path, self.pickleFn(i))
-            self._nbItems += 1
+        if chunk:
+            self._insertSegment([self.pickleFn(i) for i in chunk])
         return ret
 
     def popChunk(self, nbItems=None):
         if nbItems is None:
             nbItems = self._maxItems
         ret = []
-        for i in range(nbItems):
-            if self._nbItems == 0:
-                break
-            id = self._findNext(self.firstItemId)
-            path = os.path.join(self.path, str(id))
-            ret.append(self.unpickleFn(ReadFile(path)))
-            os.remove(path)
-            self._nbItems -= 1
-            self.firstItemId = id + 1
+        for i in range(min(nbItems, self._nbItems)):
+            ret.append(self._popItem())
+        if ret and not self._nbItems:
+            self._sync()
         return ret
 
     def save(self):
-        pass
+        self._sync()
 
     def items(self):
-        """Warning, very slow."""
-        ret = []
-        for id in range(self.firstItemId, self.lastItemId + 1):
-            path = os.path.join(self.path, str(id))
-            if os.path.exists(path):
-                ret.append(self.unpickleFn(ReadFile(path)))
-        return ret
+        return list(self.iterItems())
+
+    def iterItems(self):
+        """Generates the items one by one, reading one record at a time.
+
+        The queue must not be modified while iterating."""
+        self._flushTail()
+        for segment in list(self._segments):
+            with open(self._segmentPath(segment.id), 'rb') as f:
+                f.seek(segment.offset)
+                for i in range(segment.nbItems - segment.consumed):
+                    yield self.unpickleFn(self._readRecord(f))
 
     def nbItems(self):
         return self._nbItems
@@ -221,30 +251,205 @@ class DiskQueue(object):
 
     #### Protected functions
 
-    def _findNext(self, id):
-        while True:
-            path = os.path.join(self.path, str(id))
-            if os.path.isfile(path):
-                return id
-            id += 1
-        return None
+    def _segmentPath(self, id):
+        return os.path.join(self.path, 'segment.%d' % id)
+
+    def _indexPath(self):
+        return os.path.join(self.path, 'index')
+
+    def _record(self, data):
+        return self._header.pack(len(data)) + data
+
+    def _readRecord(self, f):
+        header = f.read(self._header.size)
+        if len(header) < self._header.size:
+            raise IOError('truncated record in %s' % f.name)
+        (length,) = self._header.unpack(header)
+        data = f.read(length)
+        if len(data) < length:
+            raise IOError('truncated record in %s' % f.name)
+        return data
+
+    def _appendItem(self, data):
+        if (not self._segments or
+            self._segments[-1].nbItems >= self.segmentItems):
+            self._closeTail()
+            if self._segments:
+                id = self._segments[-1].id + 1
+            else:
+                id = 0
+            self._segments.append(_Segment(id))
+        segment = self._segments[-1]
+        if self._tail is None:
+            self._tail = open(self._segmentPath(segment.id), 'ab')
+        record = self._record(data)
+        self._tail.write(record)
+        segment.nbItems += 1
+        segment.size += len(record)
+        self._nbItems += 1
+        self._noteChange()
+
+    def _popItem(self):
+        segment = self._segments[0]
+        if self._head is None:
+            if segment is self._segments[-1]:
+                self._flushTail()
+            self._head = open(self._segmentPath(segment.id), 'rb')
+            self._head.seek(segment.offset)
+        elif segment is self._segments[-1]:
+            self._flushTail()
+        data = self._readRecord(self._head)
+        segment.offset = self._head.tell()
+        segment.consumed += 1
+        self._nbItems -= 1
+        if segment.consumed == segment.nbItems:
+            self._closeHead()
+            if len(self._segments) == 1:
+                self._closeTail()
+            self._segments.popleft()
+            os.remove(self._segmentPath(segment.id))
+            # the index must forget the segment before its id can be used
+            # again by a new one
+            self._sync()
+        else:
+            self._noteChange()
+        return self.unpickleFn(data)
+
+    def _insertSegment(self, datas):
+        """Writes the pickled items in datas to a new first segment."""
+        if self._segments:
+            id = self._segments[0].id - 1
+        else:
+            id = 0
+        records = [self._record(data) for data in datas]
+        with open(self._segmentPath(id), 'wb') as f:
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        self._closeHead()
+        self._segments.appendleft(
+            _Segment(id, len(records), sum([len(r) for r in records])))
+        self._nbItems += len(records)
+        self._sync()
+
+    def _flushTail(self):
+        if self._tail is not None:
+            self._tail.flush()
+
+    def _closeTail(self):
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+
+    def _closeHead(self):
+        if self._head is not None:
+            self._head.close()
+            self._head = None
+
+    def _noteChange(self):
+        self._unsynced += 1
+        if self._unsynced >= self.syncItems:
+            self._sync()
+
+    def _sync(self):
+        """Syncs the last segment and writes the index."""
+        self._unsynced = 0
+        if self._tail is not None:
+            self._tail.flush()
+            os.fsync(self._tail.fileno())
+        path = self._indexPath()
+        if not self._segments:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        index = {
+            'segments': dict([(s.id, (s.nbItems, s.size, s.consumed, s.offset))
+                              for s in self._segments]),
+        }
+        WriteFile(path + '.tmp', pickle.dumps(index, -1))
+        if runtime.platformType == 'win32' and os.path.exists(path):
+            # windows cannot rename a file on top of an existing one
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def _scanSegment(self, id):
+        """Counts the records in a segment, dropping any partial record at its
+        end, as left by a crash.
+
+        Returns the number of records and the size of the segment."""
+        path = self._segmentPath(id)
+        nbItems = 0
+        size = 0
+        with open(path, 'r+b') as f:
+            while True:
+                try:
+                    self._readRecord(f)
+                except IOError:
+                    break
+                nbItems += 1
+                size = f.tell()
+            f.truncate(size)
+        return nbItems, size
 
     def _loadFromDisk(self):
-        """Loads the queue from disk upto self.maxMemoryItems items into
-        self.items.
-        """
+        """Loads the list of segments, and migrates items written one per file
+        by older versions."""
         def SafeInt(item):
             try:
                 return int(item)
             except ValueError:
                 return None
 
-        files = filter(None, [SafeInt(x) for x in os.listdir(self.path)])
-        files.sort()
-        self._nbItems = len(files)
-        if self._nbItems:
-            self.firstItemId = files[0]
-            self.lastItemId = files[-1]
+        segmentIds = []
+        legacyIds = []
+        for name in os.listdir(self.path):
+            if name.startswith('segment.'):
+                id = SafeInt(name[len('segment.'):])
+                if id is not None:
+                    segmentIds.append(id)
+            else:
+                id = SafeInt(name)
+                if id is not None:
+                    legacyIds.append(id)
+        segmentIds.sort()
+        legacyIds.sort()
+
+        index = {}
+        if os.path.exists(self._indexPath()):
+            try:
+                index = pickle.loads(ReadFile(self._indexPath()))
+            except Exception:
+                log.msg('ignoring corrupt queue index in %s' % self.path)
+        indexed = index.get('segments', {})
+
+        for id in segmentIds:
+            segment = _Segment(id)
+            segment.size = os.path.getsize(self._segmentPath(id))
+            info = indexed.get(id)
+            if info and info[1] == segment.size:
+                segment.nbItems, _, segment.consumed, segment.offset = info
+            else:
+                segment.nbItems, segment.size = self._scanSegment(id)
+                if info and info[3] <= segment.size:
+                    # the items popped before the last sync are still gone
+                    segment.consumed, segment.offset = info[2:]
+            if segment.consumed >= segment.nbItems:
+                os.remove(self._segmentPath(id))
+                continue
+            self._segments.append(segment)
+            self._nbItems += segment.nbItems - segment.consumed
+
+        if set(indexed) != set([s.id for s in self._segments]):
+            # forget the segments which are gone, before their ids are used
+            # again
+            self._sync()
+
+        if legacyIds:
+            self._insertSegment([ReadFile(os.path.join(self.path, str(id)))
+                                 for id in legacyIds])
+            for id in legacyIds:
+                os.remove(os.path.join(self.path, str(id)))
 
 
 class PersistentQueue(object):
@@ -327,6 +532,10 @@ class PersistentQueue(object):
     def items(self):
         return self.primaryQueue.items() + self.secondaryQueue.items()
 
+    def iterItems(self):
+        return itertools.chain(self.primaryQueue.iterItems(),
+                               self.secondaryQueue.iterItems())
+
     def nbItems(self):
         return self.primaryQueue.nbItems() + self.secondaryQueue.nbItems()
 
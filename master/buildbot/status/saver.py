@@ -0,0 +1,117 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+from cPickle import dumps
+
+from twisted.internet import reactor
+from twisted.python import log, runtime, threadable
+from buildbot.util import writebehind
+
+class StatusSaver(writebehind.WriteBehindService):
+    """
+    A service which saves status objects (L{BuildStatus} and
+    L{BuilderStatus}) to their pickles from a dedicated thread.  Saves made
+    in the same reactor turn, or while a batch is being written, are
+    coalesced: each object is pickled once, on the reactor, since the
+    objects it refers to may be changing, and only the writing is done by
+    the thread.  Each pickle is written to a temporary file, synced to disk,
+    and renamed into place.
+
+    There is only one instance of this class, available at
+    C{master.statussaver}.
+    """
+
+    def __init__(self):
+        writebehind.WriteBehindService.__init__(self, 'statussaver')
+        # filename : (obj, description)
+        self.pending = {}
+
+    def save(self, obj, filename, description):
+        """
+        Save C{obj} to the pickle C{filename}.  C{description} is used in
+        the message logged if the save fails.  If called from another
+        thread, the save is passed to the reactor.
+        """
+        if threadable.ioThread is not None and not threadable.isInIOThread():
+            reactor.callFromThread(self.save, obj, filename, description)
+            return
+        if not self.running:
+            try:
+                self._write(filename, dumps(obj, -1))
+            except:
+                log.msg("unable to save %s" % description)
+                log.err()
+            return
+        self.pending[filename] = (obj, description)
+        self._scheduleFlush()
+
+    def getPending(self, filename):
+        """
+        Return the object waiting to be saved to C{filename}, or None.  The
+        pickle on disk is out of date until the object has been saved.
+        """
+        if filename in self.pending:
+            return self.pending[filename][0]
+        return None
+
+    # WriteBehindService methods
+
+    def _hasPending(self):
+        return bool(self.pending)
+
+    def _takeBatch(self):
+        # pickling a builder saves its running builds, so saves may be
+        # added while the batch is made; they are written in the next one.
+        # Objects stay pending until they have been written.
+        batch = []
+        for filename, entry in self.pending.items():
+            try:
+                data = dumps(entry[0], -1)
+            except:
+                log.err(None, "unable to save %s" % entry[1])
+                del self.pending[filename]
+                continue
+            batch.append((filename, entry, data))
+        return batch
+
+    def _writeItem(self, item):
+        filename, entry, data = item
+        self._write(filename, data)
+
+    def _batchDone(self, batch, results):
+        for (filename, entry, data), why in zip(batch, results):
+            # unless it was saved again meanwhile
+            if self.pending.get(filename) is entry:
+                del self.pending[filename]
+            if why:
+                log.err(why, "unable to save %s" % entry[1])
+
+    def _write(self, filename, data):
+        tmpfilename = filename + ".tmp"
+        with open(tmpfilename, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if runtime.platformType  == 'win32':
+            # windows cannot rename a file on top of an existing one, so
+            # fall back to delete-first. There are ways this can fail and
+            # lose the builder's history, so we avoid using it in the
+            # general (non-windows) case
+            if os.path.exists(filename):
+                os.unlink(filename)
+        os.rename(tmpfilename, filename)
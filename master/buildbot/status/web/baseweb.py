@@ -37,6 +37,7 @@ from buildbot.status.web.builder import BuildersResource
 from buildbot.status.web.buildstatus import BuildStatusStatusResource
 from buildbot.status.web.slaves import BuildSlavesResource
 from buildbot.status.web.status_json import JsonStatusResource
+from buildbot.status.web.events import EventStreamResource
 from buildbot.status.web.about import AboutBuildbot
 from buildbot.status.web.authz import Authz
 from buildbot.status.web.auth import AuthFailResource,AuthzFailResource, LoginResource, LogoutResource
@@ -90,6 +91,7 @@ class WebStatus(service.MultiService):
      /buildslaves/SLAVENAME : describe a single BuildSlave
      /one_line_per_build : summarize the last few builds, one line each
      /one_line_per_build/BUILDERNAME : same, but only for a single builder
+     /events : a stream of status events, as server-sent events
      /about : describe this buildmaster (Buildbot and support library versions)
      /change_hook[/DIALECT] : accepts changes from external sources, optionally
                               choosing the dialect that will be permitted
@@ -262,10 +264,11 @@ class WebStatus(service.MultiService):
         
     
         @type  provide_feeds: None or list
-        @param provide_feeds: If empty, provides atom, json, and rss feeds.
-                              Otherwise, a dictionary of strings of
+        @param provide_feeds: If empty, provides atom, events, json, and rss
+                              feeds.  Otherwise, a dictionary of strings of
                               the type of feeds provided.  Current
-                              possibilities are "atom", "json", and "rss"
+                              possibilities are "atom", "events", "json",
+                              and "rss"
         """
 
         service.MultiService.__init__(self)
@@ -340,7 +343,7 @@ class WebStatus(service.MultiService):
 
         # Set default feeds
         if provide_feeds is None:
-            self.provide_feeds = ["atom", "json", "rss"]
+            self.provide_feeds = ["atom", "events", "json", "rss"]
         else:
             self.provide_feeds = provide_feeds
 
@@ -474,6 +477,8 @@ class WebStatus(service.MultiService):
             root.putChild("atom", Atom10StatusResource(status))
         if "json" in self.provide_feeds:
             root.putChild("json", JsonStatusResource(status))
+        if "events" in self.provide_feeds:
+            root.putChild("events", EventStreamResource(status))
 
         self.site.resource = root
 
@@ -0,0 +1,405 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""Server-sent event stream of status changes."""
+
+from collections import deque
+from functools import wraps
+
+from zope.interface import implements
+from twisted.internet import reactor
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from twisted.web import http, resource, server
+
+from buildbot.status.base import StatusReceiverBase
+from buildbot.util import json
+
+# the events a client may subscribe to, with those sent when the client does
+# not ask for particular events
+BUILD_EVENTS = ['buildStarted', 'buildETAUpdate', 'buildFinished']
+STEP_UPDATE_EVENTS = ['stepTextChanged', 'stepText2Changed', 'stepETAUpdate']
+STEP_EVENTS = ['stepStarted'] + STEP_UPDATE_EVENTS + ['stepFinished']
+LOG_EVENTS = ['logStarted', 'logChunk', 'logFinished']
+EVENTS = (['builderAdded', 'builderChangedState', 'builderRemoved']
+          + BUILD_EVENTS + STEP_EVENTS + LOG_EVENTS
+          + ['changeAdded', 'slaveConnected', 'slaveDisconnected'])
+DEFAULT_EVENTS = [ e for e in EVENTS if e != 'logChunk' ]
+
+# events of which only the latest for any one build or step is worth sending
+# to a client that has fallen behind
+COALESCED_EVENTS = ['builderChangedState', 'buildETAUpdate',
+                    'stepTextChanged', 'stepText2Changed', 'stepETAUpdate']
+
+
+def _buildInfo(build):
+    return dict(builder=build.getBuilder().getName(),
+                number=build.getNumber())
+
+def _stepInfo(build, step):
+    info = _buildInfo(build)
+    info['step'] = step.getName()
+    return info
+
+def _logInfo(build, step, loog):
+    info = _stepInfo(build, step)
+    info['log'] = loog.getName()
+    return info
+
+def _decode(value):
+    # log and step text is not necessarily UTF-8, which json requires
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (list, tuple)):
+        return [ _decode(v) for v in value ]
+    if isinstance(value, dict):
+        return dict([ (_decode(k), _decode(v))
+                      for k, v in value.iteritems() ])
+    return value
+
+def _guarded(method):
+    # status receivers are called by the build itself, so a failure to send
+    # an event is logged rather than raised into the build
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except:
+            log.err(None, "while sending '%s' to an event stream"
+                          % method.__name__)
+    return wrapper
+
+
+class EventStream(StatusReceiverBase):
+    """
+    A status receiver which writes the events it is given to a single HTTP
+    request, in the text/event-stream format.  Only the builders, categories
+    and events the client asked for are subscribed to.
+
+    The stream is a push producer for the request, so when the client falls
+    behind, events are queued rather than written.  At most C{maxBuffered}
+    events are queued: a queued event which a newer one supersedes (an ETA
+    or text update for the same builder, build or step) is replaced, and
+    otherwise the oldest event is dropped.  The client is told how many
+    events were dropped with a C{dropped} event.
+    """
+    implements(IPushProducer)
+
+    _reactor = reactor # seam for tests to use t.i.t.Clock
+
+    ETAInterval = 10
+
+    def __init__(self, status, request, builders=None, categories=None,
+                 events=None, maxBuffered=1000, keepaliveInterval=30):
+        self.status = status
+        self.request = request
+        self.builderNames = builders
+        self.categories = categories
+        if events is None:
+            events = DEFAULT_EVENTS
+        self.events = set(events)
+        self.maxBuffered = maxBuffered
+        self.keepaliveInterval = keepaliveInterval
+
+        self.paused = False
+        self.stopped = False
+        self.queue = deque()
+        # coalescing key -> queued item, for COALESCED_EVENTS
+        self.pending = {}
+        self.dropped = 0
+        self.keepalive = None
+
+        # the status objects this stream is subscribed to
+        self.builders = {}
+        self.builds = set()
+        self.steps = set()
+        self.logs = set()
+
+    def start(self):
+        request = self.request
+        request.setHeader("content-type", "text/event-stream")
+        request.setHeader("cache-control", "no-cache")
+        request.setHeader("Access-Control-Allow-Origin", "*")
+        request.write(": buildbot status events\n\n")
+        request.registerProducer(self, True)
+        request.notifyFinish().addBoth(lambda _ : self.stop())
+        self.status.subscribe(self)
+        self._scheduleKeepalive()
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.keepalive is not None and self.keepalive.active():
+            self.keepalive.cancel()
+        self.keepalive = None
+        try:
+            self.status.unsubscribe(self)
+        except ValueError:
+            pass
+        for builder in self.builders.values():
+            try:
+                builder.unsubscribe(self)
+            except ValueError:
+                pass
+        for watched in self.builds | self.steps | self.logs:
+            watched.unsubscribe(self)
+        self.builders = {}
+        self.builds = set()
+        self.steps = set()
+        self.logs = set()
+        self.queue.clear()
+        self.pending = {}
+
+    # IPushProducer
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self._flush()
+
+    def stopProducing(self):
+        self.stop()
+
+    # writing
+
+    @_guarded
+    def emit(self, event, info):
+        if self.stopped or event not in self.events:
+            return
+        info = _decode(info)
+        if not self.paused and not self.queue:
+            self._write(event, info)
+            return
+
+        key = None
+        if event in COALESCED_EVENTS:
+            key = (event, info.get('builder'), info.get('number'),
+                   info.get('step'))
+            if key in self.pending:
+                self.pending[key][2] = info
+                return
+        if len(self.queue) >= self.maxBuffered:
+            oldest = self.queue.popleft()
+            if oldest[0] is not None:
+                del self.pending[oldest[0]]
+            self.dropped += 1
+        item = [key, event, info]
+        self.queue.append(item)
+        if key is not None:
+            self.pending[key] = item
+
+    def _flush(self):
+        while self.queue and not self.paused and not self.stopped:
+            if self.dropped:
+                self._write('dropped', dict(count=self.dropped))
+                self.dropped = 0
+                continue
+            key, event, info = self.queue.popleft()
+            if key is not None:
+                del self.pending[key]
+            self._write(event, info)
+
+    @_guarded
+    def _write(self, event, info):
+        self.request.write("event: %s\ndata: %s\n\n"
+                           % (event, json.dumps(info, sort_keys=True)))
+
+    def _scheduleKeepalive(self):
+        if self.keepaliveInterval:
+            self.keepalive = self._reactor.callLater(self.keepaliveInterval,
+                                                     self._sendKeepalive)
+
+    def _sendKeepalive(self):
+        # a comment, so that proxies do not time out an idle stream
+        if not self.paused and not self.queue:
+            self.request.write(": keepalive\n\n")
+        self._scheduleKeepalive()
+
+    # subscription
+
+    def _wantsBuilder(self, builderName, builder):
+        if self.builderNames is not None \
+                and builderName not in self.builderNames:
+            return False
+        if self.categories is not None \
+                and builder.getCategory() not in self.categories:
+            return False
+        return True
+
+    def _wantsAny(self, events):
+        for event in events:
+            if event in self.events:
+                return True
+        return False
+
+    def _watchBuild(self, build):
+        self.builds.add(build)
+        build.waitUntilFinished().addCallback(self.builds.discard)
+
+    # IStatusReceiver
+
+    @_guarded
+    def builderAdded(self, builderName, builder):
+        if not self._wantsBuilder(builderName, builder):
+            return None
+        self.builders[builderName] = builder
+        self.emit('builderAdded', dict(builder=builderName,
+                                       category=builder.getCategory()))
+        # catch up on the builds already running
+        if self._wantsAny(STEP_EVENTS + LOG_EVENTS):
+            for build in builder.getCurrentBuilds():
+                build.subscribe(self)
+                self._watchBuild(build)
+        return self
+
+    @_guarded
+    def builderChangedState(self, builderName, state):
+        self.emit('builderChangedState', dict(builder=builderName,
+                                              state=state))
+
+    @_guarded
+    def builderRemoved(self, builderName):
+        if self.builders.pop(builderName, None) is not None:
+            self.emit('builderRemoved', dict(builder=builderName))
+
+    @_guarded
+    def buildStarted(self, builderName, build):
+        self.emit('buildStarted', _buildInfo(build))
+        if not self._wantsAny(STEP_EVENTS + LOG_EVENTS + ['buildETAUpdate']):
+            return None
+        self._watchBuild(build)
+        if 'buildETAUpdate' in self.events:
+            return (self, self.ETAInterval)
+        return self
+
+    @_guarded
+    def buildETAUpdate(self, build, ETA):
+        info = _buildInfo(build)
+        info['eta'] = ETA
+        self.emit('buildETAUpdate', info)
+
+    @_guarded
+    def buildFinished(self, builderName, build, results):
+        info = _buildInfo(build)
+        info['results'] = results
+        info['text'] = build.getText()
+        self.emit('buildFinished', info)
+
+    @_guarded
+    def stepStarted(self, build, step):
+        self.emit('stepStarted', _stepInfo(build, step))
+        if not self._wantsAny(STEP_UPDATE_EVENTS + LOG_EVENTS):
+            return None
+        self.steps.add(step)
+        return self
+
+    @_guarded
+    def stepTextChanged(self, build, step, text):
+        info = _stepInfo(build, step)
+        info['text'] = text
+        self.emit('stepTextChanged', info)
+
+    @_guarded
+    def stepText2Changed(self, build, step, text2):
+        info = _stepInfo(build, step)
+        info['text2'] = text2
+        self.emit('stepText2Changed', info)
+
+    @_guarded
+    def stepETAUpdate(self, build, step, ETA, expectations):
+        info = _stepInfo(build, step)
+        info['eta'] = ETA
+        self.emit('stepETAUpdate', info)
+
+    @_guarded
+    def stepFinished(self, build, step, results):
+        self.steps.discard(step)
+        info = _stepInfo(build, step)
+        info['results'], info['text'] = results
+        self.emit('stepFinished', info)
+
+    @_guarded
+    def logStarted(self, build, step, loog):
+        self.emit('logStarted', _logInfo(build, step, loog))
+        if 'logChunk' not in self.events:
+            return None
+        self.logs.add(loog)
+        return self
+
+    @_guarded
+    def logChunk(self, build, step, loog, channel, text):
+        info = _logInfo(build, step, loog)
+        info['channel'] = channel
+        info['text'] = text
+        self.emit('logChunk', info)
+
+    @_guarded
+    def logFinished(self, build, step, loog):
+        self.logs.discard(loog)
+        self.emit('logFinished', _logInfo(build, step, loog))
+
+    @_guarded
+    def changeAdded(self, change):
+        self.emit('changeAdded', change.asDict())
+
+    @_guarded
+    def slaveConnected(self, slaveName):
+        self.emit('slaveConnected', dict(slave=slaveName))
+
+    @_guarded
+    def slaveDisconnected(self, slaveName):
+        self.emit('slaveDisconnected', dict(slave=slaveName))
+
+
+# /events
+#
+# A long-lived text/event-stream response carrying status events as JSON.
+# The following arguments, each of which may be repeated, limit the events
+# sent:
+#   ?builder=NAME     only events of the named builders
+#   ?category=NAME    only events of builders in the category
+#   ?event=TYPE       only events of this type (see EVENTS); logChunk is
+#                     only sent when asked for
+class EventStreamResource(resource.Resource):
+    isLeaf = True
+
+    # events queued for a client which has fallen behind
+    maxBuffered = 1000
+    # seconds between keepalive comments on an idle stream
+    keepaliveInterval = 30
+
+    def __init__(self, status):
+        resource.Resource.__init__(self)
+        self.status = status
+
+    def render_GET(self, request):
+        events = request.args.get('event')
+        if events is not None:
+            unknown = [ e for e in events if e not in EVENTS ]
+            if unknown:
+                request.setResponseCode(http.BAD_REQUEST)
+                request.setHeader("content-type", "text/plain")
+                return "unknown event type(s): %s\n" % ", ".join(unknown)
+        stream = EventStream(self.status, request,
+                             builders=request.args.get('builder'),
+                             categories=request.args.get('category'),
+                             events=events,
+                             maxBuffered=self.maxBuffered,
+                             keepaliveInterval=self.keepaliveInterval)
+        stream.start()
+        return server.NOT_DONE_YET
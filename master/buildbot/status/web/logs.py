@@ -17,7 +17,7 @@
 from zope.interface import implements
 from twisted.python import components
 from twisted.spread import pb
-from twisted.web import server
+from twisted.web import server, http
 from twisted.web.resource import Resource
 from twisted.web.error import NoResource
 
@@ -48,7 +48,38 @@ class ChunkConsumer:
         self.textlog.finished()
 
 
+def _parseRange(spec):
+    """
+    Parse a range specification of the form 'a-b' (inclusive), 'a-', or '-n'
+    (the last n items) into a tuple (first, last), where either element may
+    be None.
+
+    @raises ValueError: if the specification is malformed
+    """
+    first, last = [ part.strip() for part in spec.split('-', 1) ]
+    first = int(first) if first else None
+    last = int(last) if last else None
+    if first is None and last is None:
+        raise ValueError("empty range")
+    if (first is not None and first < 0) or (last is not None and last < 0):
+        raise ValueError("negative range")
+    if first is not None and last is not None and last < first:
+        raise ValueError("backward range")
+    return first, last
+
+
 # /builders/$builder/builds/$buildnum/steps/$stepname/logs/$logname
+#
+# In addition to the whole log, the following parts may be requested, with
+# lines and bytes counted from zero within the text that is displayed (which
+# excludes headers in text mode):
+#   ?tail=N       the last N lines
+#   ?lines=A-B    lines A through B; 'A-' continues to the end
+#   ?bytes=A-B    bytes A through B; 'A-' continues to the end, '-N' gives the
+#                 last N bytes
+#   ?offset=N     everything from byte N onward, including any output that
+#                 arrives while the log is still being written
+# In text mode, an HTTP Range header for a single byte range is honored, too.
 class TextLog(Resource):
     # a new instance of this Resource is created for each client who views
     # it, so we can afford to track the request in the Resource.
@@ -99,10 +130,80 @@ class TextLog(Resource):
         req.setHeader("content-length", self.original.length)
         return ''
 
+    def _getChannels(self):
+        if self.asText:
+            return [logfile.STDOUT, logfile.STDERR]
+        return range(len(logfile.ChunkTypes))
+
+    def _getPart(self, req):
+        # return the chunks for the part of the log requested by req, or None
+        # if the whole log was requested.  This may set the response code.
+        channels = self._getChannels()
+        log = self.original
+
+        if 'tail' in req.args:
+            return log.getTailChunks(int(req.args['tail'][0]), channels)
+
+        if 'lines' in req.args:
+            first, last = _parseRange(req.args['lines'][0])
+            if first is None:
+                return log.getTailChunks(last, channels)
+            limit = None
+            if last is not None:
+                limit = last + 1 - first
+            return log.getChunksFrom(channels, line=first, limit=limit)
+
+        partial = False
+        if 'bytes' in req.args:
+            spec = req.args['bytes'][0]
+        else:
+            spec = req.getHeader('range')
+            if not self.asText or not spec or not spec.startswith('bytes='):
+                return None
+            spec = spec[len('bytes='):]
+            if ',' in spec:
+                # multiple ranges are not supported; send everything
+                return None
+            partial = True
+        try:
+            first, last = _parseRange(spec)
+        except ValueError:
+            if partial:
+                # an invalid Range header is ignored
+                return None
+            raise
+
+        size = log.getByteCount(channels)
+        if first is None:
+            first = max(0, size - last)
+            last = None
+        if last is None or last >= size:
+            last = size - 1
+        if partial:
+            if first >= size:
+                req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                req.setHeader("content-range", "bytes */%d" % size)
+                return []
+            req.setResponseCode(http.PARTIAL_CONTENT)
+            req.setHeader("content-range",
+                          "bytes %d-%d/%d" % (first, last, size))
+            req.setHeader("content-length", last + 1 - first)
+        return log.getChunksFrom(channels, offset=first,
+                                 limit=max(0, last + 1 - first))
+
     def render_GET(self, req):
         self._setContentType(req)
         self.req = req
 
+        try:
+            part = self._getPart(req)
+            offset = int(req.args.get('offset', [0])[0])
+        except ValueError, e:
+            req.setResponseCode(http.BAD_REQUEST)
+            req.setHeader("content-type", "text/plain")
+            self.req = None
+            return "invalid log range: %s\n" % (e,)
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")                
             
@@ -113,7 +214,16 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
-        self.original.subscribeConsumer(ChunkConsumer(req, self))
+        if part is not None:
+            data = self.content(part)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            req.write(data)
+            self.finished()
+            return server.NOT_DONE_YET
+
+        self.original.subscribeConsumer(ChunkConsumer(req, self),
+                                        self._getChannels(), offset)
         return server.NOT_DONE_YET
 
     def _setContentType(self, req):
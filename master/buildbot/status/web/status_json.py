@@ -17,14 +17,19 @@
 """Simple JSON exporter."""
 
 import datetime
-import os
 import re
 
+try:
+    from hashlib import md5
+    md5 = md5 # make pyflakes happy
+except ImportError:
+    from md5 import new as md5
+
 from twisted.internet import defer
-from twisted.web import html, resource, server
+from twisted.web import html, http, resource, server
 
 from buildbot.status.web.base import HtmlResource
-from buildbot.util import json
+from buildbot.util import json, lru
 
 
 _IS_INT = re.compile('^[-+]?\d+$')
@@ -120,6 +125,14 @@ def FilterOut(data):
         return data
 
 
+def etagMatches(if_none_match, etag):
+    """Returns True if an If-None-Match header value lists etag."""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
 class JsonResource(resource.Resource):
     """Base class for json data."""
 
@@ -128,12 +141,16 @@ class JsonResource(resource.Resource):
     help = None
     pageTitle = None
     level = 0
+    # number of serialized variants (select, filter, compact) of a cacheable
+    # resource to keep
+    jsonCacheSize = 4
 
     def __init__(self, status):
         """Adds transparent lazy-child initialization."""
         resource.Resource.__init__(self)
         # buildbot.status.builder.Status
         self.status = status
+        self.jsonCache = {}
         if self.help:
             pageTitle = ''
             if self.pageTitle:
@@ -152,6 +169,11 @@ class JsonResource(resource.Resource):
 
     def putChild(self, name, res):
         """Adds the resource's level for help links generation."""
+        self.fixChildLevel(res)
+        resource.Resource.putChild(self, name, res)
+
+    def fixChildLevel(self, res):
+        """Sets the level of a child resource and of its own children."""
 
         def RecurseFix(res, level):
             res.level = level + 1
@@ -159,7 +181,11 @@ class JsonResource(resource.Resource):
                 RecurseFix(c, res.level)
 
         RecurseFix(res, self.level)
-        resource.Resource.putChild(self, name, res)
+
+    def isCacheable(self):
+        """Whether the json data can no longer change, so that its
+        serialization can be kept.  Only true of finished builds and steps."""
+        return False
 
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
@@ -168,6 +194,10 @@ class JsonResource(resource.Resource):
             if isinstance(data, unicode):
                 data = data.encode("utf-8")
             request.setHeader("Access-Control-Allow-Origin", "*")
+            # Let pollers revalidate with If-None-Match rather than fetch the
+            # same data again.
+            etag = '"%s"' % md5(data).hexdigest()
+            request.setHeader("ETag", etag)
             if RequestArgToBool(request, 'as_text', False):
                 request.setHeader("content-type", 'text/plain')
             else:
@@ -181,6 +211,9 @@ class JsonResource(resource.Resource):
                 request.setHeader("Expires",
                                 expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
                 request.setHeader("Pragma", "no-cache")
+            if etagMatches(request.getHeader("if-none-match"), etag):
+                request.setResponseCode(http.NOT_MODIFIED)
+                return ''
             return data
         d.addCallback(handle)
         def ok(data):
@@ -202,6 +235,29 @@ class JsonResource(resource.Resource):
         compact = RequestArgToBool(request, 'compact', not as_text)
         callback = request.args.get('callback')
 
+        cacheKey = None
+        if self.isCacheable():
+            cacheKey = (select and tuple(select), filter_out, compact)
+        if cacheKey in self.jsonCache:
+            data = self.jsonCache[cacheKey]
+            if select is not None:
+                del request.args['select']
+        else:
+            data = yield self.serialize(request, select, filter_out, compact)
+            if cacheKey is not None:
+                if len(self.jsonCache) >= self.jsonCacheSize:
+                    self.jsonCache.popitem()
+                self.jsonCache[cacheKey] = data
+        if callback:
+            # Only accept things that look like identifiers for now
+            callback = callback[0]
+            if re.match(r'^[a-zA-Z$][a-zA-Z$0-9.]*$', callback):
+                data = '%s(%s);' % (callback, data)
+        defer.returnValue(data)
+
+    @defer.inlineCallbacks
+    def serialize(self, request, select, filter_out, compact):
+        """Renders the json dictionaries into a string."""
         # Implement filtering at global level and every child.
         if select is not None:
             del request.args['select']
@@ -249,11 +305,6 @@ class JsonResource(resource.Resource):
             data = json.dumps(data, sort_keys=True, separators=(',',':'))
         else:
             data = json.dumps(data, sort_keys=True, indent=2)
-        if callback:
-            # Only accept things that look like identifiers for now
-            callback = callback[0]
-            if re.match(r'^[a-zA-Z$][a-zA-Z$0-9.]*$', callback):
-                data = '%s(%s);' % (callback, data)
         defer.returnValue(data)
 
     @defer.inlineCallbacks
@@ -426,6 +477,9 @@ class BuildJsonResource(JsonResource):
                                               build_status.getSourceStamp()))
         self.putChild('steps', BuildStepsJsonResource(status, build_status))
 
+    def isCacheable(self):
+        return self.build_status.isFinished()
+
     def asDict(self, request):
         return self.build_status.asDict()
 
@@ -438,22 +492,32 @@ class AllBuildsJsonResource(JsonResource):
     def __init__(self, status, builder_status):
         JsonResource.__init__(self, status)
         self.builder_status = builder_status
+        # Build resources are kept in an LRU cache the size of the build
+        # cache, rather than as children, so that they do not pin every build
+        # ever requested.
+        self.buildResources = lru.LRUCache(self._makeBuildResource)
+
+    def _makeBuildResource(self, number, build_status):
+        child = BuildJsonResource(self.status, build_status)
+        self.fixChildLevel(child)
+        return child
 
     def getChild(self, path, request):
         # Dynamic childs.
         if isinstance(path, int) or _IS_INT.match(path):
             build_status = self.builder_status.getBuild(int(path))
             if build_status:
-                build_status_number = str(build_status.getNumber())
-                # Happens with negative numbers.
-                child = self.children.get(build_status_number)
-                if child:
-                    return child
-                # Create it on-demand.
-                child = BuildJsonResource(self.status, build_status)
-                # Cache it. Never cache negative numbers.
-                # TODO(maruel): Cleanup the cache once it's too heavy!
-                self.putChild(build_status_number, child)
+                cache_size = self.builder_status.master.config.caches['Builds']
+                self.buildResources.set_max_size(cache_size)
+                # Negative numbers are cached under the build's own number.
+                child = self.buildResources.get(build_status.getNumber(),
+                                                build_status=build_status)
+                # A build resource made before the build was loaded again
+                # would serve a stale BuildStatus.
+                if child.build_status is not build_status:
+                    child = self._makeBuildResource(build_status.getNumber(),
+                                                    build_status)
+                    self.buildResources.put(build_status.getNumber(), child)
                 return child
         return JsonResource.getChild(self, path, request)
 
@@ -487,12 +551,9 @@ class BuildsJsonResource(AllBuildsJsonResource):
         # This would load all the pickles and is way too heavy, especially that
         # it would trash the cache:
         # self.children['builds'].asDict(request)
-        # TODO(maruel) This list should also need to be cached but how?
-        builds = dict([
-            (int(file), None)
-            for file in os.listdir(self.builder_status.basedir)
-            if _IS_INT.match(file)
-        ])
+        manifest = self.builder_status.getBuildManifest()
+        builds = dict([ (number, None)
+                        for number in manifest.getBuildNumbers() ])
         return builds
 
 
@@ -507,6 +568,9 @@ class BuildStepJsonResource(JsonResource):
         self.build_step_status = build_step_status
         # TODO self.putChild('logs', LogsJsonResource())
 
+    def isCacheable(self):
+        return self.build_step_status.isFinished()
+
     def asDict(self, request):
         return self.build_step_status.asDict()
 
@@ -522,6 +586,9 @@ class BuildStepsJsonResource(JsonResource):
         # The build steps are constantly changing until the build is done so
         # keep a reference to build_status instead
 
+    def isCacheable(self):
+        return self.build_status.isFinished()
+
     def getChild(self, path, request):
         # Dynamic childs.
         build_step_status = None
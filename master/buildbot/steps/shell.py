@@ -367,6 +367,98 @@ class StringFileWriter(pb.Referenceable):
     def remote_close(self):
         pass
 
+class _SuppressionIndex(object):
+    """
+    The warning suppressions of a L{WarningCountingShellCommand}, grouped by
+    file pattern.  The suppressions that apply to a file are found once for
+    each file name, so a warning is only checked against those.
+    """
+
+    def __init__(self, suppressions):
+        self.anyFile = []
+        self.byFilePattern = {}
+        for fileRe, warnRe, start, end in suppressions:
+            entry = (warnRe, start, end)
+            if fileRe == None:
+                self.anyFile.append(entry)
+            else:
+                key = (fileRe.pattern, fileRe.flags)
+                self.byFilePattern.setdefault(key, (fileRe, []))[1].append(entry)
+        self.all = self.anyFile[:]
+        for fileRe, entries in self.byFilePattern.itervalues():
+            self.all.extend(entries)
+        self.fileCache = {}
+
+    def forFile(self, file):
+        if file == None:
+            return self.all
+        try:
+            return self.fileCache[file]
+        except KeyError:
+            pass
+        entries = self.anyFile[:]
+        for fileRe, fileEntries in self.byFilePattern.itervalues():
+            if fileRe.match(file):
+                entries.extend(fileEntries)
+        self.fileCache[file] = entries
+        return entries
+
+    def isSuppressed(self, file, lineNo, text):
+        for warnRe, start, end in self.forFile(file):
+            if not (warnRe == None or warnRe.search(text)):
+                continue
+            if not ((start == None and end == None) or
+                    (lineNo != None and start <= lineNo and end >= lineNo)):
+                continue
+            return True
+        return False
+
+class _WarningLineObserver(buildstep.LogObserver):
+    """
+    Split the stdout and stderr of a log into lines as they arrive, and pass
+    them to C{lineReceived}.  Unlike L{buildstep.LogLineObserver}, both
+    channels share a line buffer and long lines are kept, so the lines are
+    exactly those of the log text split at each newline.  If C{lineReceived}
+    fails, the remaining output is ignored, and L{finish} raises the error.
+    """
+
+    def __init__(self, lineReceived):
+        self.lineReceived = lineReceived
+        self.partial = []
+        self.failure = None
+
+    def outReceived(self, data):
+        if self.failure:
+            return
+        lines = data.split("\n")
+        if len(lines) > 1:
+            self.partial.append(lines[0])
+            lines[0] = "".join(self.partial)
+            self.partial = [ lines.pop() ]
+            try:
+                for line in lines:
+                    self.lineReceived(line)
+            except:
+                self.failure = failure.Failure()
+        else:
+            self.partial.append(data)
+
+    errReceived = outReceived
+
+    def finish(self):
+        """
+        Pass the text after the last newline, which is a line too.
+        """
+        if not self.failure:
+            line = "".join(self.partial)
+            self.partial = []
+            try:
+                self.lineReceived(line)
+            except:
+                self.failure = failure.Failure()
+        if self.failure:
+            self.failure.raiseException()
+
 class WarningCountingShellCommand(ShellCommand):
     renderables = [ 'suppressionFile' ]
 
@@ -413,6 +505,9 @@ class WarningCountingShellCommand(ShellCommand):
                                  suppressionFile=suppressionFile)
         self.suppressions = []
         self.directoryStack = []
+        self._warningLines = []
+        self._suppressionIndex = None
+        self._warningObserver = None
 
     def addSuppression(self, suppressionList):
         """
@@ -441,6 +536,7 @@ class WarningCountingShellCommand(ShellCommand):
             if warnRe != None and isinstance(warnRe, basestring):
                 warnRe = re.compile(warnRe)
             self.suppressions.append((fileRe, warnRe, start, end))
+        self._suppressionIndex = None
 
     def warnExtractWholeLine(self, line, match):
         """
@@ -470,14 +566,9 @@ class WarningCountingShellCommand(ShellCommand):
                     file = "%s/%s" % (currentDirectory, file)
 
             # Skip adding the warning if any suppression matches.
-            for fileRe, warnRe, start, end in self.suppressions:
-                if not (file == None or fileRe == None or fileRe.match(file)):
-                    continue
-                if not (warnRe == None or warnRe.search(text)):
-                    continue
-                if not ((start == None and end == None) or
-                        (lineNo != None and start <= lineNo and end >= lineNo)):
-                    continue
+            if self._suppressionIndex is None:
+                self._suppressionIndex = _SuppressionIndex(self.suppressions)
+            if self._suppressionIndex.isSuppressed(file, lineNo, text):
                 return
 
         warnings.append(line)
@@ -523,52 +614,73 @@ class WarningCountingShellCommand(ShellCommand):
         self.addSuppression(list)
         return ShellCommand.start(self)
 
+    def setupLogfiles(self, cmd, logfiles):
+        # match the output against the warning patterns as it arrives
+        self.startWarningScan()
+        self.addLogObserver('stdio', self._warningObserver)
+        ShellCommand.setupLogfiles(self, cmd, logfiles)
+
+    def startWarningScan(self):
+        """
+        Compile the warning and directory patterns, and prepare to match the
+        lines of the output against them."""
+
+        self.warnCount = 0
+        self._warningLines = []
+
+        self._warningRe = self.warningPattern
+        if isinstance(self._warningRe, basestring):
+            self._warningRe = re.compile(self._warningRe)
+
+        self._directoryEnterRe = self.directoryEnterPattern
+        if (self._directoryEnterRe != None
+                and isinstance(self._directoryEnterRe, basestring)):
+            self._directoryEnterRe = re.compile(self._directoryEnterRe)
+
+        self._directoryLeaveRe = self.directoryLeavePattern
+        if (self._directoryLeaveRe != None
+                and isinstance(self._directoryLeaveRe, basestring)):
+            self._directoryLeaveRe = re.compile(self._directoryLeaveRe)
+
+        self._warningObserver = _WarningLineObserver(self.warningLineReceived)
+
+    def warningLineReceived(self, line):
+        """
+        Match a line of output against warningPattern.  If it matches, bump
+        the warnings count and add the line to the collection of lines with
+        warnings."""
+
+        if self._directoryEnterRe:
+            match = self._directoryEnterRe.search(line)
+            if match:
+                self.directoryStack.append(match.group(1))
+                return
+        if (self._directoryLeaveRe and
+            self.directoryStack and
+            self._directoryLeaveRe.search(line)):
+                self.directoryStack.pop()
+                return
+
+        match = self._warningRe.match(line)
+        if match:
+            self.maybeAddWarning(self._warningLines, line, match)
+
     def createSummary(self, log):
         """
-        Match log lines against warningPattern.
+        Summarize the lines of the log that matched warningPattern.
 
         Warnings are collected into another log for this step, and the
         build-wide 'warnings-count' is updated."""
 
-        self.warnCount = 0
-
-        # Now compile a regular expression from whichever warning pattern we're
-        # using
-        wre = self.warningPattern
-        if isinstance(wre, str):
-            wre = re.compile(wre)
-
-        directoryEnterRe = self.directoryEnterPattern
-        if (directoryEnterRe != None
-                and isinstance(directoryEnterRe, basestring)):
-            directoryEnterRe = re.compile(directoryEnterRe)
-
-        directoryLeaveRe = self.directoryLeavePattern
-        if (directoryLeaveRe != None
-                and isinstance(directoryLeaveRe, basestring)):
-            directoryLeaveRe = re.compile(directoryLeaveRe)
-
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
-        warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                    continue
-            if (directoryLeaveRe and
-                self.directoryStack and
-                directoryLeaveRe.search(line)):
-                    self.directoryStack.pop()
-                    continue
-
-            match = wre.match(line)
-            if match:
-                self.maybeAddWarning(warnings, line, match)
+        if self._warningObserver is None:
+            # the output was not watched as it arrived, so scan it now
+            self.startWarningScan()
+            for text in log.getChunks([STDOUT, STDERR], onlyText=True):
+                self._warningObserver.outReceived(text)
+        observer, self._warningObserver = self._warningObserver, None
+        observer.finish()
+        warnings = self._warningLines
+        self._warningLines = []
 
         # If there were any warnings, make the log if lines with warnings
         # available
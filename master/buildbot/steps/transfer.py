@@ -16,15 +16,21 @@
 from __future__ import with_statement
 
 
-import os.path, tarfile, tempfile
+import os.path, tarfile, tempfile, threading
+from collections import deque
 try:
     from cStringIO import StringIO
     assert StringIO
 except ImportError:
     from StringIO import StringIO
-from twisted.internet import reactor
+try:
+    from hashlib import sha1
+    sha1 = sha1 # make pyflakes happy
+except ImportError:
+    from sha import new as sha1
+from twisted.internet import defer, reactor, threads
 from twisted.spread import pb
-from twisted.python import log
+from twisted.python import log, failure
 from buildbot.process import buildstep
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.buildstep import SUCCESS, FAILURE, SKIPPED
@@ -50,6 +56,8 @@ class _FileWriter(pb.Referenceable):
         fd, self.tmpname = tempfile.mkstemp(dir=dirname)
         self.fp = os.fdopen(fd, 'wb')
         self.remaining = maxsize
+        # checksum of the data sent, to compare with the slave's
+        self.checksum = sha1()
 
     def remote_write(self, data):
         """
@@ -59,6 +67,7 @@ class _FileWriter(pb.Referenceable):
         @type  data: C{string}
         @param data: String of data to write
         """
+        self.checksum.update(data)
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
@@ -70,12 +79,22 @@ class _FileWriter(pb.Referenceable):
     def remote_utime(self, accessed_modified):
         os.utime(self.destfile,accessed_modified)
 
-    def remote_close(self):
+    def remote_close(self, checksum=None):
         """
         Called by remote slave to state that no more data will be transfered
+
+        @type  checksum: C{string}
+        @param checksum: hex SHA1 digest of the data the slave sent; newer
+                         slaves send it, and if it does not match the data
+                         written, the file is discarded
         """
         self.fp.close()
         self.fp = None
+        if checksum is not None and checksum != self.checksum.hexdigest():
+            os.unlink(self.tmpname)
+            self.tmpname = None
+            raise ValueError("checksum mismatch uploading '%s'"
+                             % self.destfile)
         # on windows, os.rename does not automatically unlink, so do it manually
         if os.path.exists(self.destfile):
             os.unlink(self.destfile)
@@ -84,6 +103,18 @@ class _FileWriter(pb.Referenceable):
         if self.mode is not None:
             os.chmod(self.destfile, self.mode)
 
+    def remote_unchanged(self):
+        """
+        Called by remote slave instead of sending the file, when its digest
+        matches that of the existing L{destfile}
+        """
+        self.fp.close()
+        self.fp = None
+        os.unlink(self.tmpname)
+        self.tmpname = None
+        if self.mode is not None:
+            os.chmod(self.destfile, self.mode)
+
     def cancel(self):
         # unclean shutdown, the file is probably truncated, so delete it
         # altogether rather than deliver a corrupted file
@@ -130,46 +161,239 @@ def _extractall(self, path=".", members=None):
             else:
                 self._dbg(1, "tarfile: %s" % e)
 
-class _DirectoryWriter(_FileWriter):
+class _DirectoryWriter(pb.Referenceable):
     """
-    A DirectoryWriter is implemented as a FileWriter, with an added post-processing
-    step to unpack the archive, once the transfer has completed.
+    Helper class that unpacks a tar archive into a directory as the slave
+    sends it.  The archive is read from memory and extracted by a thread,
+    so it is never stored whole; at most C{maxBuffered} bytes of it wait
+    for the thread, beyond which writes are not acknowledged until it has
+    caught up.
+
+    The thread is started when the first block arrives.  It is a thread of
+    its own, rather than one from the reactor's pool, since it waits on the
+    slave for as long as the upload lasts.
     """
 
-    def __init__(self, destroot, maxsize, compress, mode):
+    maxBuffered = 1024*1024
+
+    def __init__(self, destroot, maxsize, compress):
         self.destroot = destroot
-        self.compress = compress
+        self.remaining = maxsize
+        if compress == 'bz2':
+            self.mode = 'r|bz2'
+        elif compress == 'gz':
+            self.mode = 'r|gz'
+        else:
+            self.mode = 'r|'
+
+        self.cond = threading.Condition()
+        self.chunks = deque()
+        self.buffered = 0
+        self.eof = False
+        self.cancelled = False
+        # Deferreds of writes waiting for the thread to catch up
+        self.drainWaiters = []
+
+        self.done = False
+        self.result = None
+        self.thread = None
+        # fires when the thread has stopped
+        self.extracted = defer.Deferred()
+        self.extracted.addBoth(self._extractDone)
 
-        self.fd, self.tarname = tempfile.mkstemp()
-        os.close(self.fd)
+    def remote_write(self, data):
+        """
+        Called from remote slave to write L{data} to the archive within
+        boundaries of L{maxsize}
 
-        _FileWriter.__init__(self, self.tarname, maxsize, mode)
+        @type  data: C{string}
+        @param data: String of data to write
+        """
+        if self.remaining is not None:
+            if len(data) > self.remaining:
+                data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+        if self.done:
+            # the thread has stopped reading; unpack reports why
+            return
+        self._startThread()
+        self.cond.acquire()
+        try:
+            self.chunks.append(data)
+            self.buffered += len(data)
+            self.cond.notify()
+            full = self.buffered > self.maxBuffered
+        finally:
+            self.cond.release()
+        if full:
+            d = defer.Deferred()
+            self.drainWaiters.append(d)
+            return d
 
     def remote_unpack(self):
         """
-        Called by remote slave to state that no more data will be transfered
+        Called by remote slave to state that no more data will be
+        transfered; fires when the archive has been unpacked
         """
-        # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
-
-        # Map configured compression to a TarFile setting
-        if self.compress == 'bz2':
-            mode='r|bz2'
-        elif self.compress == 'gz':
-            mode='r|gz'
+        self._startThread()
+        self.cond.acquire()
+        try:
+            self.eof = True
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        d = defer.Deferred()
+        def fire(_):
+            if isinstance(self.result, failure.Failure):
+                d.errback(self.result)
+            else:
+                d.callback(None)
+        self.extracted.addCallback(fire)
+        return d
+
+    def cancel(self):
+        # unclean shutdown; stop the thread, leaving whatever it has
+        # already unpacked
+        self.cond.acquire()
+        try:
+            self.cancelled = True
+            self.chunks.clear()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        if self.thread is None and not self.done:
+            # nothing was sent, so there is no thread to report it
+            self.extracted.errback(failure.Failure(
+                IOError("upload to '%s' cancelled" % self.destroot)))
+
+    def read(self, size):
+        # called by tarfile, in the thread
+        self.cond.acquire()
+        try:
+            while not self.chunks and not self.eof and not self.cancelled:
+                self.cond.wait()
+            if self.cancelled:
+                raise IOError("upload to '%s' cancelled" % self.destroot)
+            pieces = []
+            while self.chunks and size > 0:
+                chunk = self.chunks.popleft()
+                if len(chunk) > size:
+                    self.chunks.appendleft(chunk[size:])
+                    chunk = chunk[:size]
+                pieces.append(chunk)
+                size -= len(chunk)
+            data = ''.join(pieces)
+            before = self.buffered
+            self.buffered -= len(data)
+            # wake the writers once half of the backlog has been read
+            drained = self.buffered <= self.maxBuffered // 2 < before
+        finally:
+            self.cond.release()
+        if drained:
+            reactor.callFromThread(self._drained)
+        return data
+
+    def _startThread(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run,
+                name="DirectoryUpload to '%s'" % self.destroot)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run(self):
+        # this runs in the thread
+        try:
+            self._extract()
+        except:
+            reactor.callFromThread(self.extracted.errback, failure.Failure())
         else:
-            mode = 'r'
+            reactor.callFromThread(self.extracted.callback, None)
 
+    def _extract(self):
+        # this runs in a thread
         # Support old python
         if not hasattr(tarfile.TarFile, 'extractall'):
             tarfile.TarFile.extractall = _extractall
 
-        # Unpack archive and clean up after self
-        archive = tarfile.open(name=self.tarname, mode=mode)
+        archive = tarfile.open(mode=self.mode, fileobj=self)
         archive.extractall(path=self.destroot)
         archive.close()
-        os.remove(self.tarname)
 
+    def _extractDone(self, res):
+        self.done = True
+        self.result = res
+        self.cond.acquire()
+        try:
+            self.chunks.clear()
+            self.buffered = 0
+        finally:
+            self.cond.release()
+        self._drained()
+
+    def _drained(self):
+        waiters = self.drainWaiters
+        self.drainWaiters = []
+        for d in waiters:
+            d.callback(None)
+
+
+# digests of files on the master, by (path, size, mtime), or a list of the
+# Deferreds waiting for a digest that is being computed
+_digests = {}
+_maxDigests = 100
+
+def _computeDigest(path):
+    # this runs in a thread
+    digest = sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(64*1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+def fileDigest(path):
+    """
+    Get the hex SHA1 digest of the file at C{path}, which is read in a
+    thread.  Digests are remembered until the file's size or modification
+    time changes, so that a file sent to many slaves is only read once.
+
+    @returns: Deferred firing with the digest, or None if the file cannot be
+    read
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return defer.succeed(None)
+    key = (path, st.st_size, st.st_mtime)
+    digest = _digests.get(key)
+    if isinstance(digest, list):
+        d = defer.Deferred()
+        digest.append(d)
+        return d
+    elif digest is not None:
+        return defer.succeed(digest)
+
+    waiters = _digests[key] = []
+    d = threads.deferToThread(_computeDigest, path)
+    def done(digest):
+        if isinstance(digest, failure.Failure):
+            log.err(digest, "while computing the digest of %s" % path)
+            del _digests[key]
+            digest = None
+        else:
+            if len(_digests) > _maxDigests:
+                for k, v in _digests.items():
+                    if not isinstance(v, list):
+                        del _digests[k]
+            _digests[key] = digest
+        for w in waiters:
+            w.callback(digest)
+        return digest
+    d.addBoth(done)
+    return d
 
 def makeStatusRemoteCommand(step, remote_command, args):
     self = buildstep.RemoteCommand(remote_command, args)
@@ -200,6 +424,24 @@ class _TransferBuildStep(BuildStep):
             workdir = self.workdir
         return workdir
 
+    def _addWindow(self, args, command):
+        # slaves since 2.16 keep up to 'window' blocks in flight, rather than
+        # waiting for each to be acknowledged, and verify a checksum
+        if self.window and not self.slaveVersionIsOlderThan(command, "2.16"):
+            args['window'] = self.window
+
+    def _addDigest(self, args, command, path):
+        # slaves since 2.17 accept the digest of the master's copy of the
+        # file, and skip the transfer if they already have the content
+        if self.slaveVersionIsOlderThan(command, "2.17"):
+            return defer.succeed(None)
+        d = fileDigest(path)
+        def add(digest):
+            if digest is not None:
+                args['digest'] = digest
+        d.addCallback(add)
+        return d
+
     def interrupt(self, reason):
         self.addCompleteLog('interrupt', str(reason))
         if self.cmd:
@@ -226,7 +468,7 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 keepstamp=False, url=None,
+                 keepstamp=False, url=None, window=8, skipUnchanged=False,
                  **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(slavesrc=slavesrc,
@@ -237,6 +479,8 @@ class FileUpload(_TransferBuildStep):
                                  mode=mode,
                                  keepstamp=keepstamp,
                                  url=url,
+                                 window=window,
+                                 skipUnchanged=skipUnchanged,
                                  )
 
         self.slavesrc = slavesrc
@@ -244,12 +488,14 @@ class FileUpload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
         self.keepstamp = keepstamp
         self.url = url
+        self.skipUnchanged = skipUnchanged
 
     def start(self):
         version = self.slaveVersion("uploadFile")
@@ -289,9 +535,16 @@ class FileUpload(_TransferBuildStep):
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
             }
+        self._addWindow(args, 'uploadFile')
 
-        self.cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
-        d = self.runCommand(self.cmd)
+        if self.skipUnchanged:
+            d = self._addDigest(args, 'uploadFile', masterdest)
+        else:
+            d = defer.succeed(None)
+        def run(_):
+            self.cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
+            return self.runCommand(self.cmd)
+        d.addCallback(run)
         @d.addErrback
         def cancel(res):
             fileWriter.cancel()
@@ -351,7 +604,7 @@ class DirectoryUpload(_TransferBuildStep):
             self.addURL(os.path.basename(masterdest), self.url)
         
         # we use maxsize to limit the amount of data on both sides
-        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress, 0600)
+        dirWriter = _DirectoryWriter(masterdest, self.maxsize, self.compress)
 
         # default arguments
         args = {
@@ -365,8 +618,9 @@ class DirectoryUpload(_TransferBuildStep):
 
         self.cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runCommand(self.cmd)
-        @d.addErrback
+        @d.addBoth
         def cancel(res):
+            # if the archive was not completely sent, stop unpacking it
             dirWriter.cancel()
             return res
         d.addCallback(self.finished).addErrback(self.failed)
@@ -392,6 +646,8 @@ class _FileReader(pb.Referenceable):
 
     def __init__(self, fp):
         self.fp = fp
+        # checksum of the data read, for the slave to compare with its own
+        self.checksum = sha1()
 
     def remote_read(self, maxlength):
         """
@@ -407,15 +663,19 @@ class _FileReader(pb.Referenceable):
             return ''
 
         data = self.fp.read(maxlength)
+        self.checksum.update(data)
         return data
 
     def remote_close(self):
         """
         Called by remote slave to state that no more data will be transfered
+
+        @return: hex SHA1 digest of the data read
         """
         if self.fp is not None:
             self.fp.close()
             self.fp = None
+        return self.checksum.hexdigest()
 
 
 class FileDownload(_TransferBuildStep):
@@ -426,7 +686,7 @@ class FileDownload(_TransferBuildStep):
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=8, cache=False, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(mastersrc=mastersrc,
                                  slavedest=slavedest,
@@ -434,6 +694,8 @@ class FileDownload(_TransferBuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  mode=mode,
+                                 window=window,
+                                 cache=cache,
                                  )
 
         self.mastersrc = mastersrc
@@ -441,10 +703,12 @@ class FileDownload(_TransferBuildStep):
         self.workdir = workdir
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
         self.mode = mode
+        self.cache = cache
 
     def start(self):
         version = self.slaveVersion("downloadFile")
@@ -484,9 +748,16 @@ class FileDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        self._addWindow(args, 'downloadFile')
 
-        self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runCommand(self.cmd)
+        if self.cache:
+            d = self._addDigest(args, 'downloadFile', source)
+        else:
+            d = defer.succeed(None)
+        def run(_):
+            self.cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
+            return self.runCommand(self.cmd)
+        d.addCallback(run)
         d.addCallback(self.finished).addErrback(self.failed)
 
 class StringDownload(_TransferBuildStep):
@@ -377,6 +377,10 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(changeid)
 
+    def addChanges(self, changes):
+        return defer.gatherResults([ self.addChange(**kwargs)
+                                     for kwargs in changes ])
+
     def getLatestChangeid(self):
         if self.changes:
             return defer.succeed(max(self.changes.iterkeys()))
@@ -406,6 +410,10 @@ class FakeChangesComponent(FakeDBComponent):
 
         return defer.succeed(chdict)
 
+    def getChanges(self, changeids):
+        return defer.gatherResults([ self.getChange(changeid)
+                                     for changeid in changeids ])
+
     def getChangeUids(self, changeid):
         try:
             ch_uids = [self.changes[changeid].uid]
@@ -413,7 +421,9 @@ class FakeChangesComponent(FakeDBComponent):
             ch_uids = []
         return defer.succeed(ch_uids)
 
-    # TODO: getRecentChanges
+    def getRecentChanges(self, count):
+        changeids = sorted(self.changes.iterkeys())[-count:]
+        return self.getChanges(changeids)
 
     # fake methods
 
@@ -599,6 +609,14 @@ class FakeSourceStampsComponent(FakeDBComponent):
                 sslist.append(ssdictcpy)
         return defer.succeed(sslist)
 
+    def getSourceStampsForSets(self, sourcestampsetids):
+        rv = dict([ (setid, []) for setid in sourcestampsetids ])
+        for ssid in sorted(self.sourcestamps):
+            setid = self.sourcestamps[ssid]['sourcestampsetid']
+            if setid in rv:
+                rv[setid].append(self._getSourceStamp(ssid))
+        return defer.succeed(rv)
+
 class FakeBuildsetsComponent(FakeDBComponent):
 
     def setUp(self):
@@ -657,9 +675,11 @@ class FakeBuildsetsComponent(FakeDBComponent):
         row = self.buildsets[bsid]
         return defer.succeed(self._row2dict(row))
 
-    def getBuildsets(self, complete=None):
+    def getBuildsets(self, complete=None, bsids=None):
         rv = []
         for bs in self.buildsets.itervalues():
+            if bsids is not None and bs['id'] not in bsids:
+                continue
             if complete is not None:
                 if complete and bs['complete']:
                     rv.append(self._row2dict(bs))
@@ -689,6 +709,14 @@ class FakeBuildsetsComponent(FakeDBComponent):
         else:
             return defer.succeed({})
 
+    def getBuildsetsProperties(self, buildsetids):
+        rv = {}
+        for bsid in buildsetids:
+            rv[bsid] = {}
+            if bsid in self.buildsets:
+                rv[bsid] = self.buildsets[bsid]['properties']
+        return defer.succeed(rv)
+
     # fake methods
 
     def fakeBuildsetCompletion(self, bsid, result):
@@ -881,9 +909,11 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             return defer.succeed(None)
 
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None):
+                         bsid=None, brids=None):
         rv = []
         for br in self.reqs.itervalues():
+            if brids is not None and br.id not in brids:
+                continue
             if buildername and br.buildername != buildername:
                 continue
             if complete is not None:
@@ -936,6 +966,13 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                 objectid=self.MASTER_ID, claimed_at=self._reactor.seconds())
         return defer.succeed(None)
 
+    def unclaimBuildRequests(self, brids):
+        for brid in brids:
+            claim_row = self.claims.get(brid)
+            if claim_row and claim_row.objectid == self.MASTER_ID:
+                del self.claims[brid]
+        return defer.succeed(None)
+
     # Code copied from buildrequests.BuildRequestConnectorComponent
     def _brdictFromRow(self, row):
         claimed = mine = False
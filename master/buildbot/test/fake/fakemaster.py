@@ -17,6 +17,7 @@ import weakref
 from twisted.internet import defer
 from buildbot.test.fake import fakedb
 from buildbot import config
+from buildbot.status import saver
 import mock
 
 class FakeCache(object):
@@ -35,6 +36,9 @@ class FakeCache(object):
         d.addCallback(mkref)
         return d
 
+    def __contains__(self, key):
+        return False
+
 
 def make_master(master_id=fakedb.FakeBuildRequestsComponent.MASTER_ID):
     """
@@ -55,4 +59,7 @@ def make_master(master_id=fakedb.FakeBuildRequestsComponent.MASTER_ID):
     # and some config - this class's constructor is good enough to trust
     fakemaster.config = config.MasterConfig()
 
+    # and a status saver, which saves synchronously since it is not running
+    fakemaster.statussaver = saver.StatusSaver()
+
     return fakemaster
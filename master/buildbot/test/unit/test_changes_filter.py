@@ -123,3 +123,20 @@ class ChangeFilter(unittest.TestCase):
         self.yes(Change(project='p', repository='r', branch='b', category='c', ff=True),
                 "all match and fn returns True -> False")
         self.check()
+
+    def test_getIndexKey_none(self):
+        self.assertEqual(filter.ChangeFilter().getIndexKey(), None)
+        self.assertEqual(
+            filter.ChangeFilter(branch_re='^b', filter_fn=bool).getIndexKey(),
+            None)
+
+    def test_getIndexKey_shortest_list(self):
+        filt = filter.ChangeFilter(project='p', branch=['b1', 'b2'],
+                                   category_re='c')
+        self.assertEqual(filt.getIndexKey(), ('project', ['p']))
+
+    def test_getIndexKey_overridden_filter_change(self):
+        class MyFilter(filter.ChangeFilter):
+            def filter_change(self, change):
+                return True
+        self.assertEqual(MyFilter(branch='b').getIndexKey(), None)
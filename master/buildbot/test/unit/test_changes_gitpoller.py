@@ -15,93 +15,97 @@
 
 import os
 from twisted.trial import unittest
-from twisted.internet import defer
-from exceptions import Exception
+from twisted.python import failure
+from twisted.internet import error
 from buildbot.changes import gitpoller
-from buildbot.test.util import changesource, gpo
+from buildbot.test.util import changesource, gpo, compat
 from buildbot.util import epoch2datetime
 
 # Test that environment variables get propagated to subprocesses (See #2116)
 os.environ['TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES'] = 'TRUE'
 
-class GitOutputParsing(gpo.GetProcessOutputMixin, unittest.TestCase):
-    """Test GitPoller methods for parsing git output"""
-    def setUp(self):
-        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git')
-        self.setUpGetProcessOutput()
+def gitLogOutput(commits):
+    """Make the output of git log with L{gitpoller.GitLogParser.args} for the
+    given (rev, timestamp, author, comments, files) tuples"""
+    return ''.join([ '\0%s\0%s\0%s\0%s\n\0\n\n%s' % (rev, timestamp, author,
+                                              comments, ''.join([ f + '\n'
+                                                            for f in files ]))
+                     for rev, timestamp, author, comments, files in commits ])
 
-    def tearDown(self):
-        self.tearDownGetProcessOutput()
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        dummyRevStr = '12345abcde'
-
-        # make this call to self.patch here so that we raise a SkipTest if it
-        # is not supported
-        self.addGetProcessOutputResult(self.gpoAnyPattern(), '')
-
-        d = defer.succeed(None)
-        def call_empty(_):
-            # we should get an Exception with empty output from git
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_empty)
-    
-        def cb_empty(_):
-            if emptyRaisesException:
-                self.fail("getProcessOutput should have failed on empty output")
-        def eb_empty(f):
-            if not emptyRaisesException:
-                self.fail("getProcessOutput should NOT have failed on empty output")
-        d.addCallbacks(cb_empty, eb_empty)
-
-        # and the method shouldn't supress any exceptions
-        def call_exception(_):
-            # we should get an Exception with empty output from git
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                    lambda b, a, **k: defer.fail(Exception('fake')))
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_exception)
-    
-        def cb_exception(_):
-            self.fail("getProcessOutput should have failed on empty output")
-        def eb_exception(f):
-            pass
-        d.addCallbacks(cb_exception, eb_exception)
-
-        # finally we should get what's expected from good output
-        def call_desired(_):
-            self.addGetProcessOutputResult(self.gpoAnyPattern(),
-                desiredGoodOutput)
-            return methodToTest(dummyRevStr)
-        d.addCallback(call_desired)
-    
-        def cb_desired(r):
-            self.assertEquals(r, desiredGoodResult)
-        d.addCallback(cb_desired)
-        
-    def test_get_commit_author(self):
-        authorStr = 'Sammy Jankis <email@example.com>'
-        return self._perform_git_output_test(self.poller._get_commit_author,
-                authorStr, authorStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        return self._perform_git_output_test(self.poller._get_commit_comments,
-                commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        return self._perform_git_output_test(self.poller._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        return self._perform_git_output_test(self.poller._get_commit_timestamp,
-                stampStr, float(stampStr))
+class GitLogParser(unittest.TestCase):
+    """Test parsing git log output"""
+
+    commits = [
+        ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+         'Sammy Jankis <email@example.com>',
+         'this is a commit message\n\nthat is multiline', ['file1', 'file2']),
+        ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258010',
+         'Leonard Shelby <leonard@example.com>', 'merge', []),
+    ]
+
+    expected = [
+        dict(revision='4423cdbcbb89c14e50dd5f4152415afd686c5241',
+             timestamp=1273258009.0,
+             author=u'Sammy Jankis <email@example.com>',
+             comments=u'this is a commit message\n\nthat is multiline',
+             files=[u'file1', u'file2']),
+        dict(revision='64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
+             timestamp=1273258010.0,
+             author=u'Leonard Shelby <leonard@example.com>',
+             comments=u'merge', files=[]),
+    ]
+
+    def parse(self, output, chunksize):
+        parser = gitpoller.GitLogParser()
+        commits = []
+        for i in xrange(0, len(output), chunksize):
+            commits.extend(parser.feed(output[i:i+chunksize]))
+        commits.extend(parser.finish())
+        return commits
 
-    # _get_changes is tested in TestGitPoller, below
+    def test_parse(self):
+        output = gitLogOutput(self.commits)
+        self.assertEqual(self.parse(output, len(output)), self.expected)
+
+    def test_parse_chunked(self):
+        output = gitLogOutput(self.commits)
+        for chunksize in (1, 2, 7, 50):
+            self.assertEqual(self.parse(output, chunksize), self.expected)
+
+    def test_parse_incremental(self):
+        # each commit is returned as soon as the next one begins
+        parser = gitpoller.GitLogParser()
+        first = gitLogOutput(self.commits[:1])
+        self.assertEqual(parser.feed(first), [])
+        self.assertEqual(parser.feed('\0'), self.expected[:1])
+
+    def test_parse_empty(self):
+        self.assertEqual(self.parse('', 1), [])
+
+    def test_parse_encoding(self):
+        output = gitLogOutput([('abcd', '1273258009',
+                                u'J\xfcrgen <j@example.com>'.encode('latin1'),
+                                'comment', ['f'])])
+        parser = gitpoller.GitLogParser(encoding='latin1')
+        commits = parser.feed(output) + parser.finish()
+        self.assertEqual(commits[0]['author'], u'J\xfcrgen <j@example.com>')
+
+    def test_parse_no_author(self):
+        output = gitLogOutput([('abcd', '1273258009', '', 'comment', [])])
+        self.assertRaises(EnvironmentError, self.parse, output, 10)
+
+    def test_parse_no_comments(self):
+        output = gitLogOutput([('abcd', '1273258009', 'me <me@me>', '', [])])
+        self.assertRaises(EnvironmentError, self.parse, output, 10)
+
+    def test_parse_bad_timestamp(self):
+        output = gitLogOutput([('abcd', 'abc', 'me <me@me>', 'comment', [])])
+        self.assertRaises(ValueError, self.parse, output, 10)
+
+    def test_parse_truncated(self):
+        output = gitLogOutput(self.commits)
+        output = output[:output.rindex('\0merge')]
+        self.assertRaises(EnvironmentError, self.parse, output, 10)
 
 class TestGitPoller(gpo.GetProcessOutputMixin,
                     changesource.ChangeSourceMixin,
@@ -126,6 +130,22 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
     def test_gitbin_default(self):
         self.assertEqual(self.poller.gitbin, "git")
 
+    def patchGitLog(self, outputs, chunksize=13):
+        """Patch out the C{git log} process, to produce the output for each
+        branch in C{outputs}, in chunks"""
+        self.git_log_args = []
+        def spawnProcess(proto, args):
+            self.git_log_args.append(args)
+            branch = args[1].split('..')[0]
+            output = outputs[branch]
+            if isinstance(output, failure.Failure):
+                proto.processEnded(output)
+                return
+            for i in xrange(0, len(output), chunksize):
+                proto.outReceived(output[i:i+chunksize])
+            proto.processEnded(failure.Failure(error.ProcessDone(0)))
+        self.patch(self.poller, '_spawnProcess', spawnProcess)
+
     def test_poll(self):
         # Test that environment variables get propagated to subprocesses (See #2116)
         os.putenv('TEST_THAT_ENVIRONMENT_GETS_PASSED_TO_SUBPROCESSES', 'TRUE')
@@ -137,37 +157,27 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
         self.addGetProcessOutputResult(
                 self.gpoSubcommandPattern('git', 'fetch'),
                 "no interesting output")
-        self.addGetProcessOutputResult(
-                self.gpoSubcommandPattern('git', 'log'),
-                '\n'.join([
-                    '64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a',
-                    '4423cdbcbb89c14e50dd5f4152415afd686c5241']))
         self.addGetProcessOutputAndValueResult(
                 self.gpoSubcommandPattern('git', 'reset'),
                 ('done', '', 0))
-
-        # and patch out the _get_commit_foo methods which were already tested
-        # above
-        def timestamp(rev):
-            return defer.succeed(1273258009.0)
-        self.patch(self.poller, '_get_commit_timestamp', timestamp)
-        def author(rev):
-            return defer.succeed('by:' + rev[:8])
-        self.patch(self.poller, '_get_commit_author', author)
-        def files(rev):
-            return defer.succeed(['/etc/' + rev[:3]])
-        self.patch(self.poller, '_get_commit_files', files)
-        def comments(rev):
-            return defer.succeed('hello!')
-        self.patch(self.poller, '_get_commit_comments', comments)
+        self.patchGitLog(dict(master=gitLogOutput([
+            ('4423cdbcbb89c14e50dd5f4152415afd686c5241', '1273258009',
+             'by:4423cdbc', 'hello!', ['/etc/442']),
+            ('64a5dc2a4bd4f558b5dd193d47c83c7d7abc9a1a', '1273258009',
+             'by:64a5dc2a', 'hello!', ['/etc/64a']),
+        ])))
 
         # do the poll
         d = self.poller.poll()
 
         # check the results
         def check_changes(_):
+            self.assertEqual(self.git_log_args[0][:3],
+                             ['log', 'master..origin/master', '--reverse'])
             self.assertEqual(len(self.changes_added), 2)
             self.assertEqual(self.changes_added[0]['author'], 'by:4423cdbc')
+            self.assertEqual(self.changes_added[0]['revision'],
+                             '4423cdbcbb89c14e50dd5f4152415afd686c5241')
             self.assertEqual(self.changes_added[0]['when_timestamp'],
                                         epoch2datetime(1273258009))
             self.assertEqual(self.changes_added[0]['comments'], 'hello!')
@@ -180,6 +190,95 @@ class TestGitPoller(gpo.GetProcessOutputMixin,
             self.assertEqual(self.changes_added[1]['comments'], 'hello!')
             self.assertEqual(self.changes_added[1]['files'], [ '/etc/64a' ])
             self.assertEqual(self.changes_added[1]['src'], 'git')
+            self.assertEqual(self.poller.changeCount, 2)
         d.addCallback(check_changes)
 
         return d
+
+    def test_poll_batches(self):
+        # changes are added in batches as the output arrives
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'reset'), ('', '', 0))
+        output = gitLogOutput([ ('%040x' % i, '1273258009', 'me <me@me>',
+                                 'commit %d' % i, ['f%d' % i])
+                                for i in range(20) ])
+        self.patchGitLog(dict(master=output), chunksize=len(output) // 3)
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual([ ch['comments'] for ch in self.changes_added ],
+                             [ 'commit %d' % i for i in range(20) ])
+            self.assertTrue(len(self.change_batches) > 1)
+            self.assertEqual(sum(self.change_batches), 20)
+        d.addCallback(check)
+        return d
+
+    def test_poll_no_timestamps(self):
+        self.poller.usetimestamps = False
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'reset'), ('', '', 0))
+        self.patchGitLog(dict(master=gitLogOutput([
+            ('4423cdbc', '1273258009', 'me <me@me>', 'hello!', []) ])))
+
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(self.changes_added[0]['when_timestamp'], None)
+        d.addCallback(check)
+        return d
+
+    def test_poll_no_changes(self):
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.patchGitLog(dict(master=''))
+
+        # no catch-up is attempted, so no reset is expected
+        d = self.poller.poll()
+        def check(_):
+            self.assertEqual(self.changes_added, [])
+            self.assertEqual(self.change_batches, [])
+        d.addCallback(check)
+        return d
+
+    @compat.usesFlushLoggedErrors
+    def test_poll_multiple_branches(self):
+        self.poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                                          branches=['master', 'release',
+                                                    'broken'])
+        self.poller.master = self.master
+        self.addGetProcessOutputResult(
+                self.gpoSubcommandPattern('git', 'fetch'), "")
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'reset'), ('', '', 0))
+        self.addGetProcessOutputAndValueResult(
+                self.gpoSubcommandPattern('git', 'update-ref'), ('', '', 0))
+        self.patchGitLog(dict(
+            master=gitLogOutput([ ('aaaa', '1273258009', 'me <me@me>',
+                                   'on master', []) ]),
+            release=gitLogOutput([ ('bbbb', '1273258009', 'me <me@me>',
+                                    'on release', []) ]),
+            broken=failure.Failure(error.ProcessTerminated(128)),
+        ))
+
+        d = self.poller.poll()
+        def check(_):
+            # one fetch, then a log of each branch
+            self.assertEqual([ args[1] for args in self.git_log_args ],
+                    [ 'master..origin/master', 'release..origin/release',
+                      'broken..origin/broken' ])
+            self.assertEqual([ (ch['branch'], ch['comments'])
+                               for ch in self.changes_added ],
+                    [ ('master', 'on master'), ('release', 'on release') ])
+            # the failure on the broken branch was logged
+            self.assertEqual(len(self.flushLoggedErrors(EnvironmentError)), 1)
+        d.addCallback(check)
+        return d
+
+    def test_branches_default(self):
+        self.assertEqual(self.poller.branches, ['master'])
+        poller = gitpoller.GitPoller('git@example.com:foo/baz.git',
+                                     branches=['a', 'b'])
+        self.assertEqual((poller.branch, poller.branches), ('a', ['a', 'b']))
@@ -0,0 +1,93 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+
+from buildbot.changes import filter, router
+from buildbot.test.fake.state import State
+
+class Change(State):
+    project = ''
+    repository = ''
+    branch = ''
+    category = ''
+
+class ChangeRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = router.ChangeRouter()
+        self.delivered = []
+
+    def subscribe(self, name, change_filter=None):
+        def cb(change):
+            self.delivered.append((name, change.branch))
+        return self.router.subscribe(cb, change_filter)
+
+    def deliver(self, **kwargs):
+        self.router.deliver(Change(**kwargs))
+        delivered = sorted(self.delivered)
+        self.delivered = []
+        return delivered
+
+    def test_unfiltered(self):
+        self.subscribe('all')
+        self.assertEqual(self.deliver(branch='b'), [ ('all', 'b') ])
+
+    def test_indexed(self):
+        self.subscribe('b1', filter.ChangeFilter(branch='b1'))
+        self.subscribe('b1b2', filter.ChangeFilter(branch=['b1', 'b2'],
+                                                   project='p'))
+        self.assertEqual(self.router.index['branch'].keys(), ['b1'])
+        self.assertEqual(self.deliver(branch='b1'), [ ('b1', 'b1') ])
+        self.assertEqual(self.deliver(branch='b1', project='p'),
+                         [ ('b1', 'b1'), ('b1b2', 'b1') ])
+        self.assertEqual(self.deliver(branch='b3', project='p'), [])
+
+    def test_indexed_not_tested_against_other_values(self):
+        filt = mock.Mock(name='filter')
+        filt.getIndexKey.return_value = ('branch', ['b1'])
+        filt.filter_change.return_value = True
+        self.subscribe('b1', filt)
+        self.assertEqual(self.deliver(branch='b2'), [])
+        self.assertFalse(filt.filter_change.called)
+        self.assertEqual(self.deliver(branch='b1'), [ ('b1', 'b1') ])
+
+    def test_unindexed(self):
+        self.subscribe('re', filter.ChangeFilter(branch_re='^rel-'))
+        self.subscribe('fn', filter.ChangeFilter(
+            filter_fn=lambda c : c.branch.endswith('x')))
+        self.assertEqual(self.deliver(branch='rel-x'),
+                         [ ('fn', 'rel-x'), ('re', 'rel-x') ])
+        self.assertEqual(self.deliver(branch='rel-1'), [ ('re', 'rel-1') ])
+
+    def test_filter_exception(self):
+        def fn(change):
+            raise RuntimeError('oh noes')
+        self.subscribe('bad', filter.ChangeFilter(filter_fn=fn))
+        self.subscribe('all')
+        self.assertEqual(self.deliver(branch='b'), [ ('all', 'b') ])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    def test_unsubscribe(self):
+        subs = [ self.subscribe('b1', filter.ChangeFilter(branch='b1')),
+                 self.subscribe('re', filter.ChangeFilter(branch_re='b')),
+                 self.subscribe('all') ]
+        for sub in subs:
+            sub.unsubscribe()
+        self.assertEqual(self.deliver(branch='b1'), [])
+        self.assertEqual(self.router.index, {})
+        self.assertEqual(self.router.unindexed, set())
+        self.assertEqual(self.router.unfiltered, set())
@@ -38,13 +38,16 @@ global_defaults = dict(
     eventHorizon=50,
     logHorizon=None,
     buildHorizon=None,
+    buildIndex='file',
     logCompressionLimit=4096,
     logCompressionMethod='bz2',
     logMaxTailSize=None,
     logMaxSize=None,
+    logWriteBehindSize=None,
     properties=properties.Properties(),
     mergeRequests=None,
     prioritizeBuilders=None,
+    distributorParallelism=1,
     slavePortnum=None,
     multiMaster=False,
     debugPassword=None,
@@ -177,6 +180,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
             db=dict(
                 db_url='sqlite:///state.sqlite',
                 db_poll_interval=None),
+            notifications=dict(transport=None, listen=None, peers=[]),
             metrics = None,
             caches = dict(Changes=10, Builds=15),
             schedulers = {},
@@ -284,6 +288,7 @@ class MasterConfig(ConfigErrorsMixin, dirs.DirsMixin, unittest.TestCase):
         self.failUnless(rv.load_global.called)
         self.failUnless(rv.load_validation.called)
         self.failUnless(rv.load_db.called)
+        self.failUnless(rv.load_notifications.called)
         self.failUnless(rv.load_metrics.called)
         self.failUnless(rv.load_caches.called)
         self.failUnless(rv.load_schedulers.called)
@@ -377,6 +382,14 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_buildHorizon(self):
         self.do_test_load_global(dict(buildHorizon=10), buildHorizon=10)
 
+    def test_load_global_buildIndex(self):
+        self.do_test_load_global(dict(buildIndex=None), buildIndex=None)
+
+    def test_load_global_buildIndex_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(buildIndex='sql'), self.errors)
+        self.assertConfigError(self.errors, "must be 'file' or None")
+
     def test_load_global_logCompressionLimit(self):
         self.do_test_load_global(dict(logCompressionLimit=10),
                                  logCompressionLimit=10)
@@ -388,7 +401,11 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_logCompressionMethod_invalid(self):
         self.cfg.load_global(self.filename,
                 dict(logCompressionMethod='foo'), self.errors)
-        self.assertConfigError(self.errors, "must be 'bz2' or 'gz'")
+        self.assertConfigError(self.errors, "must be 'bz2', 'gz' or 'indexed'")
+
+    def test_load_global_logCompressionMethod_indexed(self):
+        self.do_test_load_global(dict(logCompressionMethod='indexed'),
+                                 logCompressionMethod='indexed')
 
     def test_load_global_logMaxSize(self):
         self.do_test_load_global(dict(logMaxSize=123), logMaxSize=123)
@@ -396,6 +413,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
     def test_load_global_logMaxTailSize(self):
         self.do_test_load_global(dict(logMaxTailSize=123), logMaxTailSize=123)
 
+    def test_load_global_logWriteBehindSize(self):
+        self.do_test_load_global(dict(logWriteBehindSize=1024),
+                logWriteBehindSize=1024)
+
+    def test_load_global_logWriteBehindSize_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(logWriteBehindSize=0), self.errors)
+        self.assertConfigError(self.errors, "must be a positive integer")
+
     def test_load_global_properties(self):
         exp = properties.Properties()
         exp.setProperty('x', 10, self.filename)
@@ -431,6 +457,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                 dict(prioritizeBuilders='yes'), self.errors)
         self.assertConfigError(self.errors, "must be a callable")
 
+    def test_load_global_distributorParallelism(self):
+        self.do_test_load_global(dict(distributorParallelism=4),
+                distributorParallelism=4)
+
+    def test_load_global_distributorParallelism_invalid(self):
+        self.cfg.load_global(self.filename,
+                dict(distributorParallelism=0), self.errors)
+        self.assertConfigError(self.errors, "must be a positive integer")
+
     def test_load_global_slavePortnum_int(self):
         self.do_test_load_global(dict(slavePortnum=123),
                 slavePortnum='tcp:123')
@@ -518,6 +553,51 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.assertConfigError(self.errors, "must be an int")
 
 
+    def test_load_notifications_defaults(self):
+        self.cfg.load_notifications(self.filename, {}, self.errors)
+        self.assertResults(
+            notifications=dict(transport=None, listen=None, peers=[]))
+
+    def test_load_notifications(self):
+        self.cfg.db['db_poll_interval'] = 300
+        self.cfg.load_notifications(self.filename,
+            dict(notifications=dict(transport='socket', listen='tcp:9990',
+                                    peers=('tcp:m2:9990', 'unix:/m3.sock'))),
+            self.errors)
+        self.assertResults(
+            notifications=dict(transport='socket', listen='tcp:9990',
+                               peers=['tcp:m2:9990', 'unix:/m3.sock']))
+
+    def test_load_notifications_not_dict(self):
+        self.cfg.load_notifications(self.filename,
+                dict(notifications='socket'), self.errors)
+        self.assertConfigError(self.errors, "must be a dictionary")
+
+    def test_load_notifications_unk_keys(self):
+        self.cfg.load_notifications(self.filename,
+                dict(notifications=dict(transport=None, bar='bar')),
+                self.errors)
+        self.assertConfigError(self.errors, "unrecognized keys in")
+
+    def test_load_notifications_bad_transport(self):
+        self.cfg.db['db_poll_interval'] = 300
+        self.cfg.load_notifications(self.filename,
+                dict(notifications=dict(transport='pigeon')), self.errors)
+        self.assertConfigError(self.errors, "must be 'socket' or None")
+
+    def test_load_notifications_bad_peers(self):
+        self.cfg.db['db_poll_interval'] = 300
+        self.cfg.load_notifications(self.filename,
+                dict(notifications=dict(transport='socket',
+                                        peers=['m2:9990'])), self.errors)
+        self.assertConfigError(self.errors, "must be a list of")
+
+    def test_load_notifications_no_polling(self):
+        self.cfg.load_notifications(self.filename,
+                dict(notifications=dict(transport='socket')), self.errors)
+        self.assertConfigError(self.errors, "requires db_poll_interval")
+
+
     def test_load_metrics_defaults(self):
         self.cfg.load_metrics(self.filename, {}, self.errors)
         self.assertResults(metrics=None)
@@ -245,6 +245,19 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getBuildRequests_brids_arg(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=id, buildsetid=self.BSID)
+            for id in range(70, 320) ])
+        brids = range(71, 320, 2) + [ 999 ]
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getBuildRequests(brids=brids))
+        def check(brlist):
+            self.assertEqual(sorted([ br['brid'] for br in brlist ]),
+                             range(71, 320, 2))
+        d.addCallback(check)
+        return d
+
     def test_getBuildRequests_combo(self):
         d = self.insertTestData([
             # 44: everything we want
@@ -20,6 +20,7 @@ from twisted.trial import unittest
 from twisted.internet import defer, task
 from buildbot.changes.changes import Change
 from buildbot.db import changes
+from buildbot.process import cache
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
 from buildbot.util import epoch2datetime
@@ -158,6 +159,66 @@ class TestChangesConnectorComponent(
         d.addCallback(check14)
         return d
 
+    def test_getChanges(self):
+        d = self.insertTestData([ fakedb.Change(changeid=12) ]
+                + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ :
+                self.db.changes.getChanges([14, 15, 13]))
+        def check(chdicts):
+            self.assertEqual(chdicts[0], self.change14_dict)
+            self.assertEqual(chdicts[1], None)
+            self.assertEqual(chdicts[2]['changeid'], 13)
+            self.assertEqual(sorted(chdicts[2]['files']),
+                        sorted(['master/README.txt', 'slave/README.txt']))
+            self.assertEqual(chdicts[2]['properties'],
+                        { 'notest' : ('no', 'Change') })
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_empty(self):
+        d = self.db.changes.getChanges([])
+        def check(chdicts):
+            self.assertEqual(chdicts, [])
+        d.addCallback(check)
+        return d
+
+    @defer.inlineCallbacks
+    def test_getChanges_batched(self):
+        yield self.insertTestData([ fakedb.Change(changeid=i)
+                                    for i in range(1, 251) ] +
+                [ fakedb.ChangeFile(changeid=201, filename='README') ])
+        chdicts = yield self.db.changes.getChanges(range(1, 252))
+        self.assertEqual([ c['changeid'] for c in chdicts[:-1] ],
+                         range(1, 251))
+        self.assertEqual(chdicts[-1], None)
+        self.assertEqual(chdicts[200]['files'], ['README'])
+
+    @defer.inlineCallbacks
+    def test_getChanges_fills_cache(self):
+        # use a real cache
+        self.db.master.caches = cache.CacheManager()
+        self.db.master.caches.config = dict(chdicts=10)
+        self.db.changes = changes.ChangesConnectorComponent(self.db)
+        yield self.insertTestData(self.change13_rows + self.change14_rows)
+
+        # one database operation fetches both changes
+        do = self.db.pool.do
+        calls = []
+        def counting_do(callable, *args, **kwargs):
+            calls.append(callable)
+            return do(callable, *args, **kwargs)
+        self.patch(self.db.pool, 'do', counting_do)
+
+        yield self.db.changes.getChanges([13, 14])
+        self.assertEqual(len(calls), 1)
+
+        # and then they are cached
+        chdict = yield self.db.changes.getChange(14)
+        self.assertEqual(chdict, self.change14_dict)
+        chdicts = yield self.db.changes.getChanges([14, 13])
+        self.assertEqual([ c['changeid'] for c in chdicts ], [14, 13])
+        self.assertEqual(len(calls), 1)
+
     def test_getLatestChangeid(self):
         d = self.insertTestData(self.change13_rows)
         def get(_):
@@ -359,6 +420,44 @@ class TestChangesConnectorComponent(
         d.addCallback(check_change_users)
         return d
 
+    def test_addChanges(self):
+        d = self.db.changes.addChanges([
+            dict(author=u'dustin', files=[u'a.txt'], comments=u'first',
+                 revision=u'2d6caa52', branch=u'master',
+                 when_timestamp=epoch2datetime(1239898353),
+                 properties={u'pr' : (u'v', u'Change')}, uid=None),
+            dict(author=u'warner', files=[u'b.txt', u'c.txt'],
+                 comments=u'second', revision=u'98dd2d72', branch=u'master',
+                 when_timestamp=epoch2datetime(1239898354)),
+        ])
+        def check_changes(changeids):
+            self.assertEqual(len(changeids), 2)
+            def thd(conn):
+                r = conn.execute(self.db.model.changes.select()
+                        .order_by(self.db.model.changes.c.changeid))
+                r = r.fetchall()
+                self.assertEqual([ (row.changeid, row.revision) for row in r ],
+                        zip(changeids, [u'2d6caa52', u'98dd2d72']))
+                r = conn.execute(self.db.model.change_files.select())
+                self.assertEqual(sorted([ (row.changeid, row.filename)
+                                          for row in r.fetchall() ]),
+                        [ (changeids[0], u'a.txt'), (changeids[1], u'b.txt'),
+                          (changeids[1], u'c.txt') ])
+                r = conn.execute(self.db.model.change_properties.select())
+                r = r.fetchall()
+                self.assertEqual(len(r), 1)
+                self.assertEqual(r[0].changeid, changeids[0])
+            return self.db.pool.do(thd)
+        d.addCallback(check_changes)
+        return d
+
+    def test_addChanges_empty(self):
+        d = self.db.changes.addChanges([])
+        def check(changeids):
+            self.assertEqual(changeids, [])
+        d.addCallback(check)
+        return d
+
     def test_getChangeUids_missing(self):
         d = self.db.changes.getChangeUids(1)
         def check(res):
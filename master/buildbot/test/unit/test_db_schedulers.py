@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
+from twisted.internet import defer
 from buildbot.db import schedulers
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
@@ -103,6 +104,69 @@ class TestSchedulersConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_classifyChanges_batched(self):
+        # classifications made together are written together, inserting
+        # new rows and updating existing ones
+        d = self.insertTestData([
+            self.change3, self.change4,
+            self.scheduler24, fakedb.Object(id=25, name='other'),
+            fakedb.SchedulerChange(objectid=24, changeid=3, important=0),
+        ])
+        def classify(_):
+            return defer.gatherResults([
+                self.db.schedulers.classifyChanges(24, { 3 : True }),
+                self.db.schedulers.classifyChanges(25, { 3 : False }),
+                self.db.schedulers.classifyChanges(24, { 4 : False }),
+            ])
+        d.addCallback(classify)
+        def check(_):
+            def thd(conn):
+                sch_chgs_tbl = self.db.model.scheduler_changes
+                q = sch_chgs_tbl.select(order_by=[sch_chgs_tbl.c.objectid,
+                                                  sch_chgs_tbl.c.changeid])
+                r = conn.execute(q)
+                rows = [ (row.objectid, row.changeid, row.important)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (24, 3, 1), (24, 4, 0), (25, 3, 0) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
+    def test_classifyChanges_race(self):
+        # another writer inserts a row after the existing rows are looked up
+        d = self.insertTestData([ self.change3, self.change4,
+                                  self.scheduler24 ])
+        orig_do = self.db.pool.do
+        def do(thd):
+            def racing_thd(conn):
+                tbl = self.db.model.scheduler_changes
+                execute = conn.execute
+                def racing_execute(q, *args, **kwargs):
+                    if args and isinstance(args[0], list):
+                        execute(tbl.insert(),
+                                dict(objectid=24, changeid=3, important=0))
+                    return execute(q, *args, **kwargs)
+                conn.execute = racing_execute
+                return thd(conn)
+            return orig_do(racing_thd)
+        def classify(_):
+            self.patch(self.db.pool, 'do', do)
+            return self.db.schedulers.classifyChanges(24,
+                    { 3 : True, 4 : False })
+        d.addCallback(classify)
+        def check(_):
+            self.patch(self.db.pool, 'do', orig_do)
+            def thd(conn):
+                sch_chgs_tbl = self.db.model.scheduler_changes
+                q = sch_chgs_tbl.select(order_by=sch_chgs_tbl.c.changeid)
+                r = conn.execute(q)
+                rows = [ (row.objectid, row.changeid, row.important)
+                         for row in r.fetchall() ]
+                self.assertEqual(rows, [ (24, 3, 1), (24, 4, 0) ])
+            return self.db.pool.do(thd)
+        d.addCallback(check)
+        return d
+
     def test_flushChangeClassifications(self):
         d = self.insertTestData([ self.change3, self.change4,
                                   self.change5, self.scheduler24 ])
@@ -204,6 +204,43 @@ class TestSourceStampsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getSourceStampsForSets(self):
+        d = self.insertTestData([
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                patch_author='bar', patch_comment='foo', subdir='/foo',
+                patchlevel=3),
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStampSet(id=235),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, codebase='a'),
+            fakedb.SourceStamp(id=235, sourcestampsetid=234, codebase='b',
+                patchid=99),
+            fakedb.SourceStamp(id=236, sourcestampsetid=235),
+            fakedb.Change(changeid=16),
+            fakedb.Change(changeid=19),
+            fakedb.SourceStampChange(sourcestampid=234, changeid=16),
+            fakedb.SourceStampChange(sourcestampid=234, changeid=19),
+        ])
+        d.addCallback(lambda _ :
+                self.db.sourcestamps.getSourceStampsForSets([234, 235, 236]))
+        def check(sslists):
+            self.sslists = sslists
+            self.assertEqual(sorted(sslists.keys()), [234, 235, 236])
+            self.assertEqual([ ss['ssid'] for ss in sslists[234] ],
+                             [234, 235])
+            self.assertEqual(sslists[234][0]['changeids'], set([16, 19]))
+            self.assertEqual(sslists[234][1]['patch_body'], 'hello, world')
+            self.assertEqual(sslists[234][1]['patch_subdir'], '/foo')
+            self.assertEqual([ ss['ssid'] for ss in sslists[235] ], [236])
+            self.assertEqual(sslists[236], [])
+        d.addCallback(check)
+        # the results are the same as for getSourceStamps
+        d.addCallback(lambda _ :
+                self.db.sourcestamps.getSourceStamps(234, no_cache=True))
+        def check_single(sslist):
+            self.assertEqual(list(sslist), list(self.sslists[234]))
+        d.addCallback(check_single)
+        return d
+
     def test_getSourceStamp_nosuch(self):
         d = self.db.sourcestamps.getSourceStamp(234)
         def check(ssdict):
@@ -181,6 +181,46 @@ class Subscriptions(dirs.DirsMixin, unittest.TestCase):
                 kwargs=dict(who='me', src='git'),
                 exp_args=(self.master, 'me', 'git'))
                
+    @defer.inlineCallbacks
+    def test_addChanges(self):
+        self.master.db = mock.Mock()
+        self.master.db.changes.addChanges.return_value = \
+            defer.succeed([10, 11])
+        self.master.db.changes.getChanges.return_value = \
+            defer.succeed([dict(changeid=10), dict(changeid=11)])
+        self.patch(changes.Change, 'fromChdict',
+                classmethod(lambda cls, master, chdict :
+                                defer.succeed(chdict['changeid'])))
+        self.patch(users, 'createUserObject',
+                lambda master, author, src : defer.succeed(7))
+
+        cb = mock.Mock()
+        self.master.subscribeToChanges(cb)
+
+        new_changes = yield self.master.addChanges([
+                dict(who='me', when=892293875, src='git'),
+                dict(author='you', files=['a']) ])
+
+        db_kwargs = dict(files=None, comments=None, author=None,
+                is_dir=0, revision=None, when_timestamp=None,
+                branch=None, category=None, revlink='', properties={},
+                repository='', codebase='', project='', uid=None)
+        exp = [ db_kwargs.copy(), db_kwargs.copy() ]
+        exp[0].update(author='me', uid=7,
+                      when_timestamp=epoch2datetime(892293875))
+        exp[1].update(author='you', files=['a'])
+        self.master.db.changes.addChanges.assert_called_with(exp)
+        self.master.db.changes.getChanges.assert_called_with([10, 11])
+        self.assertEqual(new_changes, [10, 11])
+        self.assertEqual(cb.call_args_list, [ ((10,), {}), ((11,), {}) ])
+
+    @defer.inlineCallbacks
+    def test_addChanges_empty(self):
+        self.master.db = mock.Mock()
+        new_changes = yield self.master.addChanges([])
+        self.assertEqual(new_changes, [])
+        self.assertFalse(self.master.db.changes.addChanges.called)
+
     def test_buildset_subscription(self):
         self.master.db = mock.Mock()
         self.master.db.buildsets.addBuildset.return_value = \
@@ -577,3 +617,119 @@ class Polling(dirs.DirsMixin, misc.PatcherMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseChanges_concurrent(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+        ])
+
+        # make the database slow, so that the polls overlap
+        getChanges = self.db.changes.getChanges
+        def slowGetChanges(changeids):
+            d = task.deferLater(reactor, 0, lambda : None)
+            d.addCallback(lambda _ : getChanges(changeids))
+            return d
+        self.patch(self.db.changes, 'getChanges', slowGetChanges)
+
+        yield defer.gatherResults([ self.master.pollDatabaseChanges()
+                                    for i in range(3) ])
+        self.assertEqual([ ch.number for ch in self.gotten_changes], [ 11 ])
+        self.db.state.assertState(53, last_processed_change=11)
+
+    @defer.inlineCallbacks
+    def test_addChange_notifications(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+        ])
+        self.master.notifier.transport = mock.Mock()
+
+        change = yield self.master.addChange(author=u'me', files=[],
+                                             comments=u'hi')
+
+        # the change is delivered right away, by a poll
+        self.assertEqual([ ch.number for ch in self.gotten_changes],
+                         [ change.number ])
+        self.db.state.assertState(53, last_processed_change=change.number)
+        self.master.notifier.transport.send.assert_called_with(
+                dict(type='change', changeid=change.number))
+
+    @defer.inlineCallbacks
+    def test_addBuildset_notifications(self):
+        self.master.notifier.transport = mock.Mock()
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+        ])
+
+        bsid, brids = yield self.master.addBuildset(sourcestampsetid=127,
+                reason='r', properties={}, builderNames=['a'])
+
+        # the build requests are delivered right away
+        self.assertEqual(self.gotten_buildrequest_additions,
+                [ dict(bsid=bsid, brid=brids['a'], buildername='a') ])
+        self.master.notifier.transport.send.assert_called_with(
+                dict(type='buildset', bsid=bsid, brids=brids))
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseBuildRequests_after_notification(self):
+        yield self.master.pollDatabaseBuildRequests()
+        self.db.insertTestData([
+            fakedb.SourceStampSet(id=127),
+            fakedb.SourceStamp(id=127, sourcestampsetid=127),
+            fakedb.Buildset(id=99, sourcestampsetid=127),
+            fakedb.BuildRequest(id=19, buildsetid=99, buildername='9teen'),
+        ])
+        self.master.buildRequestAdded(99, 19, '9teen')
+        yield self.master.pollDatabaseBuildRequests()
+        # the poll does not report the request a second time
+        self.assertEqual(self.gotten_buildrequest_additions,
+                [ dict(bsid=99, brid=19, buildername='9teen') ])
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseChanges_batches(self):
+        self.patch(self.master, 'CHANGE_POLL_BATCH', 2)
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+        ] + [ fakedb.Change(changeid=i) for i in range(10, 16) ])
+
+        batches = []
+        getChanges = self.db.changes.getChanges
+        def recordingGetChanges(changeids):
+            batches.append(changeids)
+            return getChanges(changeids)
+        self.patch(self.db.changes, 'getChanges', recordingGetChanges)
+
+        yield self.master.pollDatabaseChanges()
+        self.assertEqual([ ch.number for ch in self.gotten_changes],
+                         [ 11, 12, 13, 14, 15 ])
+        self.assertEqual(batches, [ [11, 12], [13, 14], [15] ])
+        self.db.state.assertState(53, last_processed_change=15)
+
+    @defer.inlineCallbacks
+    def test_pollDatabaseChanges_gap(self):
+        self.db.insertTestData([
+            fakedb.Object(id=53, name=self.master_name,
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        yield self.master.pollDatabaseChanges()
+        # change 12 may not be committed yet, so polling stops before it
+        self.assertEqual([ ch.number for ch in self.gotten_changes], [ 11 ])
+        self.db.state.assertState(53, last_processed_change=11)
@@ -219,6 +219,7 @@ class TestBotMaster(unittest.TestCase):
         self.assertIdentical(bldr.parent, self.botmaster)
         self.assertIdentical(bldr.master, self.master)
         self.assertEqual(self.botmaster.builderNames, [ 'bldr' ])
+        self.master.status.loadBuilders.assert_called_with([('bldr', 'bldr')])
 
         self.new_config.builders = [ ]
 
@@ -31,6 +31,7 @@ class Test(unittest.TestCase):
             return sorted(builders, lambda b1,b2 : cmp(b1.name, b2.name))
         self.master = self.botmaster.master = mock.Mock(name='master')
         self.master.config.prioritizeBuilders = prioritizeBuilders
+        self.master.config.distributorParallelism = 1
         self.brd = botmaster.BuildRequestDistributor(self.botmaster)
         self.brd.startService()
 
@@ -53,7 +54,7 @@ class Test(unittest.TestCase):
         if self.brd.running:
             return self.brd.stopService()
 
-    def addBuilders(self, names):
+    def addBuilders(self, names, slavenames=None):
         for name in names:
             bldr = mock.Mock(name=name)
             self.botmaster.builders[name] = bldr
@@ -65,6 +66,23 @@ class Test(unittest.TestCase):
                 return d
             bldr.maybeStartBuild = maybeStartBuild
             bldr.name = name
+            # by default, each builder has a slave of its own
+            bldr.config.slavenames = slavenames or [ 'slave-' + name ]
+
+    def addSlowBuilders(self, names, slavenames=None):
+        # like addBuilders, but maybeStartBuild logs when it finishes, and
+        # does not finish until all of the builders have been called
+        self.addBuilders(names, slavenames=slavenames)
+        for name in names:
+            def maybeStartBuild(n=name):
+                self.maybeStartBuild_calls.append(n)
+                d = defer.Deferred()
+                def finish():
+                    self.maybeStartBuild_calls.append(n + '-finished')
+                    d.callback(None)
+                reactor.callLater(0.01, finish)
+                return d
+            self.builders[name].maybeStartBuild = maybeStartBuild
 
     def removeBuilder(self, name):
         del self.builders[name]
@@ -149,6 +167,58 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.master.config.distributorParallelism = 3
+        self.addSlowBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+        def check(_):
+            # all three run at once, since they have disjoint slaves
+            self.assertEqual(self.maybeStartBuild_calls,
+                    ['bldr1', 'bldr2', 'bldr3', 'bldr1-finished',
+                     'bldr2-finished', 'bldr3-finished'])
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_concurrent_shared_slaves(self):
+        self.master.config.distributorParallelism = 3
+        self.addSlowBuilders(['bldr1', 'bldr2'], slavenames=['s1', 's2'])
+        self.addSlowBuilders(['bldr3'], slavenames=['s2'])
+        self.addSlowBuilders(['bldr4'], slavenames=['s3'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+        def check(_):
+            # bldr2 and bldr3 share slaves with bldr1, so they must wait for
+            # it, and then for each other; bldr4 can run alongside bldr1
+            self.assertEqual(self.maybeStartBuild_calls,
+                    ['bldr1', 'bldr4', 'bldr1-finished', 'bldr2',
+                     'bldr4-finished', 'bldr2-finished', 'bldr3',
+                     'bldr3-finished'])
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_concurrent_limit(self):
+        self.master.config.distributorParallelism = 2
+        self.addSlowBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+        def check(_):
+            self.assertEqual(self.maybeStartBuild_calls[:3],
+                    ['bldr1', 'bldr2', 'bldr1-finished'])
+            self.assertEqual(self.maybeStartBuild_calls[3], 'bldr3')
+            self.assertEqual(len(self.maybeStartBuild_calls), 6)
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_concurrent_added_while_waiting(self):
+        self.master.config.distributorParallelism = 2
+        self.addSlowBuilders(['bldr1', 'bldr2'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        # bldr2 arrives while the loop is waiting for bldr1 to finish
+        reactor.callLater(0, self.brd.maybeStartBuildsOn, ['bldr2'])
+        def check(_):
+            self.assertEqual(self.maybeStartBuild_calls,
+                    ['bldr1', 'bldr2', 'bldr1-finished', 'bldr2-finished'])
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
     def do_test_sortBuilders(self, prioritizeBuilders, oldestRequestTimes,
             expected, returnDeferred=False):
         self.addBuilders(oldestRequestTimes.keys())
@@ -314,6 +314,142 @@ class TestBuilderBuildCreation(unittest.TestCase):
         yield self.do_test_maybeStartBuild(rows=rows,
                 exp_claims=[11], exp_builds=[('test-slave2', [11])])
 
+    @defer.inlineCallbacks
+    def test_maybeStartBuild_pending_requests(self):
+        yield self.makeBuilder(mergeRequests=False)
+
+        queries = []
+        old_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            queries.append(kwargs.get('brids'))
+            return old_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=135000),
+        ]
+        yield self.do_test_maybeStartBuild(rows=rows,
+                exp_claims=[10], exp_builds=[('test-slave1', [10])])
+
+        # a new request arrives, and is fetched by itself
+        yield self.db.insertTestData([
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="bldr",
+                submitted_at=132000),
+        ])
+        self.bldr.buildRequestAdded(dict(bsid=11, brid=12,
+                                         buildername="bldr"))
+        self.builds_started = []
+        yield self.do_test_maybeStartBuild(
+                exp_claims=[10, 12], exp_builds=[('test-slave1', [12])])
+
+        # and with nothing new, no queries are made at all
+        self.builds_started = []
+        yield self.do_test_maybeStartBuild(
+                exp_claims=[10, 11, 12], exp_builds=[('test-slave1', [11])])
+        self.assertEqual(queries, [ None, set([12]) ])
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuild_pending_requests_not_started(self):
+        yield self.makeBuilder()
+
+        # build is not started, so the requests are unclaimed and then
+        # re-fetched from the database
+        self.bldr._startBuildFor = lambda sb, breqs : defer.succeed(False)
+
+        self.setSlaveBuilders({'test-slave1':1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr"),
+        ]
+        yield self.do_test_maybeStartBuild(rows=rows,
+                exp_claims=[], exp_builds=[])
+        self.assertEqual(self.bldr._pendingRequests, None)
+        unclaimed = yield self.bldr._getUnclaimedRequests()
+        self.assertEqual([ brd['brid'] for brd in unclaimed ], [10])
+
+    @defer.inlineCallbacks
+    def test_buildRequestAdded_no_index(self):
+        yield self.makeBuilder()
+        self.bldr.buildRequestAdded(dict(bsid=11, brid=12,
+                                         buildername="bldr"))
+        # nothing to do until the index has been loaded
+        self.assertEqual(self.bldr._newRequestIds, set())
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedRequests_concurrent(self):
+        yield self.makeBuilder()
+        yield self.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=130000),
+        ])
+
+        # hold the queries until they are released
+        queries = []
+        old_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            d = defer.Deferred()
+            d.addCallback(lambda _ : old_getBuildRequests(**kwargs))
+            queries.append((kwargs.get('brids'), d))
+            return d
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        results = []
+        def getIds():
+            d = self.bldr._getUnclaimedRequests()
+            d.addCallback(lambda brdicts :
+                    results.append([ brd['brid'] for brd in brdicts ]))
+            return d
+        dl = [ getIds(), getIds() ]
+
+        # the second caller waits for the query, rather than seeing an empty
+        # index
+        self.assertEqual([ brids for brids, d in queries ], [ None ])
+        self.assertEqual(results, [])
+
+        # a request noted while the query is in progress is fetched once it
+        # has finished
+        self.bldr.buildRequestAdded(dict(bsid=11, brid=12,
+                                         buildername="bldr"))
+        queries[0][1].callback(None)
+        yield self.db.insertTestData([
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="bldr",
+                submitted_at=132000),
+        ])
+        self.assertEqual([ brids for brids, d in queries ],
+                         [ None, set([12]) ])
+        queries[1][1].callback(None)
+        yield defer.gatherResults(dl)
+        self.assertEqual(results, [ [10, 12], [10, 12] ])
+
+    @defer.inlineCallbacks
+    def test_getUnclaimedRequests_invalidated_while_fetching(self):
+        yield self.makeBuilder()
+        yield self.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr"),
+        ])
+
+        queries = []
+        old_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            d = defer.Deferred()
+            d.addCallback(lambda _ : old_getBuildRequests(**kwargs))
+            queries.append(d)
+            return d
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        d = self.bldr._getUnclaimedRequests()
+        self.bldr._invalidatePendingRequests()
+        queries[0].callback(None)
+        # the results of the first query are not used
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.bldr._pendingRequests, None)
+        queries[1].callback(None)
+        unclaimed = yield d
+        self.assertEqual([ brd['brid'] for brd in unclaimed ], [10])
+
     @defer.inlineCallbacks
     def test_maybeStartBuild_builder_stopped(self):
         yield self.makeBuilder()
@@ -439,6 +575,37 @@ class TestBuilderBuildCreation(unittest.TestCase):
 
         self.bldr._breakBrdictRefloops([brdict])
 
+    @defer.inlineCallbacks
+    def test_brdictsToBuildRequests(self):
+        yield self.makeBuilder()
+
+        yield self.db.insertTestData([
+                fakedb.SourceStampSet(id=234),
+                fakedb.SourceStamp(id=234,sourcestampsetid=234),
+                fakedb.Buildset(id=30, sourcestampsetid=234, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=19, buildsetid=30, buildername='bldr',
+                    priority=13, submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=20, buildsetid=30, buildername='bldr',
+                    priority=13, submitted_at=1300305712, results=-1),
+            ])
+
+        brdicts = yield self.db.buildrequests.getBuildRequests(
+                buildername='bldr')
+        brdicts.sort(key=lambda brd : brd['brid'])
+
+        # convert one, then both; the first is not converted again
+        br19 = yield self.bldr._brdictToBuildRequest(brdicts[0])
+        brs = yield self.bldr._brdictsToBuildRequests(brdicts)
+        self.assertIdentical(brs[0], br19)
+        self.assertEqual([ br.id for br in brs ], [19, 20])
+        self.assertEqual([ br.reason for br in brs ], ['foo', 'foo'])
+        for brdict, br in zip(brdicts, brs):
+            self.assertIdentical(br.brdict, brdict)
+            self.assertIdentical(brdict['brobj'], br)
+
+        self.bldr._breakBrdictRefloops(brdicts)
+
     # _getMergeRequestsFn
 
     @defer.inlineCallbacks
@@ -717,3 +884,33 @@ class TestGetOldestRequestTime(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_gort_uses_index(self):
+        yield self.makeBuilder(name='bldr1')
+        yield self.db.insertTestData(self.base_rows)
+
+        queries = []
+        old_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            queries.append(kwargs.get('brids'))
+            return old_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        rqtime = yield self.bldr.getOldestRequestTime()
+        self.assertEqual(rqtime, epoch2datetime(1000))
+
+        # an older request arrives, and is fetched by itself
+        yield self.db.insertTestData([
+            fakedb.BuildRequest(id=555, submitted_at=500,
+                        buildername='bldr1', buildsetid=11),
+        ])
+        self.bldr.buildRequestAdded(dict(bsid=11, brid=555,
+                                         buildername='bldr1'))
+        rqtime = yield self.bldr.getOldestRequestTime()
+        self.assertEqual(rqtime, epoch2datetime(500))
+
+        # and with nothing new, the database is not consulted
+        rqtime = yield self.bldr.getOldestRequestTime()
+        self.assertEqual(rqtime, epoch2datetime(500))
+        self.assertEqual(queries, [ None, set([555]) ])
+
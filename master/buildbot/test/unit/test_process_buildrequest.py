@@ -69,6 +69,44 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_fromBrdicts(self):
+        master = fakemaster.make_master()
+        master.db = fakedb.FakeDBConnector(self)
+        master.db.insertTestData([
+            fakedb.SourceStampSet(id=234),
+            fakedb.SourceStamp(id=234, sourcestampsetid=234, branch='trunk'),
+            fakedb.SourceStampSet(id=235),
+            fakedb.SourceStamp(id=235, sourcestampsetid=235, branch='br'),
+            fakedb.Buildset(id=539, reason='triggered', sourcestampsetid=234),
+            fakedb.Buildset(id=540, reason='forced', sourcestampsetid=235),
+            fakedb.BuildsetProperty(buildsetid=540, property_name='x',
+                        property_value='[1, "X"]'),
+            fakedb.BuildRequest(id=288, buildsetid=539, buildername='bldr'),
+            fakedb.BuildRequest(id=289, buildsetid=540, buildername='bldr'),
+            fakedb.BuildRequest(id=290, buildsetid=539, buildername='bldr'),
+        ])
+        # the data should be fetched in bulk, not one request at a time
+        def fail(*args):
+            raise AssertionError("should not be called")
+        master.db.buildsets.getBuildset = fail
+        master.db.buildsets.getBuildsetProperties = fail
+        master.db.sourcestamps.getSourceStamps = fail
+
+        d = master.db.buildrequests.getBuildRequests(brids=[288, 289, 290])
+        d.addCallback(lambda brdicts :
+                buildrequest.BuildRequest.fromBrdicts(master,
+                    sorted(brdicts, key=lambda brd : -brd['brid'])))
+        def check(brs):
+            self.assertEqual([ br.id for br in brs ], [290, 289, 288])
+            self.assertEqual([ br.reason for br in brs ],
+                             ['triggered', 'forced', 'triggered'])
+            self.assertEqual([ br.source.branch for br in brs ],
+                             ['trunk', 'br', 'trunk'])
+            self.assertEqual([ br.properties.getProperty('x') for br in brs ],
+                             [None, 1, None])
+        d.addCallback(check)
+        return d
+
     def test_fromBrdict_submittedAt_NULL(self):
         master = fakemaster.make_master()
         master.db = fakedb.FakeDBConnector(self)
@@ -14,9 +14,10 @@
 # Copyright Buildbot Team Members
 
 import re
+import zlib
 import mock
 from twisted.trial import unittest
-from twisted.internet import reactor
+from twisted.internet import reactor, defer
 from buildbot.process import buildstep
 from buildbot.process.buildstep import regex_log_evaluator
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, EXCEPTION
@@ -190,3 +191,27 @@ class TestLoggingBuildStep(unittest.TestCase):
         lbs = buildstep.LoggingBuildStep(log_eval_func=eval)
         status = lbs.evaluateCommand(cmd)
         self.assertEqual(status, WARNINGS, "evaluateCommand didn't call log_eval_func or overrode its results")
+
+class TestRemoteCommand(unittest.TestCase):
+    def test_decompressUpdate(self):
+        rc = buildstep.RemoteCommand('shell', {})
+        update = {'stdout': zlib.compress('hello\n'),
+                  'log': ('foo', zlib.compress('bar')), 'rc': 0}
+        self.assertEqual(rc._decompressUpdate(update, 'zlib'),
+                {'stdout': 'hello\n', 'log': ('foo', 'bar'), 'rc': 0})
+
+    def test_decompressUpdate_unknown(self):
+        rc = buildstep.RemoteCommand('shell', {})
+        self.assertRaises(ValueError,
+                lambda : rc._decompressUpdate({'rc': 0}, 'bz2'))
+
+    def test_collectStdout_closed_when_finished(self):
+        self.patch(buildstep.RemoteCommand, 'collectStdoutMemoryLimit', 2)
+        rc = buildstep.RemoteCommand('shell', {}, collectStdout=True)
+        rc.deferred = defer.Deferred()
+        rc.remoteUpdate({'stdout': 'hello'})
+        f = rc._collectedStdout.file
+        self.assertNotEqual(f, None)
+        rc._finished()
+        self.assertTrue(f.closed)
+        self.assertEqual(rc.stdout, 'hello')
@@ -0,0 +1,161 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+from twisted.application import service
+from buildbot import config
+from buildbot.process import masternotifier
+from buildbot.test.util import compat
+
+class FakeTransport(service.Service):
+
+    def __init__(self, listen, peers, messageReceived):
+        self.listen = listen
+        self.peers = peers
+        self.messageReceived = messageReceived
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+class MasterNotifier(unittest.TestCase):
+
+    def setUp(self):
+        self.master = mock.Mock()
+        self.master.pollDatabaseChanges.return_value = defer.succeed(None)
+        self.notifier = masternotifier.MasterNotifier(self.master)
+        self.patch(masternotifier.MasterNotifier, 'transports',
+                   dict(fake=FakeTransport))
+        self.notifier.startService()
+
+    def tearDown(self):
+        return self.notifier.stopService()
+
+    def reconfig(self, **notifications):
+        new_config = config.MasterConfig()
+        new_config.notifications.update(notifications)
+        return self.notifier.reconfigService(new_config)
+
+    @defer.inlineCallbacks
+    def test_reconfigService(self):
+        yield self.reconfig()
+        self.assertFalse(self.notifier.active)
+
+        yield self.reconfig(transport='fake', listen='tcp:1234',
+                            peers=['tcp:other:1234'])
+        self.assertTrue(self.notifier.active)
+        transport = self.notifier.transport
+        self.assertEqual((transport.listen, transport.peers),
+                         ('tcp:1234', ['tcp:other:1234']))
+        self.assertTrue(transport.running)
+
+        # an unchanged config keeps the same transport
+        yield self.reconfig(transport='fake', listen='tcp:1234',
+                            peers=['tcp:other:1234'])
+        self.assertIdentical(self.notifier.transport, transport)
+
+        yield self.reconfig()
+        self.assertFalse(self.notifier.active)
+        self.assertFalse(transport.running)
+
+    def test_send_inactive(self):
+        # nothing happens without a transport
+        self.notifier.changeAdded(13)
+
+    @defer.inlineCallbacks
+    def test_send(self):
+        yield self.reconfig(transport='fake')
+        self.notifier.changeAdded(13)
+        self.notifier.buildsetAdded(20, dict(bldr=21))
+        self.notifier.buildRequestUnclaimed(20, 21, 'bldr')
+        self.assertEqual(self.notifier.transport.sent, [
+            dict(type='change', changeid=13),
+            dict(type='buildset', bsid=20, brids=dict(bldr=21)),
+            dict(type='buildrequest', bsid=20, brid=21, buildername='bldr'),
+        ])
+
+    def test_receive_change(self):
+        self.notifier.messageReceived(dict(type='change', changeid=13))
+        self.master.pollDatabaseChanges.assert_called_with()
+
+    def test_receive_buildset(self):
+        self.notifier.messageReceived(dict(type='buildset', bsid=20,
+                                           brids=dict(bldr=21)))
+        self.master.buildRequestAdded.assert_called_with(bsid=20, brid=21,
+                buildername='bldr')
+
+    def test_receive_buildrequest(self):
+        self.notifier.messageReceived(dict(type='buildrequest', bsid=20,
+                                           brid=21, buildername='bldr'))
+        self.master.buildRequestAdded.assert_called_with(bsid=20, brid=21,
+                buildername='bldr')
+
+    def test_receive_unknown(self):
+        self.notifier.messageReceived(dict(type='birthday'))
+        self.assertFalse(self.master.pollDatabaseChanges.called)
+        self.assertFalse(self.master.buildRequestAdded.called)
+
+    @compat.usesFlushLoggedErrors
+    def test_receive_invalid(self):
+        self.notifier.messageReceived(dict(type='buildrequest'))
+        self.assertEqual(len(self.flushLoggedErrors(KeyError)), 1)
+
+class SocketTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+        self.services = []
+
+    def tearDown(self):
+        return defer.gatherResults([ s.stopService() for s in self.services ])
+
+    def makeTransport(self, listen, peers):
+        t = masternotifier.SocketTransport(listen, peers, self.received.append)
+        t.startService()
+        self.services.append(t)
+        return t
+
+    @defer.inlineCallbacks
+    def waitFor(self, condition):
+        for i in xrange(500):
+            if condition():
+                return
+            yield task.deferLater(reactor, 0.01, lambda : None)
+        self.fail("timed out")
+
+    @defer.inlineCallbacks
+    def test_send(self):
+        path = os.path.abspath(self.mktemp())
+        self.makeTransport('unix:' + path, [])
+        sender = self.makeTransport(None, [ 'unix:' + path ])
+
+        yield self.waitFor(lambda : sender.factories[0].connections)
+        sender.send(dict(type='change', changeid=13))
+        sender.send(dict(type='buildset', bsid=20, brids=dict(bldr=21)))
+        yield self.waitFor(lambda : len(self.received) == 2)
+        self.assertEqual(self.received, [
+            dict(type='change', changeid=13),
+            dict(type='buildset', bsid=20, brids=dict(bldr=21)),
+        ])
+
+    def test_send_unconnected(self):
+        # notifications for unreachable peers are dropped
+        path = os.path.abspath(self.mktemp())
+        sender = self.makeTransport(None, [ 'unix:' + path ])
+        sender.send(dict(type='change', changeid=13))
+        self.assertEqual(self.received, [])
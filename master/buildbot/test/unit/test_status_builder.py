@@ -0,0 +1,106 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import gc
+from twisted.trial import unittest
+from buildbot.process import metrics
+from buildbot.status import builder
+from buildbot.test.fake import fakemaster
+from buildbot.util import lru
+
+class BuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master()
+        self.master.config.caches['Builds'] = 3
+        self.master.config.metrics = dict(log_interval=0, periodic_interval=0)
+        self.observer = metrics.MetricLogObserver()
+        self.observer.parent = self.master
+        self.observer.startService()
+        self.observer.reconfigService(self.master.config)
+
+        self.builder = builder.BuilderStatus('bldr', None, self.master)
+        self.builder.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.builder.basedir)
+        self.builder.determineNextBuildNumber()
+        for i in range(6):
+            bs = self.builder.newBuild()
+            bs.buildStarted(None)
+            bs.buildFinished()
+        del bs
+
+        # start over with an empty cache
+        self.builder.buildCache = lru.LRUCache(self.builder.cacheMiss)
+        gc.collect()
+
+    def tearDown(self):
+        if self.observer.running:
+            self.observer.stopService()
+
+    def getCounters(self):
+        counters = self.observer.asDict()['counters']
+        return dict([ (k, counters.get('buildCache.' + k, 0))
+                      for k in ('hits', 'misses', 'evictions') ])
+
+    def test_getBuildByNumber(self):
+        for i in range(6):
+            self.assertEqual(self.builder.getBuildByNumber(i).number, i)
+        self.assertEqual(self.getCounters(),
+                         dict(hits=0, misses=6, evictions=3))
+        self.assertEqual(len(self.builder.buildCache.cache), 3)
+
+        self.assertEqual(self.builder.getBuildByNumber(5).number, 5)
+        self.assertEqual(self.getCounters(),
+                         dict(hits=1, misses=6, evictions=3))
+
+    def test_getBuildByNumber_weakref(self):
+        b0 = self.builder.getBuildByNumber(0)
+        for i in range(1, 6):
+            self.builder.getBuildByNumber(i)
+        # build 0 has been evicted, but is still referenced here
+        self.assertIdentical(self.builder.getBuildByNumber(0), b0)
+        self.assertEqual(len(self.builder.buildCache.cache), 3)
+
+    def test_getBuildByNumber_missing(self):
+        self.assertRaises(IndexError, lambda :
+                self.builder.getBuildByNumber(10))
+
+    def test_cache_size_reconfig(self):
+        for i in range(6):
+            self.builder.getBuildByNumber(i)
+        self.master.config.caches['Builds'] = 1
+        self.builder.getBuildByNumber(5)
+        self.assertEqual(self.builder.buildCache.cache.keys(), [5])
+        self.assertEqual(self.getCounters()['evictions'], 5)
+
+    def test_getBuildByNumber_upgradeLock(self):
+        # loading a build from disk shares the Versioned upgrade machinery
+        # with the threads loading builder pickles
+        held = []
+        class FakeLock(object):
+            def __enter__(self):
+                held.append(True)
+            def __exit__(self, *exc):
+                held.append(False)
+        self.patch(builder, 'upgradeLock', FakeLock())
+        self.assertEqual(self.builder.getBuildByNumber(2).number, 2)
+        self.assertEqual(held, [True, False])
+
+    def test_getBuild_current(self):
+        bs = self.builder.newBuild()
+        bs.buildStarted(None)
+        self.assertIdentical(self.builder.getBuild(-1), bs)
+        self.assertTrue(bs.number in self.builder.buildCache)
@@ -0,0 +1,248 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import mock
+from twisted.trial import unittest
+from buildbot import interfaces, util
+from buildbot.sourcestamp import SourceStamp
+from buildbot.status import builder, buildindex, master
+from buildbot.status.results import SUCCESS, FAILURE
+from buildbot.test.fake import fakemaster
+from buildbot.util import lru
+
+class BuildIndexMixin(object):
+
+    def setUpBuilder(self, buildIndex):
+        self.master = fakemaster.make_master()
+        self.master.config.buildIndex = buildIndex
+        self.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.basedir)
+        self.now = 0
+        self.patch(util, 'now', lambda : self.now)
+        self.builder = self.makeBuilder()
+        self.loaded = []
+        # record the builds that are loaded from their pickles
+        orig = self.builder.makeBuildFilename
+        def makeBuildFilename(number):
+            self.loaded.append(number)
+            return orig(number)
+        self.builder.makeBuildFilename = makeBuildFilename
+
+    def makeBuilder(self):
+        b = builder.BuilderStatus('bldr', None, self.master)
+        b.basedir = self.basedir
+        b.determineNextBuildNumber()
+        return b
+
+    def makeBuild(self, branch, results, finish=True):
+        bs = self.builder.newBuild()
+        bs.setSourceStamp(SourceStamp(branch=branch, revision='r%d' %
+                                      bs.getNumber()))
+        bs.setSlavename('slave')
+        bs.setText(['build', branch])
+        bs.setResults(results)
+        self.now = 100 * bs.getNumber()
+        step = bs.addStepWithName('compile')
+        step.stepStarted()
+        step.setText(['compiled'])
+        step.stepFinished(results)
+        bs.buildStarted(None)
+        if finish:
+            self.now += 10
+            bs.buildFinished()
+        return bs
+
+    def makeBuilds(self):
+        self.makeBuild('trunk', SUCCESS)
+        self.makeBuild('branch', FAILURE)
+        self.makeBuild('trunk', FAILURE)
+        self.makeBuild('branch', SUCCESS)
+        self.makeBuild('trunk', SUCCESS)
+        self.makeBuild('trunk', SUCCESS, finish=False)
+
+    def forgetBuilds(self):
+        # simulate a restart of the master
+        self.builder.buildCache = lru.LRUCache(self.builder.cacheMiss)
+        self.builder.buildIndex = None
+        del self.loaded[:]
+
+    def finishedNumbers(self, **kwargs):
+        return [ b.getNumber()
+                 for b in self.builder.generateFinishedBuilds(**kwargs) ]
+
+class FileBuildIndex(BuildIndexMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpBuilder('file')
+        self.makeBuilds()
+
+    def test_generateFinishedBuilds(self):
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(), [4, 3, 2, 1, 0])
+        self.assertEqual(self.finishedNumbers(branches=['branch']), [3, 1])
+        self.assertEqual(self.finishedNumbers(num_builds=2), [4, 3])
+        self.assertEqual(self.finishedNumbers(max_buildnum=2), [2, 1, 0])
+        self.assertEqual(self.finishedNumbers(finished_before=300), [2, 1, 0])
+        self.assertEqual(self.finishedNumbers(max_search=3), [4, 3])
+        # none of which loaded a build pickle
+        self.assertEqual(self.loaded, [])
+
+    def test_lazy_build_status(self):
+        self.forgetBuilds()
+        build = self.builder.generateFinishedBuilds(branches=['branch']).next()
+        self.assertTrue(interfaces.IBuildStatus.providedBy(build))
+        self.assertEqual((build.getNumber(), build.getResults(),
+                          build.getText(), build.getTimes()),
+                         (3, SUCCESS, ['build', 'branch'],
+                          (300, 310)))
+        self.assertEqual(self.loaded, [])
+        # details come from the pickle
+        self.assertEqual(build.getSourceStamp().revision, 'r3')
+        self.assertEqual([ s.getName() for s in build.getSteps() ],
+                         ['compile'])
+        self.assertEqual(self.loaded, [3])
+
+    def test_findBuilds(self):
+        index = self.builder.getBuildIndex()
+        def find(**kwargs):
+            return [ s.number for s in index.findBuilds(**kwargs) ]
+        self.assertEqual(find(results=[FAILURE]), [2, 1])
+        self.assertEqual(find(branches=['trunk', 'branch'], results=[SUCCESS]),
+                         [4, 3, 0])
+        self.assertEqual(find(finished_after=210, finished_before=410),
+                         [3, 2])
+        self.assertEqual(find(min_buildnum=1, max_buildnum=3), [3, 2, 1])
+
+    def test_summary(self):
+        summary = self.builder.getBuildSummary(1)
+        self.assertEqual(summary.asTuple(),
+                (1, 100, 110, FAILURE, 'branch', 'r1', 'slave',
+                 ['build', 'branch'],
+                 [('compile', FAILURE, ['compiled'])
+                  + tuple(summary.steps[0][3:])]))
+        # the running build has no summary
+        self.assertEqual(self.builder.getBuildSummary(-1), None)
+
+    def test_persistence(self):
+        self.forgetBuilds()
+        self.assertEqual(self.builder.getBuildSummary(2).branch, 'trunk')
+        self.assertEqual(self.loaded, [])
+
+    def test_unindexed_builds(self):
+        # builds which finished before there was an index are summarized
+        # from their pickles once, and then indexed
+        os.unlink(os.path.join(self.builder.basedir, 'build-index'))
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(branches=['trunk']), [4, 2, 0])
+        self.assertEqual(sorted(self.loaded), [0, 1, 2, 3, 4])
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(branches=['trunk']), [4, 2, 0])
+        self.assertEqual(self.loaded, [])
+
+    def test_prune(self):
+        for number in range(3):
+            os.unlink(self.builder.makeBuildFilename(number))
+        self.forgetBuilds()
+        self.builder.getBuildIndex().pruneBuilds(3)
+        self.assertEqual(self.finishedNumbers(), [4, 3])
+        self.forgetBuilds()
+        index = self.builder.getBuildIndex()
+        numbers = [ s.number for s in index.findBuilds(min_buildnum=3) ]
+        self.assertEqual(numbers, [4, 3])
+
+    def test_rewrite(self):
+        index = self.builder.getBuildIndex()
+        for i in range(200):
+            index.pruneBuilds(0) # no-op
+            index._append(('prune', 0))
+        self.assertTrue(index.records < 120)
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(), [4, 3, 2, 1, 0])
+
+    def test_corrupt_index(self):
+        path = os.path.join(self.builder.basedir, 'build-index')
+        with open(path, 'ab') as f:
+            f.write('garbage')
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(), [4, 3, 2, 1, 0])
+        self.assertEqual(self.loaded, [])
+
+class PickleBuildIndex(BuildIndexMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpBuilder(None)
+        self.makeBuilds()
+
+    def test_index_class(self):
+        self.assertIsInstance(self.builder.getBuildIndex(),
+                              buildindex.PickleBuildIndex)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.builder.basedir, 'build-index')))
+
+    def test_generateFinishedBuilds(self):
+        self.forgetBuilds()
+        self.assertEqual(self.finishedNumbers(), [4, 3, 2, 1, 0])
+        self.assertEqual(self.finishedNumbers(branches=['branch']), [3, 1])
+        self.assertEqual(self.finishedNumbers(max_search=3), [4, 3])
+
+class StatusFinishedBuilds(BuildIndexMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.setUpBuilder('file')
+        self.b1 = self.builder
+        self.b1.name = 'b1'
+        self.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.basedir)
+        self.b2 = self.makeBuilder()
+        self.b2.name = 'b2'
+
+        # b1's builds finish at 10, 110 and 210; b2's out of order
+        for branch in ('trunk', 'branch', 'trunk'):
+            self.makeBuild(branch, SUCCESS)
+        self.builder = self.b2
+        for branch, finished in (('trunk', 50), ('branch', 250),
+                                 ('trunk', 110)):
+            bs = self.makeBuild(branch, SUCCESS, finish=False)
+            self.now = finished
+            bs.buildFinished()
+
+        self.status = master.Status(self.master)
+        self.status.botmaster = mock.Mock()
+        self.status.botmaster.builderNames = ['b1', 'b2']
+        self.status.botmaster.builders = dict(
+                b1=mock.Mock(builder_status=self.b1),
+                b2=mock.Mock(builder_status=self.b2))
+
+    def finished(self, **kwargs):
+        return [ (b.getBuilder().getName(), b.getNumber())
+                 for b in self.status.generateFinishedBuilds(**kwargs) ]
+
+    def test_merge(self):
+        self.assertEqual(self.finished(),
+                [('b1', 2), ('b2', 2), ('b2', 1), ('b1', 1), ('b2', 0),
+                 ('b1', 0)])
+
+    def test_filters(self):
+        self.assertEqual(self.finished(branches=['branch']),
+                [('b2', 1), ('b1', 1)])
+        self.assertEqual(self.finished(builders=['b1'], num_builds=2),
+                [('b1', 2), ('b1', 1)])
+        self.assertEqual(self.finished(finished_before=110),
+                [('b2', 0), ('b1', 0)])
+        # none of which loaded a build pickle from b1
+        self.assertEqual(self.loaded, [])
@@ -0,0 +1,147 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+from twisted.trial import unittest
+from buildbot.status import buildmanifest, builder
+from buildbot.test.fake import fakemaster
+from buildbot.util import lru
+
+class BuildManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.basedir)
+
+    def touch(self, *filenames):
+        for filename in filenames:
+            open(os.path.join(self.basedir, filename), "w").close()
+
+    def listFiles(self):
+        return sorted(fn for fn in os.listdir(self.basedir)
+                      if fn != buildmanifest.BuildManifest.filename)
+
+    def reload(self):
+        return buildmanifest.BuildManifest(self.basedir)
+
+    def test_empty(self):
+        m = buildmanifest.BuildManifest(self.basedir)
+        self.assertEqual(m.getNextBuildNumber(), 0)
+        self.assertEqual(m.getBuildNumbers(), [])
+
+    def test_scan(self):
+        self.touch('0', '1', '1-log-compile-stdio', '1-log-test-stdio.bz2',
+                   '3-log-compile-stdio', 'builder', 'build-index')
+        m = buildmanifest.BuildManifest(self.basedir)
+        self.assertEqual(m.getBuildNumbers(), [0, 1])
+        # build 3 started, but its pickle was never written
+        self.assertEqual(m.getNextBuildNumber(), 4)
+        self.assertEqual(m.logs[1],
+                ['1-log-compile-stdio', '1-log-test-stdio.bz2'])
+        # the scan is not repeated
+        self.touch('7')
+        self.assertEqual(self.reload().getBuildNumbers(), [0, 1])
+
+    def test_persistence(self):
+        m = buildmanifest.BuildManifest(self.basedir)
+        m.addBuild(0)
+        m.addLogs(0, ['0-log-a-stdio'])
+        m.addBuild(1)
+        m.addLogs(1, ['1-log-a-stdio'])
+        m.addLogs(1, ['1-log-a-stdio', '1-log-b-stdio'])
+        m = self.reload()
+        self.assertEqual(m.getBuildNumbers(), [0, 1])
+        self.assertEqual(m.getNextBuildNumber(), 2)
+        self.assertEqual(m.logs, {0 : ['0-log-a-stdio'],
+                                  1 : ['1-log-a-stdio', '1-log-b-stdio']})
+
+    def test_corrupt(self):
+        m = buildmanifest.BuildManifest(self.basedir)
+        m.addBuild(0)
+        with open(m._getPath(), "ab") as f:
+            f.write("garbage")
+        self.assertEqual(self.reload().getBuildNumbers(), [0])
+
+    def test_prune(self):
+        m = buildmanifest.BuildManifest(self.basedir)
+        for n in range(5):
+            self.touch('%d' % n, '%d-log-a-stdio.gz' % n)
+            m.addBuild(n)
+            m.addLogs(n, ['%d-log-a-stdio' % n])
+        d = m.prune(2, 4, keep=[1])
+        def check(_):
+            self.assertEqual(self.listFiles(),
+                    ['1', '1-log-a-stdio.gz', '2', '3', '4', '4-log-a-stdio.gz'])
+            self.assertEqual(m.getBuildNumbers(), [1, 2, 3, 4])
+            self.assertEqual(m.logNumbers, [1, 4])
+            m2 = self.reload()
+            self.assertEqual(m2.getBuildNumbers(), [1, 2, 3, 4])
+            self.assertEqual(m2.logNumbers, [1, 4])
+            # only build 1 remains to be pruned
+            return m.prune(2, 4)
+        d.addCallback(check)
+        def checkAgain(_):
+            self.assertEqual(self.listFiles(), ['2', '3', '4',
+                                                '4-log-a-stdio.gz'])
+        d.addCallback(checkAgain)
+        return d
+
+    def test_rewrite_keeps_last_number(self):
+        m = buildmanifest.BuildManifest(self.basedir)
+        for n in range(3):
+            m.addBuild(n)
+        d = m.prune(3, 3)
+        def check(_):
+            m._rewrite()
+            m2 = self.reload()
+            self.assertEqual(m2.getBuildNumbers(), [])
+            self.assertEqual(m2.getNextBuildNumber(), 3)
+        d.addCallback(check)
+        return d
+
+class BuilderPrune(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master()
+        self.builder = builder.BuilderStatus('bldr', None, self.master)
+        self.builder.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.builder.basedir)
+        self.builder.determineNextBuildNumber()
+
+    def test_prune(self):
+        for i in range(5):
+            bs = self.builder.newBuild()
+            step = bs.addStepWithName('compile')
+            step.stepStarted()
+            step.addLog('stdio').finish()
+            bs.buildStarted(None)
+            bs.buildFinished()
+        del bs, step
+        self.builder.buildCache = lru.LRUCache(self.builder.cacheMiss)
+        self.master.config.buildHorizon = 3
+        self.master.config.logHorizon = 1
+        d = self.builder.prune()
+        def check(_):
+            files = sorted(os.listdir(self.builder.basedir))
+            self.assertEqual([ f for f in files if f[0].isdigit() ],
+                    ['2', '3', '4', '4-log-compile-stdio'])
+            # a restarted master continues the numbering
+            self.builder.buildManifest = None
+            self.builder.determineNextBuildNumber()
+            self.assertEqual(self.builder.nextBuildNumber, 5)
+        d.addCallback(check)
+        return d
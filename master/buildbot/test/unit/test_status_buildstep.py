@@ -15,7 +15,7 @@
 
 import os
 from twisted.trial import unittest
-from buildbot.status import builder, master
+from buildbot.status import builder, master, buildmanifest
 from buildbot.test.fake import fakemaster
 
 class TestBuildStepStatus(unittest.TestCase):
@@ -65,3 +65,17 @@ class TestBuildStepStatus(unittest.TestCase):
             [['log_1', ('http://localhost:8080/builders/builder_1/'
                         'builds/0/steps/step_1/logs/log_1')]]
             )
+
+    def testAddLogRecordedInManifest(self):
+        b = self.setupBuilder('builder_1')
+        self.setupStatus(b)
+        bs = b.newBuild()
+        bss1 = bs.addStepWithName('step_1')
+        bss1.stepStarted()
+        bss1.addLog('log_1')
+        bss1.addHTMLLog('log_2', '<b>html</b>')
+        # the manifest on disk lists the logs before the build finishes
+        manifest = buildmanifest.BuildManifest(b.basedir)
+        self.assertEqual(manifest.getBuildNumbers(), [0])
+        self.assertEqual(manifest.logs[0],
+                         ['0-log-step_1-log_1', '0-log-step_1-log_2'])
@@ -45,6 +45,13 @@ class TestLogFileProducer(unittest.TestCase):
         chunks = list(lfp.getChunks())
         self.assertEqual(chunks, [ (0, 'a'), (1, 'xx'), (0, 'c') ])
 
+    def test_getChunks_static_offset(self):
+        lf = self.make_static_logfile("2:0a,3:1xx,4:0cde,")
+        lf._locate = lambda f, channels, field, target : (5, target - 1)
+        lfp = logfile.LogFileProducer(lf, mock.Mock(), [0], 2)
+        chunks = list(lfp.getChunks())
+        self.assertEqual(chunks, [ (0, 'de') ])
+
     # Remainder of LogFileProduer has a wacky interface that's not
     # well-defined, so it's not tested yet
 
@@ -334,3 +341,229 @@ class TestLogFile(unittest.TestCase, dirs.DirsMixin):
         self.config.logCompressionMethod = None
         return self.do_test_compressLog('', expect_comp=False)
 
+
+    def test_compressLog_indexed(self):
+        self.config.logCompressionMethod = 'indexed'
+        self.logfile.addEntry(0, 'hello, world')
+        self.logfile.addEntry(2, 'header')
+        self.logfile.finish()
+        d = self.logfile.compressLog()
+        def check(_):
+            fn = self.logfile.getFilename()
+            self.assertTrue(os.path.exists(fn + '.blk'))
+            self.assertTrue(os.path.exists(fn + '.blk.idx'))
+            self.assertFalse(os.path.exists(fn))
+            self.assertTrue(self.logfile.hasContents())
+            fp = self.logfile.getFile()
+            self.assertEqual(fp.read(), '13:0hello, world,7:2header,')
+            fp.seek(4)
+            self.assertEqual(fp.read(5), 'hello')
+            self.assertEqual(fp.tell(), 9)
+        d.addCallback(check)
+        return d
+
+class TestLogFileRandomAccess(unittest.TestCase, dirs.DirsMixin):
+
+    writeBehind = False
+
+    def setUp(self):
+        step = self.build_step_status = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.master = self.logfile.master = mock.Mock()
+        self.config = self.logfile.master.config = config.MasterConfig()
+        if self.writeBehind:
+            self.config.logWriteBehindSize = 1024
+            self.master.logwriter = logfile.LogWriter()
+        # use small chunks, blocks and index intervals so that the index
+        # actually gets used
+        self.logfile.chunkSize = 50
+        self.patch(logfile.LogIndex, 'interval', 100)
+        self.patch(logfile.BlockLogWriter, 'blocksize', 200)
+        self.expected = { 0 : [], 1 : [] }
+        for i in range(100):
+            chan = i % 3 and 1 or 0
+            line = 'line %d on %d\n' % (i, chan)
+            self.logfile.addEntry(chan, line)
+            self.expected[chan].append(line)
+        self.logfile.addEntry(0, 'partial')
+        self.expected[0].append('partial')
+
+    def tearDown(self):
+        if self.writeBehind:
+            d = self.master.logwriter.waitUntilIdle()
+            d.addCallback(lambda _ : self.tearDownDirs())
+            return d
+        self.tearDownDirs()
+
+    def finish(self, compression):
+        self.logfile.finish()
+        if not compression:
+            return defer.succeed(None)
+        self.config.logCompressionMethod = compression
+        d = self.logfile.compressLog()
+        def forget_index(_):
+            # simulate loading the LogFile from a pickle
+            self.logfile = cPickle.loads(cPickle.dumps(self.logfile))
+            self.logfile.step = self.build_step_status
+            self.logfile.master = self.master
+        d.addCallback(forget_index)
+        return d
+
+    def check(self):
+        lf = self.logfile
+        stdout = self.expected[0]
+        stdout_text = ''.join(stdout)
+        alltext = ''.join(lf.getChunks([0, 1], onlyText=True))
+
+        self.assertEqual(lf.getLineCount([0]), len(stdout) - 1)
+        self.assertEqual(lf.getByteCount([0]), len(stdout_text))
+        self.assertEqual(lf.getByteCount([0, 1]), len(alltext))
+
+        for first in (0, 1, 13, 33):
+            self.assertEqual(lf.getLines(first, first + 5, [0]),
+                             stdout[first:first+5])
+        self.assertEqual(lf.getLines(30, channels=[0]), stdout[30:])
+        self.assertEqual(lf.getLines(40, 50, [0]), [])
+        self.assertEqual(lf.getLines(10, 20, [0, 1]),
+                         alltext.splitlines(True)[10:20])
+
+        for count in (1, 3, 34, 50):
+            self.assertEqual(lf.getTailLines(count, [0]), stdout[-count:])
+        self.assertEqual(lf.getTailLines(0, [0]), [])
+
+        for start, end in ((0, 10), (5, 250), (333, 377), (400, None)):
+            self.assertEqual(lf.getBytes(start, end, [0]),
+                             stdout_text[start:end])
+            self.assertEqual(lf.getBytes(start, end, [0, 1]),
+                             alltext[start:end])
+
+        self.assertEqual(list(lf.readlines(0)), stdout)
+
+        # counting closes the file it reads, unless it is being written to
+        opened = []
+        def getFile():
+            f = logfile.LogFile.getFile(lf)
+            opened.append(f)
+            return f
+        lf.getFile = getFile
+        lf.getByteCount([0])
+        lf.getLineCount([0])
+        del lf.getFile
+        for f in opened:
+            if f is lf.openfile:
+                continue
+            inner = getattr(f, 'datafile', None) or getattr(f, 'diskfile', f)
+            self.assertTrue(inner.closed)
+
+    def test_live(self):
+        self.check()
+
+    def test_finished(self):
+        d = self.finish(None)
+        d.addCallback(lambda _ : self.check())
+        return d
+
+    def test_indexed(self):
+        d = self.finish('indexed')
+        d.addCallback(lambda _ : self.check())
+        return d
+
+    def test_indexed_uses_index(self):
+        d = self.finish('indexed')
+        def check(_):
+            read = []
+            orig = logfile.BlockLogFile._loadBlock
+            def _loadBlock(fp):
+                read.append(fp.pos)
+                return orig(fp)
+            self.patch(logfile.BlockLogFile, '_loadBlock', _loadBlock)
+            self.logfile.getTailLines(1, [0])
+            # the index is in use if only the last block or two are read
+            self.assertTrue(0 < len(read) <= 2)
+        d.addCallback(check)
+        return d
+
+    def test_bz2(self):
+        d = self.finish('bz2')
+        d.addCallback(lambda _ : self.check())
+        return d
+
+
+class TestLogFileRandomAccessWriteBehind(TestLogFileRandomAccess):
+
+    writeBehind = True
+
+class TestLogWriter(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.writer = logfile.LogWriter()
+        self.writer.maxBuffered = 100
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.logfile.master = mock.Mock()
+        self.logfile.master.config = config.MasterConfig()
+        self.logfile.master.config.logWriteBehindSize = 100
+        self.logfile.master.logwriter = self.writer
+
+    def tearDown(self):
+        d = self.writer.waitUntilIdle()
+        d.addCallback(lambda _ : self.tearDownDirs())
+        return d
+
+    def onDisk(self):
+        return open(self.logfile.getFilename()).read()
+
+    def test_read_buffered(self):
+        self.logfile.addEntry(0, 'hello, world')
+        self.logfile._merge()
+        # nothing is written until the reactor gets control
+        self.assertEqual(self.onDisk(), '')
+        fp = self.logfile.getFile()
+        self.assertEqual(fp.read(), '13:0hello, world,')
+        self.assertEqual(self.logfile.getText(), 'hello, world')
+        self.assertEqual(self.logfile.getEncodedLength(), 17)
+        d = self.writer.waitUntilIdle()
+        def check(_):
+            self.assertEqual(self.onDisk(), '13:0hello, world,')
+            self.logfile.addEntry(1, 'more')
+            self.logfile._merge()
+            fp.seek(0)
+            self.assertEqual(fp.read(), '13:0hello, world,5:1more,')
+            fp.seek(11)
+            self.assertEqual(fp.read(10), 'world,5:1m')
+        d.addCallback(check)
+        return d
+
+    def test_finish(self):
+        self.logfile.addEntry(0, 'hello, world')
+        self.logfile.finish()
+        d = self.logfile.waitForWrites()
+        def check(_):
+            self.assertEqual(self.writer.buffered, 0)
+            self.assertEqual(self.logfile._writefile, None)
+            fp = self.logfile.getFile()
+            self.assertEqual(fp.read(), '13:0hello, world,')
+        d.addCallback(check)
+        return d
+
+    def test_throttle(self):
+        producer = mock.Mock()
+        self.logfile.addEntry(0, 'x' * 50)
+        self.logfile._merge()
+        self.writer.throttle(producer)
+        self.assertFalse(producer.pauseProducing.called)
+        self.logfile.addEntry(1, 'y' * 100)
+        self.logfile._merge()
+        self.writer.throttle(producer)
+        self.writer.throttle(producer)
+        self.assertEqual(producer.pauseProducing.call_count, 1)
+        d = self.writer.waitUntilIdle()
+        def check(_):
+            self.assertEqual(self.writer.buffered, 0)
+            producer.resumeProducing.assert_called_with()
+        d.addCallback(check)
+        return d
@@ -17,7 +17,8 @@ from mock import Mock
 from buildbot import config
 from twisted.trial import unittest
 from buildbot.status.results import SUCCESS, FAILURE
-from buildbot.status.mail import MailNotifier
+from buildbot.status.mail import MailNotifier, LogLines
+from buildbot.status import logfile
 from twisted.internet import defer
 from buildbot.test.fake import fakedb
 from buildbot.test.fake.fakebuild import FakeBuildStatus
@@ -40,7 +41,126 @@ class FakeLog(object):
         return self.text
 
 
+def makeLogFile(*chunks):
+    logf = Mock(spec=logfile.LogFile)
+    logf.getName.return_value = 'stdio'
+    logf.getChunks.side_effect = lambda *args, **kwargs : iter(chunks)
+    return logf
+
+
+class TestLogLines(unittest.TestCase):
+
+    def test_iter(self):
+        logf = makeLogFile('one\ntw', 'o\r', '\nthree\rfour\n', 'five')
+        self.assertEqual(list(LogLines(logf)),
+                         ['one', 'two', 'three', 'four', 'five'])
+        self.assertFalse(logf.getText.called)
+
+    def test_iter_getText(self):
+        self.assertEqual(list(LogLines(FakeLog('a\nb\n'))), ['a', 'b'])
+
+    def test_tail(self):
+        logf = makeLogFile()
+        logf.getTailLines.return_value = ['a\rb\n', 'c\n']
+        self.assertEqual(LogLines(logf).tail(2), ['b', 'c'])
+        logf.getTailLines.assert_called_with(2, [logfile.STDOUT,
+                                                 logfile.STDERR])
+        self.assertEqual(LogLines(logf)[-2:], ['b', 'c'])
+        self.assertEqual(LogLines(logf).tail(0), [])
+        self.assertFalse(logf.getChunks.called)
+
+    def test_tail_getText(self):
+        self.assertEqual(LogLines(FakeLog('a\nb\nc')).tail(2), ['b', 'c'])
+
+    def test_grep(self):
+        logf = makeLogFile('ok\nerror: x\nok\n', 'error: y\n')
+        self.assertEqual(LogLines(logf).grep('^error'),
+                         ['error: x', 'error: y'])
+
+    def test_len_and_index(self):
+        logf = makeLogFile('a\nb\nc\n')
+        logf.getTailLines.return_value = ['c\n']
+        lines = LogLines(logf)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1], 'b')
+        self.assertEqual(lines[-1], 'c')
+        self.assertEqual(lines[:2], ['a', 'b'])
+        self.assertEqual(lines[::2], ['a', 'c'])
+        self.assertRaises(IndexError, lambda : lines[3])
+        self.assertTrue(lines)
+        self.assertFalse(LogLines(makeLogFile()))
+
+    def test_len_counted_once(self):
+        logf = makeLogFile('a\nb\nc\n')
+        logf.getTailLines.return_value = ['b\n', 'c\n']
+        lines = LogLines(logf)
+        # the documented pattern for the last lines of a log reads it once,
+        # to count it, and then only its tail
+        self.assertEqual(lines[len(lines)-2:], ['b', 'c'])
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(logf.getChunks.call_count, 1)
+        logf.getTailLines.assert_called_with(2, [logfile.STDOUT,
+                                                 logfile.STDERR])
+
+    def test_sequence_methods(self):
+        lines = LogLines(makeLogFile('a\nb\na\n'))
+        self.assertTrue('b' in lines)
+        self.assertFalse('c' in lines)
+        self.assertEqual(lines.index('a'), 0)
+        self.assertEqual(lines.index('a', 1), 2)
+        self.assertRaises(ValueError, lambda : lines.index('c'))
+        self.assertEqual(lines.count('a'), 2)
+        self.assertEqual(list(reversed(lines)), ['a', 'b', 'a'])
+        self.assertEqual(lines + ['x'], ['a', 'b', 'a', 'x'])
+        self.assertEqual(['x'] + lines, ['x', 'a', 'b', 'a'])
+        self.assertEqual(lines, ['a', 'b', 'a'])
+
+    def test_list_methods(self):
+        logf = makeLogFile('a\nb\nc\n')
+        lines = LogLines(logf)
+        lines.reverse()
+        lines.append('z')
+        lines[0] = 'C'
+        self.assertEqual(list(lines), ['C', 'b', 'a', 'z'])
+        self.assertEqual(lines[-2:], ['a', 'z'])
+        self.assertEqual(len(lines), 4)
+        # the log was read once, and kept
+        self.assertEqual(logf.getChunks.call_count, 1)
+        self.assertFalse(logf.getTailLines.called)
+        self.assertRaises(AttributeError, lambda : lines.nosuchmethod)
+
+
 class TestMailNotifier(unittest.TestCase):
+    def test_log_to_attachment_streams_chunks(self):
+        text = u'\u00E5\u00E4\u00F6 log line\n'.encode('utf-8') * 100
+        # split a multi-byte character between chunks
+        logf = makeLogFile(text[:1], text[1:500], text[500:])
+        mn = MailNotifier('from@example.org', addLogs=True)
+        a = mn.log_to_attachment(logf, 'step.stdio')
+        self.assertEqual(a.get_payload(decode=True), text)
+        self.assertEqual(a.get_content_charset(), 'utf-8')
+        self.assertIn('step.stdio', a['Content-Disposition'])
+        self.assertFalse(logf.getText.called)
+
+    def test_getCustomMesgData_logs_are_lazy(self):
+        build = FakeBuildStatus(name="build")
+        logf = makeLogFile('one\ntwo\n')
+        logf.getStep.return_value.getName.return_value = 'step'
+        logf.getStep.return_value.getResults.return_value = (SUCCESS, [])
+        build.getLogs = lambda : [ logf ]
+        build.getSourceStamp = lambda : None
+        master_status = Mock()
+        master_status.getURLForThing.return_value = 'http://build'
+        mn = MailNotifier('from@example.org')
+        attrs = mn.getCustomMesgData(('all',), 'bldr', build, SUCCESS,
+                                     master_status)
+        (name, url, lines, status), = attrs['logs']
+        self.assertEqual((name, url, status),
+                         ('step.stdio', 'http://build/steps/step/logs/stdio',
+                          SUCCESS))
+        self.assertFalse(logf.getChunks.called)
+        self.assertEqual(list(lines), ['one', 'two'])
+
     def test_createEmail_message_without_patch_and_log_contains_unicode(self):
         builds = [ FakeBuildStatus(name="build") ]
         msgdict = create_msgdict()
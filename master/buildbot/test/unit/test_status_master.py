@@ -13,11 +13,16 @@
 #
 # Copyright Buildbot Team Members
 
+from __future__ import with_statement
+
+import os
+import threading
 import mock
+from cPickle import dump
 from twisted.trial import unittest
 from twisted.internet import defer
-from buildbot.status import master, base
-from buildbot.test.fake import fakedb
+from buildbot.status import master, base, builder
+from buildbot.test.fake import fakedb, fakemaster
 
 class FakeStatusReceiver(base.StatusReceiver):
     pass
@@ -93,3 +98,52 @@ class TestStatus(unittest.TestCase):
         self.assertIdentical(sr0.master, None)
         self.assertIdentical(sr1.master, None)
         self.assertIdentical(sr2.master, None)
+
+    @defer.inlineCallbacks
+    def test_loadBuilders(self):
+        m = fakemaster.make_master()
+        m.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(m.basedir, 'b1'))
+        for fn in ('0', '4', '4-log-compile-stdio'):
+            open(os.path.join(m.basedir, 'b1', fn), 'w').close()
+        status = master.Status(m)
+
+        yield status.loadBuilders([('b1', 'b1'), ('b2', 'b2')])
+
+        self.assertEqual(sorted(status._preloaded.keys()),
+                         [('b1', 'b1'), ('b2', 'b2')])
+        self.assertTrue(os.path.isdir(os.path.join(m.basedir, 'b2')))
+
+        b1 = status.builderAdded('b1', 'b1')
+        self.assertEqual((b1.name, b1.nextBuildNumber), ('b1', 5))
+        b2 = status.builderAdded('b2', 'b2')
+        self.assertEqual((b2.name, b2.nextBuildNumber), ('b2', 0))
+        self.assertEqual(status._preloaded, {})
+
+    @defer.inlineCallbacks
+    def test_loadBuilders_upgraded(self):
+        m = fakemaster.make_master()
+        m.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(m.basedir, 'b1'))
+        # an old builder pickle, which is upgraded when it is loaded
+        self.patch(builder.BuilderStatus, 'persistenceVersion', 0)
+        old = builder.BuilderStatus('b1', None, m)
+        old.basedir = old.status = old.nextBuildNumber = None
+        old.currentBigState = 'offline'
+        old.slavename = 'sl'
+        with open(os.path.join(m.basedir, 'b1', 'builder'), 'wb') as f:
+            dump(old, f)
+        builder.BuilderStatus.persistenceVersion = 1
+        saves = []
+        self.patch(m.statussaver, 'save',
+                lambda obj, filename, description :
+                    saves.append((obj, threading.currentThread())))
+        status = master.Status(m)
+
+        yield status.loadBuilders([('b1', 'b1')])
+
+        # the loader thread does not save the upgraded pickle itself
+        self.assertEqual(saves, [])
+        b1 = status.builderAdded('b1', 'b1')
+        self.assertEqual(b1.slavenames, ['sl'])
+        self.assertEqual(saves, [(b1, threading.currentThread())])
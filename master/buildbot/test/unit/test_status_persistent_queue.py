@@ -144,4 +144,85 @@ class test_Queues(dirs.DirsMixin, unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+    def testDiskQueueSegments(self):
+        q = DiskQueue('fake_dir', maxItems=8, segmentItems=3, syncItems=2)
+        self._test_helper(q)
+        for i in range(7):
+            q.pushItem(i)
+        self.assertEqual(['index', 'segment.0', 'segment.1', 'segment.2'],
+                         sorted(os.listdir('fake_dir')))
+        self.assertEqual([0, 1, 2, 3], q.popChunk(4))
+        # the first segment is gone once all of its items are popped
+        self.assertEqual(['index', 'segment.1', 'segment.2'],
+                         sorted(os.listdir('fake_dir')))
+        self.assertEqual([4, 5, 6], list(q.iterItems()))
+        self.assertEqual([4, 5, 6], q.popChunk())
+
+    def testDiskQueueReload(self):
+        q = DiskQueue('fake_dir', maxItems=8, segmentItems=3)
+        for i in range(5):
+            q.pushItem(i)
+        self.assertEqual([0], q.popChunk(1))
+        q.insertBackChunk([-1])
+        q.save()
+        q = DiskQueue('fake_dir', maxItems=8, segmentItems=3)
+        self.assertEqual(5, q.nbItems())
+        self.assertEqual([-1, 1, 2, 3, 4], q.items())
+        # appending continues in the last segment
+        q.pushItem(5)
+        self.assertEqual([-1, 1, 2, 3, 4, 5], q.popChunk())
+
+    def testDiskQueueCrash(self):
+        # items pushed since the last sync are found by scanning the
+        # segments, ignoring a partially-written record
+        q = DiskQueue('fake_dir', maxItems=8, pickleFn=str, unpickleFn=str,
+                      syncItems=100)
+        for i in range(3):
+            q.pushItem('foo%d' % i)
+        q.save()
+        q.pushItem('foo3')
+        self.assertEqual(['foo0'], q.popChunk(1))
+        q._tail.write('\0\0\0\x10foo')
+        q._tail.flush()
+        q = DiskQueue('fake_dir', maxItems=8, pickleFn=str, unpickleFn=str)
+        # the unsynced pop is repeated, but no pushed item is lost
+        self.assertEqual(['foo0', 'foo1', 'foo2', 'foo3'], q.popChunk())
+
+    def testDiskQueueCrashAfterDrain(self):
+        # a segment drained by pushItem is removed from the index before its
+        # id is used again, whether or not the new segment has the same size
+        for item in ['zzzzzzzzzzz', 'zzzzzzzz']:
+            q = DiskQueue('fake_dir', maxItems=3, pickleFn=str,
+                          unpickleFn=str, segmentItems=3)
+            for i in 'abc':
+                q.pushItem(i)
+            self.assertEqual(['a', 'b'], q.popChunk(2))
+            q.save()
+            q = DiskQueue('fake_dir', maxItems=1, pickleFn=str,
+                          unpickleFn=str, segmentItems=3, syncItems=100)
+            self.assertEqual('c', q.pushItem(item))
+            q._tail.flush()
+            q = DiskQueue('fake_dir', maxItems=1, pickleFn=str,
+                          unpickleFn=str)
+            self.assertEqual([item], q.popChunk())
+
+    def testDiskQueueMigration(self):
+        # state files kept in the same directory are left alone
+        WriteFile(os.path.join('fake_dir', 'state'), 'state')
+        WriteFile(os.path.join('fake_dir', '1'), 'foo1')
+        WriteFile(os.path.join('fake_dir', '2'), 'foo2')
+        q = DiskQueue('fake_dir', 5, pickleFn=str, unpickleFn=str)
+        self.assertEqual(['index', 'segment.0', 'state'],
+                         sorted(os.listdir('fake_dir')))
+        q.pushItem('foo3')
+        self.assertEqual(['foo1', 'foo2', 'foo3'], q.popChunk())
+        os.remove(os.path.join('fake_dir', 'state'))
+
+    def testPersistentQueueIterItems(self):
+        q = PersistentQueue(MemoryQueue(3), DiskQueue('fake_dir', 5))
+        for i in range(6):
+            q.pushItem(i)
+        self.assertEqual([0, 1, 2, 3, 4, 5], list(q.iterItems()))
+        self.assertEqual([0, 1, 2, 3, 4, 5], q.popChunk(6))
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -0,0 +1,130 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import with_statement
+
+import os
+import threading
+from cPickle import load
+from twisted.trial import unittest
+from twisted.internet import threads
+from buildbot.status import saver
+
+class Thing:
+    def __init__(self, value):
+        self.value = value
+        self.items = []
+        self.transient = object()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['transient']
+        return d
+
+class Part:
+    # records the threads it is pickled in
+    threads = []
+    def __getstate__(self):
+        self.threads.append(threading.currentThread())
+        return {}
+
+class StatusSaver(unittest.TestCase):
+
+    def setUp(self):
+        self.saver = saver.StatusSaver()
+        self.basedir = os.path.abspath(self.mktemp())
+        os.mkdir(self.basedir)
+        self.filename = os.path.join(self.basedir, 'thing')
+
+    def tearDown(self):
+        if self.saver.running:
+            return self.saver.stopService()
+
+    def load(self):
+        with open(self.filename, "rb") as f:
+            return load(f)
+
+    def test_save_not_running(self):
+        self.saver.save(Thing('a'), self.filename, 'thing')
+        self.assertEqual(self.load().value, 'a')
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+    def test_save_error(self):
+        self.saver.save(Thing('a'), os.path.join(self.basedir, 'no', 'such'),
+                        'thing')
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+    def test_save_running(self):
+        self.saver.startService()
+        thing = Thing('a')
+        self.saver.save(thing, self.filename, 'thing')
+        self.assertIdentical(self.saver.getPending(self.filename), thing)
+        thing.value = 'b'
+        self.saver.save(thing, self.filename, 'thing')
+        self.assertFalse(os.path.exists(self.filename))
+        d = self.saver.waitUntilIdle()
+        def check(_):
+            self.assertEqual(self.load().value, 'b')
+            self.assertIdentical(self.saver.getPending(self.filename), None)
+        d.addCallback(check)
+        return d
+
+    def test_pickled_on_reactor(self):
+        # the objects a saved object refers to may be changing, so they are
+        # pickled on the reactor and only the data is written by the thread
+        self.saver.startService()
+        thing = Thing('a')
+        thing.items.append(Part())
+        self.patch(Part, 'threads', [])
+        self.saver.save(thing, self.filename, 'thing')
+        d = self.saver.waitUntilIdle()
+        def check(_):
+            self.assertEqual(Part.threads, [threading.currentThread()])
+            self.assertEqual(self.load().value, 'a')
+        d.addCallback(check)
+        return d
+
+    def test_unpicklable(self):
+        self.saver.startService()
+        thing = Thing('a')
+        thing.items.append(lambda : None)
+        self.saver.save(thing, self.filename, 'thing')
+        d = self.saver.waitUntilIdle()
+        def check(_):
+            self.assertFalse(os.path.exists(self.filename))
+            self.assertIdentical(self.saver.getPending(self.filename), None)
+            self.assertEqual(len(self.flushLoggedErrors()), 1)
+        d.addCallback(check)
+        return d
+
+    def test_save_from_thread(self):
+        self.saver.startService()
+        d = threads.deferToThread(self.saver.save, Thing('a'),
+                                  self.filename, 'thing')
+        d.addCallback(lambda _ : self.saver.waitUntilIdle())
+        d.addCallback(lambda _ : self.assertEqual(self.load().value, 'a'))
+        return d
+
+    def test_stopService_flushes(self):
+        self.saver.startService()
+        self.saver.save(Thing('a'), self.filename, 'thing')
+        d = self.saver.stopService()
+        def check(_):
+            self.assertEqual(self.load().value, 'a')
+            # later saves are synchronous
+            self.saver.save(Thing('b'), self.filename, 'thing')
+            self.assertEqual(self.load().value, 'b')
+        d.addCallback(check)
+        return d
@@ -0,0 +1,240 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.web import http, server
+from buildbot.status.web import events
+from buildbot.test.fake.web import FakeRequest
+from buildbot.util import json
+
+class EventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.status = mock.Mock(name='status')
+        self.request = FakeRequest()
+        self.clock = task.Clock()
+        self.patch(events.EventStream, '_reactor', self.clock)
+
+    def makeStream(self, **kwargs):
+        self.stream = events.EventStream(self.status, self.request, **kwargs)
+        self.stream.start()
+        self.request.written = ''
+        return self.stream
+
+    def makeBuilder(self, name, category=None):
+        builder = mock.Mock(name=name)
+        builder.getName.return_value = name
+        builder.getCategory.return_value = category
+        builder.getCurrentBuilds.return_value = []
+        return builder
+
+    def makeBuild(self, builder, number):
+        build = mock.Mock(name='build')
+        build.getBuilder.return_value = builder
+        build.getNumber.return_value = number
+        return build
+
+    def makeLog(self, name):
+        loog = mock.Mock(name='log')
+        loog.getName.return_value = name
+        return loog
+
+    def makeStep(self, name):
+        step = mock.Mock(name='step')
+        step.getName.return_value = name
+        return step
+
+    def getEvents(self):
+        result = []
+        for message in self.request.written.split('\n\n'):
+            if not message:
+                continue
+            event, data = message.split('\n')
+            self.assertTrue(event.startswith('event: '))
+            self.assertTrue(data.startswith('data: '))
+            result.append((event[7:], json.loads(data[6:])))
+        return result
+
+    def test_start(self):
+        self.stream = events.EventStream(self.status, self.request)
+        self.stream.start()
+        self.status.subscribe.assert_called_with(self.stream)
+        self.request.registerProducer.assert_called_with(self.stream, True)
+        self.request.setHeader.assert_any_call('content-type',
+                                               'text/event-stream')
+
+    def test_builder_filter(self):
+        stream = self.makeStream(builders=['b1'])
+        self.assertIdentical(stream.builderAdded('b1', self.makeBuilder('b1')),
+                             stream)
+        self.assertEqual(stream.builderAdded('b2', self.makeBuilder('b2')),
+                         None)
+        self.assertEqual(self.getEvents(),
+                [('builderAdded', dict(builder='b1', category=None))])
+
+    def test_category_filter(self):
+        stream = self.makeStream(categories=['fast'])
+        self.assertEqual(
+                stream.builderAdded('b1', self.makeBuilder('b1', 'slow')),
+                None)
+        self.assertIdentical(
+                stream.builderAdded('b2', self.makeBuilder('b2', 'fast')),
+                stream)
+
+    def test_event_filter(self):
+        stream = self.makeStream(events=['buildFinished'])
+        builder = self.makeBuilder('b1')
+        build = self.makeBuild(builder, 7)
+        build.getText.return_value = ['build', 'successful']
+        stream.builderAdded('b1', builder)
+        # no step events are wanted, so the build is not subscribed to
+        self.assertEqual(stream.buildStarted('b1', build), None)
+        stream.buildFinished('b1', build, 0)
+        self.assertEqual(self.getEvents(),
+                [('buildFinished', dict(builder='b1', number=7, results=0,
+                                        text=['build', 'successful']))])
+
+    def test_step_events(self):
+        stream = self.makeStream()
+        build = self.makeBuild(self.makeBuilder('b1'), 3)
+        step = self.makeStep('compile')
+        self.assertIdentical(stream.buildStarted('b1', build)[0], stream)
+        self.assertIdentical(stream.stepStarted(build, step), stream)
+        stream.stepFinished(build, step, (2, ['failed']))
+        self.assertEqual(self.getEvents(), [
+            ('buildStarted', dict(builder='b1', number=3)),
+            ('stepStarted', dict(builder='b1', number=3, step='compile')),
+            ('stepFinished', dict(builder='b1', number=3, step='compile',
+                                  results=2, text=['failed'])),
+        ])
+
+    def test_logChunk_only_when_asked(self):
+        stream = self.makeStream()
+        build = self.makeBuild(self.makeBuilder('b1'), 3)
+        loog = self.makeLog('stdio')
+        self.assertEqual(stream.logStarted(build, self.makeStep('s'), loog),
+                         None)
+
+        stream = self.makeStream(events=['logChunk'])
+        self.assertIdentical(
+                stream.logStarted(build, self.makeStep('s'), loog), stream)
+
+    def test_logChunk_not_utf8(self):
+        stream = self.makeStream(events=['logChunk'])
+        build = self.makeBuild(self.makeBuilder('b1'), 3)
+        step = self.makeStep('s')
+        loog = self.makeLog('stdio')
+        stream.logChunk(build, step, loog, 0, 'caf\xe9\n')
+        # and once queued
+        stream.pauseProducing()
+        stream.logChunk(build, step, loog, 0, 'caf\xe9\n')
+        stream.resumeProducing()
+        info = dict(builder='b1', number=3, step='s', log='stdio',
+                    channel=0, text=u'caf\ufffd\n')
+        self.assertEqual(self.getEvents(),
+                [('logChunk', info), ('logChunk', info)])
+
+    def test_errors_logged(self):
+        # a failing stream does not raise into the build calling it
+        stream = self.makeStream()
+        def write(data):
+            raise RuntimeError("oh noes")
+        self.request.write = write
+        stream.slaveConnected('s1')
+        stream.pauseProducing()
+        stream.slaveConnected('s2')
+        stream.resumeProducing()
+        builder = self.makeBuilder('b1')
+        builder.getCategory.side_effect = RuntimeError("oh noes")
+        self.assertEqual(stream.builderAdded('b1', builder), None)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 3)
+
+    def test_paused_queues(self):
+        stream = self.makeStream()
+        stream.pauseProducing()
+        stream.slaveConnected('s1')
+        self.assertEqual(self.request.written, '')
+        stream.resumeProducing()
+        self.assertEqual(self.getEvents(),
+                [('slaveConnected', dict(slave='s1'))])
+
+    def test_paused_coalesces(self):
+        stream = self.makeStream()
+        build = self.makeBuild(self.makeBuilder('b1'), 3)
+        stream.pauseProducing()
+        stream.buildETAUpdate(build, 30)
+        stream.slaveConnected('s1')
+        stream.buildETAUpdate(build, 20)
+        stream.resumeProducing()
+        self.assertEqual(self.getEvents(), [
+            ('buildETAUpdate', dict(builder='b1', number=3, eta=20)),
+            ('slaveConnected', dict(slave='s1')),
+        ])
+
+    def test_paused_drops_oldest(self):
+        stream = self.makeStream(maxBuffered=2)
+        stream.pauseProducing()
+        for i in range(5):
+            stream.slaveConnected('s%d' % i)
+        stream.resumeProducing()
+        self.assertEqual(self.getEvents(), [
+            ('dropped', dict(count=3)),
+            ('slaveConnected', dict(slave='s3')),
+            ('slaveConnected', dict(slave='s4')),
+        ])
+
+    def test_keepalive(self):
+        self.makeStream(keepaliveInterval=30)
+        self.clock.advance(30)
+        self.assertEqual(self.request.written, ': keepalive\n\n')
+
+    def test_stop(self):
+        stream = self.makeStream(events=['logChunk'])
+        builder = self.makeBuilder('b1')
+        build = self.makeBuild(builder, 3)
+        step = self.makeStep('s')
+        loog = self.makeLog('stdio')
+        stream.builderAdded('b1', builder)
+        stream.buildStarted('b1', build)
+        stream.stepStarted(build, step)
+        stream.logStarted(build, step, loog)
+        stream.stopProducing()
+        self.status.unsubscribe.assert_called_with(stream)
+        for watched in builder, build, step, loog:
+            watched.unsubscribe.assert_called_with(stream)
+        # nothing is written once stopped
+        stream.slaveConnected('s1')
+        self.assertEqual(self.request.written, '')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+class EventStreamResource(unittest.TestCase):
+
+    def test_render(self):
+        status = mock.Mock(name='status')
+        rsrc = events.EventStreamResource(status)
+        req = FakeRequest(dict(builder=['b1'], event=['buildStarted']))
+        self.assertEqual(rsrc.render_GET(req), server.NOT_DONE_YET)
+        stream = status.subscribe.call_args[0][0]
+        self.assertEqual(stream.builderNames, ['b1'])
+        self.assertEqual(stream.events, set(['buildStarted']))
+        stream.stop()
+
+    def test_render_unknown_event(self):
+        rsrc = events.EventStreamResource(mock.Mock(name='status'))
+        req = FakeRequest(dict(event=['buildStarted', 'nosuch']))
+        self.assertIn('nosuch', rsrc.render_GET(req))
+        req.setResponseCode.assert_called_with(http.BAD_REQUEST)
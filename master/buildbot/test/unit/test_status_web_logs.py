@@ -0,0 +1,150 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.web import http
+from buildbot.status import logfile
+from buildbot.status.web import logs
+from buildbot.test.fake.web import FakeRequest
+from buildbot.test.util import dirs
+from buildbot import config
+
+class ParseRange(unittest.TestCase):
+
+    def test_closed(self):
+        self.assertEqual(logs._parseRange('0-9'), (0, 9))
+
+    def test_open(self):
+        self.assertEqual(logs._parseRange('10-'), (10, None))
+
+    def test_suffix(self):
+        self.assertEqual(logs._parseRange('-10'), (None, 10))
+
+    def test_invalid(self):
+        for spec in ('', '-', '5', 'a-b', '9-3'):
+            self.assertRaises(ValueError, lambda : logs._parseRange(spec))
+
+class TextLog(unittest.TestCase, dirs.DirsMixin):
+
+    def setUp(self):
+        step = mock.Mock(name='build_step_status')
+        self.basedir = step.build.builder.basedir = os.path.abspath('basedir')
+        self.setUpDirs(self.basedir)
+        self.logfile = logfile.LogFile(step, 'testlf', '123-stdio')
+        self.logfile.master = mock.Mock()
+        self.logfile.master.config = config.MasterConfig()
+        self.logfile.addHeader('a header\n')
+        self.text = ''
+        for i in range(10):
+            line = 'line %d\n' % i
+            self.logfile.addEntry(i % 2, line)
+            self.text += line
+
+    def tearDown(self):
+        self.tearDownDirs()
+
+    def render(self, args={}, headers={}):
+        self.logfile.finish()
+        rsrc = logs.TextLog(self.logfile)
+        rsrc.asText = True
+        req = FakeRequest(args)
+        req.getHeader = headers.get
+        rsrc.render_GET(req)
+        req.deferred.addCallback(lambda _ : req)
+        return req.deferred
+
+    def test_whole(self):
+        d = self.render()
+        def check(req):
+            self.assertEqual(req.written, self.text)
+        d.addCallback(check)
+        return d
+
+    def test_tail(self):
+        d = self.render(dict(tail=['2']))
+        def check(req):
+            self.assertEqual(req.written, 'line 8\nline 9\n')
+        d.addCallback(check)
+        return d
+
+    def test_lines(self):
+        d = self.render(dict(lines=['1-2']))
+        def check(req):
+            self.assertEqual(req.written, 'line 1\nline 2\n')
+        d.addCallback(check)
+        return d
+
+    def test_lines_open(self):
+        d = self.render(dict(lines=['8-']))
+        def check(req):
+            self.assertEqual(req.written, 'line 8\nline 9\n')
+        d.addCallback(check)
+        return d
+
+    def test_bytes(self):
+        d = self.render(dict(bytes=['7-13']))
+        def check(req):
+            self.assertEqual(req.written, self.text[7:14])
+        d.addCallback(check)
+        return d
+
+    def test_bytes_suffix(self):
+        d = self.render(dict(bytes=['-3']))
+        def check(req):
+            self.assertEqual(req.written, ' 9\n')
+        d.addCallback(check)
+        return d
+
+    def test_bytes_invalid(self):
+        self.logfile.finish()
+        rsrc = logs.TextLog(self.logfile)
+        req = FakeRequest(dict(bytes=['x-y']))
+        self.assertIn('invalid log range', rsrc.render_GET(req))
+        req.setResponseCode.assert_called_with(http.BAD_REQUEST)
+
+    def test_offset(self):
+        d = self.render(dict(offset=['63']))
+        def check(req):
+            self.assertEqual(req.written, self.text[63:])
+        d.addCallback(check)
+        return d
+
+    def test_range_header(self):
+        d = self.render(headers={'range' : 'bytes=0-6'})
+        def check(req):
+            self.assertEqual(req.written, 'line 0\n')
+            req.setResponseCode.assert_called_with(http.PARTIAL_CONTENT)
+            req.setHeader.assert_any_call('content-range', 'bytes 0-6/70')
+        d.addCallback(check)
+        return d
+
+    def test_range_header_unsatisfiable(self):
+        d = self.render(headers={'range' : 'bytes=100-'})
+        def check(req):
+            self.assertEqual(req.written, '')
+            req.setResponseCode.assert_called_with(
+                    http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader.assert_any_call('content-range', 'bytes */70')
+        d.addCallback(check)
+        return d
+
+    def test_range_header_multiple(self):
+        d = self.render(headers={'range' : 'bytes=0-1,5-6'})
+        def check(req):
+            self.assertEqual(req.written, self.text)
+        d.addCallback(check)
+        return d
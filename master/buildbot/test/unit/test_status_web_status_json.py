@@ -0,0 +1,119 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.web import http
+from buildbot.status.web import status_json
+from buildbot.test.fake.web import FakeRequest
+from buildbot import config
+
+class EtagMatches(unittest.TestCase):
+
+    def test_no_header(self):
+        self.assertFalse(status_json.etagMatches(None, '"a"'))
+
+    def test_match(self):
+        self.assertTrue(status_json.etagMatches('"b", "a"', '"a"'))
+
+    def test_mismatch(self):
+        self.assertFalse(status_json.etagMatches('"b"', '"a"'))
+
+    def test_star(self):
+        self.assertTrue(status_json.etagMatches('*', '"a"'))
+
+class AllBuildsJsonResource(unittest.TestCase):
+
+    def setUp(self):
+        self.builds = {}
+        self.builder_status = mock.Mock(name='builder_status')
+        self.builder_status.master.config = config.MasterConfig()
+        self.builder_status.master.config.caches['Builds'] = 2
+        self.builder_status.getBuild = self.getBuild
+        self.rsrc = status_json.AllBuildsJsonResource(mock.Mock(),
+                                                      self.builder_status)
+
+    def getBuild(self, number):
+        if number < 0:
+            number = len(self.builds) + number
+        if number not in self.builds:
+            build_status = mock.Mock(name='build_status')
+            build_status.getNumber.return_value = number
+            build_status.getSourceStamp.return_value.changes = []
+            build_status.getSteps.return_value = []
+            build_status.isFinished.return_value = True
+            build_status.asDict.return_value = dict(number=number)
+            self.builds[number] = build_status
+        return self.builds[number]
+
+    def render(self, rsrc, args={}, headers={}):
+        req = FakeRequest(args)
+        req.getHeader = headers.get
+        rsrc.render_GET(req)
+        req.deferred.addCallback(lambda _ : req)
+        return req.deferred
+
+    def test_getChild(self):
+        child = self.rsrc.getChildWithDefault('3', FakeRequest())
+        self.assertIdentical(child.build_status, self.builds[3])
+        self.assertEqual(child.level, self.rsrc.level + 1)
+
+    def test_getChild_negative(self):
+        for i in range(3):
+            self.getBuild(i)
+        child = self.rsrc.getChildWithDefault('-1', FakeRequest())
+        self.assertIdentical(child,
+                self.rsrc.getChildWithDefault('2', FakeRequest()))
+
+    def test_getChild_bounded(self):
+        for i in range(10):
+            self.rsrc.getChildWithDefault(str(i), FakeRequest())
+        self.assertEqual(self.rsrc.children.keys(), ['help'])
+        self.assertEqual(sorted(self.rsrc.buildResources.cache.keys()),
+                         [8, 9])
+
+    def test_finished_build_serialized_once(self):
+        child = self.rsrc.getChildWithDefault('0', FakeRequest())
+        d = self.render(child)
+        d.addCallback(lambda _ : self.render(child))
+        def check(req):
+            self.assertEqual(req.written, '{"number":0}')
+            self.assertEqual(self.builds[0].asDict.call_count, 1)
+        d.addCallback(check)
+        return d
+
+    def test_running_build_serialized_each_time(self):
+        child = self.rsrc.getChildWithDefault('0', FakeRequest())
+        self.builds[0].isFinished.return_value = False
+        d = self.render(child)
+        d.addCallback(lambda _ : self.render(child))
+        def check(req):
+            self.assertEqual(req.written, '{"number":0}')
+            self.assertEqual(self.builds[0].asDict.call_count, 2)
+        d.addCallback(check)
+        return d
+
+    def test_if_none_match(self):
+        child = self.rsrc.getChildWithDefault('0', FakeRequest())
+        d = self.render(child)
+        def revalidate(req):
+            etag = dict(c[0] for c in req.setHeader.call_args_list)['ETag']
+            return self.render(child, headers={'if-none-match' : etag})
+        d.addCallback(revalidate)
+        def check(req):
+            self.assertEqual(req.written, '')
+            req.setResponseCode.assert_called_with(http.NOT_MODIFIED)
+        d.addCallback(check)
+        return d
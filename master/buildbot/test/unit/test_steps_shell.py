@@ -514,6 +514,23 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         self.expectLogfile("warnings (1)", "warning: I might fail\n")
         return self.runStep()
 
+    def test_split_chunks(self):
+        # lines are reassembled across chunks and channels, just as they
+        # appear in the text of the log
+        self.setupStep(shell.WarningCountingShellCommand(command=['make']))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='normal\nwarn')
+            + ExpectShell.log('stdio', stdout='ing: one\n', stderr='warning')
+            + ExpectShell.log('stdio', stderr=': two')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 2)
+        self.expectLogfile("warnings (2)", "warning: one\nwarning: two\n")
+        return self.runStep()
+
     def do_test_suppressions(self, step, supps_file='', stdout='',
                                 exp_warning_count=0, exp_warning_log='',
                                 exp_exception=False):
@@ -690,6 +707,24 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         return self.do_test_suppressions(step, '', stdout, 2,
                                          exp_warning_log)
 
+    def test_suppressionIndex(self):
+        index = shell._SuppressionIndex([
+            (re.compile('abc.*'), re.compile('bad'), None, None),
+            (re.compile('abc.*'), None, 10, 20),
+            (None, re.compile('ugly'), None, None),
+            (re.compile('def.*'), None, None, None),
+        ])
+        self.assertTrue(index.isSuppressed('abc.c', 1, 'bad thing'))
+        self.assertTrue(index.isSuppressed('abc.c', 15, 'good thing'))
+        self.assertFalse(index.isSuppressed('abc.c', 25, 'good thing'))
+        self.assertTrue(index.isSuppressed('xyz.c', 25, 'ugly thing'))
+        self.assertFalse(index.isSuppressed('xyz.c', 25, 'bad thing'))
+        self.assertTrue(index.isSuppressed('def.c', None, 'anything'))
+        # without a file name, every suppression applies
+        self.assertTrue(index.isSuppressed(None, None, 'bad thing'))
+        self.assertEqual(sorted(index.fileCache.keys()),
+                         ['abc.c', 'def.c', 'xyz.c'])
+
     def test_warnExtractFromRegexpGroups(self):
         step = shell.WarningCountingShellCommand(command=['make'])
         we = shell.WarningCountingShellCommand.warnExtractFromRegexpGroups
@@ -18,7 +18,14 @@ from __future__ import with_statement
 import tempfile, os
 import shutil
 import tarfile
+try:
+    from hashlib import sha1
+    sha1 = sha1 # make pyflakes happy
+except ImportError:
+    from sha import new as sha1
 from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python import failure
 
 from mock import Mock
 
@@ -48,7 +55,7 @@ class TestFileUpload(unittest.TestCase):
         s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile)
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.13"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -143,6 +150,177 @@ class TestFileUpload(unittest.TestCase):
         s.step_status.addURL.assert_called_once_with(
             os.path.basename(self.destfile), "http://server/file")
 
+    def startUpload(self, version, **kwargs):
+        s = transfer.FileUpload(slavesrc=__file__, masterdest=self.destfile,
+                                **kwargs)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = version
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        s.start()
+
+        for c in s.remote.method_calls:
+            name, command, args = c
+            if command[3] == 'uploadFile':
+                return command[-1]
+        self.fail("No uploadFile command found")
+
+    def testWindow(self):
+        kwargs = self.startUpload("2.16")
+        self.assertEqual(kwargs['window'], 8)
+        writer = kwargs['writer']
+        with open(__file__, "rb") as f:
+            data = f.read()
+        writer.remote_write(data[:100])
+        writer.remote_write(data[100:])
+        writer.remote_close(sha1(data).hexdigest())
+
+        with open(self.destfile, "rb") as dest:
+            self.assertEquals(dest.read(), data)
+
+    def testWindowOldSlave(self):
+        kwargs = self.startUpload("2.15")
+        self.assertNotIn('window', kwargs)
+
+    def testWindowDisabled(self):
+        kwargs = self.startUpload("2.16", window=None)
+        self.assertNotIn('window', kwargs)
+
+    def testChecksumMismatch(self):
+        writer = self.startUpload("2.16")['writer']
+        writer.remote_write("some data")
+        self.assertRaises(ValueError, lambda :
+                writer.remote_close(sha1("other data").hexdigest()))
+        self.assertFalse(os.path.exists(self.destfile))
+        self.assertEqual(writer.tmpname, None)
+
+    def testSkipUnchanged(self):
+        with open(self.destfile, "wb") as f:
+            f.write("old data")
+        d = transfer.fileDigest(self.destfile)
+        def check(digest):
+            kwargs = self.startUpload("2.17", skipUnchanged=True, mode=0600)
+            self.assertEqual(kwargs['digest'], digest)
+            writer = kwargs['writer']
+            tmpname = writer.tmpname
+            writer.remote_unchanged()
+            self.assertFalse(os.path.exists(tmpname))
+            with open(self.destfile, "rb") as dest:
+                self.assertEqual(dest.read(), "old data")
+            self.assertEqual(os.stat(self.destfile).st_mode & 0777, 0600)
+        d.addCallback(check)
+        return d
+
+    def testSkipUnchangedOldSlave(self):
+        kwargs = self.startUpload("2.16", skipUnchanged=True)
+        self.assertNotIn('digest', kwargs)
+
+    def testSkipUnchangedNoCopy(self):
+        kwargs = self.startUpload("2.17", skipUnchanged=True)
+        self.assertNotIn('digest', kwargs)
+
+class TestFileDownload(unittest.TestCase):
+
+    def startDownload(self, version, **kwargs):
+        s = transfer.FileDownload(mastersrc=__file__, slavedest="dest",
+                                  **kwargs)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = version
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+        s.start()
+
+        for c in s.remote.method_calls:
+            name, command, args = c
+            if command[3] == 'downloadFile':
+                return command[-1]
+        self.fail("No downloadFile command found")
+
+    def testWindow(self):
+        kwargs = self.startDownload("2.16")
+        self.assertEqual(kwargs['window'], 8)
+        reader = kwargs['reader']
+        data = reader.remote_read(100) + reader.remote_read(100000)
+        self.assertEqual(reader.remote_close(), sha1(data).hexdigest())
+        with open(__file__, "rb") as f:
+            self.assertEqual(data, f.read())
+
+    def testWindowOldSlave(self):
+        kwargs = self.startDownload("2.15")
+        self.assertNotIn('window', kwargs)
+        kwargs['reader'].remote_close()
+
+    def testCache(self):
+        d = transfer.fileDigest(__file__)
+        def check(digest):
+            kwargs = self.startDownload("2.17", cache=True)
+            self.assertEqual(kwargs['digest'], digest)
+            kwargs['reader'].remote_close()
+        d.addCallback(check)
+        return d
+
+    def testCacheOldSlave(self):
+        kwargs = self.startDownload("2.16", cache=True)
+        self.assertNotIn('digest', kwargs)
+        kwargs['reader'].remote_close()
+
+    def testNoCache(self):
+        kwargs = self.startDownload("2.17")
+        self.assertNotIn('digest', kwargs)
+        kwargs['reader'].remote_close()
+
+class TestFileDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(transfer, '_digests', {})
+        fd, self.filename = tempfile.mkstemp()
+        os.write(fd, "some data")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_digest(self):
+        d = transfer.fileDigest(self.filename)
+        d.addCallback(self.assertEqual, sha1("some data").hexdigest())
+        return d
+
+    def test_missing(self):
+        d = transfer.fileDigest(self.filename + ".missing")
+        d.addCallback(self.assertEqual, None)
+        return d
+
+    def test_computed_once(self):
+        computed = []
+        def compute(path):
+            computed.append(path)
+            return 'digest'
+        self.patch(transfer, '_computeDigest', compute)
+        d = defer.gatherResults([ transfer.fileDigest(self.filename)
+                                  for i in range(3) ])
+        d.addCallback(lambda res : self.assertEqual(res, ['digest'] * 3))
+        d.addCallback(lambda _ : transfer.fileDigest(self.filename))
+        d.addCallback(self.assertEqual, 'digest')
+        d.addCallback(lambda _ : self.assertEqual(computed, [self.filename]))
+        return d
+
+    def test_changed(self):
+        d = transfer.fileDigest(self.filename)
+        def change(_):
+            with open(self.filename, "ab") as f:
+                f.write(" and more")
+            return transfer.fileDigest(self.filename)
+        d.addCallback(change)
+        d.addCallback(self.assertEqual,
+                      sha1("some data and more").hexdigest())
+        return d
+
 class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
     def setUp(self):
         self.destdir = os.path.abspath('destdir')
@@ -168,7 +346,7 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
             archive.addfile(tarfile.TarInfo("test"), StringIO("Hello World!"))
             writer = command.args['writer']
             writer.remote_write(f.getvalue())
-            writer.remote_unpack()
+            return writer.remote_unpack()
 
         self.expectCommands(
             Expect('uploadDirectory', dict(
@@ -180,8 +358,111 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
 
         self.expectOutcome(result=SUCCESS, status_text=["uploading", "srcdir"])
         d = self.runStep()
+        d.addCallback(lambda _ :
+                self.assertTrue(os.path.exists(os.path.join(self.destdir,
+                                                            "test"))))
         return d
 
+class TestDirectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = os.path.abspath('destdir')
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def tearDown(self):
+        if os.path.exists(self.destdir):
+            shutil.rmtree(self.destdir)
+
+    def makeArchive(self, mode='w', **files):
+        from cStringIO import StringIO
+        f = StringIO()
+        archive = tarfile.open(fileobj=f, name='fake.tar', mode=mode)
+        for name, contents in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            archive.addfile(info, StringIO(contents))
+        archive.close()
+        return f.getvalue()
+
+    def test_unpack_gz(self):
+        data = self.makeArchive('w:gz', a="x" * 100000, b="y")
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz')
+        for i in range(0, len(data), 1000):
+            writer.remote_write(data[i:i+1000])
+        d = writer.remote_unpack()
+        def check(_):
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'a')).read(), "x" * 100000)
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'b')).read(), "y")
+        d.addCallback(check)
+        return d
+
+    def test_slow_unpack(self):
+        # writes beyond maxBuffered are not acknowledged until the thread
+        # has caught up
+        self.patch(transfer._DirectoryWriter, 'maxBuffered', 1024)
+        data = self.makeArchive(a="x" * 100000)
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        blocks = [ data[i:i+4096] for i in range(0, len(data), 4096) ]
+        waited = []
+        def write(_=None):
+            if not blocks:
+                return writer.remote_unpack()
+            res = writer.remote_write(blocks.pop(0))
+            if res is not None:
+                waited.append(res)
+            d = defer.maybeDeferred(lambda : res)
+            d.addCallback(write)
+            return d
+        d = write()
+        def check(_):
+            self.assertNotEqual(waited, [])
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'a')).read(), "x" * 100000)
+        d.addCallback(check)
+        return d
+
+    def test_corrupt(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, 'gz')
+        writer.remote_write("not a gzip file")
+        d = writer.remote_unpack()
+        return self.assertFailure(d, tarfile.ReadError)
+
+    def test_cancel(self):
+        data = self.makeArchive(a="x")
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        writer.remote_write(data[:100])
+        writer.cancel()
+        d = writer.extracted
+        def check(_):
+            self.assertIsInstance(writer.result, failure.Failure)
+            # writes after the thread has stopped are ignored
+            self.assertEqual(writer.remote_write(data[100:]), None)
+            self.assertEqual(writer.buffered, 0)
+        d.addCallback(check)
+        return d
+
+    def test_thread_started_by_first_write(self):
+        data = self.makeArchive(a="x")
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        self.assertEqual(writer.thread, None)
+        writer.remote_write(data)
+        self.assertNotEqual(writer.thread, None)
+        d = writer.remote_unpack()
+        d.addCallback(lambda _ :
+            self.assertEqual(
+                open(os.path.join(self.destdir, 'a')).read(), "x"))
+        return d
+
+    def test_cancel_before_write(self):
+        writer = transfer._DirectoryWriter(self.destdir, None, None)
+        writer.cancel()
+        self.assertEqual(writer.thread, None)
+        self.assertIsInstance(writer.result, failure.Failure)
+        self.assertEqual(writer.remote_write("x"), None)
+
 class TestStringDownload(unittest.TestCase):
     def testBasic(self):
         s = transfer.StringDownload("Hello World", "hello.txt")
@@ -354,3 +354,69 @@ class LRUCache(unittest.TestCase):
         self.assertEqual((yield self.lru.get('p')), short('p'))
         self.lru.put('p', set(['P2P2']))
         self.assertEqual((yield self.lru.get('p')), set(['P2P2']))
+
+class SyncLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        lru.inv_failed = False
+        self.lru = lru.LRUCache(short, 3)
+
+    def tearDown(self):
+        self.lru.inv()
+        self.assertFalse(lru.inv_failed, "invariant failed; see logs")
+
+    def test_single_key(self):
+        self.assertEqual(self.lru.get('a'), short('a'))
+        self.assertEqual(self.lru.get('a'), short('a'))
+        self.assertEqual((self.lru.hits, self.lru.misses), (1, 1))
+
+    def test_lru_expulsion(self):
+        for c in 'abcd':
+            self.lru.get(c)
+        gc.collect()
+        self.assertEqual(sorted(self.lru.cache.keys()), ['b', 'c', 'd'])
+        self.assertEqual(self.lru.evictions, 1)
+
+        # touching 'b' makes 'c' the least recently used
+        self.lru.get('b')
+        self.lru.get('e')
+        self.assertEqual(sorted(self.lru.cache.keys()), ['b', 'd', 'e'])
+
+    def test_queue_bounded(self):
+        for i in xrange(1000):
+            self.lru.get('a')
+            self.lru.get('b')
+        self.assertTrue(len(self.lru.queue) <= self.lru.max_queue + 1)
+
+    def test_weakrefs(self):
+        res_a = self.lru.get('a')
+        for c in 'bcdef':
+            self.lru.get(c)
+        self.assertTrue('a' in self.lru)
+        self.assertIdentical(self.lru.get('a'), res_a)
+        self.assertEqual(self.lru.refhits, 1)
+        self.assertEqual(len(self.lru.cache), 3)
+
+    def test_miss_fn_returns_none(self):
+        calls = []
+        def none_miss_fn(k):
+            calls.append(k)
+            return None
+        self.lru.miss_fn = none_miss_fn
+        self.assertEqual(self.lru.get('a'), None)
+        self.assertEqual(self.lru.get('a'), None)
+        self.assertEqual(calls, ['a', 'a'])
+
+    def test_miss_fn_exception(self):
+        def fail_miss_fn(k):
+            raise RuntimeError("oh noes")
+        self.lru.miss_fn = fail_miss_fn
+        self.assertRaises(RuntimeError, lambda : self.lru.get('a'))
+        self.assertFalse('a' in self.lru)
+
+    def test_set_max_size(self):
+        for c in 'abc':
+            self.lru.get(c)
+        self.lru.set_max_size(1)
+        self.assertEqual(self.lru.cache.keys(), ['c'])
+        self.assertEqual(self.lru.evictions, 2)
@@ -0,0 +1,70 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from buildbot.util import outputbuffer
+
+class OutputBuffer(unittest.TestCase):
+
+    def test_empty(self):
+        buf = outputbuffer.OutputBuffer()
+        self.assertEqual((buf.getvalue(), len(buf)), ('', 0))
+
+    def test_append(self):
+        buf = outputbuffer.OutputBuffer()
+        for data in [ 'abc', '', 'def', 'g' ]:
+            buf.append(data)
+        # appending keeps each chunk, rather than joining them
+        self.assertEqual(buf.pieces, [ 'abc', 'def', 'g' ])
+        self.assertEqual((buf.getvalue(), len(buf)), ('abcdefg', 7))
+        self.assertEqual(buf.pieces, [ 'abcdefg' ])
+        buf.append('hi')
+        self.assertEqual(buf.pieces, [ 'abcdefg', 'hi' ])
+        self.assertEqual(buf.getvalue(), 'abcdefghi')
+
+    def test_spill(self):
+        buf = outputbuffer.OutputBuffer(memoryLimit=5)
+        buf.append('abcde')
+        self.assertEqual(buf.file, None)
+        buf.append('f')
+        self.assertNotEqual(buf.file, None)
+        self.assertEqual(buf.pieces, [])
+        buf.append('ghi')
+        self.assertEqual((buf.getvalue(), len(buf)), ('abcdefghi', 9))
+        buf.append('j')
+        self.assertEqual(buf.getvalue(), 'abcdefghij')
+
+    def test_unicode(self):
+        # the value is a byte string, whether or not it has been spilled
+        for memoryLimit in None, 0:
+            buf = outputbuffer.OutputBuffer(memoryLimit=memoryLimit)
+            buf.append(u'\N{SNOWMAN}')
+            buf.append('!')
+            self.assertEqual(buf.getvalue(),
+                             u'\N{SNOWMAN}!'.encode('utf-8'))
+            self.assertEqual(len(buf), 4)
+            buf.close()
+
+    def test_close(self):
+        buf = outputbuffer.OutputBuffer(memoryLimit=2)
+        buf.append('abc')
+        f = buf.file
+        buf.close()
+        self.assertTrue(f.closed)
+        self.assertEqual(buf.file, None)
+        self.assertEqual(buf.getvalue(), 'abc')
+        buf.append('def')
+        self.assertEqual(buf.file, None)
+        self.assertEqual((buf.getvalue(), len(buf)), ('abcdef', 6))
@@ -0,0 +1,96 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import threading
+from twisted.trial import unittest
+from buildbot.util import writebehind
+
+class Writer(writebehind.WriteBehindService):
+
+    def __init__(self):
+        writebehind.WriteBehindService.__init__(self, 'writer')
+        self.waiting = []
+        self.written = []
+        self.batches = []
+
+    def add(self, item):
+        self.waiting.append(item)
+        self._scheduleFlush()
+
+    def _hasPending(self):
+        return bool(self.waiting)
+
+    def _takeBatch(self):
+        batch, self.waiting = self.waiting, []
+        return batch
+
+    def _writeItem(self, item):
+        if item == 'bad':
+            raise RuntimeError("bad item")
+        self.written.append((item, threading.currentThread()))
+
+    def _batchDone(self, batch, results):
+        self.batches.append((batch, [ r is not None for r in results ]))
+        # more writes may be added as a batch finishes
+        if batch == ['a', 'b']:
+            self.add('c')
+
+class WriteBehindService(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = Writer()
+
+    def tearDown(self):
+        if self.writer.running:
+            return self.writer.stopService()
+
+    def test_batches(self):
+        self.writer.startService()
+        self.writer.add('a')
+        self.writer.add('b')
+        self.assertEqual(self.writer.written, [])
+        d = self.writer.waitUntilIdle()
+        def check(_):
+            self.assertEqual(self.writer.batches,
+                    [ (['a', 'b'], [False, False]), (['c'], [False]) ])
+            self.assertEqual([ i for i, t in self.writer.written ],
+                             ['a', 'b', 'c'])
+            for i, t in self.writer.written:
+                self.assertNotIdentical(t, threading.currentThread())
+        d.addCallback(check)
+        return d
+
+    def test_failure(self):
+        self.writer.startService()
+        self.writer.add('bad')
+        self.writer.add('d')
+        d = self.writer.waitUntilIdle()
+        def check(_):
+            self.assertEqual(self.writer.batches,
+                             [ (['bad', 'd'], [True, False]) ])
+        d.addCallback(check)
+        return d
+
+    def test_idle(self):
+        self.assertTrue(self.writer.waitUntilIdle().called)
+
+    def test_stopService_writes_pending(self):
+        self.writer.startService()
+        self.writer.add('d')
+        d = self.writer.stopService()
+        def check(_):
+            self.assertEqual([ i for i, t in self.writer.written ], ['d'])
+        d.addCallback(check)
+        return d
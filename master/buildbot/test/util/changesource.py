@@ -24,6 +24,8 @@ class ChangeSourceMixin(object):
      - starting and stopping a ChangeSource service
      - a fake C{self.master.addChange}, which adds its args
        to the list C{self.changes_added}
+     - a fake C{self.master.addChanges}, which does the same for each
+       change, and adds the number of changes to C{self.change_batches}
     """
 
     changesource = None
@@ -43,8 +45,14 @@ class ChangeSourceMixin(object):
                                 "non-ascii string for key '%s': %r" % (k,v))
             self.changes_added.append(kwargs)
             return defer.succeed(mock.Mock())
+        self.change_batches = []
+        def addChanges(change_kwargs):
+            self.change_batches.append(len(change_kwargs))
+            return defer.gatherResults([ addChange(**kwargs)
+                                         for kwargs in change_kwargs ])
         self.master = mock.Mock()
         self.master.addChange = addChange
+        self.master.addChanges = addChanges
         return defer.succeed(None)
 
     def tearDownChangeSource(self):
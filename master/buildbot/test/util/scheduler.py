@@ -41,9 +41,15 @@ class FakeMaster(object):
         sub.unsubscribe = unsub
         return sub
 
-    def subscribeToChanges(self, callback):
+    def subscribeToChanges(self, callback, change_filter=None):
         assert not self.changes_subscr_cb
-        self.changes_subscr_cb = callback
+        if change_filter is not None:
+            def filtered(change):
+                if change_filter.filter_change(change):
+                    return callback(change)
+            self.changes_subscr_cb = filtered
+        else:
+            self.changes_subscr_cb = callback
         return self._makeSubscription('changes_subscr_cb')
 
     def subscribeToBuildsets(self, callback):
@@ -20,11 +20,16 @@ from twisted.internet import defer
 from collections import deque
 from buildbot.util.bbcollections import defaultdict
 
-class AsyncLRUCache(object):
+class LRUCache(object):
+    """
+    A synchronous least-recently-used cache.  See L{AsyncLRUCache} for the
+    details; this class differs only in that C{miss_fn} returns its value
+    directly, and so does L{get}.
+    """
 
     __slots__ = ('max_size max_queue miss_fn '
-                 'queue cache weakrefs refcount concurrent '
-                 'hits refhits misses'.split())
+                 'queue cache weakrefs refcount '
+                 'hits refhits misses evictions'.split())
     sentinel = object()
     QUEUE_SIZE_FACTOR = 10
 
@@ -35,94 +40,78 @@ class AsyncLRUCache(object):
         self.queue = deque()
         self.cache = {}
         self.weakrefs = WeakValueDictionary()
-        self.concurrent = {}
-        self.hits = self.misses = self.refhits = 0
+        self.hits = self.misses = self.refhits = self.evictions = 0
         self.refcount = defaultdict(lambda : 0)
 
     def get(self, key, **miss_fn_kwargs):
-        cache = self.cache
-        weakrefs = self.weakrefs
-        refcount = self.refcount
-        concurrent = self.concurrent
-        queue = self.queue
-
-        # utility function to record recent use of this key
-        def ref_key():
-            queue.append(key)
-            refcount[key] = refcount[key] + 1
-
-            # periodically compact the queue by eliminating duplicate keys
-            # while preserving order of most recent access.  Note that this
-            # is only required when the cache does not exceed its maximum
-            # size
-            if len(queue) > self.max_queue:
-                refcount.clear()
-                queue_appendleft = queue.appendleft
-                queue_appendleft(self.sentinel)
-                for k in ifilterfalse(refcount.__contains__,
-                                        iter(queue.pop, self.sentinel)):
-                    queue_appendleft(k)
-                    refcount[k] = 1
-
         try:
-            result = cache[key]
-            self.hits += 1
-            ref_key()
-            return defer.succeed(result)
+            return self._get_hit(key)
         except KeyError:
-            try:
-                result = weakrefs[key]
-                self.refhits += 1
-                cache[key] = result
-                ref_key()
-                return defer.succeed(result)
-            except KeyError:
-                # if there's already a fetch going on, add
-                # to the list of waiting deferreds
-                conc = concurrent.get(key)
-                if conc:
-                    self.hits += 1
-                    d = defer.Deferred()
-                    conc.append(d)
-                    return d
+            pass
 
-        # if we're here, we've missed and need to fetch
         self.misses += 1
 
-        # create a list of waiting deferreds for this key
-        d = defer.Deferred()
-        assert key not in concurrent
-        concurrent[key] = [ d ]
+        result = self.miss_fn(key, **miss_fn_kwargs)
+        if result is not None:
+            self.cache[key] = result
+            self.weakrefs[key] = result
+            self._ref_key(key)
+            self._purge()
 
-        miss_d = self.miss_fn(key, **miss_fn_kwargs)
+        return result
 
-        def handle_result(result):
-            if result is not None:
-                cache[key] = result
-                weakrefs[key] = result
+    def keys(self):
+        """
+        Return the keys of all values in the cache, including those which
+        have expired but are still referenced elsewhere.
+        """
+        return self.weakrefs.keys()
 
-                # reference the key once, possibly standing in for multiple
-                # concurrent accesses
-                ref_key()
+    def values(self):
+        """
+        Return all values in the cache, including those which have expired
+        but are still referenced elsewhere.
+        """
+        return self.weakrefs.values()
 
-            self.inv()
-            self._purge()
-
-            # and fire all of the waiting Deferreds
-            dlist = concurrent.pop(key)
-            for d in dlist:
-                d.callback(result)
+    def __contains__(self, key):
+        return key in self.weakrefs
 
-        def handle_failure(f):
-            # errback all of the waiting Deferreds
-            dlist = concurrent.pop(key)
-            for d in dlist:
-                d.errback(f)
+    def _get_hit(self, key):
+        # return the value for key if it is cached, or raise KeyError
+        try:
+            result = self.cache[key]
+            self.hits += 1
+            self._ref_key(key)
+            return result
+        except KeyError:
+            result = self.weakrefs[key]
+            self.refhits += 1
+            self.cache[key] = result
+            self._ref_key(key)
+            self._purge()
+            return result
 
-        miss_d.addCallbacks(handle_result, handle_failure)
-        miss_d.addErrback(log.err)
+    def _ref_key(self, key):
+        # record recent use of this key
+        queue = self.queue
+        refcount = self.refcount
 
-        return d
+        queue.append(key)
+        refcount[key] = refcount[key] + 1
+
+        # periodically compact the queue by eliminating duplicate keys
+        # while preserving order of most recent access.  Note that this
+        # is only required when the cache does not exceed its maximum
+        # size
+        if len(queue) > self.max_queue:
+            refcount.clear()
+            queue_appendleft = queue.appendleft
+            queue_appendleft(self.sentinel)
+            for k in ifilterfalse(refcount.__contains__,
+                                    iter(queue.pop, self.sentinel)):
+                queue_appendleft(k)
+                refcount[k] = 1
 
     def _purge(self):
         if len(self.cache) <= self.max_size:
@@ -142,6 +131,7 @@ class AsyncLRUCache(object):
                 refc = refcount[k] = refcount[k] - 1
             del cache[k]
             del refcount[k]
+            self.evictions += 1
 
     def put(self, key, value):
         if key in self.cache:
@@ -182,5 +172,68 @@ class AsyncLRUCache(object):
             log.msg("      got:", sorted(self.refcount.items()))
             inv_failed = True
 
+class AsyncLRUCache(LRUCache):
+
+    __slots__ = ['concurrent']
+
+    def __init__(self, miss_fn, max_size=50):
+        LRUCache.__init__(self, miss_fn, max_size)
+        self.concurrent = {}
+
+    def get(self, key, **miss_fn_kwargs):
+        cache = self.cache
+        weakrefs = self.weakrefs
+        concurrent = self.concurrent
+
+        try:
+            return defer.succeed(self._get_hit(key))
+        except KeyError:
+            # if there's already a fetch going on, add
+            # to the list of waiting deferreds
+            conc = concurrent.get(key)
+            if conc:
+                self.hits += 1
+                d = defer.Deferred()
+                conc.append(d)
+                return d
+
+        # if we're here, we've missed and need to fetch
+        self.misses += 1
+
+        # create a list of waiting deferreds for this key
+        d = defer.Deferred()
+        assert key not in concurrent
+        concurrent[key] = [ d ]
+
+        miss_d = self.miss_fn(key, **miss_fn_kwargs)
+
+        def handle_result(result):
+            if result is not None:
+                cache[key] = result
+                weakrefs[key] = result
+
+                # reference the key once, possibly standing in for multiple
+                # concurrent accesses
+                self._ref_key(key)
+
+            self.inv()
+            self._purge()
+
+            # and fire all of the waiting Deferreds
+            dlist = concurrent.pop(key)
+            for d in dlist:
+                d.callback(result)
+
+        def handle_failure(f):
+            # errback all of the waiting Deferreds
+            dlist = concurrent.pop(key)
+            for d in dlist:
+                d.errback(f)
+
+        miss_d.addCallbacks(handle_result, handle_failure)
+        miss_d.addErrback(log.err)
+
+        return d
+
 # for tests
 inv_failed = False
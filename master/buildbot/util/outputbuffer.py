@@ -0,0 +1,80 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import tempfile
+
+class OutputBuffer(object):
+    """
+    Accumulate the output of a remote command from a stream of chunks,
+    without the quadratic copying of repeated string concatenation.  Chunks
+    are kept in a list until they exceed C{memoryLimit} bytes, after which
+    they are spilled to a temporary file.  Unicode chunks, as PB may deliver,
+    are encoded as UTF-8, so C{getvalue} always returns a byte string.
+
+    Call C{close} once the command has finished, to release any temporary
+    file; the text is then held in memory and can still be read.
+
+    The slave has its own copy of this class, in L{buildslave.util}, since it
+    cannot depend on the master.
+    """
+
+    def __init__(self, memoryLimit=None):
+        self.memoryLimit = memoryLimit
+        self.pieces = []
+        self.length = 0
+        self.file = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, data):
+        if not data:
+            return
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.length += len(data)
+        if self.file:
+            self.file.write(data)
+            return
+        self.pieces.append(data)
+        if self.memoryLimit is not None and self.length > self.memoryLimit:
+            self._spill()
+
+    def getvalue(self):
+        if self.file:
+            self.file.seek(0)
+            value = self.file.read()
+            self.file.seek(0, 2)
+            return value
+        if len(self.pieces) > 1:
+            # keep the joined value, so that reading it again is cheap
+            self.pieces = [ ''.join(self.pieces) ]
+        if self.pieces:
+            return self.pieces[0]
+        return ''
+
+    def close(self):
+        if self.file:
+            self.pieces = [ self.getvalue() ]
+            self.file.close()
+            self.file = None
+        # anything appended later is kept in memory
+        self.memoryLimit = None
+
+    def _spill(self):
+        self.file = tempfile.TemporaryFile()
+        for data in self.pieces:
+            self.file.write(data)
+        self.pieces = []
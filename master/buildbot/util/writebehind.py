@@ -0,0 +1,118 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import log, threadpool, failure
+from twisted.application import service
+
+class WriteBehindService(service.Service):
+    """
+    Base class for services which collect writes on the reactor and perform
+    them in batches from a dedicated thread, so that a slow disk does not
+    stall the reactor.  A batch is started in the reactor turn after a write
+    is scheduled with L{_scheduleFlush}; writes scheduled while it is being
+    written make up the next batch.
+
+    Subclasses implement:
+
+     - C{_hasPending()}: whether any writes have yet to be written
+     - C{_takeBatch()}: return a list of the writes to make now
+     - C{_writeItem(item)}: perform one write; this runs in the thread, and
+       must touch nothing the reactor is changing
+     - C{_batchDone(batch, results)}: called on the reactor with the batch
+       and, for each item, None or the Failure it raised
+
+    When the service is not running, including during master shutdown once
+    everything pending has been written, batches are written synchronously.
+    """
+
+    def __init__(self, name):
+        self.setName(name)
+        self.pool = threadpool.ThreadPool(minthreads=1, maxthreads=1,
+                                          name=self.__class__.__name__)
+        self.writing = False
+        self._flushCall = None
+        self._idleWaiters = []
+
+    def startService(self):
+        self.pool.start()
+        service.Service.startService(self)
+
+    def stopService(self):
+        # write out everything still pending before stopping the thread;
+        # anything written after that is written synchronously
+        d = self.waitUntilIdle()
+        def stop(_):
+            self.pool.stop()
+            return service.Service.stopService(self)
+        d.addCallback(stop)
+        return d
+
+    def waitUntilIdle(self):
+        """
+        Return a Deferred that will fire when everything pending has been
+        written.
+        """
+        if not self.writing and not self._hasPending():
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._idleWaiters.append(d)
+        return d
+
+    def _scheduleFlush(self):
+        if not self.writing and not self._flushCall:
+            self._flushCall = reactor.callLater(0, self._flush)
+
+    def _flush(self):
+        self._flushCall = None
+        if self.writing or not self._hasPending():
+            return
+        batch = self._takeBatch()
+        if not batch:
+            self._checkIdle()
+            return
+        self.writing = True
+        if self.running:
+            d = threads.deferToThreadPool(reactor, self.pool,
+                                          self._writeBatch, batch)
+        else:
+            d = defer.maybeDeferred(self._writeBatch, batch)
+
+        def done(results):
+            self.writing = False
+            self._batchDone(batch, results)
+            self._checkIdle()
+        d.addCallback(done)
+        d.addErrback(log.err, "while writing in %s" % self.name)
+
+    def _checkIdle(self):
+        if self._hasPending():
+            self._flush()
+            return
+        waiters = self._idleWaiters
+        self._idleWaiters = []
+        for w in waiters:
+            w.callback(None)
+
+    def _writeBatch(self, batch):
+        # this runs in the thread
+        results = []
+        for item in batch:
+            try:
+                self._writeItem(item)
+                results.append(None)
+            except:
+                results.append(failure.Failure())
+        return results
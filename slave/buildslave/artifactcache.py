@@ -0,0 +1,124 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from twisted.python import log
+
+digest_re = re.compile(r"^[0-9a-f]{40}$")
+
+class ArtifactCache(object):
+    """
+    A cache of the files downloaded from the master, shared by all of the
+    builders, in which each file is named by the SHA1 digest of its
+    contents.  When it holds more than C{maxSize} bytes, the least recently
+    used files are removed.
+
+    Its methods copy whole files, so should be called in a thread.
+    """
+
+    def __init__(self, basedir, maxSize):
+        self.basedir = basedir
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+
+    def _getPath(self, digest):
+        if not digest_re.match(digest):
+            raise ValueError("invalid digest %r" % (digest,))
+        return os.path.join(self.basedir, digest)
+
+    def get(self, digest, destpath):
+        """
+        Copy the file with the given digest to C{destpath}.
+
+        @returns: False if it is not in the cache
+        """
+        path = self._getPath(digest)
+        if not os.path.exists(path):
+            return False
+        try:
+            shutil.copyfile(path, destpath)
+            # mark it as recently used
+            os.utime(path, None)
+        except (IOError, OSError):
+            if os.path.exists(path):
+                raise
+            # evicted while it was being copied
+            return False
+        return True
+
+    def add(self, srcpath, digest):
+        """
+        Copy the file at C{srcpath}, whose contents have the given digest,
+        into the cache, removing the least recently used files if it is now
+        too large.
+        """
+        path = self._getPath(digest)
+        if os.path.exists(path):
+            os.utime(path, None)
+            return
+        if os.path.getsize(srcpath) > self.maxSize:
+            return
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        fd, tmpname = tempfile.mkstemp(dir=self.basedir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(srcpath, tmpname)
+        except:
+            os.unlink(tmpname)
+            raise
+        try:
+            os.rename(tmpname, path)
+        except OSError:
+            # another builder added it first (on windows, rename does not
+            # replace an existing file)
+            os.unlink(tmpname)
+            if not os.path.exists(path):
+                raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used files until there are at most
+        C{maxSize} bytes in the cache."""
+        self.lock.acquire()
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self.basedir):
+                if not digest_re.match(name):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.basedir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+            entries.sort()
+            for mtime, size, name in entries:
+                if total <= self.maxSize:
+                    break
+                try:
+                    os.unlink(os.path.join(self.basedir, name))
+                except OSError:
+                    continue
+                log.msg("removed %s from the artifact cache" % name)
+                total -= size
+        finally:
+            self.lock.release()
@@ -17,6 +17,7 @@ import os.path
 import socket
 import sys
 import signal
+import zlib
 
 from twisted.spread import pb
 from twisted.python import log
@@ -28,6 +29,7 @@ import buildslave
 from buildslave.pbutil import ReconnectingPBClientFactory
 from buildslave.commands import registry, base
 from buildslave import monkeypatches
+from buildslave.artifactcache import ArtifactCache
 
 class UnknownCommand(pb.Error):
     pass
@@ -54,9 +56,22 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # if the master supports it (see remote_setUpdateOptions), at most
+    # .updateWindow updates are sent without being acknowledged, and the text
+    # of updates of at least COMPRESS_MIN bytes is compressed with
+    # .updateCompression.  Otherwise, updates are sent as they are produced.
+    updateWindow = None
+    updateCompression = None
+    COMPRESS_MIN = 1024
+
+    # the bot's ArtifactCache, if it has one
+    artifact_cache = None
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        self.queuedMessages = []
+        self.unackedUpdates = 0
 
     def __repr__(self):
         return "<SlaveBuilder '%s' at %d>" % (self.name, id(self))
@@ -92,6 +107,29 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def remote_setMaster(self, remote):
         self.remote = remote
         self.remote.notifyOnDisconnect(self.lostRemote)
+        # a new master connection, which may not support the extensions
+        self.updateWindow = None
+        self.updateCompression = None
+
+    def remote_setUpdateOptions(self, options):
+        """
+        Called by masters which support flow control and compression of
+        updates, after setMaster.  C{options} may contain C{window}, the
+        number of updates that may be unacknowledged at once, and
+        C{compression}, a list of the compression methods the master can
+        decode.  Returns the options that will be used.
+        """
+        window = options.get('window')
+        if isinstance(window, int) and window > 0:
+            self.updateWindow = window
+        else:
+            self.updateWindow = None
+        if 'zlib' in options.get('compression', []):
+            self.updateCompression = 'zlib'
+        else:
+            self.updateCompression = None
+        return dict(window=self.updateWindow,
+                    compression=self.updateCompression)
 
     def remote_print(self, message):
         log.msg("SlaveBuilder.remote_print(%s): message from master: %s" %
@@ -100,10 +138,13 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemote(self, remote):
         log.msg("lost remote")
         self.remote = None
+        self.queuedMessages = []
 
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self.queuedMessages = [ m for m in self.queuedMessages
+                                if m[0] is not remotestep ]
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -182,13 +223,70 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         # the update[1]=0 comes from the leftover 'updateNum', which the
         # master still expects to receive. Provide it to avoid significant
         # interoperability issues between new slaves and old masters.
-        if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
+        if not self.remoteStep:
+            return
+        if self.updateWindow:
+            self.queuedMessages.append((self.remoteStep, "update", data))
+            self._sendQueuedMessages()
+            return
+        update = [data, 0]
+        updates = [update]
+        d = self.remoteStep.callRemote("update", updates)
+        d.addCallback(self.ackUpdate)
+        d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+
+    def _sendQueuedMessages(self):
+        # send queued messages, in order, until the window is full.  The
+        # completion message is queued behind the updates, so that it does
+        # not overtake them.
+        while self.queuedMessages and \
+                self.unackedUpdates < self.updateWindow:
+            remoteStep, method, data = self.queuedMessages.pop(0)
+            if method == "complete":
+                d = remoteStep.callRemote("complete", data)
+                d.addCallback(self.ackComplete)
+                d.addErrback(self._ackFailed, "sendComplete")
+                continue
+            self.unackedUpdates += 1
+            data, compression = self._compressUpdate(data)
+            if compression:
+                d = remoteStep.callRemote("update", [[data, 0]], compression)
+            else:
+                d = remoteStep.callRemote("update", [[data, 0]])
+            d.addBoth(self._updateAcked)
             d.addCallback(self.ackUpdate)
             d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
 
+    def _updateAcked(self, res):
+        # successfully or not, the update is no longer outstanding
+        self.unackedUpdates -= 1
+        if self.updateWindow:
+            self._sendQueuedMessages()
+        return res
+
+    def _compressUpdate(self, data):
+        # compress the text in an update, if that is supported and worthwhile
+        if not self.updateCompression:
+            return data, None
+        texts = {}
+        for k in ('stdout', 'stderr', 'header'):
+            if k in data:
+                texts[k] = data[k]
+        if 'log' in data:
+            texts['log'] = data['log'][1]
+        for k, text in texts.items():
+            if isinstance(text, unicode):
+                texts[k] = text.encode('utf-8')
+        if sum([ len(t) for t in texts.values() ]) < self.COMPRESS_MIN:
+            return data, None
+        data = data.copy()
+        for k, text in texts.items():
+            if k == 'log':
+                data['log'] = (data['log'][0], zlib.compress(text))
+            else:
+                data[k] = zlib.compress(text)
+        return data, self.updateCompression
+
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
 
@@ -218,6 +316,12 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             return
         if self.remoteStep:
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
+            if self.queuedMessages:
+                self.queuedMessages.append((self.remoteStep, "complete",
+                                            failure))
+                self._sendQueuedMessages()
+                self.remoteStep = None
+                return
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
             d.addErrback(self._ackFailed, "sendComplete")
@@ -235,11 +339,17 @@ class Bot(pb.Referenceable, service.MultiService):
     usePTY = None
     name = "bot"
 
-    def __init__(self, basedir, usePTY, unicode_encoding=None):
+    def __init__(self, basedir, usePTY, unicode_encoding=None,
+                 artifact_cache_size=None):
         service.MultiService.__init__(self)
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = unicode_encoding or sys.getfilesystemencoding() or 'ascii'
+        self.artifact_cache = None
+        if artifact_cache_size:
+            self.artifact_cache = ArtifactCache(
+                    os.path.join(basedir, "artifact-cache"),
+                    artifact_cache_size)
         self.builders = {}
 
     def startService(self):
@@ -255,7 +365,7 @@ class Bot(pb.Referenceable, service.MultiService):
 
     def remote_setBuilderList(self, wanted):
         retval = {}
-        wanted_dirs = ["info"]
+        wanted_dirs = ["info", "artifact-cache"]
         for (name, builddir) in wanted:
             wanted_dirs.append(builddir)
             b = self.builders.get(name, None)
@@ -268,6 +378,7 @@ class Bot(pb.Referenceable, service.MultiService):
                 b = SlaveBuilder(name)
                 b.usePTY = self.usePTY
                 b.unicode_encoding = self.unicode_encoding
+                b.artifact_cache = self.artifact_cache
                 b.setServiceParent(self)
                 b.setBuilddir(builddir)
                 self.builders[name] = b
@@ -423,13 +534,15 @@ class BotFactory(ReconnectingPBClientFactory):
 class BuildSlave(service.MultiService):
     def __init__(self, buildmaster_host, port, name, passwd, basedir,
                  keepalive, usePTY, keepaliveTimeout=None, umask=None,
-                 maxdelay=300, unicode_encoding=None, allow_shutdown=None):
+                 maxdelay=300, unicode_encoding=None, allow_shutdown=None,
+                 artifact_cache_size=None):
 
         # note: keepaliveTimeout is ignored, but preserved here for
         # backward-compatibility
 
         service.MultiService.__init__(self)
-        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding)
+        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding,
+                  artifact_cache_size=artifact_cache_size)
         bot.setServiceParent(self)
         self.bot = bot
         if keepalive == 0:
@@ -13,15 +13,70 @@
 #
 # Copyright Buildbot Team Members
 
-import os, tarfile, tempfile
+import os, tarfile, threading
+from collections import deque
+try:
+    from hashlib import sha1
+    sha1 = sha1 # make pyflakes happy
+except ImportError:
+    from sha import new as sha1
 
-from twisted.python import log
-from twisted.internet import defer
+from twisted.python import log, failure
+from twisted.internet import defer, reactor, threads
 
 from buildslave.commands.base import Command
+from buildslave import util
+
+def _fileDigest(path):
+    # this runs in a thread
+    digest = sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(64*1024)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
 
 class TransferCommand(Command):
 
+    # When the master gives a 'window', up to that many blocks are kept in
+    # flight rather than waiting for each to be acknowledged, and the block
+    # size adapts: it doubles, up to maxBlocksize, while blocks are
+    # acknowledged within fastBlockTime seconds, and halves, down to the
+    # original size, when they take longer than slowBlockTime.  A SHA1 of the
+    # data is compared with the master's at the end.
+    #
+    # When the master gives a 'digest', the SHA1 of its copy of the file,
+    # content the other side already has is not transferred.
+    window = None
+    maxBlocksize = 256*1024
+    fastBlockTime = 1.0
+    slowBlockTime = 4.0
+
+    def setupWindow(self, args):
+        self.window = args.get('window')
+        self.digest = args.get('digest')
+        self.minBlocksize = self.blocksize
+        self.checksum = None
+        if self.window is not None or self.digest is not None:
+            self.checksum = sha1()
+
+    def adaptBlocksize(self, elapsed):
+        if elapsed < self.fastBlockTime:
+            self.blocksize = min(self.blocksize * 2,
+                                 max(self.maxBlocksize, self.minBlocksize))
+        elif elapsed > self.slowBlockTime:
+            self.blocksize = max(self.blocksize // 2, self.minBlocksize)
+
+    def _transferFailed(self, why, fire_when_done):
+        self.eof = True
+        if not fire_when_done.called:
+            fire_when_done.errback(why)
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -56,6 +111,9 @@ class SlaveFileUploadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['window']:    number of blocks to keep in flight (optional)
+        - ['digest']:    SHA1 of the master's copy of the file; if it matches,
+                         the file is not sent (optional)
     """
     debug = False
 
@@ -68,6 +126,8 @@ class SlaveFileUploadCommand(TransferCommand):
         self.keepstamp = args.get('keepstamp', False)
         self.stderr = None
         self.rc = 0
+        self.unchanged = False
+        self.setupWindow(args)
 
     def start(self):
         if self.debug:
@@ -96,10 +156,38 @@ class SlaveFileUploadCommand(TransferCommand):
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        def transfer():
+            if self.window is None:
+                self._reactor.callLater(0, self._loop, d)
+            else:
+                self._reactor.callLater(0, self._pipeline, d)
+        if self.digest is not None and self.fp is not None:
+            # the master already has a copy; only send this one if it differs
+            d1 = threads.deferToThread(_fileDigest, self.path)
+            def compare(digest):
+                if digest != self.digest:
+                    transfer()
+                    return
+                self.unchanged = True
+                self.sendStatus({'header':
+                    "\nthe master's copy is identical; not sending it"})
+                d.callback(None)
+            d1.addCallbacks(compare, d.errback)
+        else:
+            transfer()
         def _close_ok(res):
             self.fp = None
-            d1 = self.writer.callRemote("close")
+            if self.unchanged:
+                d1 = self.writer.callRemote("unchanged")
+            elif self.checksum is None:
+                d1 = self.writer.callRemote("close")
+            else:
+                d1 = self.writer.callRemote("close",
+                                            self.checksum.hexdigest())
+                def _close_failed(f):
+                    self.rc = 1
+                    return f
+                d1.addErrback(_close_failed)
             def _utime_ok(res):
                 return self.writer.callRemote("utime", accessed_modified)
             if self.keepstamp:
@@ -133,13 +221,39 @@ class SlaveFileUploadCommand(TransferCommand):
         d.addCallbacks(_done, _err)
         return None
 
-    def _writeBlock(self):
-        """Write a block of data to the remote writer"""
+    def _pipeline(self, fire_when_done):
+        self.eof = False
+        self.inflight = 0
+        d = defer.maybeDeferred(self._fillWindow, fire_when_done)
+        d.addErrback(self._transferFailed, fire_when_done)
+
+    def _fillWindow(self, fire_when_done):
+        while not self.eof and self.inflight < self.window:
+            data = self._nextBlock()
+            if not data:
+                self.eof = True
+                break
+            self.inflight += 1
+            d = self.writer.callRemote('write', data)
+            d.addBoth(self._blockWritten, util.now(self._reactor))
+            d.addCallback(lambda _ : self._fillWindow(fire_when_done))
+            d.addErrback(self._transferFailed, fire_when_done)
+        if self.eof and self.inflight == 0 and not fire_when_done.called:
+            fire_when_done.callback(None)
+
+    def _blockWritten(self, res, sent):
+        self.inflight -= 1
+        if isinstance(res, failure.Failure):
+            return res
+        self.adaptBlocksize(util.now(self._reactor) - sent)
+
+    def _nextBlock(self):
+        """Read the next block of data to send, returning '' at the end"""
 
         if self.interrupted or self.fp is None:
             if self.debug:
-                log.msg('SlaveFileUploadCommand._writeBlock(): end')
-            return True
+                log.msg('SlaveFileUploadCommand._nextBlock(): end')
+            return ''
 
         length = self.blocksize
         if self.remaining is not None and length > self.remaining:
@@ -155,23 +269,167 @@ class SlaveFileUploadCommand(TransferCommand):
             data = self.fp.read(length)
 
         if self.debug:
-            log.msg('SlaveFileUploadCommand._writeBlock(): '+
+            log.msg('SlaveFileUploadCommand._nextBlock(): '+
                     'allowed=%d readlen=%d' % (length, len(data)))
         if len(data) == 0:
             log.msg("EOF: callRemote(close)")
-            return True
+            return ''
 
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
+        if self.checksum is not None:
+            self.checksum.update(data)
+        return data
+
+    def _writeBlock(self):
+        """Write a block of data to the remote writer"""
+
+        data = self._nextBlock()
+        if not data:
+            return True
+
         d = self.writer.callRemote('write', data)
         d.addCallback(lambda res: False)
         return d
 
 
+class _ArchiveStream(object):
+    """
+    A tar archive of a directory, made by a thread and read by the reactor
+    as it is made, so that it need not be stored.  At most C{maxBuffered}
+    bytes of it are kept waiting to be read; beyond that, the thread waits.
+
+    The thread is one of its own, rather than one from the reactor's pool,
+    since it waits on the master for as long as the upload lasts.
+    """
+
+    def __init__(self, path, compress, maxBuffered):
+        self.path = path
+        if compress == 'bz2':
+            self.mode = 'w|bz2'
+        elif compress == 'gz':
+            self.mode = 'w|gz'
+        else:
+            self.mode = 'w|'
+        self.maxBuffered = maxBuffered
+        self.cond = threading.Condition()
+        self.chunks = deque()
+        self.buffered = 0
+        self.closed = False
+        self.done = False
+        self.error = None
+        # (Deferred, length) of a read waiting for data
+        self.waiting = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run,
+                name="DirectoryUpload from '%s'" % self.path)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run(self):
+        # this runs in the thread
+        try:
+            self._archive()
+        except:
+            reactor.callFromThread(self._archived, failure.Failure())
+        else:
+            reactor.callFromThread(self._archived, None)
+
+    def _archive(self):
+        # this runs in a thread
+        archive = tarfile.open(mode=self.mode, fileobj=self)
+        archive.add(self.path, '')
+        archive.close()
+
+    def write(self, data):
+        # called by tarfile, in the thread
+        self.cond.acquire()
+        try:
+            while self.buffered >= self.maxBuffered and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                raise IOError("archive of '%s' abandoned" % self.path)
+            self.chunks.append(data)
+            self.buffered += len(data)
+        finally:
+            self.cond.release()
+        reactor.callFromThread(self._wake)
+
+    def _archived(self, res):
+        if isinstance(res, failure.Failure):
+            self.error = res
+        self.done = True
+        self._wake()
+
+    def read(self, length):
+        """
+        Return a Deferred that fires with up to C{length} bytes of the
+        archive, or '' at its end.  Only one read may be outstanding.
+        """
+        d = defer.Deferred()
+        self.waiting = (d, length)
+        self._wake()
+        return d
+
+    def _wake(self):
+        if self.waiting is None:
+            return
+        d, length = self.waiting
+        self.cond.acquire()
+        try:
+            pieces = []
+            while self.chunks and length > 0:
+                chunk = self.chunks.popleft()
+                if len(chunk) > length:
+                    self.chunks.appendleft(chunk[length:])
+                    chunk = chunk[:length]
+                pieces.append(chunk)
+                length -= len(chunk)
+            data = ''.join(pieces)
+            self.buffered -= len(data)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+        if not data and not self.done:
+            return
+        self.waiting = None
+        if not data and self.error:
+            d.errback(self.error)
+        else:
+            d.callback(data)
+
+    def close(self):
+        """Stop the thread, if it is still making the archive."""
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.chunks.clear()
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+
 class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
+    """
+    Upload a directory from slave to build master, as a tar archive which is
+    sent as it is made.
+    Arguments:
+
+        - ['workdir']:   base directory to use
+        - ['slavesrc']:  name of the slave-side directory to read from
+        - ['writer']:    RemoteReference to a transfer._DirectoryWriter object
+        - ['maxsize']:   max size (in bytes) of archive to write
+        - ['blocksize']: max size for each data block
+        - ['compress']:  None, 'gz' or 'bz2'
+    """
     debug = False
 
+    # blocks of the archive made ahead of the transfer
+    maxBufferedBlocks = 16
+
     def setup(self, args):
         self.workdir = args['workdir']
         self.dirname = args['slavesrc']
@@ -181,6 +439,8 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.compress = args['compress']
         self.stderr = None
         self.rc = 0
+        self.checksum = None
+        self.archive = None
 
     def start(self):
         if self.debug:
@@ -192,22 +452,10 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        fileobj = os.fdopen(fd, 'w')
-        if self.compress == 'bz2':
-            mode='w|bz2'
-        elif self.compress == 'gz':
-            mode='w|gz'
-        else:
-            mode = 'w'
-        archive = tarfile.open(name=self.tarname, mode=mode, fileobj=fileobj)
-        archive.add(self.path, '')
-        archive.close()
-        fileobj.close()
-
-        # Transfer it
-        self.fp = open(self.tarname, 'rb')
+        # make the archive in a thread while it is transferred
+        self.archive = _ArchiveStream(self.path, self.compress,
+                                      self.maxBufferedBlocks * self.blocksize)
+        self.archive.start()
 
         self.sendStatus({'header': "sending %s" % self.path})
 
@@ -221,13 +469,48 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
             d1.addErrback(unpack_err)
             d1.addCallback(lambda ignored: res)
             return d1
-        d.addCallback(unpack)
+        def failed(f):
+            # making or sending the archive failed
+            self.rc = 1
+            return f
+        d.addCallbacks(unpack, failed)
         d.addBoth(self.finished)
         return d
 
+    def _writeBlock(self):
+        """Write the next block of the archive to the remote writer"""
+
+        if self.interrupted:
+            return True
+
+        length = self.blocksize
+        if self.remaining is not None and length > self.remaining:
+            length = self.remaining
+
+        if length <= 0:
+            if self.stderr is None:
+                self.stderr = 'Maximum filesize reached, truncating file \'%s\'' \
+                                % self.path
+                self.rc = 1
+            return True
+
+        d = self.archive.read(length)
+        def write(data):
+            if self.debug:
+                log.msg('SlaveDirectoryUploadCommand._writeBlock(): '+
+                        'allowed=%d readlen=%d' % (length, len(data)))
+            if not data:
+                return True
+            if self.remaining is not None:
+                self.remaining = self.remaining - len(data)
+            d1 = self.writer.callRemote('write', data)
+            d1.addCallback(lambda res: False)
+            return d1
+        d.addCallback(write)
+        return d
+
     def finished(self, res):
-        self.fp.close()
-        os.remove(self.tarname)
+        self.archive.close()
         return TransferCommand.finished(self, res)
 
 
@@ -242,6 +525,10 @@ class SlaveFileDownloadCommand(TransferCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    number of blocks to keep in flight (optional)
+        - ['digest']:    SHA1 of the file; if the builder's artifact cache has
+                         it, it is copied from there rather than read from
+                         the master, unless maxsize is set (optional)
     """
     debug = False
 
@@ -254,12 +541,13 @@ class SlaveFileDownloadCommand(TransferCommand):
         self.mode = args['mode']
         self.stderr = None
         self.rc = 0
+        self.fp = None
+        self.setupWindow(args)
 
     def start(self):
         if self.debug:
             log.msg('SlaveFileDownloadCommand starting')
 
-        # Open file
         self.path = os.path.join(self.builder.basedir,
                                  self.workdir,
                                  os.path.expanduser(self.filename))
@@ -268,6 +556,38 @@ class SlaveFileDownloadCommand(TransferCommand):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        cache = self.builder.artifact_cache
+        # a copy from the cache would not be truncated to maxsize, so only
+        # use it for downloads without a limit
+        if (self.digest is None or cache is None
+                or self.bytes_remaining is not None):
+            return self._download()
+
+        d = threads.deferToThread(cache.get, self.digest, self.path)
+        def get_err(f):
+            log.err(f, "while reading from the artifact cache")
+            return False
+        d.addErrback(get_err)
+        def check(found):
+            if found:
+                return self._fromCache()
+            return self._download()
+        d.addCallback(check)
+        return d
+
+    def _fromCache(self):
+        self.sendStatus({'header':
+            "copied %s from the artifact cache" % self.path})
+        if self.mode is not None:
+            os.chmod(self.path, self.mode)
+        d = self.reader.callRemote('close')
+        d.addErrback(log.err, 'while trying to close reader')
+        d.addCallback(lambda ignored: None)
+        d.addBoth(self.finished)
+        return d
+
+    def _download(self):
+        # Open file
         try:
             self.fp = open(self.path, 'wb')
             if self.debug:
@@ -290,17 +610,38 @@ class SlaveFileDownloadCommand(TransferCommand):
                 log.msg("Cannot open file '%s' for download" % self.path)
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.window is None:
+            self._reactor.callLater(0, self._loop, d)
+        else:
+            self._reactor.callLater(0, self._pipeline, d)
         def _close(res):
             # close the file, but pass through any errors from _loop
             d1 = self.reader.callRemote('close')
+            # the master's checksum covers everything it read, so only
+            # compare it after a complete transfer
+            if (self.checksum is not None and self.rc == 0
+                    and not isinstance(res, failure.Failure)):
+                d1.addCallback(self._verifyChecksum)
             d1.addErrback(log.err, 'while trying to close reader')
             d1.addCallback(lambda ignored: res)
             return d1
         d.addBoth(_close)
+        d.addCallback(self._addToCache)
         d.addBoth(self.finished)
         return d
 
+    def _addToCache(self, res):
+        cache = self.builder.artifact_cache
+        if (cache is None or self.digest is None or self.rc != 0
+                or self.checksum.hexdigest() != self.digest):
+            return res
+        self.fp.close()
+        self.fp = None
+        d = threads.deferToThread(cache.add, self.path, self.digest)
+        d.addErrback(log.err, 'while adding to the artifact cache')
+        d.addCallback(lambda ignored: res)
+        return d
+
     def _loop(self, fire_when_done):
         d = defer.maybeDeferred(self._readBlock)
         def _done(finished):
@@ -313,6 +654,65 @@ class SlaveFileDownloadCommand(TransferCommand):
         d.addCallbacks(_done, _err)
         return None
 
+    def _pipeline(self, fire_when_done):
+        self.eof = False
+        # [requested length, data or None] for each read in flight, in order
+        self.reads = []
+        self.requested = 0
+        d = defer.maybeDeferred(self._fillWindow, fire_when_done)
+        d.addErrback(self._transferFailed, fire_when_done)
+
+    def _fillWindow(self, fire_when_done):
+        # reads count against the window until their data is written
+        while not self.eof and len(self.reads) < self.window:
+            if self.interrupted or self.fp is None:
+                self.eof = True
+                break
+
+            length = self.blocksize
+            if self.bytes_remaining is not None:
+                available = self.bytes_remaining - self.requested
+                if length > available:
+                    length = available
+
+            if length <= 0:
+                if self.reads:
+                    # the reads in flight may yet reach the end of the file
+                    break
+                if self.stderr is None:
+                    self.stderr = "Maximum filesize reached, truncating file '%s'" \
+                                    % self.path
+                    self.rc = 1
+                self.eof = True
+                break
+
+            read = [length, None]
+            self.reads.append(read)
+            self.requested += length
+            d = self.reader.callRemote('read', length)
+            d.addCallback(self._blockRead, read, util.now(self._reactor))
+            d.addCallback(lambda _ : self._fillWindow(fire_when_done))
+            d.addErrback(self._transferFailed, fire_when_done)
+        if self.eof and not self.reads and not fire_when_done.called:
+            fire_when_done.callback(None)
+
+    def _blockRead(self, data, read, sent):
+        read[1] = data
+        self.adaptBlocksize(util.now(self._reactor) - sent)
+        # write what has arrived, in the order it was requested
+        while self.reads and self.reads[0][1] is not None:
+            length, data = self.reads.pop(0)
+            self.requested -= length
+            if self.eof or self.interrupted:
+                continue
+            if self._writeData(data):
+                self.eof = True
+
+    def _verifyChecksum(self, checksum):
+        if checksum != self.checksum.hexdigest():
+            self.stderr = "Checksum mismatch downloading file '%s'" % self.path
+            self.rc = 1
+
     def _readBlock(self):
         """Read a block of data from the remote reader."""
 
@@ -346,6 +746,8 @@ class SlaveFileDownloadCommand(TransferCommand):
         if self.bytes_remaining is not None:
             self.bytes_remaining = self.bytes_remaining - len(data)
             assert self.bytes_remaining >= 0
+        if self.checksum is not None:
+            self.checksum.update(data)
         self.fp.write(data)
         return False
 
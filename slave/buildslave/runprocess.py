@@ -219,6 +219,10 @@ class RunProcess:
     BUFFER_SIZE = 64*1024
     BUFFER_TIMEOUT = 5
 
+    # Output kept for keepStdout and keepStderr is spilled to a temporary
+    # file once it exceeds this many bytes
+    KEEP_MEMORY_LIMIT = 1024*1024
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -243,7 +247,9 @@ class RunProcess:
         @param keepStdout: if True, we keep a copy of all the stdout text
                            that we've seen. This copy is available in
                            self.stdout, which can be read after the command
-                           has finished.
+                           has finished.  Output larger than
+                           KEEP_MEMORY_LIMIT is kept in a temporary file
+                           while the command runs.
         @param keepStderr: same, for stderr
 
         @param usePTY: "slave-config" -> use the SlaveBuilder's usePTY;
@@ -325,6 +331,8 @@ class RunProcess:
         self.maxTimer = None
         self.keepStdout = keepStdout
         self.keepStderr = keepStderr
+        self._keptStdout = None
+        self._keptStderr = None
 
         self.buffered = deque()
         self.buflen = 0
@@ -371,6 +379,20 @@ class RunProcess:
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self.fake_command)
 
+    def _getKept(self, kept, name):
+        if kept is None:
+            raise AttributeError(name)
+        return kept.getvalue()
+
+    stdout = property(lambda self : self._getKept(self._keptStdout, 'stdout'))
+    stderr = property(lambda self : self._getKept(self._keptStderr, 'stderr'))
+
+    def _closeKept(self):
+        # release any temporary files; the kept output can still be read
+        for kept in self._keptStdout, self._keptStderr:
+            if kept is not None:
+                kept.close()
+
     def sendStatus(self, status):
         self.builder.sendUpdate(status)
 
@@ -378,9 +400,9 @@ class RunProcess:
         # return a Deferred which fires (with the exit code) when the command
         # completes
         if self.keepStdout:
-            self.stdout = ""
+            self._keptStdout = util.OutputBuffer(self.KEEP_MEMORY_LIMIT)
         if self.keepStderr:
-            self.stderr = ""
+            self._keptStderr = util.OutputBuffer(self.KEEP_MEMORY_LIMIT)
         self.deferred = defer.Deferred()
         try:
             self._startCommand()
@@ -679,7 +701,7 @@ class RunProcess:
             self._addToBuffers('stdout', data)
 
         if self.keepStdout:
-            self.stdout += data
+            self._keptStdout.append(data)
         if self.timer:
             self.timer.reset(self.timeout)
 
@@ -688,7 +710,7 @@ class RunProcess:
             self._addToBuffers('stderr', data)
 
         if self.keepStderr:
-            self.stderr += data
+            self._keptStderr.append(data)
         if self.timer:
             self.timer.reset(self.timeout)
 
@@ -705,6 +727,7 @@ class RunProcess:
             # this will send the final updates
             w.stop()
         self._sendBuffers()
+        self._closeKept()
         if sig is not None:
             rc = -1
         if self.sendRC:
@@ -731,6 +754,7 @@ class RunProcess:
 
     def failed(self, why):
         self._sendBuffers()
+        self._closeKept()
         log.msg("RunProcess.failed: command failed: %s" % (why,))
         if self.timer:
             self.timer.cancel()
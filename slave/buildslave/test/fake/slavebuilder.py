@@ -27,6 +27,7 @@ class FakeSlaveBuilder:
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = 'utf-8'
+        self.artifact_cache = None
 
     def sendUpdate(self, data):
         if self.debug:
@@ -0,0 +1,82 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import shutil
+try:
+    from hashlib import sha1
+    sha1 = sha1 # make pyflakes happy
+except ImportError:
+    from sha import new as sha1
+
+from twisted.trial import unittest
+
+from buildslave.artifactcache import ArtifactCache
+
+class TestArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.cache = ArtifactCache(os.path.join(self.basedir, 'cache'), 100)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def addFile(self, contents, mtime=None):
+        src = os.path.join(self.basedir, 'src')
+        open(src, 'wb').write(contents)
+        digest = sha1(contents).hexdigest()
+        self.cache.add(src, digest)
+        if mtime is not None:
+            os.utime(os.path.join(self.cache.basedir, digest), (mtime, mtime))
+        return digest
+
+    def get(self, digest):
+        dest = os.path.join(self.basedir, 'dest')
+        if not self.cache.get(digest, dest):
+            return None
+        return open(dest, 'rb').read()
+
+    def test_miss(self):
+        self.assertEqual(self.get(sha1('x').hexdigest()), None)
+
+    def test_add_get(self):
+        digest = self.addFile('x' * 10)
+        self.assertEqual(self.get(digest), 'x' * 10)
+
+    def test_invalid_digest(self):
+        self.assertRaises(ValueError, lambda : self.get('../../etc/passwd'))
+
+    def test_too_large(self):
+        digest = self.addFile('x' * 101)
+        self.assertEqual(self.get(digest), None)
+
+    def test_evict_least_recently_used(self):
+        a = self.addFile('a' * 40, mtime=1000)
+        b = self.addFile('b' * 40, mtime=2000)
+        c = self.addFile('c' * 40, mtime=3000)
+        # only two fit; the oldest is evicted
+        self.assertEqual(self.get(a), None)
+        self.assertEqual(self.get(c), 'c' * 40)
+        os.utime(os.path.join(self.cache.basedir, c), (4000, 4000))
+        # reading b marks it as recently used, so c goes next
+        self.assertEqual(self.get(b), 'b' * 40)
+        self.addFile('d' * 40)
+        self.assertEqual(self.get(c), None)
+        self.assertEqual(self.get(b), 'b' * 40)
@@ -16,6 +16,7 @@
 import os
 import shutil
 import mock
+import zlib
 
 from twisted.trial import unittest
 from twisted.internet import defer, reactor, task
@@ -99,6 +100,23 @@ class TestBot(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_setBuilderList_artifact_cache(self):
+        self.real_bot.stopService()
+        self.real_bot = bot.Bot(self.basedir, False,
+                                artifact_cache_size=1000)
+        self.real_bot.startService()
+        self.bot = FakeRemote(self.real_bot)
+
+        d = self.bot.callRemote("setBuilderList", [ ('mybld', 'myblddir') ])
+        def check(builders):
+            cache = self.real_bot.builders['mybld'].artifact_cache
+            self.assertIdentical(cache, self.real_bot.artifact_cache)
+            self.assertEqual(cache.basedir,
+                             os.path.join(self.basedir, 'artifact-cache'))
+            self.assertEqual(cache.maxSize, 1000)
+        d.addCallback(check)
+        return d
+
     def test_setBuilderList_updates(self):
         d = defer.succeed(None)
 
@@ -175,10 +193,16 @@ class FakeStep(object):
     def wait_for_finish(self):
         return self.finished_d
 
-    def remote_update(self, updates):
+    def remote_update(self, updates, compression=None):
         for update in updates:
             if 'elapsed' in update[0]:
                 update[0]['elapsed'] = 1
+            if compression:
+                assert compression == 'zlib'
+                self.actions.append(["compressed"])
+                for k in ('stdout', 'stderr', 'header'):
+                    if k in update[0]:
+                        update[0][k] = zlib.decompress(update[0][k])
         self.actions.append(["update", updates])
 
     def remote_complete(self, f):
@@ -220,6 +244,28 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         # master is not part of the interface (and, in fact, it does very little)
         return self.sb.callRemote("setMaster", mock.Mock())
 
+    def test_setUpdateOptions(self):
+        d = self.sb.callRemote("setMaster", mock.Mock())
+        d.addCallback(lambda _ : self.sb.callRemote("setUpdateOptions",
+                            dict(window=4, compression=['bz9', 'zlib'])))
+        def check(options):
+            self.assertEqual(options, dict(window=4, compression='zlib'))
+            # a new master connection forgets them
+            return self.sb.callRemote("setMaster", mock.Mock())
+        d.addCallback(check)
+        d.addCallback(lambda _ :
+            self.assertEqual((self.sb.original.updateWindow,
+                              self.sb.original.updateCompression),
+                             (None, None)))
+        return d
+
+    def test_setUpdateOptions_unsupported(self):
+        d = self.sb.callRemote("setUpdateOptions",
+                               dict(window=0, compression=['bz9']))
+        d.addCallback(lambda options :
+            self.assertEqual(options, dict(window=None, compression=None)))
+        return d
+
     def test_shutdown(self):
         # don't *actually* shut down the reactor - that would be silly
         stop = mock.Mock()
@@ -264,6 +310,57 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_startCommand_window(self):
+        st = FakeStep()
+        self.sb.original.updateWindow = 1
+        self.sb.original.updateCompression = 'zlib'
+
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], os.path.join(self.basedir, 'sb', 'workdir'))
+            + { 'hdr' : 'headers' } + { 'stdout' : 'hello\n' * 1000 }
+            + { 'rc' : 0 }
+            + 0,
+        )
+
+        # hold the acknowledgements until the command is complete
+        acks = []
+        orig_update = st.remote_update
+        def remote_update(*args):
+            d = defer.Deferred()
+            d.addCallback(lambda _ : orig_update(*args))
+            acks.append(d)
+            return d
+        st.remote_update = remote_update
+
+        d = defer.succeed(None)
+        def do_start(_):
+            return self.sb.callRemote("startCommand", FakeRemote(st),
+                                      "13", "shell", dict(
+                                                command=[ 'echo', 'hello' ],
+                                                workdir='workdir',
+                                            ))
+        d.addCallback(do_start)
+        def release(_):
+            # only one update has been sent so far
+            self.assertEqual(len(acks), 1)
+            i = 0
+            while i < len(acks):
+                acks[i].callback(None)
+                i += 1
+            return st.wait_for_finish()
+        d.addCallback(release)
+        def check(_):
+            self.assertEqual(st.actions, [
+                         ['update', [[{'hdr': 'headers'}, 0]]],
+                         ['compressed'],
+                         ['update', [[{'stdout': 'hello\n' * 1000}, 0]]],
+                         ['update', [[{'rc': 0}, 0]]],
+                         ['update', [[{'elapsed': 1}, 0]]],
+                         ['complete', None],
+                    ])
+        d.addCallback(check)
+        return d
+
     def test_startCommand_interruptCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -17,7 +17,13 @@ import os
 import sys
 import shutil
 import tarfile
+import threading
 import StringIO
+try:
+    from hashlib import sha1
+    sha1 = sha1 # make pyflakes happy
+except ImportError:
+    from sha import new as sha1
 
 from twisted.trial import unittest
 from twisted.internet import defer, reactor
@@ -26,6 +32,7 @@ from twisted.python import runtime, failure
 from buildslave.test.fake.remote import FakeRemote
 from buildslave.test.util.command import CommandTestMixin
 from buildslave.commands import transfer
+from buildslave.artifactcache import ArtifactCache
 
 class FakeMasterMethods(object):
     # a fake to represent any of:
@@ -45,9 +52,13 @@ class FakeMasterMethods(object):
 
         self.unpack_fail = False
 
+        self.bad_checksum = False
+
         self.written = False
         self.read = False
         self.data = ''
+        self.read_data = ''
+        self.checksum = None
 
     def remote_write(self, data):
         if self.write_out_of_space_at is not None:
@@ -80,6 +91,7 @@ class FakeMasterMethods(object):
             return ''
 
         slice, self.data = self.data[:length], self.data[length:]
+        self.read_data += slice
         if self.delay_read:
             d = defer.Deferred()
             reactor.callLater(0.01, d.callback, slice)
@@ -92,11 +104,23 @@ class FakeMasterMethods(object):
         if self.unpack_fail:
             return defer.fail(failure.Failure(RuntimeError("out of space")))
 
+    def remote_unchanged(self):
+        self.add_update('unchanged')
+
     def remote_utime(self,accessed_modified):
         self.add_update('utime - %s' % accessed_modified[0])
         
-    def remote_close(self):
+    def remote_close(self, checksum=None):
         self.add_update('close')
+        # as a FileWriter, check the slave's checksum; as a FileReader,
+        # return one
+        self.checksum = checksum
+        if self.bad_checksum:
+            if checksum is not None:
+                return defer.fail(failure.Failure(
+                                    ValueError("checksum mismatch")))
+            return 'bad'
+        return sha1(self.read_data).hexdigest()
 
 class TestUploadFile(CommandTestMixin, unittest.TestCase):
 
@@ -273,6 +297,163 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_window(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=32,
+            keepstamp=False,
+            window=4,
+        ))
+        self.cmd.maxBlocksize = 64
+
+        d = self.run_command()
+
+        def check(_):
+            # the block size doubles as blocks are quickly acknowledged
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write 32', 'write 64', 'write 64', 'write 20', 'close',
+                    {'rc': 0}
+                ])
+            data = open(self.datafile, "rb").read()
+            self.assertEqual(self.fakemaster.data, data)
+            self.assertEqual(self.fakemaster.checksum, sha1(data).hexdigest())
+        d.addCallback(check)
+        return d
+
+    def test_window_delayed(self):
+        self.fakemaster.delay_write = True
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.data,
+                             open(self.datafile, "rb").read())
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=100,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write 64', 'write 36', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'" % self.datafile}
+                ])
+        d.addCallback(check)
+        return d
+
+    def test_window_bad_checksum(self):
+        self.fakemaster.bad_checksum = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            window=4,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, ValueError)
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
+    def test_digest_unchanged(self):
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            digest=sha1("this is some data\n" * 10).hexdigest(),
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    {'header':
+                        "\nthe master's copy is identical; not sending it"},
+                    'unchanged',
+                    {'rc': 0}
+                ])
+        d.addCallback(check)
+        return d
+
+    def test_digest_changed(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            digest=sha1("other data").hexdigest(),
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datafile},
+                    'write(s)', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.data, "this is some data\n" * 10)
+            self.assertEqual(self.fakemaster.checksum,
+                             sha1(self.fakemaster.data).hexdigest())
+        d.addCallback(check)
+        return d
+
 class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -365,8 +546,116 @@ class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
         return d
 
-    # this is just a subclass of SlaveUpload, so the remaining permutations
-    # are already tested
+    def test_slow_master(self):
+        # the archive is made no further ahead of the transfer than allowed
+        self.patch(transfer.SlaveDirectoryUploadCommand, 'maxBufferedBlocks', 1)
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+        open(os.path.join(self.datadir, "cc"), "wb").write("c" * 100000)
+        buffered = []
+        orig_write = transfer._ArchiveStream.write
+        def write(archive, data):
+            orig_write(archive, data)
+            buffered.append(archive.buffered)
+        self.patch(transfer._ArchiveStream, 'write', write)
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=4096,
+            compress='gz',
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # tarfile writes in records of up to 10240 bytes
+            self.assertTrue(max(buffered) < 4096 + 10240)
+            f = StringIO.StringIO(self.fakemaster.data)
+            a = tarfile.open(fileobj=f, mode='r:gz')
+            self.assertEqual(a.extractfile('cc').read(), "c" * 100000)
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_own_thread(self):
+        # the archive is made by a thread of its own, rather than one from
+        # the reactor's pool, which it would hold for the whole upload
+        threadNames = []
+        orig_archive = transfer._ArchiveStream._archive
+        def _archive(archive):
+            threadNames.append(threading.currentThread().getName())
+            return orig_archive(archive)
+        self.patch(transfer._ArchiveStream, '_archive', _archive)
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(threadNames,
+                             ["DirectoryUpload from '%s'" % self.datadir])
+        d.addCallback(check)
+        return d
+
+    def test_missing(self):
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='nosuchdir',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, OSError)
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s'
+                        % os.path.join(self.basedir, 'workdir', 'nosuchdir')},
+                    {'rc': 1}
+                ])
+        d.addCallback(check)
+        return d
+
+    def test_truncated(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveDirectoryUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=512,
+            compress=None
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    {'header': 'sending %s' % self.datadir},
+                    'write(s)', 'unpack',
+                    {'rc': 1, 'stderr': "Maximum filesize reached, "
+                                    "truncating file '%s'" % self.datadir}
+                ])
+            self.assertEqual(len(self.fakemaster.data), 1000)
+        d.addCallback(check)
+        return d
+
+    # the rest of the transfer is as for SlaveUpload, so the remaining
+    # permutations are already tested
 
 class TestDownloadFile(CommandTestMixin, unittest.TestCase):
 
@@ -525,3 +814,191 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+    def test_window(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = '1234' * 13
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # the block size doubles as blocks are quickly returned
+            self.assertUpdates([
+                    'read 16', 'read 32', 'read 64', 'read 128', 'close',
+                    {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_window_delayed(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 100 # 1k
+        self.fakemaster.delay_read = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_window_truncated(self):
+        self.fakemaster.data = test_data = 'tenchars--' * 10
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=32,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % os.path.join(self.basedir, '.', 'data')}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data[:50])
+        d.addCallback(check)
+        return d
+
+    def test_window_bad_checksum(self):
+        self.fakemaster.data = 'hi'
+        self.fakemaster.bad_checksum = True
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=0777,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Checksum mismatch downloading file '%s'"
+                                % os.path.join(self.basedir, '.', 'data')}
+                ])
+        d.addCallback(check)
+        return d
+
+    def make_cached_download(self, data, maxsize=None):
+        self.fakemaster.data = data
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=maxsize,
+            blocksize=32,
+            mode=None,
+            digest=sha1(data).hexdigest(),
+        ))
+        self.builder.artifact_cache = self.cache = ArtifactCache(
+                os.path.join(self.basedir, 'cache'), 1000)
+
+    def test_cache_miss(self):
+        self.make_cached_download('hi')
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 0}
+                ])
+            cached = os.path.join(self.basedir, 'cache', sha1('hi').hexdigest())
+            self.assertEqual(open(cached).read(), 'hi')
+        d.addCallback(check)
+        return d
+
+    def test_cache_hit(self):
+        self.make_cached_download('hi')
+        src = os.path.join(self.basedir, 'src')
+        open(src, 'wb').write('hi')
+        self.cache.add(src, sha1('hi').hexdigest())
+
+        d = self.run_command()
+
+        def check(_):
+            datafile = os.path.join(self.basedir, '.', 'data')
+            self.assertUpdates([
+                    {'header': 'copied %s from the artifact cache' % datafile},
+                    'close',
+                    {'rc': 0}
+                ])
+            self.assertFalse(self.fakemaster.read)
+            self.assertEqual(open(datafile).read(), 'hi')
+        d.addCallback(check)
+        return d
+
+    def test_cache_skipped_with_maxsize(self):
+        # a cached copy would not be truncated, so the file is read from the
+        # master instead
+        self.make_cached_download('tenchars--' * 10, maxsize=50)
+        src = os.path.join(self.basedir, 'src')
+        open(src, 'wb').write('tenchars--' * 10)
+        self.cache.add(src, sha1('tenchars--' * 10).hexdigest())
+
+        d = self.run_command()
+
+        def check(_):
+            datafile = os.path.join(self.basedir, '.', 'data')
+            self.assertUpdates([
+                    'read(s)', 'close',
+                    {'rc': 1,
+                     'stderr': "Maximum filesize reached, truncating file '%s'"
+                                % datafile}
+                ])
+            self.assertEqual(open(datafile).read(), 'tenchars--' * 5)
+        d.addCallback(check)
+        return d
+
+    def test_cache_not_added_on_mismatch(self):
+        # the master's file changed after its digest was computed
+        self.make_cached_download('hi')
+        self.fakemaster.data = 'ho'
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(os.listdir(os.path.join(self.basedir)), ['data'])
+        d.addCallback(check)
+        return d
@@ -112,6 +112,19 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def testKeepStdout_spilled(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir, keepStdout=True)
+        s.KEEP_MEMORY_LIMIT = 2
+
+        d = s.start()
+        def check(ign):
+            # the temporary file is closed once the command finishes
+            self.failUnlessEqual(s._keptStdout.file, None)
+            self.failUnlessEquals(s.stdout, nl('hello\n'))
+        d.addCallback(check)
+        return d
+
     def testStderr(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b, stderrCommand("hello"), self.basedir)
@@ -69,3 +69,27 @@ class TestObfuscated(unittest.TestCase):
         self.failUnlessEqual(1, util.Obfuscated.get_real(cmd))
         self.failUnlessEqual(1, util.Obfuscated.get_fake(cmd))
 
+class OutputBuffer(unittest.TestCase):
+
+    def test_append(self):
+        buf = util.OutputBuffer()
+        self.assertEqual((buf.getvalue(), len(buf)), ('', 0))
+        for data in [ 'abc', '', 'def', 'g' ]:
+            buf.append(data)
+        # appending keeps each chunk, rather than joining them
+        self.assertEqual(buf.pieces, [ 'abc', 'def', 'g' ])
+        self.assertEqual((buf.getvalue(), len(buf)), ('abcdefg', 7))
+
+    def test_spill_and_close(self):
+        buf = util.OutputBuffer(memoryLimit=5)
+        buf.append('abcde')
+        self.assertEqual(buf.file, None)
+        buf.append('f')
+        f = buf.file
+        self.assertNotEqual(f, None)
+        self.assertEqual(buf.pieces, [])
+        buf.append('ghi')
+        self.assertEqual((buf.getvalue(), len(buf)), ('abcdefghi', 9))
+        buf.close()
+        self.assertTrue(f.closed)
+        self.assertEqual(buf.getvalue(), 'abcdefghi')
@@ -15,6 +15,7 @@
 
 import types
 import time
+import tempfile
 
 def remove_userpassword(url):
     if '@' not in url:
@@ -84,3 +85,62 @@ class Obfuscated:
                     rv.append(Obfuscated.to_text(elt))
         return rv
 
+class OutputBuffer(object):
+    """
+    Accumulate the output a command keeps (see C{keepStdout} and
+    C{keepStderr} in L{buildslave.runprocess.RunProcess}) from a stream of
+    chunks, without the quadratic copying of repeated string concatenation.
+    Chunks are kept in a list until they exceed C{memoryLimit} bytes, after
+    which they are spilled to a temporary file.
+
+    Call C{close} once the process has finished, to release any temporary
+    file; the text is then held in memory and can still be read.
+    """
+
+    def __init__(self, memoryLimit=None):
+        self.memoryLimit = memoryLimit
+        self.pieces = []
+        self.length = 0
+        self.file = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, data):
+        # the output of a process is always a byte string
+        if not data:
+            return
+        self.length += len(data)
+        if self.file:
+            self.file.write(data)
+            return
+        self.pieces.append(data)
+        if self.memoryLimit is not None and self.length > self.memoryLimit:
+            self._spill()
+
+    def getvalue(self):
+        if self.file:
+            self.file.seek(0)
+            value = self.file.read()
+            self.file.seek(0, 2)
+            return value
+        if len(self.pieces) > 1:
+            # keep the joined value, so that reading it again is cheap
+            self.pieces = [ ''.join(self.pieces) ]
+        if self.pieces:
+            return self.pieces[0]
+        return ''
+
+    def close(self):
+        if self.file:
+            self.pieces = [ self.getvalue() ]
+            self.file.close()
+            self.file = None
+        # anything appended later is kept in memory
+        self.memoryLimit = None
+
+    def _spill(self):
+        self.file = tempfile.TemporaryFile()
+        for data in self.pieces:
+            self.file.write(data)
+        self.pieces = []